@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the memory allocated to build the body of a draft PATCH request:
+
+* "json": what add_file_to_draft() used to do, i.e. base64-encode each file
+  with encode_str_for_draft(), and let requests JSON-encode the whole body
+  (requests.patch(json=...) does json.dumps(...).encode('utf-8')).
+* "stream": DraftFilesBody, read in the 8 KB blocks that http.client sends.
+
+Peak memory is measured with tracemalloc (Python 3 only), on top of the
+file data itself.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from openedx_blockstore_relay.blockstore_client import DraftFilesBody, encode_str_for_draft
+
+SEND_BLOCK_SIZE = 8192
+
+
+def json_body(files):
+    """
+    Build the request body the old way, returning its size.
+    """
+    body = json.dumps({'files': {path: encode_str_for_draft(data).decode('ascii') for path, data in files}})
+    return len(body.encode('utf-8'))
+
+
+def stream_body(files):
+    """
+    Read the body from DraftFilesBody the way http.client does, returning its size.
+    """
+    body = DraftFilesBody(files)
+    size = 0
+    block = body.read(SEND_BLOCK_SIZE)
+    while block:
+        size += len(block)
+        block = body.read(SEND_BLOCK_SIZE)
+    return size
+
+
+def measure(encoder, files):
+    """
+    Return (body size, peak bytes allocated, seconds taken) for one encoder.
+    """
+    tracemalloc.start()
+    started = time.time()
+    size = encoder(files)
+    elapsed = time.time() - started
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak, elapsed
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file-mb', type=float, default=32, help='Size of each file, in MB. Default: %(default)s')
+    parser.add_argument('--files', type=int, default=1, help='Number of files per request. Default: %(default)s')
+    args = parser.parse_args()
+
+    files = [
+        ('asset/static/file{}.bin'.format(i), os.urandom(int(args.file_mb * 1024 * 1024)))
+        for i in range(args.files)
+    ]
+    data_size = sum(len(data) for _path, data in files)
+    print('{} file(s), {:.1f} MB of data in total'.format(len(files), data_size / 1024 / 1024))
+    for name, encoder in (('json', json_body), ('stream', stream_body)):
+        size, peak, elapsed = measure(encoder, files)
+        print('{:>6}: body {:8.1f} MB, peak allocated {:8.2f} MB ({:5.2f}x the data), {:.3f}s'.format(
+            name, size / 1024 / 1024, peak / 1024 / 1024, peak / data_size, elapsed,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Measure what gzip-compressing draft upload bodies (BLOCKSTORE_RELAY_GZIP_MIN_BYTES
+and BLOCKSTORE_RELAY_GZIP_LEVEL) saves on the wire, and what it costs in CPU.
+
+Synthetic course files (OLX, HTML, SRT transcripts, and some incompressible
+images) are uploaded to the in-process fake Blockstore server
+(test_utils/fake_blockstore.py), one file per request, on --workers threads,
+with compression off and at each compression level. Bytes on the wire are
+counted by the server; the CPU cost is the process time spent in gzip_body()
+for the same bodies.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import os
+import random
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.test.utils import override_settings
+
+from openedx_blockstore_relay.blockstore_client import (
+    DraftFilesBody,
+    add_file_to_draft,
+    create_draft,
+    gzip_body,
+    should_gzip
+)
+from openedx_blockstore_relay.test_utils.fake_blockstore import FakeBlockstore
+
+WORDS = ('the', 'student', 'answer', 'problem', 'video', 'course', 'module', 'energy', 'force', 'graph', 'value')
+
+
+def text(rand, num_words):
+    """
+    Return num_words random words.
+    """
+    return ' '.join(rand.choice(WORDS) for _ in range(num_words))
+
+
+def synthetic_files(num_blocks, seed=0):
+    """
+    Return a list of (path, data) for a course-like mix of files.
+    """
+    rand = random.Random(seed)
+    files = []
+    for i in range(num_blocks):
+        kind = i % 4
+        if kind == 0:
+            files.append(('html/h{}/definition.xml'.format(i), '<html filename="h{}"/>'.format(i)))
+            files.append(('html/h{}/static/h{}.html'.format(i, i), '<p>{}</p>'.format(text(rand, 800))))
+        elif kind == 1:
+            files.append(('problem/p{}/definition.xml'.format(i), (
+                '<problem display_name="Problem {}"><multiplechoiceresponse><p>{}</p>'
+                '<choicegroup>{}</choicegroup></multiplechoiceresponse></problem>'
+            ).format(i, text(rand, 200), ''.join(
+                '<choice correct="{}">{}</choice>'.format(j == 0, text(rand, 10)) for j in range(4)
+            ))))
+        elif kind == 2:
+            files.append(('video/v{}/definition.xml'.format(i), '<video youtube_id_1_0="abc{}"/>'.format(i)))
+            files.append(('video/v{}/static/v{}-en.srt'.format(i, i), ''.join(
+                '{}\n00:00:{:02d},000 --> 00:00:{:02d},500\n{}\n\n'.format(j + 1, j % 60, j % 60, text(rand, 12))
+                for j in range(400)
+            )))
+        else:
+            files.append(('html/i{}/static/image{}.png'.format(i, i), os.urandom(rand.randint(20000, 200000))))
+    return [(path, data.encode('utf-8') if not isinstance(data, bytes) else data) for path, data in files]
+
+
+def upload(files, workers, min_bytes, level):
+    """
+    Upload files to a fresh fake server, and return (wire bytes, seconds).
+    """
+    with FakeBlockstore() as blockstore, override_settings(
+        BLOCKSTORE_API_URL=blockstore.url, BLOCKSTORE_RELAY_GZIP_MIN_BYTES=min_bytes, BLOCKSTORE_RELAY_GZIP_LEVEL=level,
+    ):
+        draft_uuid = create_draft('c0ffee00-65d8-4ad8-8e2d-1a2c6d7e40ff', 'relay_import', 'Benchmark')['uuid']
+        wire_bytes_before = blockstore.wire_bytes
+        started = time.time()
+        pool = ThreadPool(workers)
+        pool.map(lambda path_data: add_file_to_draft(draft_uuid, *path_data), files)
+        pool.close()
+        elapsed = time.time() - started
+        return blockstore.wire_bytes - wire_bytes_before, elapsed
+
+
+def compression_cpu(files, min_bytes, level):
+    """
+    Return the process time spent gzipping the bodies of files.
+    """
+    with override_settings(BLOCKSTORE_RELAY_GZIP_MIN_BYTES=min_bytes):
+        bodies = [body for body in (DraftFilesBody([path_data]) for path_data in files) if should_gzip(len(body))]
+    started = time.process_time()
+    for body in bodies:
+        gzip_body(body, level=level)
+    return time.process_time() - started
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=400, help='Number of synthetic blocks. Default: %(default)s')
+    parser.add_argument('--workers', type=int, default=4, help='Upload threads. Default: %(default)s')
+    parser.add_argument('--min-bytes', type=int, default=1024,
+                        help='BLOCKSTORE_RELAY_GZIP_MIN_BYTES when compressing. Default: %(default)s')
+    args = parser.parse_args()
+
+    settings.configure()
+    files = synthetic_files(args.blocks)
+    print('{} files, {:.1f} MB of data'.format(len(files), sum(len(data) for _path, data in files) / 1024 / 1024))
+    print('{:>6} {:>14} {:>8} {:>13} {:>10}'.format('level', 'wire (MB)', 'saved', 'gzip CPU (s)', 'wall (s)'))
+    baseline = None
+    for level in (None, 1, 6, 9):
+        min_bytes = None if level is None else args.min_bytes
+        wire_bytes, elapsed = upload(files, args.workers, min_bytes, level or 6)
+        baseline = baseline or wire_bytes
+        cpu = compression_cpu(files, min_bytes, level) if level else 0.0
+        print('{:>6} {:>14.2f} {:>7.1f}% {:>13.3f} {:>10.3f}'.format(
+            level or 'off', wire_bytes / 1024 / 1024, 100 * (1 - wire_bytes / baseline), cpu, elapsed,
+        ))
+
+
+if __name__ == '__main__':
+    main()
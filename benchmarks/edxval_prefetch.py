@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Measure the database queries and time taken to serialize every video block of
+a course, with the edxval data of each video exported one video at a time (as
+edxval's export_to_xml() does) and with all of it fetched in bulk up front
+(compat.get_edxval_videos()). Use a course with hundreds of videos.
+
+This needs a configured edx-platform environment, e.g. in a Studio devstack:
+
+    DJANGO_SETTINGS_MODULE=cms.envs.devstack python benchmarks/edxval_prefetch.py course-v1:edX+DemoX+Demo_Course
+
+The OLX and transcript files produced both ways are also compared.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import time
+
+import django
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('course_key', help='Key of the course to serialize')
+    args = parser.parse_args()
+
+    django.setup()
+    # These need Django to be set up first:
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from opaque_keys.edx.keys import CourseKey
+    from xmodule.modulestore.django import modulestore
+    from openedx_blockstore_relay import compat
+    from openedx_blockstore_relay.adapters import prefetched_edxval
+    from openedx_blockstore_relay.block_serializer import XBlockSerializer
+
+    course_key = CourseKey.from_string(args.course_key)
+    with modulestore().bulk_operations(course_key):
+        videos = modulestore().get_items(course_key, qualifiers={'category': 'video'})
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.time()
+            one_by_one = [XBlockSerializer(video) for video in videos]
+            one_by_one_time = time.time() - started
+        one_by_one_queries = len(queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.time()
+            edxval_videos = compat.get_edxval_videos(compat.get_course_video_ids(course_key), course_key)
+            with prefetched_edxval(edxval_videos):
+                prefetched = [XBlockSerializer(video) for video in videos]
+            prefetched_time = time.time() - started
+        prefetched_queries = len(queries)
+
+    identical = all(
+        (a.olx_str, a.static_files) == (b.olx_str, b.static_files) for a, b in zip(one_by_one, prefetched)
+    )
+    print('{} video blocks, {} of them in edxval, {} transcript files'.format(
+        len(videos), len(edxval_videos), sum(len(data.static_files) for data in prefetched),
+    ))
+    print('{:>12} {:>8} {:>9}'.format('', 'queries', 'time (s)'))
+    print('{:>12} {:>8} {:>9.3f}'.format('one by one', one_by_one_queries, one_by_one_time))
+    print('{:>12} {:>8} {:>9.3f}'.format('prefetched', prefetched_queries, prefetched_time))
+    print('identical: {}'.format('yes' if identical else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
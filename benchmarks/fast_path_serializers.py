@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Measure how much faster the fast-path serializers (block_serializer.FAST_SERIALIZERS)
+are than the generic export path, for each block type in a course.
+
+This needs a configured edx-platform environment, e.g. in a Studio devstack:
+
+    DJANGO_SETTINGS_MODULE=cms.envs.devstack python benchmarks/fast_path_serializers.py course-v1:edX+DemoX+Demo_Course
+
+Blocks are loaded once, then each block is serialized --repeat times with
+each path; the OLX and static files produced by both paths are also compared.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import time
+from collections import defaultdict
+
+import django
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('course_key', help='Key of the course to serialize')
+    parser.add_argument('--repeat', type=int, default=5, help='Times to serialize each block. Default: %(default)s')
+    args = parser.parse_args()
+
+    django.setup()
+    # These need Django to be set up first:
+    from opaque_keys.edx.keys import CourseKey
+    from xmodule.modulestore.django import modulestore
+    from openedx_blockstore_relay.block_serializer import FAST_SERIALIZERS, XBlockSerializer
+
+    course_key = CourseKey.from_string(args.course_key)
+    blocks = defaultdict(list)
+    with modulestore().bulk_operations(course_key):
+        for block in modulestore().get_items(course_key):
+            if block.scope_ids.usage_id.block_type in FAST_SERIALIZERS:
+                blocks[block.scope_ids.usage_id.block_type].append(block)
+
+        print('{:>10} {:>7} {:>12} {:>12} {:>8} {:>9}'.format(
+            'type', 'blocks', 'generic (s)', 'fast (s)', 'speedup', 'identical',
+        ))
+        for block_type, type_blocks in sorted(blocks.items()):
+            timings = {}
+            results = {}
+            for use_fast_path in (False, True):
+                started = time.time()
+                for _ in range(args.repeat):
+                    results[use_fast_path] = [
+                        XBlockSerializer(block, use_fast_path=use_fast_path) for block in type_blocks
+                    ]
+                timings[use_fast_path] = time.time() - started
+            identical = all(
+                (fast.olx_str, fast.static_files) == (generic.olx_str, generic.static_files)
+                for fast, generic in zip(results[True], results[False])
+            )
+            print('{:>10} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x {:>9}'.format(
+                block_type, len(type_blocks), timings[False], timings[True],
+                timings[False] / timings[True] if timings[True] else float('inf'), 'yes' if identical else 'NO',
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure how long finding the changed blocks of a large course takes with
+hash trees (see hash_tree.py), after a single edit: computing the hashes of
+every block from the block versions in the structure, and comparing them
+with the recorded ones top-down.
+
+Before hash trees, finding out that only one block had changed meant
+serializing every block; the "compared" column is the number of blocks
+looked at instead.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import random
+import time
+
+from opaque_keys.edx.keys import CourseKey
+
+from openedx_blockstore_relay.hash_tree import compute_hash_tree, diff_hash_trees
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+BLOCK_TYPES = ('chapter', 'sequential', 'vertical', 'html')
+
+
+def synthetic_block_versions(width):
+    """
+    Return the block versions (see compat.get_block_versions()) of a course
+    with width children per block, four levels deep.
+    """
+    root_key = COURSE_KEY.make_usage_key('course', 'course')
+    block_versions = {root_key: ['v1', []]}
+    parents = [root_key]
+    for block_type in BLOCK_TYPES:
+        children = []
+        for parent in parents:
+            for i in range(width):
+                child = COURSE_KEY.make_usage_key(block_type, '{}_{}'.format(parent.block_id, i))
+                block_versions[parent][1].append(child)
+                block_versions[child] = ['v1', []]
+                children.append(child)
+        parents = children
+    return root_key, block_versions
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=10, help='Children per block. Default: %(default)s')
+    parser.add_argument('--edits', type=int, default=1, help='Number of edited blocks. Default: %(default)s')
+    args = parser.parse_args()
+
+    root_key, block_versions = synthetic_block_versions(args.width)
+    started = time.time()
+    recorded = compute_hash_tree(block_versions, root_key)
+    print('{} blocks, hashed in {:.3f}s'.format(len(block_versions), time.time() - started))
+
+    for usage_key in random.Random(0).sample(sorted(block_versions, key=str), args.edits):
+        block_versions[usage_key][0] = 'v2'
+    started = time.time()
+    hashes = compute_hash_tree(block_versions, root_key)
+    hashed = time.time() - started
+    diff = diff_hash_trees(root_key, block_versions, hashes, recorded)
+    compared = time.time() - started - hashed
+    print('{:>10} {:>10} {:>10} {:>10}'.format('changed', 'compared', 'hash (s)', 'diff (s)'))
+    print('{:>10} {:>10} {:>10.3f} {:>10.4f}'.format(len(diff.changed), diff.compared, hashed, compared))
+
+
+if __name__ == '__main__':
+    main()
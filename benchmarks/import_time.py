@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Measure how long importing the relay takes, using ``python -X importtime``
+(Python 3.7+), and which edx-platform modules get imported along with it.
+
+Three imports are measured, each in a fresh interpreter: the package itself,
+the serializers, and the transfer_to_blockstore management command (which
+also needs Django to be set up). Run it inside an edx-platform environment
+to see the edx-platform modules that the relay avoids importing, e.g.:
+
+    DJANGO_SETTINGS_MODULE=cms.envs.devstack python benchmarks/import_time.py
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import subprocess
+import sys
+
+TARGETS = (
+    ('package', 'import openedx_blockstore_relay'),
+    ('serializers', 'import openedx_blockstore_relay.block_serializer'),
+    ('command', 'import django; django.setup(); '
+                'import openedx_blockstore_relay.management.commands.transfer_to_blockstore'),
+)
+
+EDX_PLATFORM_PACKAGES = ('xmodule', 'edxval', 'static_replace', 'openedx', 'cms', 'lms')
+
+
+def import_times(code):
+    """
+    Run code in a new interpreter under -X importtime, and return a dict of
+    {module name: (self microseconds, cumulative microseconds)}.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', code], stderr=subprocess.STDOUT,
+    ).decode('utf-8')
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Times to import each target. Default: %(default)s')
+    args = parser.parse_args()
+
+    print('{:>12} {:>9} {:>16} {:>17}'.format('target', 'modules', 'total time (ms)', 'edx-platform mods'))
+    for label, code in TARGETS:
+        runs = [import_times(code) for _ in range(args.repeat)]
+        best_total = min(sum(self_us for self_us, _cumulative in run.values()) for run in runs)
+        edx_modules = [name for name in runs[0] if name.split('.')[0] in EDX_PLATFORM_PACKAGES]
+        print('{:>12} {:>9} {:>16.1f} {:>17}'.format(label, len(runs[0]), best_total / 1000, len(edx_modules)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Measure how long UploadPipeline takes to upload a course whose file sizes are
+skewed (many small OLX/HTML files, a few large static assets), with and
+without the size-aware lanes: large files uploaded largest-first by their own
+workers, and small files batched into one request each.
+
+Uploads are simulated: each request takes a fixed latency plus its size
+divided by the bandwidth, so the results show the scheduling, not the
+network. The "one lane" row uploads every file in its own request, like the
+pipeline did before lanes were added.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import random
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from opaque_keys.edx.keys import CourseKey
+
+from openedx_blockstore_relay.block_serializer import StaticFile
+from openedx_blockstore_relay.pipeline import UploadPipeline
+
+# The parts of XBlockSerializer that the pipeline uses:
+SerializedBlock = namedtuple('SerializedBlock', ['orig_block_key', 'def_id', 'olx_str', 'static_files'])
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+DRAFT_UUID = '12345678-4249-4d57-a63c-a12354565756'
+
+
+def synthetic_course(num_blocks, num_large, large_mb, seed=0):
+    """
+    Return fake serialized blocks: each has a small OLX file and a few small
+    static files, and num_large of them, spread at random, also have a large one.
+    """
+    rand = random.Random(seed)
+    large_blocks = set(rand.sample(range(num_blocks), num_large))
+    blocks = []
+    for i in range(num_blocks):
+        static_files = [StaticFile('f{}.html'.format(j), b'x' * rand.randint(200, 20000)) for j in range(3)]
+        if i in large_blocks:
+            size = int(rand.uniform(0.5, 1) * large_mb * 1024 * 1024)
+            static_files.append(StaticFile('lecture.mp4', b'v' * size))
+        block_key = COURSE_KEY.make_usage_key('html', 'html{}'.format(i))
+        blocks.append(SerializedBlock(block_key, 'html/html{}'.format(i), b'<html/>', static_files))
+    return blocks
+
+
+class SimulatedUploader(object):
+    """
+    Takes latency seconds, plus the size of the data over bandwidth, per request.
+    """
+
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+
+    def __call__(self, draft_uuid, path, data):
+        self.upload_batch(draft_uuid, [(path, data)])
+
+    def upload_batch(self, draft_uuid, files):  # pylint: disable=unused-argument
+        """
+        Simulate uploading several files in one request.
+        """
+        self.requests += 1
+        time.sleep(self.latency + sum(len(data) for _path, data in files) / self.bandwidth)
+
+
+def run(blocks, uploader, lanes, workers, max_inflight_bytes):
+    """
+    Upload blocks through a pipeline and return the seconds it took.
+    """
+    kwargs = {'large_file_bytes': None}
+    if lanes:
+        kwargs = {'upload_batch': uploader.upload_batch, 'large_file_bytes': 1024 * 1024, 'large_file_workers': 1}
+    started = time.time()
+    pipeline = UploadPipeline(
+        uploader, DRAFT_UUID, {'components': [], 'assets': []}, max_inflight_bytes=max_inflight_bytes,
+        workers=workers, **kwargs
+    )
+    for block in blocks:
+        pipeline.add_block(block)
+    pipeline.close()
+    return time.time() - started
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=300, help='Number of synthetic blocks. Default: %(default)s')
+    parser.add_argument('--large', type=int, default=6, help='Number of large files. Default: %(default)s')
+    parser.add_argument('--large-mb', type=float, default=20, help='Largest file size. Default: %(default)s')
+    parser.add_argument('--workers', type=int, default=4, help='Small-file upload threads. Default: %(default)s')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Per-request latency. Default: %(default)s')
+    parser.add_argument('--bandwidth-mbps', type=float, default=200,
+                        help='Simulated bandwidth, in MB/s. Default: %(default)s')
+    parser.add_argument('--max-inflight-mb', type=float, default=128, help='Memory budget. Default: %(default)s')
+    args = parser.parse_args()
+
+    settings.configure()
+    blocks = synthetic_course(args.blocks, args.large, args.large_mb)
+    num_files = sum(1 + len(block.static_files) for block in blocks)
+    print('{} blocks, {} files'.format(len(blocks), num_files))
+    print('{:>10} {:>10} {:>10}'.format('', 'requests', 'time (s)'))
+    for lanes in (False, True):
+        uploader = SimulatedUploader(args.latency_ms / 1000, args.bandwidth_mbps * 1024 * 1024)
+        elapsed = run(blocks, uploader, lanes, args.workers, int(args.max_inflight_mb * 1024 * 1024))
+        print('{:>10} {:>10} {:>10.2f}'.format('lanes' if lanes else 'one lane', uploader.requests, elapsed))
+
+
+if __name__ == '__main__':
+    main()
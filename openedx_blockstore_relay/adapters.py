@@ -3,12 +3,26 @@ Helpers required to adapt to differing APIs
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import threading
 from contextlib import contextmanager
 
+import six
 from fs.memoryfs import MemoryFS
 from fs.wrapfs import WrapFS
+from lxml.etree import Element, SubElement
 
-from xmodule.xml_module import XmlParserMixin
+from .compat import edx_symbol, get_block_class
+
+# The videos prefetched by the current thread's prefetched_edxval(), if any:
+_prefetched = threading.local()  # pylint: disable=invalid-name
+_install_lock = threading.Lock()  # pylint: disable=invalid-name
+
+
+def _xml_parser_mixin():
+    """
+    Return xmodule.xml_module.XmlParserMixin.
+    """
+    return edx_symbol('xmodule.xml_module', 'XmlParserMixin')
 
 
 @contextmanager
@@ -36,10 +50,176 @@ def override_export_fs(block):
     if hasattr(block, 'export_to_file'):
         old_export_to_file = block.export_to_file
         block.export_to_file = lambda: False
-    old_global_export_to_file = XmlParserMixin.export_to_file
-    XmlParserMixin.export_to_file = lambda _: False  # So this applies to child blocks that get loaded during export
+    xml_parser_mixin = _xml_parser_mixin()
+    old_global_export_to_file = xml_parser_mixin.export_to_file
+    xml_parser_mixin.export_to_file = lambda _: False  # So this applies to child blocks that get loaded during export
     yield fs
     block.runtime.export_fs = old_export_fs
     if hasattr(block, 'export_to_file'):
         block.export_to_file = old_export_to_file
-    XmlParserMixin.export_to_file = old_global_export_to_file
+    xml_parser_mixin.export_to_file = old_global_export_to_file
+
+
+def is_plain_xmodule(block):
+    """
+    Return True if the given block is exported by XmlParserMixin.add_xml_to_node()
+    and has no XBlockAsides that would add to its OLX, i.e. if its OLX can be
+    built by xmodule_olx_node().
+    """
+    return isinstance(block, _xml_parser_mixin()) and not block.runtime.get_asides(block)
+
+
+def xmodule_olx_node(block, xml_object):
+    """
+    Complete the OLX node of an XModule-style block, given the XML element
+    returned by its definition_to_xml() method, the same way that
+    XmlParserMixin.add_xml_to_node() does when export_to_file() is False:
+    attributes named after settings fields are removed (e.g. those which a
+    problem's stored XML has on its root element), the tag is set to the block
+    type, the block's own (non-inherited) metadata and XML attributes are added
+    as attributes, and url_name is set.
+
+    Returns the node.
+    """
+    field_data = block._field_data  # pylint: disable=protected-access
+    return _complete_xmodule_olx_node(
+        xml_object,
+        block_class=type(block),
+        block_type=block.category,
+        url_name=block.url_name,
+        settings={
+            attr: field_data.get(block, attr)
+            for attr in edx_symbol('xmodule.modulestore.inheritance', 'own_metadata')(block)
+        },
+        xml_attributes=block.xml_attributes,
+        metadata_to_strip=block.metadata_to_strip,
+        metadata_to_export_to_policy=block.metadata_to_export_to_policy,
+    )
+
+
+def stored_fields_olx_node(xml_object, block_type, url_name, settings):
+    """
+    Like xmodule_olx_node(), but for an XModule-style block that hasn't been
+    loaded: settings is the dict of the block's own settings field values, in
+    the JSON form the modulestore stores them in (which is also what
+    add_xml_to_node() reads from the block's field data).
+    """
+    settings = dict(settings)
+    block_class = get_block_class(block_type)
+    return _complete_xmodule_olx_node(
+        xml_object,
+        block_class=block_class,
+        block_type=block_type,
+        url_name=url_name,
+        settings=settings,
+        xml_attributes=settings.get('xml_attributes') or {},
+        metadata_to_strip=block_class.metadata_to_strip,
+        metadata_to_export_to_policy=block_class.metadata_to_export_to_policy,
+    )
+
+
+def _complete_xmodule_olx_node(
+    xml_object, block_class, block_type, url_name, settings, xml_attributes, metadata_to_strip,
+    metadata_to_export_to_policy,
+):
+    """
+    Set the tag and attributes of an XModule's OLX node (see xmodule_olx_node()).
+    """
+    serialize_field = edx_symbol('xmodule.xml_module', 'serialize_field')
+    block_class.clean_metadata_from_xml(xml_object)
+    xml_object.tag = block_type
+    for attr in sorted(settings):
+        if attr not in metadata_to_strip and attr not in metadata_to_export_to_policy:
+            xml_object.set(attr, serialize_field(settings[attr]))
+    for key, value in xml_attributes.items():
+        if key not in metadata_to_strip:
+            xml_object.set(key, serialize_field(value))
+    xml_object.tail = None
+    xml_object.set('url_name', url_name)
+    return xml_object
+
+
+class PrefetchedEdxvalApi(object):
+    """
+    Stand-in for the edxval.api module, whose export_to_xml() uses video data
+    prefetched in bulk by compat.get_edxval_videos() instead of querying the
+    database for each video. Everything else is passed on to edxval.api.
+
+    It is installed once, in place of the video XModule's edxval_api, and
+    only uses the videos given to prefetched_edxval() in the current thread:
+    for other threads and requests, it passes everything on to edxval.api, so
+    they never see each other's prefetched data.
+
+    export_to_xml() builds the same <video_asset> element, and writes the same
+    transcript files into the export filesystem, as edxval's.
+    """
+
+    def __init__(self, edxval_api):
+        self._edxval_api = edxval_api
+
+    def __getattr__(self, name):
+        return getattr(self._edxval_api, name)
+
+    def export_to_xml(self, video_id, resource_fs, static_dir, course_id=None):
+        """
+        Return the edxval data of the given video as a <video_asset> element,
+        along with a dict of the names of its transcript files (written into
+        resource_fs) keyed by language code.
+        """
+        video = (getattr(_prefetched, 'videos', None) or {}).get(video_id)
+        if video is None:
+            return self._edxval_api.export_to_xml(video_id, resource_fs, static_dir, course_id=course_id)
+        video_el = Element('video_asset', attrib={
+            'client_video_id': video['client_video_id'],
+            'duration': six.text_type(video['duration']),
+            'image': video['image'],
+        })
+        for encoded_video in video['encoded_videos']:
+            SubElement(video_el, 'encoded_video', encoded_video)
+        transcript_files = {}
+        if video['transcripts']:
+            transcripts_el = SubElement(video_el, 'transcripts')
+            transcripts_dir = 'course/{}'.format(static_dir)
+            resource_fs.makedirs(transcripts_dir, recreate=True)
+            for transcript in video['transcripts']:
+                file_name = '{}-{}.srt'.format(video_id, transcript['language_code'])
+                with resource_fs.open('{}/{}'.format(transcripts_dir, file_name), 'wb') as transcript_file:
+                    transcript_file.write(transcript['content'])
+                transcript_files[transcript['language_code']] = file_name
+                SubElement(transcripts_el, 'transcript', {
+                    'language_code': transcript['language_code'],
+                    'file_format': 'srt',
+                    'provider': transcript['provider'],
+                })
+        return {'xml': video_el, 'transcripts': transcript_files}
+
+
+def _install_prefetched_edxval_api():
+    """
+    Replace the video XModule's edxval_api with a PrefetchedEdxvalApi, unless
+    that has been done already (or edxval isn't installed).
+    """
+    video_module = edx_symbol('xmodule.video_module', 'video_module')
+    with _install_lock:
+        edxval_api = video_module.edxval_api
+        if edxval_api is not None and not isinstance(edxval_api, PrefetchedEdxvalApi):
+            video_module.edxval_api = PrefetchedEdxvalApi(edxval_api)
+
+
+@contextmanager
+def prefetched_edxval(videos):
+    """
+    Make the video XModule export its edxval data from the given videos (as
+    returned by compat.get_edxval_videos(), or None for none), through
+    PrefetchedEdxvalApi, in the current thread only.
+    """
+    if not videos:
+        yield
+        return
+    _install_prefetched_edxval_api()
+    old_videos = getattr(_prefetched, 'videos', None)
+    _prefetched.videos = videos
+    try:
+        yield
+    finally:
+        _prefetched.videos = old_videos
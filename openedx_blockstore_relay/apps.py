@@ -7,7 +7,7 @@ from __future__ import absolute_import, unicode_literals
 
 from django.apps import AppConfig
 
-from openedx.core.djangoapps.plugins.constants import PluginSettings, ProjectType, SettingsType
+from openedx.core.djangoapps.plugins.constants import PluginSettings, PluginSignals, ProjectType, SettingsType
 
 
 class OpenEdxBlockstoreRelayAppConfig(AppConfig):
@@ -29,10 +29,25 @@ class OpenEdxBlockstoreRelayAppConfig(AppConfig):
                 SettingsType.PRODUCTION: {PluginSettings.RELATIVE_PATH: 'settings'},
             },
         },
+        PluginSignals.CONFIG: {
+            ProjectType.CMS: {
+                PluginSignals.RELATIVE_PATH: 'signals',
+                PluginSignals.RECEIVERS: [
+                    {
+                        PluginSignals.RECEIVER_FUNC_NAME: 'relay_course_published',
+                        PluginSignals.SIGNAL_PATH: 'xmodule.modulestore.django.SignalHandler.course_published',
+                    },
+                    {
+                        PluginSignals.RECEIVER_FUNC_NAME: 'relay_item_changed',
+                        PluginSignals.SIGNAL_PATH: 'xmodule.modulestore.django.SignalHandler.item_deleted',
+                    },
+                ],
+            },
+        },
     }
 
     def ready(self):
         """
-        Load signal handlers when the app is ready.
+        Load signal handlers and Celery tasks when the app is ready.
         """
-        pass
+        from . import tasks  # pylint: disable=unused-import
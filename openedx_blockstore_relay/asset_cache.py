@@ -0,0 +1,222 @@
+"""
+A local, on-disk cache of contentstore assets, shared by every process which
+uses the same directory (e.g. the workers of a parallel migration, and later
+runs).
+
+Each asset is stored in a file named after the SHA-1 digest of its course key,
+path, contentstore MD5 digest and size, so an asset which changes in the
+contentstore gets a new cache file, and the stale one is eventually evicted.
+Files are written under a temporary name and atomically renamed into place, so
+readers never see a partly written file, and processes caching the same asset
+at the same time just write it twice. Large files are read through mmap, so
+their data stays in the OS page cache (shared between processes) rather than
+being copied into each process's memory.
+
+When the files in the cache add up to more than its maximum size, the least
+recently used ones (by modification time, which a cache hit updates) are
+removed. On POSIX systems, a file which is removed while a reader has it mapped
+stays readable until the reader is done with it.
+
+The cache is used by compat.get_asset_content_from_path() when
+settings.BLOCKSTORE_RELAY_ASSET_CACHE_DIR is set.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import threading
+import uuid
+
+import six
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024 * 1024
+# Files at least this big are memory-mapped rather than read (so that a course with very many small assets doesn't
+# hold as many memory maps open):
+MMAP_MIN_BYTES = 1024 * 1024
+# Look for files to evict once this fraction of the maximum size has been written since the last time:
+EVICT_EVERY_FRACTION = 0.1
+TMP_DIR = 'tmp'
+
+_caches = {}  # AssetCache of each directory
+_caches_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """
+    Return the AssetCache set up in settings.BLOCKSTORE_RELAY_ASSET_CACHE_DIR
+    (and BLOCKSTORE_RELAY_ASSET_CACHE_MAX_BYTES), or None if it isn't set.
+    """
+    root = getattr(settings, 'BLOCKSTORE_RELAY_ASSET_CACHE_DIR', None)
+    if not root:
+        return None
+    max_bytes = getattr(settings, 'BLOCKSTORE_RELAY_ASSET_CACHE_MAX_BYTES', None) or DEFAULT_MAX_BYTES
+    with _caches_lock:
+        cache = _caches.get(root)
+        if cache is None or cache.max_bytes != max_bytes:
+            cache = _caches[root] = AssetCache(root, max_bytes)
+        return cache
+
+
+def _ignore_missing(function, *args):
+    """
+    Call the given os function, ignoring the error if the file is missing
+    (e.g. because another process just evicted or replaced it).
+    """
+    try:
+        return function(*args)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+        return None
+
+
+class AssetCache(object):
+    """
+    A directory of cached asset files (see above).
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._written_since_eviction = 0
+        try:
+            os.makedirs(os.path.join(root, TMP_DIR))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def key(course_key, asset_path, md5, size):
+        """
+        Return the cache key of the given version of an asset.
+        """
+        return hashlib.sha1('\n'.join(
+            [six.text_type(course_key), asset_path, md5, six.text_type(size)]
+        ).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """
+        Return the path of the file holding the asset with the given key.
+        """
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key, size):
+        """
+        Return the data of the asset with the given key and size, or None if
+        it isn't in the cache. Large files are returned as read-only mmap
+        objects, which can be used like bytes.
+        """
+        path = self.path(key)
+        try:
+            cache_file = open(path, 'rb')
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return None
+        with cache_file:
+            if os.fstat(cache_file.fileno()).st_size != size:
+                log.warning('Discarding cached asset %s, which has the wrong size', key)
+                _ignore_missing(os.remove, path)
+                return None
+            # Mark the file as recently used, so that it's evicted last:
+            _ignore_missing(os.utime, path, None)
+            if size >= MMAP_MIN_BYTES:
+                return mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return cache_file.read()
+
+    def put(self, key, data):
+        """
+        Store the given asset data under the given key.
+        """
+        path = self.path(key)
+        tmp_path = os.path.join(self.root, TMP_DIR, '{}.{}'.format(key, uuid.uuid4().hex))
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(data)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # On Windows, renaming onto an existing file fails: then another process has just cached it.
+            _ignore_missing(os.remove, tmp_path)
+            if not os.path.exists(path):
+                raise
+        with self._lock:
+            self._written_since_eviction += len(data)
+            evict = self._written_since_eviction >= self.max_bytes * EVICT_EVERY_FRACTION
+            if evict:
+                self._written_since_eviction = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache is no bigger than
+        its maximum size, and return the number of bytes removed.
+        """
+        files = []
+        total_bytes = 0
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            if dir_path == self.root and TMP_DIR in dir_names:
+                dir_names.remove(TMP_DIR)
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                stat = _ignore_missing(os.stat, path)
+                if stat is not None:
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total_bytes += stat.st_size
+        removed = 0
+        for _mtime, size, path in sorted(files):
+            if total_bytes - removed <= self.max_bytes:
+                break
+            _ignore_missing(os.remove, path)
+            removed += size
+        if removed:
+            log.info('Evicted %d bytes of assets from %s', removed, self.root)
+        return removed
+
+
+class CachedAsset(object):
+    """
+    Wraps a contentstore asset whose data is only read when needed: from the
+    cache if it is there, and otherwise by calling load(), in which case the
+    data is then cached. Other attributes are those of the wrapped asset.
+    """
+
+    def __init__(self, cache, key, asset, load):
+        self._cache = cache
+        self._key = key
+        self._asset = asset
+        self._load = load
+        self._data = None
+
+    def __getattr__(self, name):
+        return getattr(self._asset, name)
+
+    @property
+    def data(self):
+        """
+        The asset's data.
+        """
+        if self._data is None:
+            self._data = self._cache.get(self._key, self._asset.length)
+            if self._data is None:
+                self._data = self._load()
+                self._cache.put(self._key, self._data)
+        return self._data
+
+    def copy_to_in_mem(self):
+        """
+        Return the asset itself: its data is read on first access.
+        """
+        return self
@@ -3,21 +3,67 @@ Code for serializing an XBlock to OLX
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import hashlib
 import logging
 import os
 from collections import namedtuple
 
 import six
+from django.conf import settings
+from fs.memoryfs import MemoryFS
+from fs.wrapfs import WrapFS
 from lxml.etree import Element
+from lxml.etree import fromstring as etree_fromstring
 from lxml.etree import tostring as etree_tostring
 
 from . import compat
-from .adapters import override_export_fs
+from .adapters import is_plain_xmodule, override_export_fs, prefetched_edxval, xmodule_olx_node
 
 log = logging.getLogger(__name__)
 
 # A static file required by an XBlock
 StaticFile = namedtuple('StaticFile', ['name', 'data'])
+# A contentstore asset required by an XBlock, which the destination bundle
+# already has (see XBlockSerializer's known_assets), so it isn't read:
+ReusedAsset = namedtuple('ReusedAsset', ['name', 'digest', 'size'])
+
+
+def canonical_olx_enabled():
+    """
+    Return True if OLX should be serialized in canonical form
+    (settings.BLOCKSTORE_RELAY_CANONICAL_OLX; see canonicalize_olx()).
+    """
+    return getattr(settings, 'BLOCKSTORE_RELAY_CANONICAL_OLX', False)
+
+
+def _is_indentation(text):
+    """
+    Return True if the given element text or tail is only line breaks and
+    indentation, as opposed to (possibly significant) content.
+    """
+    return text is not None and '\n' in text and not text.strip()
+
+
+def canonicalize_olx(olx_node):
+    """
+    Put the given OLX etree node into canonical form, in place, so that the
+    same content always serializes to the same bytes: the attributes of each
+    element are sorted by name, and text which is only line breaks and
+    indentation is removed (pretty_print then re-indents the result the same
+    way every time). Whitespace without a line break, like the space between
+    two inline elements, is content and is kept.
+    """
+    for element in olx_node.iter():
+        if isinstance(element.tag, six.string_types):  # Not a comment or processing instruction
+            attributes = sorted(element.attrib.items())
+            element.attrib.clear()
+            for name, value in attributes:
+                element.set(name, value)
+            if _is_indentation(element.text):
+                element.text = None
+        if element is not olx_node and _is_indentation(element.tail):
+            element.tail = None
+    return olx_node
 
 
 def blockstore_def_key_from_modulestore_usage_key(usage_key):
@@ -48,50 +94,80 @@ class XBlockSerializer(object):
         (2) an XML string defining the XBlock and referencing the IDs of its
             children (but not containing the actual XML of its children)
         (3) a list of any static files required by the XBlock and their data
+        (4) a list of the contentstore assets required by the XBlock that the
+            destination bundle already has (reused_assets), if known_assets is
+            given
+        (5) the SHA-1 digests of its output: content_digest, of the OLX
+            without the comment naming the source block (so the same content
+            has the same digest wherever it comes from, e.g. in a course
+            rerun), and file_digests, of each file as uploaded, keyed by its
+            path in the bundle
     """
 
-    def __init__(self, block):
+    def __init__(self, block, use_fast_path=True, known_assets=None, child_sources=None, edxval_videos=None):
         """
         Serialize an XBlock to an OLX string + supporting files, and store the
         resulting data in this object.
+
+        Blocks of the types in FAST_SERIALIZERS are serialized straight from
+        their field data, unless use_fast_path is False.
+
+        known_assets is the dict of the contentstore assets which the
+        destination bundle already has, keyed by path (see
+        ledger.get_bundle_assets()). Assets found there, with the MD5 digest
+        that the contentstore has for them, go into self.reused_assets
+        without their data being read.
+
+        child_sources is a dict of bundle link names keyed by usage key, for
+        children which live in other bundles (see finish()).
+
+        edxval_videos is the edxval data of videos prefetched in bulk by
+        compat.get_edxval_videos(), which video blocks export instead of
+        querying edxval (see adapters.prefetched_edxval()).
         """
         self.orig_block_key = block.scope_ids.usage_id
         self.static_files = []
         self.def_id = blockstore_def_key_from_modulestore_usage_key(self.orig_block_key)
+        self.init_assets(known_assets)
 
-        # Create an XML node to hold the exported data
-        olx_node = Element("root")  # The node name doesn't matter: add_xml_to_node will change it
-        # ^ Note: We could pass nsmap=xblock.core.XML_NAMESPACES here, but the
-        # resulting XML namespace attributes don't seem that useful?
-        with override_export_fs(block) as filesystem:  # Needed for XBlocks that inherit XModuleDescriptor
-            # Tell the block to serialize itself as XML/OLX:
-            if not block.has_children:
-                block.add_xml_to_node(olx_node)
-            else:
-                # We don't want the children serialized at this time, because
-                # otherwise we can't tell which files in 'filesystem' belong to
-                # this block and which belong to its children. So, temporarily
-                # disable any children:
-                children = block.children
-                block.children = []
-                block.add_xml_to_node(olx_node)
-                block.children = children
+        fast_serializer = FAST_SERIALIZERS.get(self.orig_block_key.block_type) if use_fast_path else None
+        with prefetched_edxval(edxval_videos):
+            olx_node = fast_serializer(self, block) if fast_serializer else None
+            if olx_node is None:
+                olx_node = self.serialize_generic(block)
+        self.finish(
+            olx_node,
+            children=block.children if block.has_children else [],
+            html_data=block.data if self.orig_block_key.block_type == 'html' else None,
+            child_sources=child_sources,
+        )
 
-            # Now the block/module may have exported addtional data as files in
-            # 'filesystem'. If so, store them:
-            for item in filesystem.walk():  # pylint: disable=not-callable
-                for unit_file in item.files:
-                    file_path = os.path.join(item.path, unit_file.name)
-                    with filesystem.open(file_path, 'rb') as fh:
-                        data = fh.read()
-                    self.static_files.append(StaticFile(name=unit_file.name, data=data))
+    def init_assets(self, known_assets=None):
+        """
+        Set up the attributes tracking the block's contentstore assets.
+        """
+        self.known_assets = known_assets
+        self.reused_assets = []
+        self.asset_md5s = {}  # Contentstore MD5 digest of each asset, by name
+
+    def finish(self, olx_node, children, html_data=None, child_sources=None):
+        """
+        Turn the block's exported OLX node into self.olx_str, referencing the
+        given child usage keys, and find the contentstore assets it uses.
+
+        html_data is the HTML of html blocks, which isn't part of their OLX.
+        Children found in child_sources (a dict of bundle link names keyed by
+        usage key) are included from the bundle behind that link, as
+        <xblock-include source="link name" definition="..."/>, rather than
+        from the block's own bundle.
+        """
         # Apply some transformations to the OLX:
         self.transform_olx(olx_node)
         # Add  <xblock-include /> tags for each child (XBlock XML export
         # normally puts children inline as e.g. <html> tags, but we want
         # references to them only.)
-        if block.has_children:
-            for child_id in block.children:
+        if children:
+            for child_id in children:
                 # In modulestore, the "definition key" is a MongoDB ObjectID
                 # kept in split's definitions table, which theoretically allows
                 # the same block to be used in many places (each with a unique
@@ -110,35 +186,120 @@ class XBlockSerializer(object):
                 #     child_def_id = six.text_type(child.scope_ids.def_id)
                 # and then use
                 #     <xblock-include definition={child_def_id} usage={child_id.block_id} />
-                def_id = blockstore_def_key_from_modulestore_usage_key(child_id)
-                olx_node.append(olx_node.makeelement("xblock-include", {"definition": def_id}))
+                include = olx_node.makeelement("xblock-include", {
+                    "definition": blockstore_def_key_from_modulestore_usage_key(child_id),
+                })
+                if child_sources and child_id in child_sources:
+                    include.set("source", child_sources[child_id])
+                olx_node.append(include)
         # Store the resulting XML as a string:
+        if canonical_olx_enabled():
+            canonicalize_olx(olx_node)
         self.olx_str = etree_tostring(olx_node, encoding="utf-8", pretty_print=True)
+        self.content_digest = hashlib.sha1(self.olx_str).hexdigest()
         # And add a comment:
         self.olx_str += (
             '<!-- Imported from {} using openedx-blockstore-relay -->\n'.format(six.text_type(self.orig_block_key))
         ).encode('utf-8')
         # Search the OLX for references to files stored in the course's
         # "Files & Uploads" (contentstore):
-        course_key = self.orig_block_key.course_key
-        for asset in compat.collect_assets_from_text(self.olx_str, course_key):
+        as_stream = bool(self.known_assets)  # Don't read the assets until we know the bundle doesn't have them
+        for asset in self.find_assets(self.olx_str, as_stream=as_stream):
             # TODO: need to rewrite the URLs/paths in the olx_str to the new format/location
-            self.add_static_asset(asset['content'])
+            self.add_static_asset(asset)
         # Special case: for HTML blocks, the HTML we need to scan is in a separate .html file,
         # not in the OLX string. But we can access it at 'block.data':
-        if self.orig_block_key.block_type == 'html':
-            for asset in compat.collect_assets_from_text(block.data, course_key):
-                self.add_static_asset(asset['content'])
+        if html_data is not None:
+            for asset in self.find_assets(html_data, as_stream=as_stream):
+                self.add_static_asset(asset)
+        self.file_digests = self.compute_file_digests()
+
+    def find_assets(self, text, as_stream=False):
+        """
+        Yield the contentstore assets referenced by the given OLX or HTML (see
+        compat.get_asset_content_from_path() about as_stream).
+        """
+        course_key = self.orig_block_key.course_key
+        for asset in compat.collect_assets_from_text(text, course_key, as_stream=as_stream):
+            yield asset['content']
+
+    def compute_file_digests(self):
+        """
+        Return the SHA-1 digests of the block's files, keyed by their paths
+        in the bundle (including the reused assets, which aren't uploaded).
+        """
+        folder_path = '{}/'.format(self.def_id)
+        file_digests = {folder_path + 'definition.xml': hashlib.sha1(self.olx_str).hexdigest()}
+        for asset_file in self.static_files:
+            data = asset_file.data.encode('utf-8') if isinstance(asset_file.data, six.text_type) else asset_file.data
+            file_digests[folder_path + 'static/' + asset_file.name] = hashlib.sha1(data).hexdigest()
+        for reused_asset in self.reused_assets:
+            file_digests[folder_path + 'static/' + reused_asset.name] = reused_asset.digest
+        return file_digests
+
+    def serialize_generic(self, block):
+        """
+        Serialize any XBlock by asking it to export itself into an in-memory
+        filesystem. Returns the OLX node, and adds any files the block exported
+        to self.static_files.
+        """
+        # Create an XML node to hold the exported data
+        olx_node = Element("root")  # The node name doesn't matter: add_xml_to_node will change it
+        # ^ Note: We could pass nsmap=xblock.core.XML_NAMESPACES here, but the
+        # resulting XML namespace attributes don't seem that useful?
+        with override_export_fs(block) as filesystem:  # Needed for XBlocks that inherit XModuleDescriptor
+            # Tell the block to serialize itself as XML/OLX:
+            if not block.has_children:
+                block.add_xml_to_node(olx_node)
+            else:
+                # We don't want the children serialized at this time, because
+                # otherwise we can't tell which files in 'filesystem' belong to
+                # this block and which belong to its children. So, temporarily
+                # disable any children:
+                children = block.children
+                block.children = []
+                block.add_xml_to_node(olx_node)
+                block.children = children
+
+            # Now the block/module may have exported addtional data as files in
+            # 'filesystem'. If so, store them:
+            self.add_files_from_fs(filesystem)
+        return olx_node
+
+    def add_files_from_fs(self, filesystem):
+        """
+        Add every file in the given filesystem to self.static_files.
+        """
+        for item in filesystem.walk():  # pylint: disable=not-callable
+            for unit_file in item.files:
+                file_path = os.path.join(item.path, unit_file.name)
+                with filesystem.open(file_path, 'rb') as fh:
+                    data = fh.read()
+                self.static_files.append(StaticFile(name=unit_file.name, data=data))
 
     def add_static_asset(self, asset):
         """
         Add the given contentstore StaticContent file to the's list of static
-        files that this block uses.
+        files that this block uses, or to self.reused_assets if it is one of
+        self.known_assets.
+
+        asset may be a StaticContentStream, whose data is only read if needed.
         """
         # note: asset.name is a human-friendly name, not necessarily the file name.
         filename = asset.location.path
-        if filename not in [sf.name for sf in self.static_files]:
-            self.static_files.append(StaticFile(name=filename, data=asset.data))
+        if filename in self.asset_md5s or filename in [sf.name for sf in self.static_files]:
+            return
+        md5 = getattr(asset, 'content_digest', None)
+        known_asset = self.known_assets.get(
+            '{}/static/{}'.format(self.def_id, filename)
+        ) if self.known_assets else None
+        if md5 and known_asset is not None and known_asset.md5 == md5:
+            self.reused_assets.append(ReusedAsset(name=filename, digest=known_asset.digest, size=known_asset.size))
+        else:
+            data = asset.data if asset.data is not None else asset.copy_to_in_mem().data
+            self.static_files.append(StaticFile(name=filename, data=data))
+        if md5:
+            self.asset_md5s[filename] = md5
 
     def transform_olx(self, olx_node):
         """
@@ -155,3 +316,71 @@ class XBlockSerializer(object):
             for key in olx_node.attrib.keys():
                 if key not in ('display_name', 'url_name'):
                     log.warn('<vertical> tag attribute "%s" will be ignored after conversion to <unit>', key)
+
+
+# Functions which serialize blocks of a given type more cheaply than
+# XBlockSerializer.serialize_generic(), producing the same OLX and static files
+# from the block's field data. Each is called as fn(serializer, block), and
+# returns the OLX node (adding any files to serializer.static_files), or None
+# to fall back to the generic path.
+FAST_SERIALIZERS = {}
+
+
+def fast_serializer(block_type):
+    """
+    Decorator registering a function in FAST_SERIALIZERS for the given block type.
+    """
+    def register(func):
+        """ Register func """
+        FAST_SERIALIZERS[block_type] = func
+        return func
+    return register
+
+
+def html_filename(url_name):
+    """
+    Return the name (without extension) of the file holding the HTML of the
+    html block with the given url_name, as referenced by its OLX.
+    """
+    # Like xmodule.xml_module.name_to_pathname(), which turns ':' into '/':
+    return os.path.basename(url_name.replace(':', '/'))
+
+
+@fast_serializer('html')
+def serialize_html(serializer, block):
+    """
+    HtmlDescriptor.definition_to_xml() writes the HTML to a '<url_name>.html'
+    file, and returns <html filename="<url_name>"/>.
+    """
+    if not is_plain_xmodule(block):
+        return None
+    filename = html_filename(block.url_name)
+    serializer.static_files.append(StaticFile(name=filename + '.html', data=block.data.encode('utf-8')))
+    return xmodule_olx_node(block, Element('html', {'filename': filename}))
+
+
+@fast_serializer('problem')
+def serialize_problem(serializer, block):  # pylint: disable=unused-argument
+    """
+    CapaDescriptor.definition_to_xml() returns the parsed problem XML as-is.
+    """
+    if not is_plain_xmodule(block):
+        return None
+    return xmodule_olx_node(block, etree_fromstring(block.data))
+
+
+@fast_serializer('video')
+def serialize_video(serializer, block):
+    """
+    VideoDescriptor.definition_to_xml() builds the OLX from the block's fields,
+    but edx-val writes the transcript files into the export filesystem, so a
+    bare in-memory filesystem is still needed here (without patching the
+    runtime or XmlParserMixin as override_export_fs() does).
+    """
+    if not is_plain_xmodule(block):
+        return None
+    filesystem = WrapFS(MemoryFS())  # edx-val calls delegate_fs(), which only wrapped filesystems have
+    filesystem.makedirs('course/static')  # edx-val puts transcripts in this directory
+    olx_node = xmodule_olx_node(block, block.definition_to_xml(filesystem))
+    serializer.add_files_from_fs(filesystem)
+    return olx_node
@@ -1,18 +1,30 @@
 """
 A very rudimentary API client for Blockstore
+
+Every request first waits for the Blockstore rate limits, if any are set (see
+limits.throttle()).
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import base64
+import io
+import json
 import logging
+import zlib
 
 import requests
 import six
 from django.conf import settings
 from future.moves.urllib.parse import urljoin
 
+from . import limits
+
 log = logging.getLogger(__name__)
 
+# How much file data DraftFilesBody base64-encodes at a time (must be a multiple of 3):
+ENCODE_CHUNK_SIZE = 3 * 64 * 1024
+DEFAULT_GZIP_LEVEL = 6
+
 
 def encode_str_for_draft(input_str):
     """Given a string, return UTF-8 representation that is then base64 encoded."""
@@ -21,45 +33,278 @@ def encode_str_for_draft(input_str):
     return base64.b64encode(input_str)
 
 
-def create_bundle(collection_uuid, title, slug, **kwargs):
+def _encoded_size(num_bytes):
+    """
+    Return the length of the base64 encoding of num_bytes bytes.
+    """
+    return 4 * ((num_bytes + 2) // 3)
+
+
+class DraftFilesBody(object):
+    """
+    The JSON body of a PATCH request adding files to a draft, i.e.
+        {"files": {"path/1": "<base64 data>", "path/2": "<base64 data>"}}
+    generated incrementally as it is read, so that neither a base64-encoded
+    copy of each file nor the whole JSON document is ever held in memory.
+
+    requests sends file-like bodies by calling read() repeatedly, and uses
+    len() and tell() to set the Content-Length header. It also calls seek() to
+    rewind the body before sending it again (e.g. after a redirect), which
+    starts generating it again from the beginning.
+    """
+
+    def __init__(self, files, chunk_size=ENCODE_CHUNK_SIZE):
+        """
+        files is a list of (path, data) tuples, or a dict of data keyed by path.
+
+        chunk_size must be a multiple of 3, so that base64-encoding a file
+        chunk by chunk gives the same result as encoding it all at once.
+        """
+        if chunk_size <= 0 or chunk_size % 3:
+            raise ValueError('chunk_size must be a positive multiple of 3, not {}'.format(chunk_size))
+        if isinstance(files, dict):
+            files = files.items()
+        self.files = []
+        for path, data in files:
+            if isinstance(data, six.text_type):
+                data = data.encode('utf8')
+            self.files.append((json.dumps(path).encode('ascii'), data))
+        self.chunk_size = chunk_size
+        self._chunks = self._generate_chunks()
+        self._buffer = b''
+        self._position = 0
+
+    def __len__(self):
+        """
+        Return the total size of the body, in bytes.
+        """
+        size = len(b'{"files": {') + len(b'}}') + len(b', ') * max(len(self.files) - 1, 0)
+        for json_path, data in self.files:
+            size += len(json_path) + len(b': "') + _encoded_size(len(data)) + len(b'"')
+        return size
+
+    def _generate_chunks(self):
+        """
+        Yield the body, piece by piece.
+        """
+        yield b'{"files": {'
+        for i, (json_path, data) in enumerate(self.files):
+            if i:
+                yield b', '
+            yield json_path + b': "'
+            for offset in range(0, len(data), self.chunk_size):
+                # Each chunk but the last is a multiple of 3 bytes long, so
+                # there is no padding except at the end of the file.
+                yield base64.b64encode(data[offset:offset + self.chunk_size])
+            yield b'"'
+        yield b'}}'
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._buffer:
+            chunk, self._buffer = self._buffer, b''
+        else:
+            chunk = next(self._chunks)
+        self._position += len(chunk)
+        return chunk
+
+    next = __next__  # Python 2
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes of the body (or all of the rest, if size is negative).
+        """
+        pieces = [self._buffer]
+        num_bytes = len(self._buffer)
+        while size < 0 or num_bytes < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            pieces.append(chunk)
+            num_bytes += len(chunk)
+        data = b''.join(pieces)
+        if size < 0:
+            self._buffer = b''
+        else:
+            self._buffer = data[size:]
+            data = data[:size]
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        """
+        Return the current position in the body.
+        """
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Move to the given position in the body, and return it. Moving back
+        generates the body again from the beginning.
+        """
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self)
+        offset = max(offset, 0)
+        if offset < self._position:
+            self._chunks = self._generate_chunks()
+            self._buffer = b''
+            self._position = 0
+        while self._position < offset and self.read(min(offset - self._position, self.chunk_size)):
+            pass
+        return self._position
+
+
+def gzip_min_bytes():
+    """
+    Return the size from which draft upload bodies get gzip-compressed, or None
+    if they are never compressed (settings.BLOCKSTORE_RELAY_GZIP_MIN_BYTES).
+    """
+    return getattr(settings, 'BLOCKSTORE_RELAY_GZIP_MIN_BYTES', None)
+
+
+def should_gzip(body_size):
+    """
+    Return True if a draft upload body of body_size bytes should be compressed.
+    """
+    min_bytes = gzip_min_bytes()
+    return min_bytes is not None and body_size >= min_bytes
+
+
+def gzip_body(body, level=DEFAULT_GZIP_LEVEL):
+    """
+    Compress a request body (an iterable of byte strings, such as a
+    DraftFilesBody) into a gzip byte string, chunk by chunk.
+
+    zlib releases the GIL while compressing, so bodies being compressed on
+    several upload threads are compressed in parallel.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+    pieces = [compressor.compress(chunk) for chunk in body]
+    pieces.append(compressor.flush())
+    return b''.join(pieces)
+
+
+def _api_url(path, api_url=None):
+    """
+    Return the URL of the given Blockstore API path, on the Blockstore instance
+    at api_url (settings.BLOCKSTORE_API_URL by default).
+    """
+    return urljoin(api_url or settings.BLOCKSTORE_API_URL, path)
+
+
+def create_bundle(collection_uuid, title, slug, api_url=None, **kwargs):
     """
     Create a bundle in the specified collection.
     """
-    url = urljoin(settings.BLOCKSTORE_API_URL, 'bundles')
+    url = _api_url('bundles', api_url)
     data = dict(collection_uuid=str(collection_uuid), title=title, slug=slug, **kwargs)
     log.debug("POST %s %s", url, data)
+    limits.throttle(api_url=api_url)
     response = requests.post(url, data)
     response.raise_for_status()
     return response.json()
 
 
-def create_draft(bundle_uuid, name, title):
+def create_draft(bundle_uuid, name, title, api_url=None):
     """
     Create a draft in the specified bundle.
     """
-    url = urljoin(settings.BLOCKSTORE_API_URL, 'drafts')
+    url = _api_url('drafts', api_url)
     data = {'bundle_uuid': str(bundle_uuid), 'name': name, 'title': title, }
     log.debug("POST %s %s", url, data)
+    limits.throttle(api_url=api_url)
     response = requests.post(url, data)
     response.raise_for_status()
     return response.json()
 
 
-def add_file_to_draft(draft_uuid, path, data):
+def add_file_to_draft(draft_uuid, path, data, api_url=None):
     """
     Add the specified file data to the draft
     """
-    url = urljoin(settings.BLOCKSTORE_API_URL, 'drafts/{}'.format(draft_uuid))
-    log.debug("PATCH %s", url)
-    response = requests.patch(url, json={'files': {path: encode_str_for_draft(data)}})
+    add_files_to_draft(draft_uuid, [(path, data)], api_url=api_url)
+
+
+def add_files_to_draft(draft_uuid, files, api_url=None):
+    """
+    Add several files to the draft in a single request.
+
+    files is a list of (path, data) tuples, or a dict of data keyed by path.
+
+    Bodies of at least settings.BLOCKSTORE_RELAY_GZIP_MIN_BYTES bytes are sent
+    gzip-compressed (on the calling thread, i.e. on the upload threads when
+    uploads are concurrent). The body's size as sent counts towards the byte
+    rate limit (see limits.throttle()).
+    """
+    url = _api_url('drafts/{}'.format(draft_uuid), api_url)
+    body = DraftFilesBody(files)
+    headers = {'Content-Type': 'application/json'}
+    body_size = len(body)
+    if should_gzip(body_size):
+        body = gzip_body(body, level=getattr(settings, 'BLOCKSTORE_RELAY_GZIP_LEVEL', DEFAULT_GZIP_LEVEL))
+        headers['Content-Encoding'] = 'gzip'
+        log.debug("PATCH %s (%d bytes, %d gzipped)", url, body_size, len(body))
+    else:
+        log.debug("PATCH %s (%d bytes)", url, body_size)
+    limits.throttle(len(body), api_url=api_url)
+    with limits.phase(limits.PHASE_UPLOAD):
+        response = requests.patch(url, data=body, headers=headers)
+    response.raise_for_status()
+
+
+def set_draft_link(draft_uuid, link_name, bundle_uuid, version, api_url=None):
+    """
+    Create (or replace) the draft's link of the given name to the given
+    version of another bundle.
+    """
+    url = _api_url('drafts/{}'.format(draft_uuid), api_url)
+    data = {'links': {link_name: {'bundle_uuid': str(bundle_uuid), 'version': version}}}
+    log.debug("PATCH %s %s", url, data)
+    limits.throttle(api_url=api_url)
+    response = requests.patch(url, json=data)
     response.raise_for_status()
 
 
-def commit_draft(draft_uuid):
+def commit_draft(draft_uuid, api_url=None):
     """
     Commit the draft, saving the files to the Blockstore bundle.
     """
-    url = urljoin(settings.BLOCKSTORE_API_URL, 'drafts/{}/commit'.format(draft_uuid))
+    url = _api_url('drafts/{}/commit'.format(draft_uuid), api_url)
     log.debug("POST %s", url)
+    limits.throttle(api_url=api_url)
     response = requests.post(url)
     response.raise_for_status()
+
+
+def get_bundle_version(bundle_uuid, api_url=None):
+    """
+    Return the number of the latest committed version of the bundle, or 0 if
+    it has none yet.
+    """
+    url = _api_url('bundles/{}'.format(bundle_uuid), api_url)
+    log.debug("GET %s", url)
+    limits.throttle(api_url=api_url)
+    response = requests.get(url)
+    response.raise_for_status()
+    # The versions are listed as URLs, oldest first, e.g. ".../bundle_versions/<bundle uuid>,15":
+    versions = response.json()['versions']
+    return int(versions[-1].rstrip('/').split(',')[-1]) if versions else 0
+
+
+def get_bundle_files(bundle_uuid, api_url=None):
+    """
+    Return the listing of the files in the latest version of the bundle, as a
+    list of dicts with (at least) the 'path', 'size' and 'hash_digest' (the
+    SHA-1 hex digest of the file's data) of each file.
+    """
+    url = _api_url('bundles/{}/files'.format(bundle_uuid), api_url)
+    log.debug("GET %s", url)
+    limits.throttle(api_url=api_url)
+    response = requests.get(url)
+    response.raise_for_status()
+    return response.json()
@@ -15,10 +15,21 @@ eliminates external dependencies
 """
 from __future__ import absolute_import, unicode_literals
 
+import importlib
 import logging
 
+import six
+from django.core.exceptions import ObjectDoesNotExist
+
+from . import asset_cache, limits
+
 LOG = logging.getLogger(__name__)
 
+# edx-platform symbols which have been resolved by edx_symbol(), keyed by (module name, symbol name)
+_EDX_SYMBOLS = {}
+# XBlock classes returned by get_block_class(), keyed by block type
+_BLOCK_CLASSES = {}
+
 
 class EdXPlatformImportError(ImportError):
     """
@@ -29,56 +40,368 @@ class EdXPlatformImportError(ImportError):
         """
         Construct a message from the given import_error's message.
         """
-        message = 'Must run inside an edx-platform virtualenv: {}'.format(import_error.message)
+        message = 'Must run inside an edx-platform virtualenv: {}'.format(six.text_type(import_error))
         super(EdXPlatformImportError, self).__init__(message)
 
 
-def get_block(usage_key):
+def edx_symbol(module_name, name):
     """
-    Return block from the modulestore.
+    Return the given symbol from the given edx-platform module.
+
+    edx-platform modules are slow to import, so the relay doesn't import any
+    at module load time: each symbol is imported when it is first needed,
+    and cached, so that later lookups are a dict access.
+
+    Raises EdXPlatformImportError if the symbol can't be imported.
     """
     try:
-        from xmodule.modulestore.django import modulestore as store
+        return _EDX_SYMBOLS[module_name, name]
+    except KeyError:
+        pass
+    try:
+        symbol = getattr(importlib.import_module(module_name), name)
     except ImportError as exc:
         raise EdXPlatformImportError(exc)
+    except AttributeError:
+        raise EdXPlatformImportError(ImportError('cannot import name {} from {}'.format(name, module_name)))
+    _EDX_SYMBOLS[module_name, name] = symbol
+    return symbol
+
 
-    return store().get_item(usage_key)
+def modulestore():
+    """
+    Return the modulestore.
+    """
+    return edx_symbol('xmodule.modulestore.django', 'modulestore')()
 
 
-def get_asset_content_from_path(course_key, asset_path):
+def get_block(usage_key):
     """
-    Locate the given asset content, load it into memory, and return it.
+    Return block from the modulestore.
+    """
+    with limits.phase(limits.PHASE_MODULESTORE):
+        return modulestore().get_item(usage_key)
 
-    Returns None if the asset is not found.
+
+def get_block_class(block_type):
+    """
+    Return the XBlock class of the given block type, with the mixins that the
+    modulestore's runtime adds to it, i.e. the class of loaded blocks of that
+    type.
     """
     try:
-        from xmodule.contentstore.content import StaticContent
-        from xmodule.assetstore.assetmgr import AssetManager
-        from xmodule.modulestore.exceptions import ItemNotFoundError
-        from xmodule.exceptions import NotFoundError
-    except ImportError as exc:
-        raise EdXPlatformImportError(exc)
+        return _BLOCK_CLASSES[block_type]
+    except KeyError:
+        pass
+    store = modulestore()
+    block_class = edx_symbol('xblock.core', 'XBlock').load_class(block_type, select=store.xblock_select)
+    _BLOCK_CLASSES[block_type] = edx_symbol('xblock.runtime', 'Mixologist')(store.xblock_mixins).mix(block_class)
+    return _BLOCK_CLASSES[block_type]
 
-    try:
-        asset_key = StaticContent.get_asset_key_from_path(course_key, asset_path)
-        return AssetManager.find(asset_key)
-    except (ItemNotFoundError, NotFoundError) as exc:
+
+def has_block(usage_key):
+    """
+    Return True if the given block exists (i.e. has not been deleted).
+    """
+    return modulestore().has_item(usage_key)
+
+
+def get_course_root_key(course_key):
+    """
+    Return the usage key of the root block of the given course.
+    """
+    return modulestore().make_course_usage_key(course_key)
+
+
+def get_parent_key(usage_key):
+    """
+    Return the usage key of the given block's parent, or None for root blocks.
+    """
+    return modulestore().get_parent_location(usage_key)
+
+
+def _get_split_structure(course_key, structure_version=None):
+    """
+    Return (split modulestore, draft branch key, structure document) for the
+    given course, or None if the course is not stored in split modulestore.
+
+    The structure document is the draft branch's current one, unless the ID
+    of one of its earlier versions is given (see get_structure_history()).
+    """
+    ModuleStoreEnum = edx_symbol('xmodule.modulestore', 'ModuleStoreEnum')  # pylint: disable=invalid-name
+    split = modulestore()._get_modulestore_for_courselike(course_key)  # pylint: disable=protected-access
+    if split.get_modulestore_type() != ModuleStoreEnum.Type.split:
         return None
+    branch_key = course_key.for_branch(ModuleStoreEnum.BranchName.draft)
+    if structure_version is not None:
+        structure = split.db_connection.get_structure(structure_version, branch_key)
+    else:
+        structure = split._lookup_course(branch_key).structure  # pylint: disable=protected-access
+    return split, branch_key, structure
+
+
+def _get_previous_version(split, structure_version):
+    """
+    Return the ID of the structure which the given version of a split
+    modulestore structure was derived from, or None for the first version.
+
+    This is the only place where the structures collection is queried
+    directly, to read that one field rather than the whole (possibly large)
+    structure document.
+    """
+    document = split.db_connection.structures.find_one({'_id': structure_version}, {'previous_version': True})
+    return document.get('previous_version') if document else None
+
+
+def get_structure_history(course_key):
+    """
+    Return the IDs of every version of the given course's draft branch
+    structure, oldest first (the last one is the current version), or None if
+    the course is not stored in split modulestore.
+
+    Each structure document points to the version it was derived from, so the
+    history is found by following those pointers back from the current
+    version, reading only that field of each version of the draft branch
+    (and nothing of the other branches' structures).
+    """
+    with limits.phase(limits.PHASE_MODULESTORE):
+        split_structure = _get_split_structure(course_key)
+        if split_structure is None:
+            return None
+        split, _branch_key, structure = split_structure
+        history = []
+        version = structure['_id']
+        while version is not None:
+            history.append(version)
+            version = _get_previous_version(split, version)
+    history.reverse()
+    return history
 
 
-def collect_assets_from_text(text, course_id):
+def get_block_at_version(usage_key, structure_version):
     """
-    Yield dicts of asset content and path from static asset paths found in the given text.
+    Load the given block as it was in the given version of its course's
+    structure (see get_structure_history()).
     """
+    return get_block(usage_key.for_version(structure_version))
+
+
+def get_block_versions(course_key, structure_version=None):
+    """
+    Return the version of every block of the given course, read from split
+    modulestore's structure document alone, without loading any XBlocks or
+    definitions.
+
+    Returns a dict keyed by usage key of (version, children) tuples: version
+    is a string which changes whenever the block's settings or content do
+    (its definition ID and the structure version it was last edited in), and
+    children is the list of the usage keys of its children. Returns None if
+    the course is not stored in split modulestore.
+
+    The blocks are read from the course's current structure, unless the ID of
+    an earlier version is given (see get_structure_history()).
+    """
+    with limits.phase(limits.PHASE_MODULESTORE):
+        split_structure = _get_split_structure(course_key, structure_version)
+    if split_structure is None:
+        return None
+    structure = split_structure[2]
+    block_versions = {}
+    for block_key, block_data in structure['blocks'].items():
+        version = '{}@{}'.format(block_data.definition, getattr(block_data.edit_info, 'update_version', None))
+        children = [course_key.make_usage_key(child[0], child[1]) for child in block_data.fields.get('children', [])]
+        block_versions[course_key.make_usage_key(block_key.type, block_key.id)] = (version, children)
+    return block_versions
+
+
+def get_stored_blocks(course_key, structure_version=None, usage_keys=None):
+    """
+    Read every block of the given course (or only those with the given usage
+    keys) straight from split modulestore's structure and definition
+    documents, in bulk, without loading any XBlocks.
+
+    Returns a dict keyed by usage key of dicts like:
+        {
+            'fields': {...},  # The block's own settings, plus 'children' as a list of usage keys
+            'definition_fields': {...},  # The block's content fields
+            'asides': [...],
+        }
+    with field values in the JSON form in which they are stored. Returns None
+    if the course is not stored in split modulestore.
+
+    The blocks are read from the course's current structure, unless the ID of
+    an earlier version is given (see get_structure_history()).
+    """
+    with limits.phase(limits.PHASE_MODULESTORE):
+        split_structure = _get_split_structure(course_key, structure_version)
+        if split_structure is None:
+            return None
+        split, branch_key, structure = split_structure
+        blocks = structure['blocks']
+        if usage_keys is not None:
+            # Structures are keyed by BlockKey, a (type, id) namedtuple:
+            wanted = set((usage_key.block_type, usage_key.block_id) for usage_key in usage_keys)
+            blocks = {block_key: block_data for block_key, block_data in blocks.items() if block_key in wanted}
+        definitions = {
+            definition['_id']: definition
+            for definition in split.get_definitions(
+                branch_key, [block_data.definition for block_data in blocks.values()],
+            )
+        }
+
+    stored_blocks = {}
+    for block_key, block_data in blocks.items():
+        fields = dict(block_data.fields)
+        if 'children' in fields:
+            fields['children'] = [course_key.make_usage_key(child[0], child[1]) for child in fields['children']]
+        stored_blocks[course_key.make_usage_key(block_key.type, block_key.id)] = {
+            'fields': fields,
+            'definition_fields': definitions.get(block_data.definition, {}).get('fields', {}),
+            'asides': getattr(block_data, 'asides', None) or [],
+        }
+    return stored_blocks
+
+
+def get_course_video_ids(course_key):
+    """
+    Return the edxval video IDs used by the video blocks of the given course.
+    """
+    with limits.phase(limits.PHASE_MODULESTORE):
+        videos = modulestore().get_items(course_key, qualifiers={'category': 'video'})
+    return [video.edx_video_id for video in videos if video.edx_video_id]
+
+
+def get_edxval_videos(edx_video_ids, course_key):
+    """
+    Fetch the edxval data of the given videos in bulk, for export.
+
+    Returns a dict keyed by edx_video_id of dicts like:
+        {
+            'client_video_id': 'Intro video',
+            'duration': 0.0,
+            'image': '',  # The video's image in the given course, if any
+            'encoded_videos': [{'profile': 'youtube', 'url': '...', 'file_size': '0', 'bitrate': '0'}, ...],
+            'transcripts': [{'language_code': 'en', 'provider': 'Custom', 'content': b'<SRT>'}, ...],
+        }
+    Videos which are not in edxval are left out.
+    """
+    CourseVideo = edx_symbol('edxval.models', 'CourseVideo')  # pylint: disable=invalid-name
+    Video = edx_symbol('edxval.models', 'Video')  # pylint: disable=invalid-name
+    VideoTranscript = edx_symbol('edxval.models', 'VideoTranscript')  # pylint: disable=invalid-name
+    Transcript = edx_symbol('edxval.transcript_utils', 'Transcript')  # pylint: disable=invalid-name
+    edx_video_ids = list(edx_video_ids)
+    videos = {}
+    for video in Video.objects.filter(edx_video_id__in=edx_video_ids).prefetch_related('encoded_videos__profile'):
+        videos[video.edx_video_id] = {
+            'client_video_id': video.client_video_id,
+            'duration': video.duration,
+            'image': '',
+            'encoded_videos': [
+                {
+                    name: six.text_type(getattr(encoded_video, name))
+                    for name in ('profile', 'url', 'file_size', 'bitrate')
+                }
+                for encoded_video in video.encoded_videos.all()
+            ],
+            'transcripts': [],
+        }
+    course_videos = CourseVideo.objects.filter(
+        course_id=six.text_type(course_key), video__edx_video_id__in=edx_video_ids,
+    ).select_related('video', 'video_image')
+    for course_video in course_videos:
+        try:
+            videos[course_video.video.edx_video_id]['image'] = course_video.video_image.image.name
+        except ObjectDoesNotExist:
+            pass
+    transcripts = VideoTranscript.objects.filter(
+        video__edx_video_id__in=edx_video_ids,
+    ).select_related('video').order_by('language_code')
+    for transcript in transcripts:
+        try:
+            content = transcript.transcript.file.read()
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception('Could not read the %s transcript of video %s', transcript.language_code, transcript.video_id)
+            continue
+        if isinstance(content, six.binary_type):
+            content = content.decode('utf-8')
+        content = Transcript.convert(content, input_format=transcript.file_format, output_format=Transcript.SRT)
+        videos[transcript.video.edx_video_id]['transcripts'].append({
+            'language_code': transcript.language_code,
+            'provider': transcript.provider,
+            'content': content.encode('utf-8') if isinstance(content, six.text_type) else content,
+        })
+    return videos
+
+
+def get_asset_content_from_path(course_key, asset_path, as_stream=False):
+    """
+    Locate the given asset content, load it into memory, and return it.
+
+    If as_stream is True, a StaticContentStream is returned instead, whose
+    data is only read from the contentstore when it is streamed (its stored
+    content_digest is available without reading it).
+
+    If the local asset cache is enabled (see asset_cache.py), only the asset's
+    metadata is read from the contentstore here, and an asset_cache.CachedAsset
+    is returned, whose data comes from the cache if the cache has this version
+    of the asset, and is otherwise read from the contentstore and cached.
+
+    Returns None if the asset is not found.
+    """
+    not_found_errors = (
+        edx_symbol('xmodule.modulestore.exceptions', 'ItemNotFoundError'),
+        edx_symbol('xmodule.exceptions', 'NotFoundError'),
+    )
+    cache = asset_cache.get_asset_cache()
     try:
-        from static_replace import replace_static_urls
-    except ImportError as exc:
-        raise EdXPlatformImportError(exc)
+        asset_key = edx_symbol('xmodule.contentstore.content', 'StaticContent').get_asset_key_from_path(
+            course_key, asset_path,
+        )
+        with limits.phase(limits.PHASE_CONTENTSTORE):
+            asset = edx_symbol('xmodule.assetstore.assetmgr', 'AssetManager').find(
+                asset_key, as_stream=as_stream or cache is not None,
+            )
+    except not_found_errors:
+        return None
+    if cache is None:
+        return asset
+    md5 = getattr(asset, 'content_digest', None)
+    if not md5:
+        # Without a digest, a cached copy can't be told apart from an outdated one:
+        return asset if as_stream else _read_asset_stream(asset)
+    key = cache.key(course_key, asset_path, md5, asset.length)
+    return asset_cache.CachedAsset(cache, key, asset, load=lambda: _read_asset_stream(asset).data)
 
+
+def _read_asset_stream(asset):
+    """
+    Read the data of the given StaticContentStream from the contentstore, and
+    return it as a StaticContent.
+    """
+    with limits.phase(limits.PHASE_CONTENTSTORE):
+        return asset.copy_to_in_mem()
+
+
+def get_course_asset_bytes(course_key):
+    """
+    Return the total size in bytes of the given course's contentstore assets
+    ("Files & Uploads"), without reading any of them.
+    """
+    contentstore = edx_symbol('xmodule.contentstore.django', 'contentstore')
+    with limits.phase(limits.PHASE_CONTENTSTORE):
+        assets, _count = contentstore().get_all_content_for_course(course_key)
+    return sum(asset.get('length', 0) for asset in assets)
+
+
+def collect_assets_from_text(text, course_id, as_stream=False):
+    """
+    Yield dicts of asset content and path from static asset paths found in the given text
+    (see get_asset_content_from_path() about as_stream).
+    """
     static_paths = []
-    replace_static_urls(text=text, course_id=course_id, static_paths_out=static_paths)
+    edx_symbol('static_replace', 'replace_static_urls')(text=text, course_id=course_id, static_paths_out=static_paths)
     for (path, uri) in static_paths:
-        content = get_asset_content_from_path(course_id, path)
+        content = get_asset_content_from_path(course_id, path, as_stream=as_stream)
         if content is None:
             LOG.error("Static asset not found: (%s, %s)", path, uri)
         else:
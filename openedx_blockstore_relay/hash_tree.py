@@ -0,0 +1,105 @@
+"""
+Merkle-style hash trees of a course's blocks, for finding what has changed
+since a bundle was last updated without serializing anything.
+
+Each block gets two hashes, computed from the block versions and children
+lists in split modulestore's structure document (see
+compat.get_block_versions()):
+
+* its node hash, of its own version and of the list of its children, which
+  changes whenever the block itself has to be serialized again;
+* its subtree hash, of its node hash and of the subtree hashes of its
+  children, which changes whenever anything in its subtree does.
+
+The ledger keeps the hashes of the blocks in each bundle as of its last
+changed-only transfer (see ledger.get_subtree_hashes()). diff_hash_trees()
+compares them top-down, and only descends into subtrees whose hash differs:
+after a single edit, it compares the blocks along the path to the edited
+block (and their siblings) rather than the whole course.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import hashlib
+from collections import namedtuple
+
+import six
+
+# The hashes of a block:
+BlockHashes = namedtuple('BlockHashes', ['node_hash', 'subtree_hash'])
+
+
+class HashTreeDiff(namedtuple('HashTreeDiff', ['changed', 'outdated', 'compared'])):
+    """
+    The result of comparing a block's current hash tree with the recorded one:
+    changed is the list of the usage keys of the blocks which need serializing
+    again (parents before children), outdated the set of the usage keys whose
+    recorded hashes need updating, and compared the number of blocks whose
+    hashes were compared.
+    """
+
+
+def _sha1(*parts):
+    """
+    Return the SHA-1 hex digest of the given strings, one per line.
+    """
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def compute_hash_tree(block_versions, root_key):
+    """
+    Return the BlockHashes of root_key and each of its descendants, keyed by
+    usage key, given a dict of (version, children) tuples keyed by usage key
+    (see compat.get_block_versions()). Children missing from block_versions
+    are only part of their parent's node hash.
+    """
+    hashes = {}
+    # Iterative post-order traversal, so that deep trees can't hit the recursion limit. Each block is pushed
+    # once with its block versions entry, to be hashed once its children have been (usage keys are slow to
+    # hash, so they are looked up as few times as possible):
+    stack = [(root_key, None)]
+    while stack:
+        usage_key, entry = stack.pop()
+        if entry is None:
+            if usage_key in hashes:
+                continue
+            version, all_children = block_versions[usage_key]
+            children = [child_key for child_key in all_children if child_key in block_versions]
+            stack.append((usage_key, (version, all_children, children)))
+            stack.extend((child_key, None) for child_key in reversed(children))
+            continue
+        version, all_children, children = entry
+        node_hash = _sha1(six.text_type(usage_key), version, *(six.text_type(child_key) for child_key in all_children))
+        subtree_hash = _sha1(node_hash, *(hashes[child_key].subtree_hash for child_key in children))
+        hashes[usage_key] = BlockHashes(node_hash, subtree_hash)
+    return hashes
+
+
+def diff_hash_trees(root_key, block_versions, hashes, recorded_hashes):
+    """
+    Compare the current hash tree of root_key (see compute_hash_tree()) with
+    the recorded one (a dict of BlockHashes keyed by usage key), top-down, and
+    return a HashTreeDiff.
+
+    Subtrees whose subtree hash hasn't changed are skipped without looking at
+    their descendants. Blocks which have no recorded hashes count as changed.
+    """
+    changed = []
+    outdated = set()
+    compared = 0
+    stack = [root_key]
+    while stack:
+        usage_key = stack.pop()
+        if usage_key in outdated:
+            continue
+        compared += 1
+        current = hashes[usage_key]
+        recorded = recorded_hashes.get(usage_key)
+        if recorded is not None and recorded.subtree_hash == current.subtree_hash:
+            continue
+        outdated.add(usage_key)
+        if recorded is None or recorded.node_hash != current.node_hash:
+            changed.append(usage_key)
+        children = [child_key for child_key in block_versions[usage_key][1] if child_key in hashes]
+        # Reversed, so that children get popped off the stack in order:
+        stack.extend(reversed(children))
+    return HashTreeDiff(changed=changed, outdated=outdated, compared=compared)
@@ -0,0 +1,339 @@
+"""
+API for the transfer ledger (see models.py).
+
+Every transfer is recorded with the destination of the sink it was written to
+(see sinks.py). The functions below only look at transfers into Blockstore
+(destination BLOCKSTORE), unless given another destination, so that bundles
+written to local files never pass for Blockstore bundles.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+from collections import OrderedDict, namedtuple
+
+import six
+from django.db import transaction
+from django.utils import timezone
+
+from .hash_tree import BlockHashes
+from .models import BlockHash, Transfer, TransferredAsset, TransferredBlock
+
+# The destination of transfers into Blockstore (see sinks.py):
+BLOCKSTORE = ''
+
+# A contentstore asset in a bundle, as returned by get_bundle_assets():
+BundleAsset = namedtuple('BundleAsset', ['md5', 'digest', 'size'])
+
+
+def digest(data):
+    """
+    Return the SHA-1 hex digest of the given file data.
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def start_transfer(
+    root_block_key, bundle_uuid, draft_uuid=None, collection_uuid=None, destination=BLOCKSTORE, incremental=False,
+):
+    """
+    Record the start of a transfer of root_block_key (and its descendants)
+    into the given bundle (in collection_uuid, if the transfer was given it,
+    whether or not it created the bundle) of the given destination, and return
+    the new Transfer.
+
+    Transfers which only upload some of the blocks under root_block_key must
+    be marked as incremental, so that they are not taken for transfers of the
+    whole subtree (see get_latest_transfer() and get_transfer_since()).
+    """
+    return Transfer.objects.create(
+        root_key=root_block_key,
+        course_key=root_block_key.course_key,
+        bundle_uuid=bundle_uuid,
+        draft_uuid=draft_uuid,
+        collection_uuid=collection_uuid,
+        destination=destination,
+        incremental=incremental,
+    )
+
+
+def block_digests(data):
+    """
+    Return (olx_digest, asset_digests) for the given serialized block (an
+    XBlockSerializer), as recorded in its TransferredBlock.
+
+    These are the digests of the files as uploaded, which the serializer
+    computes as it goes (see XBlockSerializer.file_digests).
+    """
+    folder_path = '{}/'.format(data.def_id)
+    file_digests = getattr(data, 'file_digests', None)
+    if file_digests is None:
+        file_digests = {folder_path + 'definition.xml': digest(data.olx_str)}
+        file_digests.update(
+            (folder_path + 'static/' + asset_file.name, digest(asset_file.data)) for asset_file in data.static_files
+        )
+        # Assets which the bundle already had, and so weren't read (see XBlockSerializer):
+        for reused_asset in getattr(data, 'reused_assets', ()):
+            file_digests[folder_path + 'static/' + reused_asset.name] = reused_asset.digest
+    olx_path = folder_path + 'definition.xml'
+    return file_digests[olx_path], {path: value for path, value in file_digests.items() if path != olx_path}
+
+
+class BlockRecorder(object):
+    """
+    Collects the ledger rows for blocks uploaded as part of a transfer (and
+    for their contentstore assets), so they can be saved in bulk once the data
+    of each block is long gone.
+    """
+
+    def __init__(self, transfer):
+        self.transfer = transfer
+        self.rows = []
+        self.asset_rows = []
+
+    def add(self, data):
+        """
+        Record that the given serialized block (an XBlockSerializer) was uploaded.
+        """
+        olx_digest, asset_digests = block_digests(data)
+        self.rows.append(TransferredBlock(
+            transfer=self.transfer,
+            usage_key=data.orig_block_key,
+            def_path='{}/definition.xml'.format(data.def_id),
+            olx_digest=olx_digest,
+            asset_digests=asset_digests,
+        ))
+        folder_path = '{}/static/'.format(data.def_id)
+        sizes = {asset_file.name: len(asset_file.data) for asset_file in data.static_files}
+        sizes.update((reused_asset.name, reused_asset.size) for reused_asset in getattr(data, 'reused_assets', ()))
+        for name, md5 in getattr(data, 'asset_md5s', {}).items():
+            self.asset_rows.append(TransferredAsset(
+                transfer=self.transfer,
+                path=folder_path + name,
+                digest=asset_digests[folder_path + name],
+                md5=md5,
+                size=sizes[name],
+            ))
+
+    def save(self):
+        """
+        Save the rows collected so far.
+        """
+        TransferredBlock.objects.bulk_create(self.rows)
+        TransferredAsset.objects.bulk_create(self.asset_rows)
+        self.rows = []
+        self.asset_rows = []
+
+
+def record_blocks(transfer, serialized_blocks):
+    """
+    Record that each of serialized_blocks (a dict of XBlockSerializer objects)
+    was uploaded as part of the given transfer.
+    """
+    recorder = BlockRecorder(transfer)
+    for data in serialized_blocks.values():
+        recorder.add(data)
+    recorder.save()
+
+
+def mark_committed(transfer):
+    """
+    Record that the given transfer's draft has been committed.
+    """
+    transfer.committed_at = timezone.now()
+    transfer.save(update_fields=['committed_at'])
+
+
+def mark_failed(transfer, error):
+    """
+    Record that the given transfer has failed, with the given error message,
+    so that it isn't taken for one which is still running.
+    """
+    transfer.failed_at = timezone.now()
+    transfer.error = error
+    transfer.save(update_fields=['failed_at', 'error'])
+
+
+def mark_partially_committed(transfer):
+    """
+    Record that the given transfer's draft has been committed, with only some
+    of the transfer's files uploaded so far.
+    """
+    transfer.partial_commits += 1
+    transfer.save(update_fields=['partial_commits'])
+
+
+def get_partially_committed_blocks(root_block_key, bundle_uuid, destination=BLOCKSTORE):
+    """
+    If the most recent transfer of the given block was into the given bundle,
+    and failed after committing some of its blocks, return the digests of those
+    blocks, as a dict of (olx_digest, asset_digests) keyed by usage key.
+    Otherwise, return an empty dict.
+
+    This relies on the blocks of such transfers only being recorded once they
+    have been committed (see transfer_data.ChunkedCommitter).
+    """
+    transfer = get_transfer_since(root_block_key, destination=destination)
+    if (
+        transfer is None or transfer.committed_at is not None or not transfer.partial_commits or
+        six.text_type(transfer.bundle_uuid) != six.text_type(bundle_uuid)
+    ):
+        return {}
+    return {
+        block.usage_key: (block.olx_digest, block.asset_digests)
+        for block in transfer.blocks.all()
+    }
+
+
+def _in_collection(transfers, collection_uuid):
+    """
+    Filter the given Transfer queryset down to transfers into bundles which
+    were transferred into the given collection, unless collection_uuid is
+    None.
+    """
+    if collection_uuid is None:
+        return transfers
+    return transfers.filter(
+        bundle_uuid__in=Transfer.objects.filter(collection_uuid=collection_uuid).values('bundle_uuid'),
+    )
+
+
+def get_latest_transfer(root_block_key, collection_uuid=None, destination=BLOCKSTORE):
+    """
+    Return the most recent complete (not incremental) committed Transfer of
+    the given block, or None. If collection_uuid is given, only bundles in
+    that collection count.
+    """
+    transfers = Transfer.objects.filter(
+        root_key=root_block_key, destination=destination, incremental=False, committed_at__isnull=False,
+    )
+    return _in_collection(transfers, collection_uuid).order_by('-committed_at').first()
+
+
+def get_transfer_since(root_block_key, since=None, collection_uuid=None, destination=BLOCKSTORE, bundle_uuid=None):
+    """
+    Return the most recent complete (not incremental) Transfer of the given
+    block started after the given datetime (or ever, if since is None),
+    whether it was committed or not. Returns None if there is none.
+
+    If collection_uuid is given, only bundles in that collection count; if bundle_uuid is given, only that bundle does.
+    """
+    transfers = Transfer.objects.filter(root_key=root_block_key, destination=destination, incremental=False)
+    if bundle_uuid is not None:
+        transfers = transfers.filter(bundle_uuid=bundle_uuid)
+    if since is not None:
+        transfers = transfers.filter(created__gt=since)
+    return _in_collection(transfers, collection_uuid).order_by('-created', '-id').first()
+
+
+def get_course_transfers(course_key):
+    """
+    Return the committed transfers of blocks in the given course, newest first.
+    """
+    return Transfer.objects.filter(
+        course_key=course_key, destination=BLOCKSTORE, committed_at__isnull=False,
+    ).order_by('-committed_at')
+
+
+def locate_block(usage_key):
+    """
+    Return the TransferredBlock describing where the given block was most
+    recently transferred to (see its .transfer.bundle_uuid and .def_path), or
+    None if it has never been transferred.
+    """
+    return TransferredBlock.objects.filter(
+        usage_key=usage_key, transfer__destination=BLOCKSTORE, transfer__committed_at__isnull=False,
+    ).select_related('transfer').order_by('-transfer__committed_at').first()
+
+
+def get_block_digests(bundle_uuid, destination=BLOCKSTORE):
+    """
+    Return a dict with the OLX digest of every block committed to the given
+    bundle, keyed by usage key. Where a block was transferred several times,
+    the most recent digest is used.
+    """
+    rows = TransferredBlock.objects.filter(
+        transfer__bundle_uuid=bundle_uuid, transfer__destination=destination, transfer__committed_at__isnull=False,
+    ).order_by('transfer__committed_at').values_list('usage_key', 'olx_digest')
+    return dict(rows)
+
+
+def get_bundle_contents(bundle_uuid, destination=BLOCKSTORE):
+    """
+    Return the paths of the files which committed transfers put into the
+    given bundle for each block, as an OrderedDict of bundle.json manifest
+    entries ({'components': [OLX path], 'assets': [static file paths]}) keyed
+    by usage key, in the order the blocks were first transferred. Where a block
+    was transferred several times, the most recent paths are used.
+    """
+    rows = TransferredBlock.objects.filter(
+        transfer__bundle_uuid=bundle_uuid, transfer__destination=destination, transfer__committed_at__isnull=False,
+    ).order_by('transfer__committed_at', 'id').values_list('usage_key', 'def_path', 'asset_digests')
+    contents = OrderedDict()
+    for usage_key, def_path, asset_digests in rows:
+        contents[usage_key] = {'components': [def_path], 'assets': sorted(asset_digests)}
+    return contents
+
+
+def get_bundle_assets(bundle_uuid, destination=BLOCKSTORE):
+    """
+    Return the contentstore assets which committed transfers put into the
+    given bundle, as a dict of BundleAsset keyed by path within the bundle.
+    Where a path was transferred several times, the most recent asset is used.
+    """
+    rows = TransferredAsset.objects.filter(
+        transfer__bundle_uuid=bundle_uuid, transfer__destination=destination, transfer__committed_at__isnull=False,
+    ).order_by('transfer__committed_at', 'id').values_list('path', 'md5', 'digest', 'size')
+    return {path: BundleAsset(md5, asset_digest, size) for path, md5, asset_digest, size in rows}
+
+
+def find_asset(asset_digest=None, md5=None, collection_uuid=None):
+    """
+    Return the TransferredAssets of committed transfers with the given SHA-1
+    digest and/or contentstore MD5 digest, i.e. where copies of an asset
+    are, most recent first. If collection_uuid is given, only bundles in that
+    collection are searched.
+    """
+    assets = TransferredAsset.objects.filter(transfer__destination=BLOCKSTORE, transfer__committed_at__isnull=False)
+    if asset_digest is not None:
+        assets = assets.filter(digest=asset_digest)
+    if md5 is not None:
+        assets = assets.filter(md5=md5)
+    if collection_uuid is not None:
+        assets = assets.filter(transfer__collection_uuid=collection_uuid)
+    return assets.select_related('transfer').order_by('-transfer__committed_at')
+
+
+def get_subtree_hashes(bundle_uuid, destination=BLOCKSTORE):
+    """
+    Return the recorded hash tree of the blocks in the given bundle (see
+    hash_tree.py), as a dict of BlockHashes keyed by usage key.
+    """
+    rows = BlockHash.objects.filter(bundle_uuid=bundle_uuid, destination=destination).values_list(
+        'usage_key', 'node_hash', 'subtree_hash',
+    )
+    return {usage_key: BlockHashes(node_hash, subtree_hash) for usage_key, node_hash, subtree_hash in rows}
+
+
+def record_subtree_hashes(bundle_uuid, hashes, batch_size=500, destination=BLOCKSTORE):
+    """
+    Record the given BlockHashes (keyed by usage key) as those of the blocks
+    in the given bundle, replacing any recorded before. This must only be
+    done once the blocks' files have been committed.
+    """
+    usage_keys = list(hashes)
+    with transaction.atomic():
+        for start in range(0, len(usage_keys), batch_size):
+            BlockHash.objects.filter(
+                bundle_uuid=bundle_uuid, destination=destination,
+                usage_key__in=usage_keys[start:start + batch_size],
+            ).delete()
+        BlockHash.objects.bulk_create(
+            [
+                BlockHash(bundle_uuid=bundle_uuid, destination=destination, usage_key=usage_key,
+                          node_hash=block_hashes.node_hash, subtree_hash=block_hashes.subtree_hash)
+                for usage_key, block_hashes in hashes.items()
+            ],
+            batch_size=batch_size,
+        )
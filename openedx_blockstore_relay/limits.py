@@ -0,0 +1,295 @@
+"""
+Process-wide limits on how many threads may be in each phase of a transfer at
+once, e.g. so that a migration running many transfers side by side (see
+scheduler.py) doesn't read from MongoDB on all of its threads at the same time.
+
+The phases are reading blocks from the modulestore, reading assets from the
+contentstore (GridFS), and uploading files to Blockstore. The calls which
+make up each phase (in compat.py and blockstore_client.py) are wrapped in
+`with limits.phase(...)`, which waits for a free slot if the phase is limited,
+and does nothing otherwise. No phase is limited unless set_phase_limits() is
+called.
+
+Separately, the rate of requests and of request bytes sent to Blockstore can be
+limited across all the processes on a host (e.g. several migrations run side by
+side), with settings.BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND and
+BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND: every call in blockstore_client.py first
+calls throttle(), which waits as long as the shared RateGovernor of the
+Blockstore instance it calls says. Each instance (e.g. each mirror of a
+transfer, see sinks.FanOutSink) has limits of its own.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import errno
+import logging
+import os
+import re
+import stat
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from future.moves.urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: the rate limits then only apply within each process.
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+PHASE_MODULESTORE = 'modulestore'
+PHASE_CONTENTSTORE = 'contentstore'
+PHASE_UPLOAD = 'upload'
+PHASES = (PHASE_MODULESTORE, PHASE_CONTENTSTORE, PHASE_UPLOAD)
+
+_semaphores = {}  # BoundedSemaphore of each limited phase
+
+
+def set_phase_limits(limits):
+    """
+    Limit the number of threads in each phase, given a dict of the maximum
+    number of threads keyed by phase. Phases missing from the dict, or whose
+    limit is None, are not limited.
+
+    This is meant to be called while no transfer is running: threads already
+    in a phase are not counted towards its new limit.
+    """
+    unknown = set(limits) - set(PHASES)
+    if unknown:
+        raise ValueError('Unknown phase(s): {}'.format(', '.join(sorted(unknown))))
+    if any(limit is not None and limit < 1 for limit in limits.values()):
+        raise ValueError('Phase limits must be at least 1')
+    _semaphores.clear()
+    _semaphores.update(
+        (phase_name, threading.BoundedSemaphore(limit)) for phase_name, limit in limits.items() if limit is not None
+    )
+
+
+@contextmanager
+def phase(phase_name):
+    """
+    Context manager to wrap the calls that make up the given phase, which
+    waits for a free slot first if the phase is limited.
+    """
+    semaphore = _semaphores.get(phase_name)
+    if semaphore is None:
+        yield
+        return
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+# Where the state of the rate limits is kept by default, shared by every process of the same user. The state of each
+# Blockstore instance is kept in a file of its own, named after this one and the instance's host (see
+# rate_limit_path()):
+DEFAULT_RATE_LIMIT_DIR = os.path.join(
+    tempfile.gettempdir(),
+    'openedx-blockstore-relay-{}'.format(os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', '')),
+)
+DEFAULT_RATE_LIMIT_FILE = os.path.join(DEFAULT_RATE_LIMIT_DIR, 'rate-limit')
+# The state: tokens and refill time of the request bucket and of the byte bucket, then the total number of seconds
+# that calls have waited, and the number of calls which waited:
+_RATE_STATE = struct.Struct(str('<6d'))
+
+_governors = {}  # RateGovernor of each (file, host, requests per second, bytes per second)
+_governors_lock = threading.Lock()
+_throttle_stats = {'calls': 0, 'throttled_calls': 0, 'wait_seconds': 0.0}  # Of this process
+_throttle_stats_lock = threading.Lock()
+
+
+def _refill(tokens, refilled_at, rate, now):
+    """
+    Return the tokens in a bucket which holds up to one second's worth of them,
+    given the tokens it had when last refilled.
+    """
+    return min(rate, tokens + max(now - refilled_at, 0) * rate)
+
+
+def _make_private_dir(path):
+    """
+    Create the given directory, readable and writable only by this user, if it
+    doesn't exist yet, and check that it is one which nobody else can write to
+    (and not e.g. a link planted in the shared temporary directory).
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or (
+        hasattr(os, 'getuid') and info.st_uid != os.getuid()
+    ):
+        raise ValueError('{} is not a private directory of this user: refusing to keep rate limits there'.format(path))
+
+
+class RateGovernor(object):
+    """
+    Token buckets of the requests and of the request bytes sent to Blockstore,
+    kept in a small file so that every process on the host which uses the
+    same file shares them.
+
+    Each bucket holds up to one second's worth of tokens, and refills
+    continuously at its rate. A call always takes its tokens, leaving the
+    bucket in debt if it didn't have enough, and then waits for as long as the
+    bucket takes to pay off the debt. So calls go through in the order they
+    arrive, and an upload bigger than the byte rate just waits longer. The file
+    is only locked (with flock) while its state is read and updated.
+
+    A limit of None means that calls aren't limited by that bucket.
+    """
+
+    def __init__(self, path, requests_per_second=None, bytes_per_second=None, clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.requests_per_second = requests_per_second
+        self.bytes_per_second = bytes_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()  # flock doesn't exclude the threads of a process from each other
+        self._fd = None
+        self._pid = None
+
+    @contextmanager
+    def _state(self):
+        """
+        Context manager which locks the state file, and yields its state as a
+        list, which is written back on exit.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked process shares its parent's descriptor, and so its lock: open the file again.
+                # The file is never followed through a link, and only this user may use it:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+                self._pid = os.getpid()
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                data = os.read(self._fd, _RATE_STATE.size)
+                if len(data) == _RATE_STATE.size:
+                    state = list(_RATE_STATE.unpack(data))
+                else:
+                    # A new file: both buckets start full.
+                    now = self.clock()
+                    state = [self.requests_per_second or 0, now, self.bytes_per_second or 0, now, 0.0, 0.0]
+                yield state
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, _RATE_STATE.pack(*state))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reserve(self, num_bytes=0):
+        """
+        Take the tokens for a request sending num_bytes bytes, and return the
+        number of seconds to wait before sending it.
+        """
+        wait = 0.0
+        with self._state() as state:
+            now = self.clock()
+            for index, rate, amount in ((0, self.requests_per_second, 1), (2, self.bytes_per_second, num_bytes)):
+                if rate:
+                    tokens = _refill(state[index], state[index + 1], rate, now) - amount
+                    state[index:index + 2] = [tokens, now]
+                    wait = max(wait, -tokens / rate)
+            if wait > 0:
+                state[4] += wait
+                state[5] += 1
+        return wait
+
+    def throttle(self, num_bytes=0):
+        """
+        Wait until a request sending num_bytes bytes may be sent, and return
+        the number of seconds waited.
+        """
+        wait = self.reserve(num_bytes)
+        if wait > 0:
+            log.debug('Waiting %.3f seconds for the Blockstore rate limits', wait)
+            self.sleep(wait)
+        return wait
+
+    def stats(self):
+        """
+        Return the total number of seconds that calls have waited, and the
+        number of calls which waited, in all the processes sharing the state
+        file, as a dict.
+        """
+        with self._state() as state:
+            return {'wait_seconds': state[4], 'throttled_calls': int(state[5])}
+
+
+def rate_limit_path(rate_limit_file, host):
+    """
+    Return the path of the file holding the state of the rate limits of the
+    Blockstore instance at the given host (e.g. 'blockstore.example.com:8250'),
+    given settings.BLOCKSTORE_RELAY_RATE_LIMIT_FILE (None for
+    DEFAULT_RATE_LIMIT_FILE, whose directory is created if needed).
+    """
+    if not rate_limit_file:
+        _make_private_dir(DEFAULT_RATE_LIMIT_DIR)
+        rate_limit_file = DEFAULT_RATE_LIMIT_FILE
+    return '{}.{}'.format(rate_limit_file, re.sub(r'[^A-Za-z0-9.-]', '_', host) or 'default')
+
+
+def get_rate_governor(api_url=None):
+    """
+    Return the RateGovernor of the Blockstore instance at api_url
+    (settings.BLOCKSTORE_API_URL by default) set up in settings, or None if
+    neither BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND nor
+    BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND is set. The state is kept in a file
+    of each host named after settings.BLOCKSTORE_RELAY_RATE_LIMIT_FILE (see
+    rate_limit_path()).
+    """
+    requests_per_second = getattr(settings, 'BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND', None)
+    bytes_per_second = getattr(settings, 'BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND', None)
+    if not (requests_per_second or bytes_per_second):
+        return None
+    key = (
+        getattr(settings, 'BLOCKSTORE_RELAY_RATE_LIMIT_FILE', None),
+        urlparse(api_url or settings.BLOCKSTORE_API_URL).netloc,
+        requests_per_second,
+        bytes_per_second,
+    )
+    with _governors_lock:
+        governor = _governors.get(key)
+        if governor is None:
+            rate_limit_file, host = key[:2]
+            governor = _governors[key] = RateGovernor(
+                rate_limit_path(rate_limit_file, host), requests_per_second, bytes_per_second,
+            )
+        return governor
+
+
+def throttle(num_bytes=0, api_url=None):
+    """
+    Wait until a Blockstore API request sending num_bytes bytes to the
+    Blockstore instance at api_url (settings.BLOCKSTORE_API_URL by default)
+    may be sent, if rate limits are set (see get_rate_governor()), and return
+    the number of seconds waited.
+    """
+    governor = get_rate_governor(api_url)
+    wait = governor.throttle(num_bytes) if governor is not None else 0.0
+    with _throttle_stats_lock:
+        _throttle_stats['calls'] += 1
+        if wait > 0:
+            _throttle_stats['throttled_calls'] += 1
+            _throttle_stats['wait_seconds'] += wait
+    return wait
+
+
+def get_throttle_stats():
+    """
+    Return the number of Blockstore API calls made by this process, how many
+    of them waited for the rate limits, and the total number of seconds they
+    waited, as a dict (see RateGovernor.stats() for the totals of every
+    process).
+    """
+    with _throttle_stats_lock:
+        return dict(_throttle_stats)
@@ -0,0 +1,170 @@
+"""
+Live relay: keep Blockstore bundles up to date as courses are edited.
+
+Authors can generate a lot of changes in a short time (every autosave of a
+component is a change), so rather than transferring each change as it comes,
+the usage keys of changed blocks are recorded per course as PendingChange
+rows. The first change of a batch schedules a relay_changes_task() (see
+tasks.py) with a countdown; once the course has had no new changes for a
+debounce window, that task coalesces the batch (a change to a block makes
+changes to any of its descendants redundant, since the whole subtree gets
+re-serialized) and transfers it, producing one draft and one commit.
+
+Since this state is kept in the database and the task queue, every Studio
+process shares the same batch of a course, and restarting a process loses
+nothing. A relay claims its batch by marking the course's RelayedCourse row as
+being relayed, which only locks the row for as long as that takes, so that
+relays of a course never run at the same time. The transfer itself runs
+outside of any database transaction: the ledger rows and the bundle UUID it
+records are kept even if it fails, and its retry transfers into the same
+bundle.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+from datetime import timedelta
+
+import six
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PendingChange, RelayedCourse
+
+log = logging.getLogger(__name__)
+
+
+def coalesce_subtrees(usage_keys, get_parent):
+    """
+    Return the subset of usage_keys which are not descendants of another
+    block in usage_keys, so that transferring each of their subtrees covers
+    all of usage_keys exactly once.
+
+    get_parent is a function that returns a usage key's parent key (or None).
+    """
+    usage_keys = set(usage_keys)
+    roots = set()
+    for usage_key in usage_keys:
+        ancestor = get_parent(usage_key)
+        while ancestor is not None and ancestor not in usage_keys:
+            ancestor = get_parent(ancestor)
+        if ancestor is None:
+            roots.add(usage_key)
+    return roots
+
+
+def get_due_delay(changes, now):
+    """
+    Return how many seconds from now the given batch of PendingChanges
+    (oldest first) is due to be relayed (zero or less if it is due already).
+
+    A batch is due debounce seconds after its most recent change, or the
+    maximum delay after its first change, whichever comes first, so that a
+    steady stream of edits can't postpone it forever.
+    """
+    due_at = changes[-1].changed_at + timedelta(seconds=settings.BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS)
+    max_delay_seconds = settings.BLOCKSTORE_RELAY_LIVE_MAX_DELAY_SECONDS
+    if max_delay_seconds is not None:
+        due_at = min(due_at, changes[0].changed_at + timedelta(seconds=max_delay_seconds))
+    return (due_at - now).total_seconds()
+
+
+# A claim on a course's batch older than this is taken to be that of a relay which died (e.g. with its worker):
+RELAY_CLAIM_TIMEOUT = timedelta(hours=1)
+
+
+def _schedule_relay(course_key, delay):
+    """
+    Run relay_changes_task() for the given course in delay seconds.
+    """
+    from .tasks import relay_changes_task  # Avoid a circular import
+    relay_changes_task.apply_async((six.text_type(course_key), ), countdown=max(delay, 0))
+
+
+def _claim_batch(course_key, now):
+    """
+    Claim the given course's batch of pending changes if it is due, and no
+    other relay of the course is running, by marking the course as being
+    relayed. Otherwise, schedule another relay_changes_task() for when it may
+    be.
+
+    Returns the course's RelayedCourse and the claimed PendingChanges (oldest
+    first), or None and no changes.
+    """
+    with transaction.atomic():
+        RelayedCourse.objects.get_or_create(course_key=course_key)
+        relayed_course = RelayedCourse.objects.select_for_update().get(course_key=course_key)
+        if relayed_course.relay_started is not None and now - relayed_course.relay_started < RELAY_CLAIM_TIMEOUT:
+            # The running relay schedules another one for changes made meanwhile, unless it dies:
+            _schedule_relay(course_key, (relayed_course.relay_started + RELAY_CLAIM_TIMEOUT - now).total_seconds())
+            return None, []
+        changes = list(PendingChange.objects.filter(course_key=course_key).order_by('id'))
+        if not changes:
+            return None, []
+        delay = get_due_delay(changes, now)
+        if delay > 0:
+            _schedule_relay(course_key, delay)
+            return None, []
+        relayed_course.relay_started = now
+        relayed_course.save(update_fields=['relay_started'])
+    return relayed_course, changes
+
+
+def relay_pending_changes(course_key, relay, now=None):
+    """
+    If the given course's batch of pending changes is due, claim it, relay it
+    by calling relay(relayed_course, usage_keys), and delete it. Otherwise, or
+    if further changes were made in the meantime, schedule another
+    relay_changes_task() for when they are due.
+
+    relay() runs outside of any database transaction, so whatever it saves
+    (e.g. the RelayedCourse's bundle_uuid, as soon as it has created the
+    bundle) is kept even if it fails. If it fails, the batch is kept, and
+    relayed again later.
+    """
+    debounce_seconds = settings.BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS
+    relayed_course, changes = _claim_batch(course_key, now or timezone.now())
+    if not changes:
+        return
+    change_ids = [change.id for change in changes]
+    usage_keys = {change.usage_key for change in changes}
+    log.info('Relaying %d changed block(s) in %s', len(usage_keys), course_key)
+    try:
+        relay(relayed_course, usage_keys)
+    except Exception:
+        RelayedCourse.objects.filter(id=relayed_course.id).update(relay_started=None)
+        # Keep the batch and try again later, since further changes to the course won't schedule a relay of their own:
+        _schedule_relay(course_key, settings.BLOCKSTORE_RELAY_LIVE_MAX_DELAY_SECONDS or debounce_seconds)
+        raise
+    with transaction.atomic():
+        relayed_course.relayed_at = timezone.now()
+        relayed_course.relay_started = None
+        relayed_course.save(update_fields=['bundle_uuid', 'relayed_at', 'relay_started'])
+        PendingChange.objects.filter(id__in=change_ids).delete()
+    # Changes made while relaying weren't part of this batch, and may not have scheduled a task of their own:
+    if PendingChange.objects.filter(course_key=course_key).exists():
+        _schedule_relay(course_key, debounce_seconds)
+
+
+def is_enabled():
+    """
+    Return True if the live relay has been turned on in the settings.
+    """
+    return bool(getattr(settings, 'BLOCKSTORE_RELAY_LIVE', False))
+
+
+def block_changed(usage_key):
+    """
+    Record that the given block has changed, and should be relayed to
+    Blockstore once its course's changes have settled.
+    """
+    if not is_enabled():
+        return
+    course_key = usage_key.course_key
+    change = PendingChange.objects.create(course_key=course_key, usage_key=usage_key)
+    first_change_id = PendingChange.objects.filter(course_key=course_key).order_by('id').values_list(
+        'id', flat=True,
+    ).first()
+    if first_change_id == change.id:
+        # This change starts a new batch:
+        _schedule_relay(course_key, settings.BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS)
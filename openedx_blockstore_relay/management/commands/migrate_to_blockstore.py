@@ -0,0 +1,142 @@
+"""
+Transfers a batch of Blocks (usually whole courses) and their children from
+the Open edX modulestore to Blockstore, each into a new bundle in the given
+collection, cheapest first, several at a time.
+
+The batch is kept in the database under the given --batch name: running the
+command again with the same name picks up where it stopped (see
+openedx_blockstore_relay.scheduler).
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+from argparse import ArgumentError
+from uuid import UUID
+
+from django.core.management.base import BaseCommand
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import UsageKey
+
+from ...limits import PHASE_CONTENTSTORE, PHASE_MODULESTORE, PHASE_UPLOAD
+from ...scheduler import DEFAULT_AGING, DEFAULT_WORKERS, MigrationScheduler
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    migrate_to_blockstore management command.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.help = __doc__
+        self.args = {}
+
+    def add_arguments(self, parser):
+        """
+        Add named arguments.
+        """
+        self.args['batch'] = parser.add_argument(
+            '--batch',
+            type=str,
+            required=True,
+            help='Name of the batch. Blocks already in the batch are not added again.'
+        )
+        self.args['block_key'] = parser.add_argument(
+            '--block-key',
+            type=str,
+            action='append',
+            default=[],
+            metavar='USAGE_KEY',
+            help='Usage key of a block to add to the batch. Can be given several times.'
+        )
+        self.args['block_keys_file'] = parser.add_argument(
+            '--block-keys-file',
+            type=str,
+            required=False,
+            metavar='PATH',
+            help='File listing the usage keys of blocks to add to the batch, one per line.'
+        )
+        self.args['collection_uuid'] = parser.add_argument(
+            '--collection-uuid',
+            type=str,
+            required=False,
+            metavar='UUID',
+            help='UUID of the Blockstore Collection to create the new bundles in. Required to add blocks.'
+        )
+        self.args['workers'] = parser.add_argument(
+            '--workers',
+            type=int,
+            default=DEFAULT_WORKERS,
+            metavar='N',
+            help='Number of transfers to run at the same time. Default: %(default)s'
+        )
+        self.args['aging'] = parser.add_argument(
+            '--aging',
+            type=float,
+            default=DEFAULT_AGING,
+            metavar='SECONDS',
+            help='Seconds of estimated transfer time by which a block moves up the queue for every second it has '
+                 'waited. Default: %(default)s'
+        )
+        for phase, what in ((PHASE_MODULESTORE, 'reading from the modulestore'),
+                            (PHASE_CONTENTSTORE, 'reading from the contentstore'),
+                            (PHASE_UPLOAD, 'uploading to Blockstore')):
+            self.args['max_' + phase] = parser.add_argument(
+                '--max-{}'.format(phase),
+                type=int,
+                required=False,
+                metavar='N',
+                help='Maximum number of threads {} at the same time. Default: no limit'.format(what)
+            )
+        self.args['retry_failed'] = parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Run the blocks which failed in a previous run of the batch again.'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Validate the arguments, add the blocks to the batch, and run it.
+        """
+        block_keys = list(options.get('block_key') or [])
+        if options.get('block_keys_file'):
+            with open(options['block_keys_file']) as block_keys_file:
+                block_keys.extend(line.strip() for line in block_keys_file if line.strip())
+        try:
+            block_keys = [UsageKey.from_string(block_key) for block_key in block_keys]
+        except InvalidKeyError:
+            raise ArgumentError(message='Invalid block usage key', argument=self.args['block_key'])
+        try:
+            collection_uuid = options.get('collection_uuid')
+            if collection_uuid:
+                collection_uuid = UUID(collection_uuid)
+        except ValueError:
+            raise ArgumentError(message='Invalid collection UUID', argument=self.args['collection_uuid'])
+        if block_keys and not collection_uuid:
+            raise ArgumentError(
+                message='--collection-uuid is required to add blocks', argument=self.args['collection_uuid'],
+            )
+        workers = options.get('workers', DEFAULT_WORKERS)
+        if workers < 1:
+            raise ArgumentError(message='--workers must be at least 1', argument=self.args['workers'])
+        phase_limits = {}
+        for phase in (PHASE_MODULESTORE, PHASE_CONTENTSTORE, PHASE_UPLOAD):
+            limit = options.get('max_' + phase)
+            if limit is not None and limit < 1:
+                raise ArgumentError(
+                    message='--max-{} must be at least 1'.format(phase), argument=self.args['max_' + phase],
+                )
+            phase_limits[phase] = limit
+
+        scheduler = MigrationScheduler(
+            options['batch'], workers=workers, phase_limits=phase_limits, aging=options.get('aging', DEFAULT_AGING),
+        )
+        for block_key in block_keys:
+            scheduler.submit(block_key, collection_uuid=collection_uuid)
+        counts = scheduler.run(retry_failed=options.get('retry_failed', False))
+        self.stdout.write(json.dumps(counts, sort_keys=True))
+        for job in scheduler.jobs().exclude(error=''):
+            log.error('%s failed: %s', job.root_key, job.error)
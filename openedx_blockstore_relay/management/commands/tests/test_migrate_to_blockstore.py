@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` migrate_to_blockstore command.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+from argparse import ArgumentError
+from uuid import UUID
+
+import mock
+from django.core.management import call_command
+from django.test import TestCase
+from opaque_keys.edx.keys import UsageKey
+from six import StringIO
+
+from openedx_blockstore_relay.limits import PHASE_CONTENTSTORE, PHASE_MODULESTORE, PHASE_UPLOAD
+
+
+class MigrateToBlockstoreCommandTestCase(TestCase):
+    """
+    Tests for the migrate_to_blockstore command.
+    """
+
+    BLOCK_KEYS = [
+        'block-v1:edX+DemoX+Demo_Course+type@course+block@course',
+        'block-v1:edX+Other+Run+type@course+block@course',
+    ]
+    COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+
+    def setUp(self):
+        super(MigrateToBlockstoreCommandTestCase, self).setUp()
+        patch = mock.patch('openedx_blockstore_relay.management.commands.migrate_to_blockstore.MigrationScheduler')
+        self.mock_scheduler = patch.start()
+        self.addCleanup(patch.stop)
+        self.mock_scheduler.return_value.run.return_value = {'done': 2}
+
+    def test_command(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        keys_path = os.path.join(temp_dir, 'keys.txt')
+        with open(keys_path, 'w') as keys_file:
+            keys_file.write('\n{}\n'.format(self.BLOCK_KEYS[1]))
+        out = StringIO()
+        call_command(
+            'migrate_to_blockstore', '--batch', 'spring', '--block-key', self.BLOCK_KEYS[0],
+            '--block-keys-file', keys_path, '--collection-uuid', self.COLLECTION_UUID, '--workers', '8',
+            '--max-upload', '2', stdout=out,
+        )
+        self.assertEqual(json.loads(out.getvalue()), {'done': 2})
+        self.mock_scheduler.assert_called_once_with(
+            'spring', workers=8, aging=1.0,
+            phase_limits={PHASE_MODULESTORE: None, PHASE_CONTENTSTORE: None, PHASE_UPLOAD: 2},
+        )
+        scheduler = self.mock_scheduler.return_value
+        self.assertEqual(scheduler.submit.call_args_list, [
+            mock.call(UsageKey.from_string(key), collection_uuid=UUID(self.COLLECTION_UUID)) for key in self.BLOCK_KEYS
+        ])
+        scheduler.run.assert_called_once_with(retry_failed=False)
+
+    def test_resume(self):
+        call_command('migrate_to_blockstore', '--batch', 'spring', '--retry-failed', stdout=StringIO())
+        self.mock_scheduler.return_value.submit.assert_not_called()
+        self.mock_scheduler.return_value.run.assert_called_once_with(retry_failed=True)
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegexp(ArgumentError, 'Invalid block usage key'):
+            call_command('migrate_to_blockstore', '--batch', 'spring', '--block-key', 'invalid_key')
+        with self.assertRaisesRegexp(ArgumentError, '--collection-uuid is required'):
+            call_command('migrate_to_blockstore', '--batch', 'spring', '--block-key', self.BLOCK_KEYS[0])
+        with self.assertRaisesRegexp(ArgumentError, '--max-modulestore must be at least 1'):
+            call_command('migrate_to_blockstore', '--batch', 'spring', '--max-modulestore', '0')
+        self.mock_scheduler.assert_not_called()
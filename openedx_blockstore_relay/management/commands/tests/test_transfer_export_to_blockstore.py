@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` transfer_export_to_blockstore command.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import shutil
+import tempfile
+from argparse import ArgumentError
+from uuid import UUID
+
+import mock
+from django.core.management import call_command
+from django.test import TestCase
+
+from openedx_blockstore_relay.sinks import BlockstoreSink, DirectorySink
+
+
+class TransferExportToBlockstoreCommandTestCase(TestCase):
+    """
+    Tests for the transfer_export_to_blockstore command.
+    """
+
+    COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+    BUNDLE_UUID = '93fc9c6e-4249-4d57-a63c-b08be9f4fe02'
+
+    def setUp(self):
+        super(TransferExportToBlockstoreCommandTestCase, self).setUp()
+        patch = mock.patch(
+            'openedx_blockstore_relay.management.commands.transfer_export_to_blockstore.transfer_export_to_blockstore'
+        )
+        self.mock_transfer = patch.start()
+        self.addCleanup(patch.stop)
+        self.export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_dir)
+
+    def test_command(self):
+        call_command('transfer_export_to_blockstore', '--export', self.export_dir, '--collection-uuid',
+                     self.COLLECTION_UUID)
+        self.assertEqual(self.mock_transfer.call_args[0], (self.export_dir,))
+        self.assertEqual(self.mock_transfer.call_args[1]['collection_uuid'], UUID(self.COLLECTION_UUID))
+        self.assertIsNone(self.mock_transfer.call_args[1]['bundle_uuid'])
+        self.assertIsInstance(self.mock_transfer.call_args[1]['sink'], BlockstoreSink)
+
+        call_command('transfer_export_to_blockstore', '--export', self.export_dir, '--bundle-uuid', self.BUNDLE_UUID)
+        self.assertEqual(self.mock_transfer.call_args[1]['bundle_uuid'], UUID(self.BUNDLE_UUID))
+
+        call_command('transfer_export_to_blockstore', '--export', self.export_dir, '--output-dir', self.export_dir)
+        self.assertIsInstance(self.mock_transfer.call_args[1]['sink'], DirectorySink)
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegexp(ArgumentError, 'No such course export'):
+            call_command('transfer_export_to_blockstore', '--export', '/no/such/export', '--collection-uuid',
+                         self.COLLECTION_UUID)
+        with self.assertRaisesRegexp(ArgumentError, 'Invalid bundle UUID'):
+            call_command('transfer_export_to_blockstore', '--export', self.export_dir, '--bundle-uuid', 'invalid')
+        with self.assertRaisesRegexp(ArgumentError, 'Either collection OR bundle UUID is required'):
+            call_command('transfer_export_to_blockstore', '--export', self.export_dir)
+        with self.assertRaisesRegexp(ArgumentError, 'Either collection OR bundle UUID is required'):
+            call_command(
+                'transfer_export_to_blockstore', '--export', self.export_dir, '--bundle-uuid', self.BUNDLE_UUID,
+                '--collection-uuid', self.COLLECTION_UUID,
+            )
+        self.mock_transfer.assert_not_called()
@@ -5,11 +5,20 @@ Tests for the `openedx-blockstore-relay` transfer_to_blockstore command.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import json
+import os
+import shutil
+import tarfile
+import tempfile
 from argparse import ArgumentError
+from uuid import UUID
 
 import mock
 from django.core.management import CommandError, call_command
 from django.test import TestCase
+from six import StringIO
+
+from openedx_blockstore_relay.sinks import BlockstoreSink, DirectorySink, FanOutSink, TarSink
 
 
 class TransferToBlockstoreCommandTestCase(TestCase):
@@ -32,7 +41,8 @@ class TransferToBlockstoreCommandTestCase(TestCase):
         patch = mock.patch(
             'openedx_blockstore_relay.management.commands.transfer_to_blockstore.transfer_to_blockstore'
         )
-        patch.start()
+        self.mock_transfer = patch.start()
+        self.addCleanup(patch.stop)
 
     def test_command(self):
 
@@ -59,3 +69,284 @@ class TransferToBlockstoreCommandTestCase(TestCase):
 
         call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
         call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID)
+
+    def test_progress(self):
+        """
+        Test that --progress prints each progress event as a line of JSON.
+        """
+        out = StringIO()
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--progress', '--progress-interval', '1.5', stdout=out,
+        )
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertEqual(kwargs['progress_interval'], 1.5)
+        kwargs['progress_callback']({'stage': 'committed', 'files_done': 3})
+        self.assertEqual(json.loads(out.getvalue()), {'stage': 'committed', 'files_done': 3})
+
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
+        self.assertIsNone(self.mock_transfer.call_args[1]['progress_callback'])
+
+    def test_concurrency_options(self):
+        """
+        Test the options controlling concurrent uploads.
+        """
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertIsNone(kwargs['max_inflight_bytes'])
+        self.assertEqual(kwargs['upload_workers'], 1)
+
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--max-inflight-mb', '1.5', '--upload-workers', '4',
+        )
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertEqual(kwargs['max_inflight_bytes'], 1536 * 1024)
+        self.assertEqual(kwargs['upload_workers'], 4)
+        self.assertEqual(kwargs['large_file_bytes'], 8 * 1024 * 1024)
+        self.assertEqual(kwargs['large_file_workers'], 1)
+
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--upload-workers', '4', '--large-file-mb', '0.5', '--large-file-workers', '2',
+        )
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertEqual(kwargs['large_file_bytes'], 512 * 1024)
+        self.assertEqual(kwargs['large_file_workers'], 2)
+
+        self.assertFalse(kwargs['from_structure'])
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--from-structure',
+        )
+        self.assertTrue(self.mock_transfer.call_args[1]['from_structure'])
+
+        with self.assertRaisesRegexp(ArgumentError, '--max-inflight-mb must be positive'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--max-inflight-mb', '0',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--upload-workers must be at least 1'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--upload-workers', '0',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--large-file-workers must be at least 1'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--large-file-workers', '0',
+            )
+
+    def test_commit_every_options(self):
+        """
+        Test the options controlling intermediate commits.
+        """
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertIsNone(kwargs['commit_every_files'])
+        self.assertIsNone(kwargs['commit_every_bytes'])
+
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--commit-every-files', '500', '--commit-every-mb', '64',
+        )
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertEqual(kwargs['commit_every_files'], 500)
+        self.assertEqual(kwargs['commit_every_bytes'], 64 * 1024 * 1024)
+
+        with self.assertRaisesRegexp(ArgumentError, '--commit-every-files must be at least 1'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--commit-every-files', '0',
+            )
+        with self.assertRaisesRegexp(ArgumentError, 'cannot be combined with concurrent uploads'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--commit-every-files', '500', '--upload-workers', '2',
+            )
+
+    @mock.patch(
+        'openedx_blockstore_relay.management.commands.transfer_to_blockstore.transfer_sharded_to_blockstore'
+    )
+    def test_shard_options(self, mock_transfer_sharded):
+        """
+        Test the options of sharded transfers.
+        """
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+            '--shard-by', 'sequential', '--shard-workers', '2', '--resume',
+        )
+        self.mock_transfer.assert_not_called()
+        kwargs = mock_transfer_sharded.call_args[1]
+        self.assertEqual(str(kwargs['collection_uuid']), self.COLLECTION_UUID)
+        self.assertEqual(kwargs['shard_block_type'], 'sequential')
+        self.assertEqual(kwargs['workers'], 2)
+        self.assertTrue(kwargs['resume'])
+
+        with self.assertRaisesRegexp(ArgumentError, '--shard-by requires --collection-uuid'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--shard-by', 'chapter',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--shard-workers must be at least 1'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+                '--shard-by', 'chapter', '--shard-workers', '0',
+            )
+
+    def test_output_options(self):
+        """
+        Test writing to a directory or tar archive instead of Blockstore.
+        """
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
+        self.assertIsInstance(self.mock_transfer.call_args[1]['sink'], BlockstoreSink)
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--output-dir', output_dir)
+        kwargs = self.mock_transfer.call_args[1]
+        self.assertIsInstance(kwargs['sink'], DirectorySink)
+        self.assertEqual(kwargs['sink'].root, output_dir)
+        self.assertIsNone(kwargs['collection_uuid'])
+        self.assertIsNone(kwargs['bundle_uuid'])
+
+        output_tar = os.path.join(output_dir, 'course.tar.gz')
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--output-tar', output_tar)
+        self.assertIsInstance(self.mock_transfer.call_args[1]['sink'], TarSink)
+        with tarfile.open(output_tar) as archive:  # The sink was closed, finishing the (empty) archive
+            self.assertEqual(archive.getnames(), [])
+
+        with self.assertRaisesRegexp(ArgumentError, 'Use either --output-dir or --output-tar'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--output-dir', output_dir,
+                '--output-tar', output_tar,
+            )
+
+    def test_verify_option(self):
+        """
+        Test the option to verify bundles once they are committed.
+        """
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
+        self.assertFalse(self.mock_transfer.call_args[1]['verify'])
+
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID, '--verify',
+        )
+        self.assertTrue(self.mock_transfer.call_args[1]['verify'])
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        with self.assertRaisesRegexp(ArgumentError, '--verify cannot be used with --output-tar'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--verify',
+                '--output-tar', os.path.join(output_dir, 'course.tar'),
+            )
+
+    def test_reuse_assets_option(self):
+        """
+        Test the option to reuse the assets which the bundle already has.
+        """
+        call_command('transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID)
+        self.assertFalse(self.mock_transfer.call_args[1]['reuse_assets'])
+
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--reuse-assets',
+        )
+        self.assertTrue(self.mock_transfer.call_args[1]['reuse_assets'])
+
+        with self.assertRaisesRegexp(ArgumentError, '--reuse-assets requires --bundle-uuid'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+                '--reuse-assets',
+            )
+
+    @mock.patch(
+        'openedx_blockstore_relay.management.commands.transfer_to_blockstore.transfer_changes_to_blockstore'
+    )
+    def test_changed_only_option(self, mock_transfer_changes):
+        """
+        Test the option to transfer only the blocks which have changed.
+        """
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+            '--changed-only', '--reuse-assets',
+        )
+        self.mock_transfer.assert_not_called()
+        self.assertEqual(mock_transfer_changes.call_args[1]['bundle_uuid'], UUID(self.BUNDLE_UUID))
+        self.assertTrue(mock_transfer_changes.call_args[1]['reuse_assets'])
+
+        with self.assertRaisesRegexp(ArgumentError, '--changed-only requires --bundle-uuid'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+                '--changed-only',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--changed-only cannot be combined'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--changed-only', '--upload-workers', '4',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--changed-only cannot be combined'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--changed-only', '--output-dir', tempfile.gettempdir(),
+            )
+
+    def test_mirror_option(self):
+        """
+        Test the option to write the bundle to other Blockstore instances too.
+        """
+        staging_url = 'http://blockstore.stage:18250/api/v1/'
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+            '--mirror', staging_url, 'collection', self.BUNDLE_UUID, '--mirror-buffer-mb', '8',
+        )
+        sink = self.mock_transfer.call_args[1]['sink']
+        self.assertIsInstance(sink, FanOutSink)
+        self.assertIsInstance(sink.primary, BlockstoreSink)
+        self.assertEqual(sink.max_buffered_bytes, 8 * 1024 * 1024)
+        self.assertEqual(len(sink.mirrors), 1)
+        self.assertEqual(sink.mirrors[0].sink.api_url, staging_url)
+        self.assertEqual(sink.mirrors[0].collection_uuid, UUID(self.BUNDLE_UUID))
+
+        with self.assertRaisesRegexp(ArgumentError, '--mirror must name a collection UUID'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+                '--mirror', staging_url, 'bundle', self.BUNDLE_UUID,
+            )
+        with self.assertRaisesRegexp(ArgumentError, 'Invalid mirror UUID'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--mirror', staging_url, 'bundle', 'nope',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--mirror cannot be combined'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--mirror', staging_url, 'bundle', self.BUNDLE_UUID, '--changed-only',
+            )
+
+    @mock.patch(
+        'openedx_blockstore_relay.management.commands.transfer_to_blockstore.replay_history_to_blockstore'
+    )
+    def test_replay_history_option(self, mock_replay):
+        """
+        Test the option to replay the course's history into the bundle.
+        """
+        call_command(
+            'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--collection-uuid', self.COLLECTION_UUID,
+            '--replay-history',
+        )
+        self.mock_transfer.assert_not_called()
+        self.assertEqual(mock_replay.call_args[1]['collection_uuid'], UUID(self.COLLECTION_UUID))
+        self.assertIsNone(mock_replay.call_args[1]['bundle_uuid'])
+
+        with self.assertRaisesRegexp(ArgumentError, '--replay-history cannot be combined'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--bundle-uuid', self.BUNDLE_UUID,
+                '--replay-history', '--changed-only',
+            )
+        with self.assertRaisesRegexp(ArgumentError, '--replay-history cannot be combined'):
+            call_command(
+                'transfer_to_blockstore', '--block-key', self.BLOCK_KEY, '--output-dir', '/tmp/bundles',
+                '--replay-history',
+            )
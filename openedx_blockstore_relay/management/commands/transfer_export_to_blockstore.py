@@ -0,0 +1,107 @@
+"""
+Transfers a course from an OLX course export (a directory, or a .tar.gz
+archive as downloaded from Studio) to Blockstore, without reading it from the
+modulestore.
+
+Provide either --collection-uuid or --bundle-uuid, or write the bundle to a
+local directory or tar archive with --output-dir or --output-tar.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+from argparse import ArgumentError
+from uuid import UUID
+
+from ...transfer_data import transfer_export_to_blockstore
+from .transfer_to_blockstore import Command as TransferCommand
+
+
+class Command(TransferCommand):
+    """
+    transfer_export_to_blockstore management command.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.help = __doc__
+
+    def add_arguments(self, parser):
+        """
+        Add named arguments.
+        """
+        self.args['export'] = parser.add_argument(
+            '--export',
+            type=str,
+            required=True,
+            metavar='PATH',
+            help='Path of the course export: its directory, or a (possibly compressed) tar archive of it.'
+        )
+        self.args['bundle_uuid'] = parser.add_argument(
+            '--bundle-uuid',
+            type=str,
+            required=False,
+            help='UUID of the destination Blockstore bundle.'
+        )
+        self.args['collection_uuid'] = parser.add_argument(
+            '--collection-uuid',
+            type=str,
+            required=False,
+            help='UUID of the Blockstore collection in which to create the destination bundle.'
+        )
+        self.args['progress'] = parser.add_argument(
+            '--progress',
+            action='store_true',
+            help='Print progress events (as JSON, one per line) to stdout during the transfer.'
+        )
+        self.args['output_dir'] = parser.add_argument(
+            '--output-dir',
+            type=str,
+            required=False,
+            metavar='PATH',
+            help='Write the bundle to this local directory instead of Blockstore.'
+        )
+        self.args['output_tar'] = parser.add_argument(
+            '--output-tar',
+            type=str,
+            required=False,
+            metavar='PATH',
+            help='Write the bundle to this local tar archive (compressed if named .gz/.tgz or .bz2/.tbz2) instead of '
+                 'Blockstore.'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Validate the arguments, and start the transfer.
+        """
+        self.set_logging(options['verbosity'])
+        export_path = options['export']
+        if not os.path.exists(export_path):
+            raise ArgumentError(message='No such course export', argument=self.args['export'])
+        destination = {}
+        for name in ('bundle_uuid', 'collection_uuid'):
+            if options.get(name):
+                try:
+                    destination[name] = UUID(options[name])
+                except ValueError:
+                    raise ArgumentError(
+                        message='Invalid {} UUID'.format(name.split('_')[0]), argument=self.args[name],
+                    )
+        output_dir = options.get('output_dir')
+        output_tar = options.get('output_tar')
+        if output_dir and output_tar:
+            raise ArgumentError(message='Use either --output-dir or --output-tar', argument=self.args['output_tar'])
+        if len(destination) == 2 or not (destination or output_dir or output_tar):
+            raise ArgumentError(message='Either collection OR bundle UUID is required',
+                                argument=self.args['collection_uuid'])
+
+        sink = self.get_sink(output_dir, output_tar)
+        try:
+            transfer_export_to_blockstore(
+                export_path,
+                bundle_uuid=destination.get('bundle_uuid'),
+                collection_uuid=destination.get('collection_uuid'),
+                progress_callback=self.print_progress if options.get('progress') else None,
+                sink=sink,
+            )
+        finally:
+            sink.close()
@@ -2,9 +2,25 @@
 Transfers a Block and its children from the Open edX modulestore to Blockstore.
 
 Provide either --collection-uuid or --bundle-uuid.
+
+With --shard-by, each chapter (or subsection) goes into a bundle of its own, in
+the given collection.
+
+With --changed-only, only the blocks which have changed since the last such
+transfer into the given bundle are serialized and uploaded.
+
+With --replay-history, the block is transferred as it was in each version of
+its course, oldest first, with one commit per version.
+
+With --output-dir or --output-tar, the bundles are written to a local directory
+or tar archive instead of Blockstore, and no UUID is needed.
+
+With --mirror, the same bundle is also written to other Blockstore instances,
+from a single serialization.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import json
 import logging
 from argparse import ArgumentError
 from uuid import UUID
@@ -13,7 +29,11 @@ from django.core.management.base import BaseCommand
 from opaque_keys import InvalidKeyError
 from opaque_keys.edx.keys import UsageKey
 
-from ...transfer_data import transfer_to_blockstore
+from ...pipeline import DEFAULT_LARGE_FILE_BYTES, DEFAULT_LARGE_FILE_WORKERS
+from ...progress import DEFAULT_PROGRESS_INTERVAL
+from ...sharding import DEFAULT_SHARD_WORKERS, transfer_sharded_to_blockstore
+from ...sinks import DEFAULT_MIRROR_BUFFER_BYTES, BlockstoreSink, DirectorySink, FanOutSink, Mirror, TarSink
+from ...transfer_data import replay_history_to_blockstore, transfer_changes_to_blockstore, transfer_to_blockstore
 
 
 class Command(BaseCommand):
@@ -56,6 +76,150 @@ class Command(BaseCommand):
             help='UUID of an existing Blockstore Collection -- a new Bundle will be created for the block. '
                  'e.g., "01234567-89ab-cdef-fedc-ba9876543210"'
         )
+        self.args['progress'] = parser.add_argument(
+            '--progress',
+            action='store_true',
+            help='Print progress events (as JSON, one per line) to stdout during the transfer.'
+        )
+        self.args['progress_interval'] = parser.add_argument(
+            '--progress-interval',
+            type=float,
+            default=DEFAULT_PROGRESS_INTERVAL,
+            metavar='SECONDS',
+            help='Minimum number of seconds between two progress events. Default: %(default)s'
+        )
+        self.args['max_inflight_mb'] = parser.add_argument(
+            '--max-inflight-mb',
+            type=float,
+            required=False,
+            metavar='MB',
+            help='Upload blocks while the rest are still being serialized, pausing serialization whenever the data '
+                 'waiting to be uploaded (including the buffers used to encode it) would take more than this many '
+                 'megabytes. The block just serialized, which waits for room, comes on top of this.'
+        )
+        self.args['upload_workers'] = parser.add_argument(
+            '--upload-workers',
+            type=int,
+            default=1,
+            metavar='N',
+            help='Number of threads uploading files to Blockstore concurrently. Default: %(default)s'
+        )
+        self.args['large_file_mb'] = parser.add_argument(
+            '--large-file-mb',
+            type=float,
+            default=DEFAULT_LARGE_FILE_BYTES / 1024 / 1024,
+            metavar='MB',
+            help='With concurrent uploads, upload files of at least this many megabytes on threads of their own, '
+                 'largest first, and smaller files in batches. Default: %(default)s'
+        )
+        self.args['large_file_workers'] = parser.add_argument(
+            '--large-file-workers',
+            type=int,
+            default=DEFAULT_LARGE_FILE_WORKERS,
+            metavar='N',
+            help='Number of threads uploading large files (see --large-file-mb), in addition to --upload-workers. '
+                 'Default: %(default)s'
+        )
+        self.args['from_structure'] = parser.add_argument(
+            '--from-structure',
+            action='store_true',
+            help='Serialize common block types straight from the course\'s split modulestore documents, without '
+                 'loading each block. Faster for whole courses.'
+        )
+        self.args['commit_every_files'] = parser.add_argument(
+            '--commit-every-files',
+            type=int,
+            required=False,
+            metavar='N',
+            help='Commit the draft every time this many files have been uploaded, rather than only at the end. '
+                 'Re-running a failed transfer into the same bundle then skips the blocks it already committed.'
+        )
+        self.args['commit_every_mb'] = parser.add_argument(
+            '--commit-every-mb',
+            type=float,
+            required=False,
+            metavar='MB',
+            help='Commit the draft every time this many megabytes have been uploaded, rather than only at the end.'
+        )
+        self.args['shard_by'] = parser.add_argument(
+            '--shard-by',
+            choices=('chapter', 'sequential'),
+            required=False,
+            help='Transfer each block of this type (with its descendants) into its own bundle, and the blocks above '
+                 'them into a parent bundle which depends on those. Requires --collection-uuid.'
+        )
+        self.args['shard_workers'] = parser.add_argument(
+            '--shard-workers',
+            type=int,
+            default=DEFAULT_SHARD_WORKERS,
+            metavar='N',
+            help='With --shard-by, the number of shards to transfer at the same time. Default: %(default)s'
+        )
+        self.args['resume'] = parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='With --shard-by, skip the shards which were transferred by a previous, failed run.'
+        )
+        self.args['output_dir'] = parser.add_argument(
+            '--output-dir',
+            type=str,
+            required=False,
+            metavar='PATH',
+            help='Write the bundles into this directory (one sub-directory per bundle) instead of Blockstore.'
+        )
+        self.args['output_tar'] = parser.add_argument(
+            '--output-tar',
+            type=str,
+            required=False,
+            metavar='PATH',
+            help='Stream the bundles into this tar archive (compressed if it ends in .gz, .tgz or .bz2) instead of '
+                 'Blockstore.'
+        )
+        self.args['reuse_assets'] = parser.add_argument(
+            '--reuse-assets',
+            action='store_true',
+            help='With --bundle-uuid, neither read nor upload the course assets which the bundle already has, '
+                 'according to the transfer ledger.'
+        )
+        self.args['changed_only'] = parser.add_argument(
+            '--changed-only',
+            action='store_true',
+            help='With --bundle-uuid, only transfer the blocks which have changed since the last --changed-only '
+                 'transfer into that bundle, found by comparing hashes of the block versions in the course\'s split '
+                 'modulestore structure. The bundle.json manifest is rewritten to list the changed blocks along with '
+                 'the unchanged ones which the bundle already has.'
+        )
+        self.args['replay_history'] = parser.add_argument(
+            '--replay-history',
+            action='store_true',
+            help='Transfer the block as it was in each version of its course\'s split modulestore structure, oldest '
+                 'first, committing once per version and only uploading the blocks which changed in it, so that the '
+                 'bundle\'s history mirrors the course\'s.'
+        )
+        self.args['mirror'] = parser.add_argument(
+            '--mirror',
+            nargs=3,
+            action='append',
+            default=[],
+            metavar=('API_URL', 'bundle|collection', 'UUID'),
+            help='Also write the bundle to the Blockstore instance with this API URL, into the existing bundle (with '
+                 '--bundle-uuid) or a new bundle in the collection (with --collection-uuid) with this UUID there. Can '
+                 'be given several times. Blocks and assets are only read and serialized once.'
+        )
+        self.args['mirror_buffer_mb'] = parser.add_argument(
+            '--mirror-buffer-mb',
+            type=float,
+            default=DEFAULT_MIRROR_BUFFER_BYTES / 1024 / 1024,
+            metavar='MB',
+            help='Maximum megabytes of file data waiting to be written to each mirror: past that, the transfer waits '
+                 'for the mirror to catch up. Default: %(default)s'
+        )
+        self.args['verify'] = parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Once committed, check the file listing of each bundle against the files sent, and upload any '
+                 'missing or mismatched files again.'
+        )
 
     def handle(self, *args, **options):
         """
@@ -80,11 +244,200 @@ class Command(BaseCommand):
         except ValueError:
             raise ArgumentError(message='Invalid collection UUID', argument=self.args['collection_uuid'])
 
-        if bool(collection_uuid) is bool(bundle_uuid):
+        output_dir = options.get('output_dir')
+        output_tar = options.get('output_tar')
+        if output_dir and output_tar:
+            raise ArgumentError(message='Use either --output-dir or --output-tar', argument=self.args['output_tar'])
+        to_blockstore = not (output_dir or output_tar)
+        verify = options.get('verify', False)
+        if verify and output_tar:
+            raise ArgumentError(message='--verify cannot be used with --output-tar', argument=self.args['verify'])
+        if to_blockstore and bool(collection_uuid) is bool(bundle_uuid):
+            raise ArgumentError(message='Either collection OR bundle UUID is required',
+                                argument=self.args['collection_uuid'])
+        if collection_uuid and bundle_uuid:
             raise ArgumentError(message='Either collection OR bundle UUID is required',
                                 argument=self.args['collection_uuid'])
+        reuse_assets = options.get('reuse_assets', False)
+        if reuse_assets and not bundle_uuid:
+            raise ArgumentError(message='--reuse-assets requires --bundle-uuid', argument=self.args['reuse_assets'])
+
+        changed_only = options.get('changed_only', False)
+        if changed_only and not bundle_uuid:
+            raise ArgumentError(message='--changed-only requires --bundle-uuid', argument=self.args['changed_only'])
+
+        max_inflight_mb = options.get('max_inflight_mb')
+        if max_inflight_mb is not None and max_inflight_mb <= 0:
+            raise ArgumentError(message='--max-inflight-mb must be positive', argument=self.args['max_inflight_mb'])
+        upload_workers = options.get('upload_workers', 1)
+        if upload_workers < 1:
+            raise ArgumentError(message='--upload-workers must be at least 1', argument=self.args['upload_workers'])
+        large_file_mb = options.get('large_file_mb', DEFAULT_LARGE_FILE_BYTES / 1024 / 1024)
+        if large_file_mb <= 0:
+            raise ArgumentError(message='--large-file-mb must be positive', argument=self.args['large_file_mb'])
+        large_file_workers = options.get('large_file_workers', DEFAULT_LARGE_FILE_WORKERS)
+        if large_file_workers < 1:
+            raise ArgumentError(
+                message='--large-file-workers must be at least 1', argument=self.args['large_file_workers'],
+            )
+
+        commit_every_files = options.get('commit_every_files')
+        if commit_every_files is not None and commit_every_files < 1:
+            raise ArgumentError(
+                message='--commit-every-files must be at least 1', argument=self.args['commit_every_files'],
+            )
+        commit_every_mb = options.get('commit_every_mb')
+        if commit_every_mb is not None and commit_every_mb <= 0:
+            raise ArgumentError(message='--commit-every-mb must be positive', argument=self.args['commit_every_mb'])
+        if (commit_every_files or commit_every_mb) and (max_inflight_mb or upload_workers > 1):
+            raise ArgumentError(
+                message='--commit-every-files/--commit-every-mb cannot be combined with concurrent uploads',
+                argument=self.args['commit_every_files'],
+            )
+
+        progress_callback = self.print_progress if options.get('progress') else None
+        if changed_only and (
+            options.get('shard_by') or max_inflight_mb or upload_workers > 1 or commit_every_files or
+            commit_every_mb or verify or not to_blockstore
+        ):
+            raise ArgumentError(
+                message='--changed-only cannot be combined with --shard-by, concurrent uploads, intermediate commits, '
+                        '--verify or --output-dir/--output-tar',
+                argument=self.args['changed_only'],
+            )
+
+        replay_history = options.get('replay_history', False)
+        if replay_history and (
+            changed_only or options.get('shard_by') or max_inflight_mb or upload_workers > 1 or commit_every_files or
+            commit_every_mb or verify or reuse_assets or not to_blockstore
+        ):
+            raise ArgumentError(
+                message='--replay-history cannot be combined with --changed-only, --shard-by, concurrent uploads, '
+                        'intermediate commits, --verify, --reuse-assets or --output-dir/--output-tar',
+                argument=self.args['replay_history'],
+            )
+
+        mirrors = self.get_mirrors(options.get('mirror') or [], 'bundle' if bundle_uuid else 'collection')
+        if mirrors and (
+            not to_blockstore or changed_only or replay_history or options.get('shard_by') or verify or reuse_assets
+        ):
+            raise ArgumentError(
+                message='--mirror cannot be combined with --output-dir/--output-tar, --changed-only, '
+                        '--replay-history, --shard-by, --verify or --reuse-assets',
+                argument=self.args['mirror'],
+            )
+        mirror_buffer_mb = options.get('mirror_buffer_mb', DEFAULT_MIRROR_BUFFER_BYTES / 1024 / 1024)
+        if mirror_buffer_mb <= 0:
+            raise ArgumentError(message='--mirror-buffer-mb must be positive', argument=self.args['mirror_buffer_mb'])
+
+        shard_by = options.get('shard_by')
+        shard_workers = options.get('shard_workers', DEFAULT_SHARD_WORKERS)
+        if shard_by:
+            if to_blockstore and not collection_uuid:
+                raise ArgumentError(message='--shard-by requires --collection-uuid', argument=self.args['shard_by'])
+            if shard_workers < 1:
+                raise ArgumentError(message='--shard-workers must be at least 1', argument=self.args['shard_workers'])
 
-        transfer_to_blockstore(root_block_key=block_key, bundle_uuid=bundle_uuid, collection_uuid=collection_uuid)
+        sink = self.get_sink(output_dir, output_tar)
+        if mirrors:
+            sink = FanOutSink(sink, mirrors, max_buffered_bytes=int(mirror_buffer_mb * 1024 * 1024))
+        try:
+            if shard_by:
+                transfer_sharded_to_blockstore(
+                    root_block_key=block_key,
+                    collection_uuid=collection_uuid,
+                    shard_block_type=shard_by,
+                    workers=shard_workers,
+                    resume=options.get('resume', False),
+                    progress_callback=progress_callback,
+                    sink=sink,
+                    verify=verify,
+                )
+                return
+
+            if replay_history:
+                replay_history_to_blockstore(
+                    root_block_key=block_key,
+                    bundle_uuid=bundle_uuid,
+                    collection_uuid=collection_uuid,
+                    progress_callback=progress_callback,
+                    sink=sink,
+                )
+                return
+
+            if changed_only:
+                transfer_changes_to_blockstore(
+                    root_block_key=block_key,
+                    bundle_uuid=bundle_uuid,
+                    progress_callback=progress_callback,
+                    sink=sink,
+                    reuse_assets=reuse_assets,
+                )
+                return
+
+            transfer_to_blockstore(
+                root_block_key=block_key,
+                bundle_uuid=bundle_uuid,
+                collection_uuid=collection_uuid,
+                progress_callback=progress_callback,
+                progress_interval=options.get('progress_interval', DEFAULT_PROGRESS_INTERVAL),
+                max_inflight_bytes=int(max_inflight_mb * 1024 * 1024) if max_inflight_mb else None,
+                upload_workers=upload_workers,
+                from_structure=options.get('from_structure', False),
+                commit_every_files=commit_every_files,
+                commit_every_bytes=int(commit_every_mb * 1024 * 1024) if commit_every_mb else None,
+                sink=sink,
+                large_file_bytes=int(large_file_mb * 1024 * 1024),
+                large_file_workers=large_file_workers,
+                verify=verify,
+                reuse_assets=reuse_assets,
+            )
+        finally:
+            sink.close()
+
+    def get_sink(self, output_dir=None, output_tar=None):
+        """
+        Return the sink to write the bundles to: Blockstore, unless an output
+        directory or tar archive is given.
+        """
+        if output_dir:
+            return DirectorySink(output_dir)
+        if output_tar:
+            for extensions, compression in ((('.gz', '.tgz'), 'gz'), (('.bz2', '.tbz2'), 'bz2')):
+                if output_tar.endswith(extensions):
+                    return TarSink(output_tar, compression)
+            return TarSink(output_tar)
+        return BlockstoreSink()
+
+    def get_mirrors(self, mirror_options, kind):
+        """
+        Return a Mirror for each --mirror option, given whether the transfer is
+        into an existing bundle or into a new one in a collection.
+        """
+        mirrors = []
+        for api_url, mirror_kind, mirror_uuid in mirror_options:
+            if mirror_kind != kind:
+                raise ArgumentError(
+                    message='--mirror must name a {} UUID, like the main destination'.format(kind),
+                    argument=self.args['mirror'],
+                )
+            try:
+                mirror_uuid = UUID(mirror_uuid)
+            except ValueError:
+                raise ArgumentError(message='Invalid mirror UUID', argument=self.args['mirror'])
+            mirrors.append(Mirror(
+                BlockstoreSink(api_url=api_url),
+                bundle_uuid=mirror_uuid if kind == 'bundle' else None,
+                collection_uuid=mirror_uuid if kind == 'collection' else None,
+                name=api_url,
+            ))
+        return mirrors
+
+    def print_progress(self, event):
+        """
+        Print a progress event to stdout, as a single line of JSON.
+        """
+        self.stdout.write(json.dumps(event, sort_keys=True))
 
     def set_logging(self, verbosity):
         """
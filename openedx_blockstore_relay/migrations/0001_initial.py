@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+import jsonfield.fields
+import opaque_keys.edx.django.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transfer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root_key', opaque_keys.edx.django.models.UsageKeyField(db_index=True, max_length=255)),
+                ('course_key', opaque_keys.edx.django.models.CourseKeyField(db_index=True, max_length=255)),
+                ('bundle_uuid', models.UUIDField(db_index=True)),
+                ('draft_uuid', models.UUIDField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('committed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TransferredBlock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usage_key', opaque_keys.edx.django.models.UsageKeyField(db_index=True, max_length=255)),
+                ('def_path', models.CharField(max_length=255)),
+                ('olx_digest', models.CharField(max_length=40)),
+                ('asset_digests', jsonfield.fields.JSONField(default=dict)),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='openedx_blockstore_relay.Transfer')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='transfer',
+            index_together=set([('course_key', 'committed_at')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='transferredblock',
+            index_together=set([('usage_key', 'transfer')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='partial_commits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
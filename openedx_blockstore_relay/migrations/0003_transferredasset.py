@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0002_transfer_partial_commits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='collection_uuid',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TransferredAsset',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('digest', models.CharField(db_index=True, max_length=40)),
+                ('md5', models.CharField(db_index=True, max_length=32)),
+                ('size', models.BigIntegerField()),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assets', to='openedx_blockstore_relay.Transfer')),
+            ],
+        ),
+    ]
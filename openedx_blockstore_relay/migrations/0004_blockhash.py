@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import opaque_keys.edx.django.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0003_transferredasset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockHash',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bundle_uuid', models.UUIDField()),
+                ('usage_key', opaque_keys.edx.django.models.UsageKeyField(max_length=255)),
+                ('node_hash', models.CharField(max_length=40)),
+                ('subtree_hash', models.CharField(max_length=40)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': set([('bundle_uuid', 'usage_key')]),
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import opaque_keys.edx.django.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0004_blockhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch', models.CharField(max_length=255)),
+                ('root_key', opaque_keys.edx.django.models.UsageKeyField(max_length=255)),
+                ('collection_uuid', models.UUIDField(blank=True, null=True)),
+                ('bundle_uuid', models.UUIDField(blank=True, null=True)),
+                ('blocks', models.PositiveIntegerField(default=0)),
+                ('asset_bytes', models.BigIntegerField(default=0)),
+                ('cost', models.FloatField(default=0)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('submitted', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': set([('batch', 'root_key')]),
+                'index_together': set([('batch', 'state')]),
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import opaque_keys.edx.django.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0006_live_relay'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transfer',
+            name='course_key',
+            field=opaque_keys.edx.django.models.CourseKeyField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='transferredblock',
+            name='usage_key',
+            field=opaque_keys.edx.django.models.UsageKeyField(max_length=255),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0007_drop_redundant_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='destination',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='blockhash',
+            name='destination',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterUniqueTogether(
+            name='blockhash',
+            unique_together=set([('bundle_uuid', 'destination', 'usage_key')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0008_transfer_destination'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+    ]
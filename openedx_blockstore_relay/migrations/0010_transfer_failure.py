@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0009_transfer_incremental'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openedx_blockstore_relay', '0010_transfer_failure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relayedcourse',
+            name='relay_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,234 @@
+"""
+Database models for openedx_blockstore_relay.
+
+The transfer ledger records what was transferred where: one Transfer row per
+transfer into a Blockstore bundle, one TransferredBlock row per block that
+was part of that transfer, and one TransferredAsset row per contentstore
+asset that the transfer put into the bundle, so that later transfers (and
+anyone wanting to know where a block or asset ended up) can find out without
+querying Blockstore.
+
+It also keeps the hash tree of the blocks in each bundle (one BlockHash row
+per block), so that changed-only transfers can tell which blocks have changed
+since (see hash_tree.py).
+
+MigrationJob rows are the persisted queue of the scheduler (see scheduler.py),
+so that a migration of many courses can be restarted where it stopped.
+
+PendingChange and RelayedCourse rows hold the state of the live relay (see
+live_relay.py), so that it is shared by every Studio process and survives
+their restarts.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.db import models
+from django.utils import timezone
+from jsonfield.fields import JSONField
+from opaque_keys.edx.django.models import CourseKeyField, UsageKeyField
+from six import python_2_unicode_compatible
+
+
+@python_2_unicode_compatible
+class Transfer(models.Model):
+    """
+    A transfer of an Open edX block (and its descendants) into a Blockstore bundle.
+
+    collection_uuid is that of the collection the bundle is in, as given to
+    the transfer (whether or not the transfer created the bundle). destination is '' for transfers into Blockstore,
+    and otherwise describes where the bundle was written instead, e.g. a local
+    directory (see sinks.py); only transfers into Blockstore are looked up by
+    ledger.py, unless asked otherwise.
+    committed_at is null until the draft holding the transferred files has
+    been committed, i.e. for transfers which are still running or have failed;
+    failed_at and error are set when a failure was recorded (see
+    ledger.mark_failed()).
+    partial_commits counts the intermediate commits of transfers which commit
+    their draft every so many files (see transfer_data.ChunkedCommitter).
+    incremental transfers only uploaded some of the blocks under root_key (e.g.
+    those which had changed; see transfer_data.transfer_changes_to_blockstore()),
+    so they don't count as transfers of root_key as a whole.
+
+    .. no_pii:
+    """
+    root_key = UsageKeyField(max_length=255, db_index=True)
+    course_key = CourseKeyField(max_length=255)  # Indexed by the index on (course_key, committed_at)
+    bundle_uuid = models.UUIDField(db_index=True)
+    collection_uuid = models.UUIDField(null=True, blank=True)
+    draft_uuid = models.UUIDField(null=True, blank=True)
+    destination = models.CharField(max_length=255, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    committed_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    partial_commits = models.PositiveIntegerField(default=0)
+    incremental = models.BooleanField(default=False)
+
+    class Meta(object):
+        index_together = [
+            ('course_key', 'committed_at'),
+        ]
+
+    def __str__(self):
+        return '{} -> bundle {}'.format(self.root_key, self.bundle_uuid)
+
+
+@python_2_unicode_compatible
+class TransferredBlock(models.Model):
+    """
+    A block which was part of a Transfer.
+
+    def_path is the path of the block's OLX file within the bundle, and the
+    digests are SHA-1 hex digests of the OLX and of each static file
+    (asset_digests maps each static file's path within the bundle to its
+    digest).
+
+    .. no_pii:
+    """
+    transfer = models.ForeignKey(Transfer, related_name='blocks', on_delete=models.CASCADE)
+    usage_key = UsageKeyField(max_length=255)  # Indexed by the index on (usage_key, transfer)
+    def_path = models.CharField(max_length=255)
+    olx_digest = models.CharField(max_length=40)
+    asset_digests = JSONField(default=dict)
+
+    class Meta(object):
+        index_together = [
+            ('usage_key', 'transfer'),
+        ]
+
+    def __str__(self):
+        return '{} -> {}'.format(self.usage_key, self.def_path)
+
+
+@python_2_unicode_compatible
+class TransferredAsset(models.Model):
+    """
+    A contentstore ("Files & Uploads") asset which a Transfer put into its
+    bundle, at the given path: the registry of which assets are in which
+    bundles, keyed by the SHA-1 hex digest of their data.
+
+    md5 is the MD5 hex digest which the contentstore stored for the asset, so
+    that an asset can be recognized without reading its data.
+
+    .. no_pii:
+    """
+    transfer = models.ForeignKey(Transfer, related_name='assets', on_delete=models.CASCADE)
+    path = models.CharField(max_length=255)
+    digest = models.CharField(max_length=40, db_index=True)
+    md5 = models.CharField(max_length=32, db_index=True)
+    size = models.BigIntegerField()
+
+    def __str__(self):
+        return '{} -> {}'.format(self.digest, self.path)
+
+
+@python_2_unicode_compatible
+class BlockHash(models.Model):
+    """
+    The hashes of a block in a bundle, as of the last changed-only transfer
+    into that bundle which looked at it (see hash_tree.py): node_hash, of
+    the block's version and children list, and subtree_hash, of it and its
+    descendants. destination is that of the bundle's transfers (see Transfer).
+
+    .. no_pii:
+    """
+    bundle_uuid = models.UUIDField()
+    destination = models.CharField(max_length=255, blank=True, default='')
+    usage_key = UsageKeyField(max_length=255)
+    node_hash = models.CharField(max_length=40)
+    subtree_hash = models.CharField(max_length=40)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        unique_together = [
+            ('bundle_uuid', 'destination', 'usage_key'),
+        ]
+
+    def __str__(self):
+        return '{} in bundle {}: {}'.format(self.usage_key, self.bundle_uuid, self.subtree_hash)
+
+
+@python_2_unicode_compatible
+class MigrationJob(models.Model):
+    """
+    The transfer of a block (and its descendants) as part of a batch of
+    transfers run by the scheduler (see scheduler.py).
+
+    blocks and asset_bytes are the census of the block's subtree taken when
+    the job was submitted, and cost the resulting estimate of how long the
+    transfer will take, in seconds. bundle_uuid is set as soon as the job
+    has created its bundle, before transferring anything into it; error
+    holds the message of the exception that made it fail.
+
+    .. no_pii:
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    batch = models.CharField(max_length=255)
+    root_key = UsageKeyField(max_length=255)
+    collection_uuid = models.UUIDField(null=True, blank=True)
+    bundle_uuid = models.UUIDField(null=True, blank=True)
+    blocks = models.PositiveIntegerField(default=0)
+    asset_bytes = models.BigIntegerField(default=0)
+    cost = models.FloatField(default=0)
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING)
+    error = models.TextField(blank=True)
+    submitted = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta(object):
+        unique_together = [
+            ('batch', 'root_key'),
+        ]
+        index_together = [
+            ('batch', 'state'),
+        ]
+
+    def __str__(self):
+        return '{} in batch {} ({})'.format(self.root_key, self.batch, self.state)
+
+
+@python_2_unicode_compatible
+class PendingChange(models.Model):
+    """
+    A change to a block which the live relay has yet to transfer (see
+    live_relay.py). The rows of a course are deleted once the batch of changes
+    they are part of has been relayed.
+
+    .. no_pii:
+    """
+    course_key = CourseKeyField(max_length=255, db_index=True)
+    usage_key = UsageKeyField(max_length=255)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '{} changed at {}'.format(self.usage_key, self.changed_at)
+
+
+@python_2_unicode_compatible
+class RelayedCourse(models.Model):
+    """
+    A course kept up to date by the live relay, in the given bundle (null
+    until the course's first batch of changes creates it).
+
+    relay_started is set while a relay of the course's batch of changes is
+    running, so that only one of them runs at a time (see live_relay.py).
+
+    .. no_pii:
+    """
+    course_key = CourseKeyField(max_length=255, unique=True)
+    bundle_uuid = models.UUIDField(null=True, blank=True)
+    relayed_at = models.DateTimeField(null=True, blank=True)
+    relay_started = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} -> bundle {}'.format(self.course_key, self.bundle_uuid)
@@ -0,0 +1,372 @@
+"""
+Code for reading a course from an OLX course export, so that it can be
+transferred to Blockstore without access to the modulestore (see
+transfer_data.transfer_export_to_blockstore()).
+
+A course export (as written by Studio's "Export Course" or the export_olx
+command) is a directory, or a .tar.gz archive of one, holding course.xml, which
+points to the course's OLX in course/<run>.xml. The OLX of each block either
+contains its children inline, or points to them with tags like
+<chapter url_name="..."/>, in which case their OLX is in chapter/<url_name>.xml.
+The HTML of html blocks is in html/<filename>.html, the course's settings which
+aren't in its OLX are in policies/<run>/policy.json, and its "Files & Uploads"
+are in static/.
+
+ExportBlockSerializer turns each block into the same definition ID, OLX (with
+<xblock-include /> tags for its children) and static files that
+XBlockSerializer produces from the modulestore, taking the files referenced by
+the OLX and HTML from the export's static/ directory instead of the
+contentstore.
+
+An archive is read in a single pass, streaming each file into a temporary
+directory, so that neither the archive nor any of its files is held in memory.
+Static files of at least asset_cache.MMAP_MIN_BYTES are then memory-mapped
+rather than read.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import copy
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+from collections import namedtuple
+
+import six
+from lxml import etree
+from opaque_keys.edx.locator import CourseLocator
+from six.moves.urllib.parse import unquote
+
+from .asset_cache import MMAP_MIN_BYTES
+from .block_serializer import StaticFile, XBlockSerializer, blockstore_def_key_from_modulestore_usage_key, html_filename
+
+log = logging.getLogger(__name__)
+
+COURSE_FILE = 'course.xml'
+STATIC_DIR = 'static'
+# Block types whose child elements which have a url_name are child blocks, even
+# when they are inline rather than pointers to the child's own file:
+CONTAINER_BLOCK_TYPES = ('course', 'chapter', 'sequential', 'vertical')
+# References to the course's static files, like those which
+# static_replace.replace_static_urls() finds in the modulestore's OLX:
+STATIC_URL_RE = re.compile(r'''(?<=['"(])/static/([^'"?#)\s]+)''')
+
+# The part of an XBlock's ScopeIds which start_import() uses:
+ScopeIds = namedtuple('ScopeIds', ['usage_id'])
+AssetLocation = namedtuple('AssetLocation', ['path'])
+
+
+def is_pointer_tag(element):
+    """
+    Return True if the given element only points to the file holding the OLX
+    of the block (like XmlParserMixin.is_pointer_tag()).
+    """
+    expected_attributes = {'url_name', 'org', 'course'} if element.tag == 'course' else {'url_name'}
+    has_text = element.text is not None and element.text.strip()
+    return len(element) == 0 and set(element.attrib.keys()) == expected_attributes and not has_text
+
+
+def name_to_pathname(name):
+    """
+    Return the path (without extension) of the file named by the given
+    url_name or filename (like xmodule.xml_module.name_to_pathname()).
+    """
+    return name.replace(':', '/')
+
+
+def read_file(path):
+    """
+    Return the data of the given file: a read-only mmap object (which can be
+    used like bytes) if it is at least MMAP_MIN_BYTES long.
+    """
+    with open(path, 'rb') as data_file:
+        if os.fstat(data_file.fileno()).st_size >= MMAP_MIN_BYTES:
+            return mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return data_file.read()
+
+
+def _join(root, path):
+    """
+    Return the given relative path joined to root, or None if it would point
+    outside of root.
+    """
+    full_path = os.path.normpath(os.path.join(root, path))
+    if full_path == root or not full_path.startswith(root + os.sep):
+        return None
+    return full_path
+
+
+def _extract_archive(archive_path, destination):
+    """
+    Extract the regular files of the given (possibly compressed) tar archive
+    into the given directory, reading the archive as a stream.
+    """
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue  # Directories are created as needed; links aren't followed.
+            path = _join(destination, member.name)
+            if path is None:
+                log.warning('Skipping "%s" in %s, which is outside of the export', member.name, archive_path)
+                continue
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            with open(path, 'wb') as extracted_file:
+                shutil.copyfileobj(archive.extractfile(member), extracted_file)
+
+
+class ExportBlock(object):
+    """
+    A block read from a course export: its usage key, its OLX node (without
+    its children), the usage keys of its children, and for html blocks, the
+    HTML.
+    """
+
+    def __init__(self, usage_key, olx_node, children, html_data=None):
+        self.usage_key = usage_key
+        self.scope_ids = ScopeIds(usage_id=usage_key)
+        self.olx_node = olx_node
+        self.children = children
+        self.html_data = html_data
+        self.display_name = olx_node.get('display_name') or six.text_type(usage_key)
+
+
+class ExportAsset(object):
+    """
+    A file of the export's static/ directory, standing in for the contentstore
+    asset which importing the course would create (see
+    XBlockSerializer.add_static_asset()). Its data is only read when needed.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.location = AssetLocation(path=name)
+        self._data = None
+        self._content_digest = None
+
+    @property
+    def data(self):
+        """
+        The file's data.
+        """
+        if self._data is None:
+            self._data = read_file(self.path)
+        return self._data
+
+    @property
+    def content_digest(self):
+        """
+        The MD5 digest of the file, as the contentstore would store it.
+        """
+        if self._content_digest is None:
+            self._content_digest = hashlib.md5(self.data).hexdigest()
+        return self._content_digest
+
+
+class OlxExport(object):
+    """
+    A course export, given the path of its directory or archive. Use it as a
+    context manager (or call close()) to remove the files extracted from an
+    archive.
+    """
+
+    def __init__(self, path):
+        self._tmp_dir = None if os.path.isdir(path) else tempfile.mkdtemp(prefix='olx-export-')
+        try:
+            if self._tmp_dir is not None:
+                _extract_archive(path, self._tmp_dir)
+            self.root = self._find_root(os.path.abspath(self._tmp_dir or path))
+            self._course_pointer = self.parse(COURSE_FILE)
+            self.course_key = CourseLocator(
+                self._course_pointer.get('org'), self._course_pointer.get('course'),
+                self._course_pointer.get('url_name'),
+            )
+            self.policy = self._read_policy(self.course_key.run)
+        except Exception:
+            self.close()
+            raise
+        self.root_block_key = self.course_key.make_usage_key('course', 'course')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Remove the files extracted from the archive, if any.
+        """
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    @staticmethod
+    def _find_root(directory):
+        """
+        Return the directory holding course.xml: the given one, or its only
+        subdirectory (an archive of an export holds the export's directory).
+        """
+        if os.path.isfile(os.path.join(directory, COURSE_FILE)):
+            return directory
+        subdirectories = [name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))]
+        if len(subdirectories) == 1 and os.path.isfile(os.path.join(directory, subdirectories[0], COURSE_FILE)):
+            return os.path.join(directory, subdirectories[0])
+        raise ValueError('No {} found in the course export'.format(COURSE_FILE))
+
+    def path(self, relative_path):
+        """
+        Return the path of the given file of the export, or None if the path
+        points outside of the export.
+        """
+        return _join(self.root, relative_path)
+
+    def parse(self, relative_path):
+        """
+        Parse the given XML file of the export, and return its root element.
+        """
+        path = self.path(relative_path)
+        if path is None or not os.path.isfile(path):
+            raise ValueError('The course export has no file "{}"'.format(relative_path))
+        parser = etree.XMLParser(dtd_validation=False, load_dtd=False, remove_comments=True, remove_blank_text=True)
+        return etree.parse(path, parser).getroot()
+
+    def _read_policy(self, run):
+        """
+        Return the settings of the course's blocks from its policy.json, keyed
+        by '<block type>/<url_name>'.
+        """
+        path = self.path(os.path.join('policies', run, 'policy.json'))
+        if path is None or not os.path.isfile(path):
+            return {}
+        with open(path, 'rb') as policy_file:
+            return json.loads(policy_file.read().decode('utf-8'))
+
+    def static_asset(self, path):
+        """
+        Return an ExportAsset for the given path within the export's static/
+        directory, or None if there is no such file.
+        """
+        full_path = _join(os.path.join(self.root, STATIC_DIR), path)
+        if full_path is None or not os.path.isfile(full_path):
+            return None
+        # Like StaticContent.compute_location(), which names the assets that importing the course creates:
+        return ExportAsset(full_path, path.replace('/', '_'))
+
+    def iter_blocks(self):
+        """
+        Yield an ExportBlock for each block of the course, parents before their
+        children, starting with the course.
+        """
+        stack = [self._course_pointer]
+        while stack:
+            block, child_elements = self.load_block(stack.pop())
+            yield block
+            stack.extend(reversed(child_elements))
+
+    def load_block(self, element):
+        """
+        Read the block of the given element of the OLX (either the block's OLX
+        or a pointer to its file), which must have a url_name. Returns the
+        ExportBlock and the elements of its children.
+        """
+        url_name = element.get('url_name')
+        if is_pointer_tag(element):
+            element = self.parse('{}/{}.xml'.format(element.tag, name_to_pathname(url_name)))
+        block_type = element.tag
+        # Importing a course into split modulestore names its root block 'course':
+        usage_key = self.course_key.make_usage_key(block_type, 'course' if block_type == 'course' else url_name)
+
+        olx_node = copy.deepcopy(element)
+        child_elements = []
+        for child_element, child_node in zip(list(element), list(olx_node)):
+            if self.is_child_block(block_type, child_element):
+                child_elements.append(child_element)
+                olx_node.remove(child_node)
+        for name, value in self.policy.get('{}/{}'.format(block_type, url_name), {}).items():
+            olx_node.set(name, value if isinstance(value, six.string_types) else json.dumps(value))
+        children = [self.course_key.make_usage_key(child.tag, child.get('url_name')) for child in child_elements]
+
+        html_data = None
+        if block_type == 'html':
+            olx_node, html_data = self.read_html(olx_node, url_name)
+        return ExportBlock(usage_key, olx_node, children, html_data), child_elements
+
+    def is_child_block(self, block_type, element):
+        """
+        Return True if the given element of the OLX of a block of the given
+        type is a child block, as opposed to part of the block's content.
+        """
+        if not isinstance(element.tag, six.string_types):
+            return False
+        if block_type in CONTAINER_BLOCK_TYPES and element.get('url_name'):
+            return True
+        if not is_pointer_tag(element):
+            return False
+        path = self.path('{}/{}.xml'.format(element.tag, name_to_pathname(element.get('url_name'))))
+        return path is not None and os.path.isfile(path)
+
+    def read_html(self, olx_node, url_name):
+        """
+        Return the OLX node and HTML of an html block, given its OLX node,
+        which either names its .html file or contains the HTML, as
+        HtmlDescriptor.definition_to_xml() would export it.
+        """
+        filename = olx_node.attrib.pop('filename', None)
+        if filename:
+            path = self.path('html/{}.html'.format(name_to_pathname(filename)))
+            if path is None or not os.path.isfile(path):
+                raise ValueError('The course export has no HTML file "{}" for block "{}"'.format(filename, url_name))
+            with open(path, 'rb') as html_file:
+                html_data = html_file.read().decode('utf-8')
+        else:
+            html_data = (olx_node.text or '') + ''.join(
+                etree.tostring(child, encoding='unicode') for child in olx_node
+            )
+        html_node = etree.Element('html', {'filename': html_filename(url_name)})
+        for name, value in olx_node.attrib.items():
+            html_node.set(name, value)
+        return html_node, html_data
+
+
+class ExportBlockSerializer(XBlockSerializer):
+    """
+    Serializes an ExportBlock of the given OlxExport, with the same result as
+    XBlockSerializer would have once the course is imported.
+    """
+
+    def __init__(self, export, block):  # pylint: disable=super-init-not-called
+        self.export = export
+        self.orig_block_key = block.usage_key
+        self.static_files = []
+        self.def_id = blockstore_def_key_from_modulestore_usage_key(block.usage_key)
+        self.init_assets()
+        if block.html_data is not None:
+            self.static_files.append(StaticFile(
+                name=block.olx_node.get('filename') + '.html', data=block.html_data.encode('utf-8'),
+            ))
+        self.finish(block.olx_node, children=block.children, html_data=block.html_data)
+
+    def find_assets(self, text, as_stream=False):
+        """
+        Yield an ExportAsset for each file of the export's static/ directory
+        which the given OLX or HTML references.
+        """
+        if isinstance(text, six.binary_type):
+            text = text.decode('utf-8')
+        for match in STATIC_URL_RE.finditer(text):
+            path = unquote(match.group(1))
+            asset = self.export.static_asset(path)
+            if asset is None:
+                log.error('Static asset not found in the course export: %s', path)
+            else:
+                yield asset
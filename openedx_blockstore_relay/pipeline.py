@@ -0,0 +1,318 @@
+"""
+A concurrent upload stage with a bound on the memory used by in-flight data.
+
+Serializing a block produces its OLX and static files in memory, and
+uploading a file needs some more memory to encode it into the request body.
+UploadPipeline lets the serializer run
+ahead of the uploads, with a pool of worker threads doing the uploading, but
+makes it wait (backpressure) whenever the data that has been serialized and
+not yet uploaded would exceed a byte budget.
+
+The budget bounds the data in flight, not the peak memory of the transfer: a
+block's size is only known once it has been serialized, so the budget is
+charged when the block is handed to add_block(). The serializer then waits
+there before going on to the next block, so at most one serialized block (the
+one waiting for room) is held on top of the budget.
+
+Files are scheduled by size, in two lanes: large files (static assets like
+videos or PDFs) are uploaded one per request by their own workers, largest
+first, so that a huge file doesn't end up being the last thing uploaded;
+small files (OLX, HTML, transcripts) are grouped into batches uploaded in a
+single request each.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import itertools
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+from .blockstore_client import ENCODE_CHUNK_SIZE, should_gzip
+
+log = logging.getLogger(__name__)
+
+# Files of at least this many bytes go into the large-file lane:
+DEFAULT_LARGE_FILE_BYTES = 8 * 1024 * 1024
+DEFAULT_LARGE_FILE_WORKERS = 1
+# Limits on the batches of small files uploaded in one request:
+DEFAULT_BATCH_MAX_FILES = 50
+DEFAULT_BATCH_MAX_BYTES = 1024 * 1024
+
+
+def inflight_cost(num_bytes):
+    """
+    Estimate how much memory uploading a file of num_bytes bytes takes: the
+    file data itself, plus the request body encoder's buffers, which hold at
+    most about two base64-encoded chunks of it at a time (see
+    blockstore_client.DraftFilesBody). If the body gets gzip-compressed, the
+    compressed copy is held in memory too; it is assumed to be no larger than
+    the base64-encoded file.
+    """
+    encoded_chunk_size = 4 * ((min(num_bytes, ENCODE_CHUNK_SIZE) + 2) // 3)
+    cost = num_bytes + 2 * encoded_chunk_size
+    encoded_size = 4 * ((num_bytes + 2) // 3)
+    if should_gzip(encoded_size):
+        cost += encoded_size
+    return cost
+
+
+class TransferAborted(Exception):
+    """
+    Raised to stop a producer that is waiting for a budget that will never be
+    released, because the uploads have failed.
+    """
+
+
+class ByteBudget(object):
+    """
+    A semaphore counting bytes rather than slots.
+
+    acquire() blocks until the requested number of bytes fits within the
+    limit. A single request larger than the whole limit is let through once
+    nothing else is in flight, rather than blocking forever; that is the only
+    case in which the bytes in use exceed the limit.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.wait_seconds = 0.0  # Total time spent blocked in acquire()
+        self._condition = threading.Condition()
+        self._aborted = False
+
+    def acquire(self, num_bytes):
+        """
+        Reserve num_bytes bytes of the budget, waiting until they are available.
+        """
+        with self._condition:
+            started_waiting = time.time()
+            while self.in_use and self.in_use + num_bytes > self.limit and not self._aborted:
+                self._condition.wait()
+            self.wait_seconds += time.time() - started_waiting
+            if self._aborted:
+                raise TransferAborted()
+            self.in_use += num_bytes
+            self.peak = max(self.peak, self.in_use)
+
+    def would_block(self, num_bytes):
+        """
+        Return True if acquire(num_bytes) would have to wait, at the moment.
+        """
+        with self._condition:
+            return bool(self.in_use) and self.in_use + num_bytes > self.limit
+
+    def release(self, num_bytes):
+        """
+        Return num_bytes bytes to the budget.
+        """
+        with self._condition:
+            self.in_use -= num_bytes
+            self._condition.notify_all()
+
+    def abort(self):
+        """
+        Make any current and future acquire() calls raise TransferAborted.
+        """
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+
+
+class UploadPipeline(object):
+    """
+    Uploads the files of serialized blocks into a draft, using pools of worker
+    threads, while limiting the amount of data in flight.
+
+    Use it like:
+        pipeline = UploadPipeline(upload, draft_uuid, manifest, max_inflight_bytes=64 * 1024 * 1024, workers=4)
+        for data in serialized_blocks:
+            pipeline.add_block(data)  # Blocks while the budget is full
+        pipeline.close()  # Waits for the uploads to finish, re-raising the first error, if any
+
+    Files of at least large_file_bytes bytes are uploaded by the large-file
+    workers, largest first among those waiting. The other files are
+    uploaded by the (small-file) workers, in batches of up to
+    batch_max_files files / batch_max_bytes bytes if upload_batch is given,
+    or one at a time otherwise.
+    """
+
+    def __init__(
+        self, upload, draft_uuid, manifest, progress=None, max_inflight_bytes=None, workers=1,
+        upload_batch=None, large_file_bytes=DEFAULT_LARGE_FILE_BYTES, large_file_workers=DEFAULT_LARGE_FILE_WORKERS,
+        batch_max_files=DEFAULT_BATCH_MAX_FILES, batch_max_bytes=DEFAULT_BATCH_MAX_BYTES,
+    ):
+        """
+        Start the worker threads.
+
+        Args:
+        * upload: function to call as upload(draft_uuid, path, data) for each file
+        * draft_uuid: UUID of the draft to upload the files into
+        * manifest: bundle.json manifest dict to record the files' paths in
+        * progress: optional TransferProgress to update as files are uploaded
+        * max_inflight_bytes: memory budget for data which has been added but
+          not yet uploaded (see inflight_cost()); None for no limit
+        * workers: number of small-file upload threads
+        * upload_batch: optional function to call as upload_batch(draft_uuid,
+          [(path, data), ...]) to upload several small files in one request
+        * large_file_bytes: size from which files go into the large-file lane;
+          None to upload every file in the small-file lane
+        * large_file_workers: number of large-file upload threads
+        * batch_max_files, batch_max_bytes: limits on the batches of small files
+        """
+        self.upload = upload
+        self.upload_batch = upload_batch
+        self.draft_uuid = draft_uuid
+        self.manifest = manifest
+        self.progress = progress
+        self.budget = ByteBudget(max_inflight_bytes) if max_inflight_bytes else None
+        self.large_file_bytes = large_file_bytes
+        self.batch_max_files = batch_max_files if upload_batch else 1
+        self.batch_max_bytes = batch_max_bytes
+        self._errors = []
+        self.lock = threading.Lock()  # Protects self.progress, self._errors and self._files_left
+        self._files_left = {}  # Number of files not uploaded yet, for each block being uploaded
+        self._batch = []
+        self._batch_bytes = 0
+        self._sequence = itertools.count()  # Tie-breaker for large files of the same size
+        if large_file_bytes is None:
+            large_file_workers = 0
+        # Without a budget, the queue lengths are what keep the serializer from running too far ahead:
+        self._queue = queue.Queue(maxsize=0 if self.budget else 2 * workers)
+        self._large_queue = queue.PriorityQueue(maxsize=0 if self.budget else 2 * max(large_file_workers, 1))
+        self._threads = []
+        for i in range(workers):
+            self._start_thread(self._work, 'blockstore-upload-{}'.format(i))
+        self._large_threads = []
+        for i in range(large_file_workers):
+            self._large_threads.append(self._start_thread(self._work_large, 'blockstore-upload-large-{}'.format(i)))
+
+    def _start_thread(self, target, name):
+        """
+        Start a daemon thread.
+        """
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    def add_block(self, data):
+        """
+        Queue the OLX and static files of the given serialized block for upload,
+        waiting first if the memory budget is full.
+        """
+        folder_path = '{}/'.format(data.def_id)
+        files = [(folder_path + 'definition.xml', data.olx_str)]
+        files.extend((folder_path + 'static/' + asset_file.name, asset_file.data) for asset_file in data.static_files)
+        costs = [inflight_cost(len(file_data)) for _path, file_data in files]
+        if self._errors:
+            raise TransferAborted()
+        if self.budget:
+            if self.budget.would_block(sum(costs)):
+                # The budget may be held by the batch being filled: send it off rather than wait for it forever
+                self._flush_batch()
+            self.budget.acquire(sum(costs))
+        self.manifest['components'].append(files[0][0])
+        self.manifest['assets'].extend(path for path, _file_data in files[1:])
+        self.manifest['assets'].extend(
+            folder_path + 'static/' + reused_asset.name for reused_asset in getattr(data, 'reused_assets', ())
+        )
+        log.info('Uploading {} to {}'.format(data.orig_block_key, files[0][0]))
+        block_id = data.orig_block_key
+        with self.lock:
+            self._files_left[block_id] = self._files_left.get(block_id, 0) + len(files)
+        for (path, file_data), cost in zip(files, costs):
+            job = (path, file_data, cost, block_id)
+            if self._large_threads and len(file_data) >= self.large_file_bytes:
+                # Largest first; close() queues None jobs, which sort after any file:
+                self._large_queue.put((-len(file_data), next(self._sequence), job))
+            else:
+                self._add_to_batch(job)
+
+    def _add_to_batch(self, job):
+        """
+        Add a small file to the current batch, and queue the batch once it is full.
+        """
+        self._batch.append(job)
+        self._batch_bytes += len(job[1])
+        if len(self._batch) >= self.batch_max_files or self._batch_bytes >= self.batch_max_bytes:
+            self._flush_batch()
+
+    def _flush_batch(self):
+        """
+        Queue the current batch of small files for upload.
+        """
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+            self._batch_bytes = 0
+
+    def _upload_jobs(self, jobs):
+        """
+        Upload the given files, in one request if there are several, and
+        record the progress.
+        """
+        try:
+            if not self._errors:
+                if len(jobs) == 1:
+                    path, file_data, _cost, _block_id = jobs[0]
+                    self.upload(self.draft_uuid, path, file_data)
+                else:
+                    self.upload_batch(self.draft_uuid, [(path, file_data) for path, file_data, _c, _b in jobs])
+                with self.lock:
+                    for _path, file_data, _cost, block_id in jobs:
+                        if self.progress:
+                            self.progress.file_uploaded(len(file_data))
+                        self._files_left[block_id] -= 1
+                        if not self._files_left[block_id]:
+                            del self._files_left[block_id]
+                            if self.progress:
+                                self.progress.block_uploaded()
+        except Exception as exc:  # pylint: disable=broad-except
+            log.exception('Upload failed')
+            with self.lock:
+                self._errors.append(exc)
+            if self.budget:
+                self.budget.abort()
+        finally:
+            if self.budget:
+                self.budget.release(sum(cost for _path, _file_data, cost, _block_id in jobs))
+
+    def _work(self):
+        """
+        Upload batches of small files from the queue until told to stop.
+        """
+        while True:
+            jobs = self._queue.get()
+            if jobs is None:
+                return
+            self._upload_jobs(jobs)
+
+    def _work_large(self):
+        """
+        Upload large files from the priority queue until told to stop.
+        """
+        while True:
+            _priority, _sequence, job = self._large_queue.get()
+            if job is None:
+                return
+            self._upload_jobs([job])
+
+    def close(self):
+        """
+        Wait for all queued uploads to finish, and re-raise the first upload
+        error, if any.
+        """
+        self._flush_batch()
+        for thread in self._threads:
+            if thread in self._large_threads:
+                self._large_queue.put((float('inf'), next(self._sequence), None))
+            else:
+                self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
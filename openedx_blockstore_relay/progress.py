@@ -0,0 +1,169 @@
+"""
+Progress reporting for transfers to Blockstore.
+
+A transfer first walks the XBlock tree (serializing each block), and only then
+knows how many blocks, files and bytes it has to upload. From that point on,
+TransferProgress keeps count of what has been uploaded and periodically emits a
+structured progress event: a dict that is logged as JSON and also passed to an
+optional callback, so that the same information can drive a console, a Studio
+UI or a Celery task state.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import logging
+import time
+
+import six
+
+from . import limits
+
+log = logging.getLogger(__name__)
+
+# By default, emit at most one 'uploading' event every this many seconds:
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+STAGE_SERIALIZED = 'serialized'
+STAGE_UPLOADING = 'uploading'
+STAGE_COMMITTED = 'committed'
+
+
+class TransferProgress(object):
+    """
+    Tracks how far along a transfer is, and emits progress events.
+
+    Each event is a JSON-serializable dict like:
+        {
+            "root": "block-v1:A+B+C+type@course+block@course",
+            "stage": "uploading",
+            "blocks_total": 120, "blocks_done": 40,
+            "files_total": 300, "files_done": 97,
+            "bytes_total": 1048576, "bytes_done": 262144,
+            "elapsed": 12.5,
+            "files_per_sec": 7.76, "bytes_per_sec": 20971.5,
+            "eta": 37.5,
+            "throttle_wait": 1.25,
+        }
+    "eta" (in seconds) is None until there is enough data to estimate it.
+    "throttle_wait" is the number of seconds that calls to Blockstore in this
+    process have waited for the rate limits since the transfer started (see
+    limits.throttle()).
+    """
+
+    def __init__(self, root_block_key, callback=None, interval=DEFAULT_PROGRESS_INTERVAL, clock=time.time):
+        """
+        Start tracking the transfer of the subtree rooted at root_block_key.
+
+        Args:
+        * root_block_key: usage key of the block being transferred
+        * callback: optional callable which will be passed each event dict
+        * interval: minimum number of seconds between two 'uploading' events
+        * clock: function returning the current time in seconds
+        """
+        self.root = six.text_type(root_block_key)
+        self.callback = callback
+        self.interval = interval
+        self.clock = clock
+        self.blocks_total = self.files_total = self.bytes_total = 0
+        self.blocks_done = self.files_done = self.bytes_done = 0
+        self.started_at = clock()
+        self.throttle_wait_at_start = limits.get_throttle_stats()['wait_seconds']
+        self.upload_started_at = None
+        self.last_emitted_at = None
+
+    def set_totals(self, blocks, files, num_bytes):
+        """
+        Record the amount of work to do, once the XBlock tree has been walked.
+        """
+        self.blocks_total = blocks
+        self.files_total = files
+        self.bytes_total = num_bytes
+        self.upload_started_at = self.clock()
+        self.emit(STAGE_SERIALIZED)
+
+    def add_totals(self, blocks=0, files=0, num_bytes=0):
+        """
+        Add to the amount of work to do, for transfers which start uploading
+        before the whole XBlock tree has been walked. Call emit(STAGE_SERIALIZED)
+        once the walk is over and the totals are final.
+        """
+        self.blocks_total += blocks
+        self.files_total += files
+        self.bytes_total += num_bytes
+        if self.upload_started_at is None:
+            self.upload_started_at = self.clock()
+
+    def block_uploaded(self):
+        """
+        Record that all files belonging to one block have been uploaded.
+        """
+        self.blocks_done += 1
+
+    def file_uploaded(self, num_bytes):
+        """
+        Record that one file of num_bytes bytes has been uploaded, and emit an
+        'uploading' event if the last one was long enough ago.
+        """
+        self.files_done += 1
+        self.bytes_done += num_bytes
+        now = self.clock()
+        if self.last_emitted_at is None or now - self.last_emitted_at >= self.interval:
+            self.emit(STAGE_UPLOADING, now=now)
+
+    def committed(self):
+        """
+        Record that the transfer is complete, and emit a final event.
+        """
+        self.emit(STAGE_COMMITTED)
+
+    def event(self, stage, now=None):
+        """
+        Build the progress event dict describing the current state.
+        """
+        if now is None:
+            now = self.clock()
+        files_per_sec = bytes_per_sec = eta = None
+        if self.upload_started_at is not None:
+            upload_elapsed = now - self.upload_started_at
+            if upload_elapsed > 0:
+                files_per_sec = self.files_done / upload_elapsed
+                bytes_per_sec = self.bytes_done / upload_elapsed
+            # Most of the upload time is spent moving bytes, so estimate from
+            # the byte rate; fall back to the file rate for tiny transfers.
+            if bytes_per_sec:
+                eta = max(self.bytes_total - self.bytes_done, 0) / bytes_per_sec
+            elif files_per_sec:
+                eta = max(self.files_total - self.files_done, 0) / files_per_sec
+        return {
+            'root': self.root,
+            'stage': stage,
+            'blocks_total': self.blocks_total,
+            'blocks_done': self.blocks_done,
+            'files_total': self.files_total,
+            'files_done': self.files_done,
+            'bytes_total': self.bytes_total,
+            'bytes_done': self.bytes_done,
+            'elapsed': round(now - self.started_at, 3),
+            'files_per_sec': _rounded(files_per_sec),
+            'bytes_per_sec': _rounded(bytes_per_sec),
+            'eta': _rounded(eta),
+            'throttle_wait': round(limits.get_throttle_stats()['wait_seconds'] - self.throttle_wait_at_start, 3),
+        }
+
+    def emit(self, stage, now=None):
+        """
+        Log the current progress as JSON and pass it to the callback, if any.
+        """
+        event = self.event(stage, now=now)
+        self.last_emitted_at = self.clock() if now is None else now
+        log.info(json.dumps(event, sort_keys=True))
+        if self.callback is not None:
+            self.callback(event)
+        return event
+
+
+def _rounded(value):
+    """
+    Round a float for display, leaving None alone.
+    """
+    return None if value is None else round(value, 3)
@@ -0,0 +1,270 @@
+"""
+A scheduler for migrating many blocks (usually whole courses) to Blockstore.
+
+Transferring a batch of courses in the order they were given lets a few huge
+courses hold up hundreds of small ones. MigrationScheduler instead:
+
+* takes a census of each root when it is submitted: the number of blocks in
+  its subtree (read from the course's structure alone; see
+  compat.get_block_versions()) and the size of its assets, from which it
+  estimates how long the transfer will take (its cost);
+* runs the cheapest jobs first (shortest job first), with aging: each job's
+  cost is discounted by `aging` seconds for every second it has been waiting,
+  so that jobs submitted long ago (e.g. before a restart) aren't postponed
+  forever by cheaper ones submitted since;
+* runs `workers` jobs at a time, optionally limiting how many threads may be
+  reading from the modulestore, reading from the contentstore or uploading to
+  Blockstore at once, across all jobs (see limits.py);
+* keeps the queue in the database (as MigrationJob rows), so that running the
+  same batch again picks up where it stopped: jobs which are done are
+  skipped, and jobs which were running when the process stopped are run
+  again, into their bundle. Each job creates its bundle (and records it)
+  before transferring anything, so only transfers into that bundle count as
+  the job's.
+
+Only one process should run a given batch at a time.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import heapq
+import logging
+import threading
+
+import six
+from django.db import connection
+from django.utils import timezone
+
+from . import compat, ledger, limits
+from .models import MigrationJob
+from .transfer_data import create_destination_bundle, transfer_to_blockstore
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_AGING = 1.0
+# Rough throughput of a transfer, used to estimate each job's cost in seconds:
+SECONDS_PER_BLOCK = 0.02
+ASSET_BYTES_PER_SECOND = 10 * 1024 * 1024
+
+
+def _count_subtree(root_block_key, get_children):
+    """
+    Return the number of blocks in the subtree of the given block, given a
+    function returning the usage keys of a block's children.
+    """
+    count = 0
+    seen = set()
+    to_visit = [root_block_key]
+    while to_visit:
+        block_key = to_visit.pop()
+        if block_key in seen:
+            continue
+        seen.add(block_key)
+        count += 1
+        to_visit.extend(get_children(block_key))
+    return count
+
+
+def take_census(root_block_key):
+    """
+    Return (number of blocks, asset bytes) for the subtree of the given block.
+
+    Blocks are counted from the course's split modulestore structure if
+    possible, and otherwise by loading each block. Assets belong to the
+    course rather than to any block, so the asset bytes of a block which isn't
+    the course's root are the course's share for that many blocks (or all of
+    the course's, if the course isn't in split modulestore).
+    """
+    course_key = root_block_key.course_key
+    block_versions = compat.get_block_versions(course_key)
+    if block_versions is not None:
+        blocks = _count_subtree(root_block_key, lambda key: block_versions[key][1] if key in block_versions else [])
+    else:
+        def get_children(block_key):
+            """ Load the block to find its children """
+            block = compat.get_block(block_key)
+            return block.children if block.has_children else []
+        blocks = _count_subtree(root_block_key, get_children)
+    asset_bytes = compat.get_course_asset_bytes(course_key)
+    if root_block_key.block_type != 'course' and block_versions:
+        asset_bytes = asset_bytes * blocks // len(block_versions)
+    return blocks, asset_bytes
+
+
+def estimate_cost(blocks, asset_bytes):
+    """
+    Return the estimated number of seconds that transferring the given number
+    of blocks and bytes of assets will take.
+    """
+    return blocks * SECONDS_PER_BLOCK + asset_bytes / ASSET_BYTES_PER_SECOND
+
+
+class MigrationScheduler(object):
+    """
+    Runs the transfers of a named batch of blocks, cheapest first (see above).
+
+    Args:
+    * batch: name of the batch, under which its jobs are kept
+    * workers: number of transfers to run at the same time
+    * phase_limits: optional dict of the maximum number of threads in each
+      phase of the transfers, keyed by phase (see limits.py)
+    * aging: seconds of estimated cost by which a job's priority improves for
+      each second it has been waiting
+    * transfer_options: passed on to each transfer_to_blockstore() call
+    """
+
+    def __init__(self, batch, workers=DEFAULT_WORKERS, phase_limits=None, aging=DEFAULT_AGING, **transfer_options):
+        self.batch = batch
+        self.workers = workers
+        self.phase_limits = phase_limits or {}
+        self.aging = aging
+        self.transfer_options = transfer_options
+        self._lock = threading.Lock()
+        self._queue = []
+
+    def submit(self, root_block_key, collection_uuid=None, bundle_uuid=None):
+        """
+        Add a transfer of the given block into the given existing bundle, or
+        into a new bundle in the given collection, to the batch, and return
+        its MigrationJob. Blocks already in the batch are not added again.
+        """
+        job = MigrationJob.objects.filter(batch=self.batch, root_key=root_block_key).first()
+        if job is not None:
+            return job
+        blocks, asset_bytes = take_census(root_block_key)
+        job = MigrationJob.objects.create(
+            batch=self.batch,
+            root_key=root_block_key,
+            collection_uuid=collection_uuid,
+            bundle_uuid=bundle_uuid,
+            blocks=blocks,
+            asset_bytes=asset_bytes,
+            cost=estimate_cost(blocks, asset_bytes),
+        )
+        log.info(
+            'Submitted %s: %d block(s), %d byte(s) of assets, cost %.1f', root_block_key, blocks, asset_bytes, job.cost,
+        )
+        return job
+
+    def priority(self, job):
+        """
+        Return the sort key of the given job: lowest first.
+
+        Every waiting job ages at the same rate, so comparing costs minus the
+        time waited so far orders jobs the same way as comparing costs plus
+        submission times, which doesn't change as they wait.
+        """
+        submitted = (job.submitted - timezone.now()).total_seconds()
+        return (job.cost + self.aging * submitted, job.id)
+
+    def jobs(self):
+        """
+        Return the MigrationJobs of the batch.
+        """
+        return MigrationJob.objects.filter(batch=self.batch).order_by('id')
+
+    def run(self, retry_failed=False, progress_callback=None):
+        """
+        Run the batch's pending jobs (and those which were running when a
+        previous run stopped, and if retry_failed, those which failed) until
+        none are left, and return the number of jobs in each state.
+        """
+        states_to_run = [MigrationJob.RUNNING] + ([MigrationJob.FAILED] if retry_failed else [])
+        self.jobs().filter(state__in=states_to_run).update(state=MigrationJob.PENDING)
+        with self._lock:
+            self._queue = [
+                (self.priority(job), job) for job in self.jobs().filter(state=MigrationJob.PENDING)
+            ]
+            heapq.heapify(self._queue)
+        log.info('Running %d job(s) of batch %s', len(self._queue), self.batch)
+
+        report_lock = threading.Lock()
+
+        def report(event):
+            """ Pass on a job's progress event """
+            with report_lock:
+                progress_callback(event)
+
+        def work():
+            """ Run jobs from the queue until it is empty """
+            while True:
+                job = self._next_job()
+                if job is None:
+                    return
+                self._run_job(job, report if progress_callback else None)
+
+        def work_in_thread():
+            """ Run work(), then close this thread's database connection """
+            try:
+                work()
+            finally:
+                connection.close()
+
+        limits.set_phase_limits(self.phase_limits)
+        try:
+            if self.workers <= 1:
+                work()
+            else:
+                threads = []
+                for i in range(self.workers):
+                    thread = threading.Thread(target=work_in_thread, name='blockstore-migration-{}'.format(i))
+                    thread.start()
+                    threads.append(thread)
+                for thread in threads:
+                    thread.join()
+        finally:
+            limits.set_phase_limits({})
+        counts = {state: 0 for state, _name in MigrationJob.STATES}
+        for state in self.jobs().values_list('state', flat=True):
+            counts[state] += 1
+        return counts
+
+    def _next_job(self):
+        """
+        Take the job with the highest priority off the queue, mark it as
+        running and return it, or return None if the queue is empty.
+        """
+        with self._lock:
+            if not self._queue:
+                return None
+            _priority, job = heapq.heappop(self._queue)
+        job.state = MigrationJob.RUNNING
+        job.started = timezone.now()
+        job.save(update_fields=['state', 'started'])
+        return job
+
+    def _run_job(self, job, progress_callback=None):
+        """
+        Run the given job's transfer, and record how it went.
+        """
+        try:
+            if job.bundle_uuid is None:
+                # Record the job's bundle before transferring anything, so that a later run carries on with it:
+                job.bundle_uuid = create_destination_bundle(
+                    compat.get_block(job.root_key), job.collection_uuid, self.transfer_options.get('sink'),
+                )
+                job.save(update_fields=['bundle_uuid'])
+            # If a previous run of this job committed its bundle before stopping, it is done:
+            previous = ledger.get_transfer_since(job.root_key, job.submitted, bundle_uuid=job.bundle_uuid)
+            if previous is not None and previous.committed_at is not None:
+                log.info('%s was already transferred to bundle %s', job.root_key, job.bundle_uuid)
+            else:
+                log.info('Transferring %s (cost %.1f)', job.root_key, job.cost)
+                transfer_to_blockstore(
+                    job.root_key,
+                    bundle_uuid=job.bundle_uuid,
+                    collection_uuid=job.collection_uuid,
+                    progress_callback=progress_callback,
+                    **self.transfer_options
+                )
+        except Exception as exc:  # pylint: disable=broad-except
+            log.exception('Failed to transfer %s', job.root_key)
+            job.state = MigrationJob.FAILED
+            job.error = six.text_type(exc)
+            job.finished = timezone.now()
+            job.save(update_fields=['state', 'error', 'finished'])
+            return
+        job.state = MigrationJob.DONE
+        job.error = ''
+        job.finished = timezone.now()
+        job.save(update_fields=['state', 'error', 'finished'])
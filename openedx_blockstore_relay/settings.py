@@ -15,6 +15,40 @@ BLOCKSTORE_API_URL = 'http://edx.devstack.blockstore:18250/api/v1/'
 if not BLOCKSTORE_API_URL.endswith(path_separator):
     BLOCKSTORE_API_URL = '{}{}'.format(BLOCKSTORE_API_URL, path_separator)
 
+# Live relay: when enabled, courses are re-transferred into a bundle in the
+# given collection whenever they are published. Changes are batched: the
+# transfer starts once no further change has been made for DEBOUNCE_SECONDS
+# (but no later than MAX_DELAY_SECONDS after the first change in the batch).
+BLOCKSTORE_RELAY_LIVE = False
+BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID = None
+BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS = 30
+BLOCKSTORE_RELAY_LIVE_MAX_DELAY_SECONDS = 300
+
+# Draft uploads whose request body is at least GZIP_MIN_BYTES long are sent
+# with "Content-Encoding: gzip", compressed at GZIP_LEVEL (1-9). None disables
+# compression: Blockstore only accepts compressed bodies behind a server or
+# middleware that decompresses them.
+BLOCKSTORE_RELAY_GZIP_MIN_BYTES = None
+BLOCKSTORE_RELAY_GZIP_LEVEL = 6
+
+# Serialize OLX in canonical form (sorted attributes, indentation normalized),
+# so that the same content always gives the same bytes and digests.
+BLOCKSTORE_RELAY_CANONICAL_OLX = False
+
+# A local directory in which to cache contentstore assets, shared by every
+# process using it (see asset_cache.py), and the maximum total size of the
+# files in it. None disables the cache.
+BLOCKSTORE_RELAY_ASSET_CACHE_DIR = None
+BLOCKSTORE_RELAY_ASSET_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+# Limits on the rate of requests, and of request bytes, sent to each Blockstore
+# instance by all the processes on a host which share the same RATE_LIMIT_FILE
+# (see limits.py; None for a file in a private directory of the user). None
+# disables a limit.
+BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND = None
+BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND = None
+BLOCKSTORE_RELAY_RATE_LIMIT_FILE = None
+
 # Register settings: ###########################################################
 
 
@@ -24,3 +58,15 @@ def plugin_settings(settings):
     may override these values later, e.g. via envs/private.py.
     """
     settings.BLOCKSTORE_API_URL = BLOCKSTORE_API_URL
+    settings.BLOCKSTORE_RELAY_LIVE = BLOCKSTORE_RELAY_LIVE
+    settings.BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID = BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID
+    settings.BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS = BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS
+    settings.BLOCKSTORE_RELAY_LIVE_MAX_DELAY_SECONDS = BLOCKSTORE_RELAY_LIVE_MAX_DELAY_SECONDS
+    settings.BLOCKSTORE_RELAY_GZIP_MIN_BYTES = BLOCKSTORE_RELAY_GZIP_MIN_BYTES
+    settings.BLOCKSTORE_RELAY_GZIP_LEVEL = BLOCKSTORE_RELAY_GZIP_LEVEL
+    settings.BLOCKSTORE_RELAY_CANONICAL_OLX = BLOCKSTORE_RELAY_CANONICAL_OLX
+    settings.BLOCKSTORE_RELAY_ASSET_CACHE_DIR = BLOCKSTORE_RELAY_ASSET_CACHE_DIR
+    settings.BLOCKSTORE_RELAY_ASSET_CACHE_MAX_BYTES = BLOCKSTORE_RELAY_ASSET_CACHE_MAX_BYTES
+    settings.BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND = BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND
+    settings.BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND = BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND
+    settings.BLOCKSTORE_RELAY_RATE_LIMIT_FILE = BLOCKSTORE_RELAY_RATE_LIMIT_FILE
@@ -0,0 +1,273 @@
+"""
+Transfers of large courses split into several bundles ("shards").
+
+transfer_to_blockstore() puts a whole course into one draft, committed at
+once. transfer_sharded_to_blockstore() instead transfers each block of a given
+type (e.g. each chapter) with its descendants into its own bundle, several at a
+time, and then puts the blocks above them (e.g. the course block) into a parent
+bundle whose bundle.json lists the shard bundles as its 'dependencies'.
+
+The OLX of the parent bundle's blocks includes each shard from its own bundle,
+as <xblock-include source="<link name>" definition="..."/>: each dependency
+names the link (see shard_link_name()) through which the Blockstore runtime
+resolves those includes, so the parent draft is given links of those names to
+the latest committed version of each shard bundle (see sinks.py).
+
+Each shard is committed independently, so when some of them fail, the others
+are kept: re-running the transfer with resume=True only transfers the shards
+which haven't been committed since the parent bundle last was.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import threading
+from collections import OrderedDict
+
+import six
+from django.db import connection
+from six.moves import queue
+
+from . import compat, ledger, verification
+from .block_serializer import XBlockSerializer, blockstore_def_key_from_modulestore_usage_key
+from .progress import TransferProgress
+from .sinks import BlockstoreSink
+from .transfer_data import (
+    count_upload_work,
+    finish_import,
+    manifest_json,
+    new_manifest,
+    start_import,
+    transfer_to_blockstore,
+    upload_serialized_blocks
+)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SHARD_BLOCK_TYPE = 'chapter'
+DEFAULT_SHARD_WORKERS = 4
+
+
+class ShardTransferError(Exception):
+    """
+    Raised when some shards of a sharded transfer have failed (once all of
+    the other shards are done). failures is a dict of the exceptions raised,
+    keyed by the usage key of each failed shard.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(ShardTransferError, self).__init__('Failed to transfer {} shard(s): {}'.format(
+            len(failures), ', '.join(sorted(six.text_type(key) for key in failures)),
+        ))
+
+
+def shard_link_name(shard_key):
+    """
+    Return the name of the parent bundle's link to the bundle of the shard
+    with the given root block, as used by the parent's <xblock-include>s.
+    """
+    return blockstore_def_key_from_modulestore_usage_key(shard_key).replace('/', '-')
+
+
+def find_shards(root_block_key, shard_block_type=DEFAULT_SHARD_BLOCK_TYPE):
+    """
+    Split the subtree of the given block at the blocks of shard_block_type.
+
+    Returns (parent_keys, shard_keys): the usage keys of the blocks above the
+    shards (starting with the root) and of the shards' root blocks, both in
+    course order.
+    """
+    parent_keys = []
+    shard_keys = []
+    to_visit = [root_block_key]
+    while to_visit:
+        block_key = to_visit.pop()
+        if block_key.block_type == shard_block_type and block_key != root_block_key:
+            shard_keys.append(block_key)
+            continue
+        parent_keys.append(block_key)
+        block = compat.get_block(block_key)
+        if block.has_children:
+            # Reversed, so that children get popped off the stack in order:
+            to_visit.extend(reversed(block.children))
+    return parent_keys, shard_keys
+
+
+def transfer_sharded_to_blockstore(
+    root_block_key, collection_uuid, shard_block_type=DEFAULT_SHARD_BLOCK_TYPE,
+    workers=DEFAULT_SHARD_WORKERS, resume=False, progress_callback=None, sink=None, verify=False,
+):
+    """
+    Transfer the given block (and its children) to Blockstore, with each
+    descendant of shard_block_type in its own bundle.
+
+    Args:
+    * root_block_key: usage key of the Open edX block to transfer
+    * collection_uuid: UUID of the collection to create the bundles in
+    * shard_block_type: type of the blocks to put into bundles of their own
+    * workers: number of shards to transfer at the same time
+    * resume: don't transfer again the shards that were committed since the
+      last time the parent bundle was, and reuse the bundles of the others
+    * progress_callback: optional callable which is passed the progress
+      events (see progress.TransferProgress) of each shard, and of the parent
+    * sink: where to write the bundles (see sinks.py); Blockstore by default
+    * verify: verify each bundle once committed, re-uploading any missing or
+      mismatched files (see verification.verify_and_repair()); a shard which
+      still fails verification counts as failed
+
+    Returns the UUID of the parent bundle. Raises ShardTransferError if any
+    shard failed, in which case the parent bundle is not committed.
+    """
+    sink = sink or BlockstoreSink()
+    if verify and not verification.can_verify(sink):
+        raise ValueError('Transfers written to {} cannot be verified'.format(type(sink).__name__))
+    parent_keys, shard_keys = find_shards(root_block_key, shard_block_type)
+    since = None
+    if resume:
+        # Only the bundles of earlier runs into the same collection (and destination) are resumed:
+        latest_parent_transfer = ledger.get_latest_transfer(
+            root_block_key, collection_uuid=collection_uuid, destination=sink.destination,
+        )
+        since = latest_parent_transfer.committed_at if latest_parent_transfer else None
+
+    shard_bundles = {}
+    to_transfer = []
+    for shard_key in shard_keys:
+        previous = ledger.get_transfer_since(
+            shard_key, since, collection_uuid=collection_uuid, destination=sink.destination,
+        ) if resume else None
+        if previous is not None and previous.committed_at is not None:
+            log.info('Shard %s was already transferred to bundle %s', shard_key, previous.bundle_uuid)
+            shard_bundles[shard_key] = previous.bundle_uuid
+        else:
+            to_transfer.append((shard_key, previous.bundle_uuid if previous else None))
+    log.info('Transferring %d of %d shard(s) of %s', len(to_transfer), len(shard_keys), root_block_key)
+
+    failures = _transfer_shards(
+        to_transfer, collection_uuid, workers, progress_callback, shard_bundles, sink, verify,
+    )
+    if failures:
+        raise ShardTransferError(failures)
+
+    previous = ledger.get_transfer_since(
+        root_block_key, since, collection_uuid=collection_uuid, destination=sink.destination,
+    ) if resume else None
+    return _transfer_parent(
+        root_block_key, parent_keys, [(key, shard_bundles[key]) for key in shard_keys],
+        bundle_uuid=previous.bundle_uuid if previous else None,
+        collection_uuid=collection_uuid,
+        progress_callback=progress_callback,
+        sink=sink,
+        verify=verify,
+    )
+
+
+def _transfer_shards(shards, collection_uuid, workers, progress_callback, shard_bundles, sink=None, verify=False):
+    """
+    Transfer each of shards, a list of (shard root key, bundle UUID or None),
+    using up to the given number of threads. Records the bundle of each shard
+    in the shard_bundles dict.
+
+    Returns a dict of the exceptions raised by failed shards, keyed by their
+    root block key.
+    """
+    jobs = queue.Queue()
+    for shard in shards:
+        jobs.put(shard)
+    failures = {}
+    lock = threading.Lock()  # Protects shard_bundles, failures and calls to progress_callback
+
+    def report(event):
+        """ Pass on a shard's progress event """
+        with lock:
+            progress_callback(event)
+
+    def work():
+        """ Transfer shards from the queue until it is empty """
+        while True:
+            try:
+                shard_key, bundle_uuid = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                bundle_uuid = transfer_to_blockstore(
+                    shard_key,
+                    bundle_uuid=bundle_uuid,
+                    collection_uuid=collection_uuid,
+                    progress_callback=report if progress_callback else None,
+                    sink=sink,
+                    verify=verify,
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                log.exception('Failed to transfer shard %s', shard_key)
+                with lock:
+                    failures[shard_key] = exc
+            else:
+                with lock:
+                    shard_bundles[shard_key] = bundle_uuid
+
+    def work_in_thread():
+        """ Run work(), then close this thread's database connection """
+        try:
+            work()
+        finally:
+            connection.close()
+
+    if workers <= 1:
+        work()
+    else:
+        threads = []
+        for i in range(min(workers, len(shards))):
+            thread = threading.Thread(target=work_in_thread, name='blockstore-shard-{}'.format(i))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    return failures
+
+
+def _transfer_parent(
+    root_block_key, parent_keys, shards, bundle_uuid, collection_uuid, progress_callback, sink=None, verify=False,
+):
+    """
+    Transfer the blocks above the shards into the parent bundle, listing the
+    shard bundles in its manifest's dependencies and linking its draft to
+    them, and commit it.
+    """
+    sink = sink or BlockstoreSink()
+    shard_links = {shard_key: shard_link_name(shard_key) for shard_key, _shard_bundle_uuid in shards}
+
+    def serialize(block_key):
+        """ Serialize a block of the parent bundle, including its shard children through their links """
+        return XBlockSerializer(compat.get_block(block_key), child_sources=shard_links)
+
+    serialized_blocks = OrderedDict((block_key, serialize(block_key)) for block_key in parent_keys)
+    progress = TransferProgress(root_block_key, callback=progress_callback)
+    num_files, num_bytes = count_upload_work(serialized_blocks)
+    progress.set_totals(blocks=len(serialized_blocks), files=num_files + 1, num_bytes=num_bytes)
+
+    bundle_uuid, draft_uuid = start_import(
+        compat.get_block(root_block_key), bundle_uuid=bundle_uuid, collection_uuid=collection_uuid, sink=sink,
+    )
+    transfer = ledger.start_transfer(root_block_key, bundle_uuid, draft_uuid, collection_uuid, sink.destination)
+    for shard_key, shard_bundle_uuid in shards:
+        sink.set_draft_link(
+            draft_uuid, shard_links[shard_key], shard_bundle_uuid, sink.get_bundle_version(shard_bundle_uuid),
+        )
+    manifest = new_manifest(root_block_key)
+    manifest['dependencies'] = [
+        {
+            'name': shard_links[shard_key],
+            'bundle_uuid': six.text_type(shard_bundle_uuid),
+            'definition': blockstore_def_key_from_modulestore_usage_key(shard_key),
+        }
+        for shard_key, shard_bundle_uuid in shards
+    ]
+    upload_serialized_blocks(draft_uuid, serialized_blocks, manifest, progress, sink=sink)
+    ledger.record_blocks(transfer, serialized_blocks)
+    finish_import(draft_uuid, manifest, progress, sink)
+    ledger.mark_committed(transfer)
+    log.info('Finished import of %s into bundle %s, with %d shard(s)', root_block_key, bundle_uuid, len(shards))
+    if verify:
+        verification.verify_and_repair(transfer, sink, manifest_json(manifest), serialize)
+    return bundle_uuid
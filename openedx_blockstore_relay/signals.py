@@ -0,0 +1,36 @@
+"""
+Signal receivers for the live relay.
+
+These are connected to the modulestore signals by the plugin framework; see
+the PluginSignals config in apps.py.
+
+The modulestore has no signal for a changed block: only course_published and
+item_deleted are relayed, so changes to a course reach Blockstore when the
+course is next published, and unpublished edits aren't relayed at all.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+from . import compat, live_relay
+
+
+def relay_course_published(sender, course_key, **kwargs):  # pylint: disable=unused-argument
+    """
+    Relay a course to Blockstore after it has been published.
+
+    course_published doesn't say which blocks were published, so the course's
+    root block is marked as changed; the relay then finds which blocks have
+    changed from their hash tree (see tasks._relay_changes()).
+    """
+    if live_relay.is_enabled():
+        live_relay.block_changed(compat.get_course_root_key(course_key))
+
+
+def relay_item_changed(sender, usage_key, **kwargs):  # pylint: disable=unused-argument
+    """
+    Relay a changed block to Blockstore. It is only connected to item_deleted,
+    for lack of a signal for other changes.
+
+    The block is marked as changed, and coalesced with any other changes to
+    its course (see tasks.relay_changes_task() about deleted blocks).
+    """
+    live_relay.block_changed(usage_key)
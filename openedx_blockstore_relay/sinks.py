@@ -0,0 +1,711 @@
+"""
+Destinations that transfers write bundles to.
+
+A sink implements the Blockstore operations that a transfer uses:
+
+    sink.create_bundle(collection_uuid, title, slug, description) -> {'uuid': ...}
+    sink.create_draft(bundle_uuid, name, title) -> {'uuid': ...}
+    sink.add_file_to_draft(draft_uuid, path, data)
+    sink.add_files_to_draft(draft_uuid, [(path, data), ...])
+    sink.set_draft_link(draft_uuid, link_name, bundle_uuid, version)
+    sink.commit_draft(draft_uuid)
+    sink.get_bundle_version(bundle_uuid) -> number of the latest committed version (0 if none)
+    sink.get_bundle_files(bundle_uuid) -> [{'path': ..., 'size': ..., 'hash_digest': ...}, ...]
+
+plus close(), to call once nothing more is going to be written. BlockstoreSink
+talks to the Blockstore REST API, and is what transfers use by default;
+DirectorySink and TarSink write bundles to local files instead, e.g. to seed,
+diff or load-test Blockstore with a large course without any network in the
+loop. FanOutSink writes the same bundles to several sinks (e.g. several
+Blockstore instances) at once, from a single serialization.
+
+Each sink also has a destination attribute, which the ledger records with the
+transfers written to it, so that bundles written to local files are never
+taken for Blockstore bundles: ledger.BLOCKSTORE ('') for the Blockstore of
+settings.BLOCKSTORE_API_URL, and a description of where the bundles go
+otherwise.
+
+get_bundle_files() is only needed to verify transfers (see verification.py),
+and sinks which can't list their bundles don't have it: TarSink, whose archive
+is write-only, so transfers written to it can't be verified.
+
+Links (e.g. from the parent bundle of a sharded transfer to its shards; see
+sharding.py) are kept by the local sinks next to the bundles' files, as
+.bundles/<bundle uuid>.json, along with the number of versions committed.
+
+add_file_to_draft() and add_files_to_draft() may be called from several upload
+threads at once (see pipeline.UploadPipeline), so sinks must allow that.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+import uuid
+from collections import deque
+
+import requests
+import six
+
+from .blockstore_client import (
+    add_file_to_draft,
+    add_files_to_draft,
+    commit_draft,
+    create_bundle,
+    create_draft,
+    get_bundle_files,
+    get_bundle_version,
+    set_draft_link
+)
+
+log = logging.getLogger(__name__)
+
+# How much file data may be queued for each mirror of a FanOutSink before writing to the sink waits for it:
+DEFAULT_MIRROR_BUFFER_BYTES = 64 * 1024 * 1024
+# How many times a FanOutSink retries a failed operation on one of its sinks, and the delay before the first retry
+# (doubled for each further retry):
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+# The sink operations which a FanOutSink retries: those which have the same effect however many times they run. The
+# others (the POSTs creating bundles and drafts, and committing drafts) may have taken effect before failing, so
+# running them again could create duplicates:
+IDEMPOTENT_OPERATIONS = frozenset(['add_files_to_draft', 'set_draft_link', 'get_bundle_version', 'get_bundle_files'])
+# Where the local sinks keep the version and links of each bundle:
+BUNDLE_INFO_DIR = '.bundles'
+
+
+class BlockstoreSink(object):
+    """
+    Writes bundles to Blockstore, through its REST API: the Blockstore
+    instance at the given API URL, or settings.BLOCKSTORE_API_URL by default.
+    """
+
+    def __init__(self, api_url=None):
+        self.api_url = api_url
+        self.destination = api_url or ''
+        self._client_kwargs = {'api_url': api_url} if api_url else {}
+
+    def create_bundle(self, collection_uuid, title, slug, **kwargs):
+        """
+        Create a bundle in the specified collection.
+        """
+        kwargs.update(self._client_kwargs)
+        return create_bundle(collection_uuid=collection_uuid, title=title, slug=slug, **kwargs)
+
+    def create_draft(self, bundle_uuid, name, title):
+        """
+        Create a draft in the specified bundle.
+        """
+        return create_draft(bundle_uuid=bundle_uuid, name=name, title=title, **self._client_kwargs)
+
+    def add_file_to_draft(self, draft_uuid, path, data):
+        """
+        Add the specified file data to the draft.
+        """
+        add_file_to_draft(draft_uuid, path, data, **self._client_kwargs)
+
+    def add_files_to_draft(self, draft_uuid, files):
+        """
+        Add several files to the draft, in a single request.
+        """
+        add_files_to_draft(draft_uuid, files, **self._client_kwargs)
+
+    def set_draft_link(self, draft_uuid, link_name, bundle_uuid, version):
+        """
+        Link the draft to the given version of another bundle.
+        """
+        set_draft_link(draft_uuid, link_name, bundle_uuid, version, **self._client_kwargs)
+
+    def commit_draft(self, draft_uuid):
+        """
+        Commit the draft, saving the files to the Blockstore bundle.
+        """
+        commit_draft(draft_uuid, **self._client_kwargs)
+
+    def get_bundle_version(self, bundle_uuid):
+        """
+        Return the number of the bundle's latest version.
+        """
+        return get_bundle_version(bundle_uuid, **self._client_kwargs)
+
+    def get_bundle_files(self, bundle_uuid):
+        """
+        Return the listing of the bundle's committed files.
+        """
+        return get_bundle_files(bundle_uuid, **self._client_kwargs)
+
+    def close(self):
+        """
+        Nothing to do.
+        """
+
+
+def _as_bytes(data):
+    """
+    Return the given file data as bytes (text is encoded as UTF-8).
+    """
+    if isinstance(data, six.text_type):
+        return data.encode('utf8')
+    return data
+
+
+def _uuid_or_none(value):
+    """
+    Return the given UUID as a string, or None if it is None.
+    """
+    return None if value is None else six.text_type(value)
+
+
+def _link(bundle_uuid, version):
+    """
+    Return the description of a link to the given version of a bundle, as
+    Blockstore has it.
+    """
+    return {'bundle_uuid': six.text_type(bundle_uuid), 'version': version}
+
+
+def _committed_bundle_info(bundle_info, draft_links):
+    """
+    Return the version and links of a bundle (as a dict), given those it had
+    and the links of the draft being committed into it.
+    """
+    links = dict(bundle_info.get('links', {}))
+    links.update(draft_links)
+    return {'version': bundle_info.get('version', 0) + 1, 'links': links}
+
+
+def _check_path(path):
+    """
+    Raise ValueError if the given bundle file path could escape the bundle.
+    """
+    if path.startswith('/') or '..' in path.split('/'):
+        raise ValueError('Invalid bundle file path: {}'.format(path))
+
+
+def _makedirs(path):
+    """
+    Create the given directory and its parents, unless it already exists.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+class DirectorySink(object):
+    """
+    Writes each bundle into a directory of its own, named after its UUID,
+    inside the given root directory:
+
+        <root>/<bundle uuid>/bundle.json
+        <root>/<bundle uuid>/html/intro/definition.xml
+        ...
+
+    Files added to a draft are written into <root>/.drafts/<draft uuid>/ and
+    moved into the bundle's directory when the draft is committed, so a bundle
+    directory only ever has committed files in it. A draft can be used again
+    after it has been committed. Each commit also records the bundle's number
+    of versions and its links in <root>/.bundles/<bundle uuid>.json.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.destination = 'dir:{}'.format(os.path.abspath(root))
+        self._draft_bundles = {}  # draft uuid: bundle uuid
+        self._draft_links = {}  # draft uuid: {link name: link}
+        _makedirs(root)
+
+    def bundle_path(self, bundle_uuid):
+        """
+        Return the directory holding the given bundle's committed files.
+        """
+        return os.path.join(self.root, six.text_type(bundle_uuid))
+
+    def draft_path(self, draft_uuid):
+        """
+        Return the directory holding the given draft's uncommitted files.
+        """
+        return os.path.join(self.root, '.drafts', six.text_type(draft_uuid))
+
+    def get_bundle_info(self, bundle_uuid):
+        """
+        Return the number of versions committed to the given bundle and its
+        links, as {'version': ..., 'links': {link name: {'bundle_uuid': ...,
+        'version': ...}}}.
+        """
+        info_path = os.path.join(self.root, BUNDLE_INFO_DIR, '{}.json'.format(bundle_uuid))
+        if not os.path.exists(info_path):
+            return {'version': 0, 'links': {}}
+        with open(info_path, 'rb') as info_file:
+            return json.loads(info_file.read().decode('utf-8'))
+
+    def create_bundle(self, collection_uuid, title, slug, **kwargs):  # pylint: disable=unused-argument
+        """
+        Create an empty bundle directory.
+        """
+        bundle_uuid = six.text_type(uuid.uuid4())
+        _makedirs(self.bundle_path(bundle_uuid))
+        return {'uuid': bundle_uuid, 'collection_uuid': _uuid_or_none(collection_uuid), 'title': title, 'slug': slug}
+
+    def create_draft(self, bundle_uuid, name, title):
+        """
+        Create an empty draft directory for the given bundle.
+        """
+        draft_uuid = six.text_type(uuid.uuid4())
+        _makedirs(self.draft_path(draft_uuid))
+        self._draft_bundles[draft_uuid] = six.text_type(bundle_uuid)
+        return {'uuid': draft_uuid, 'bundle_uuid': six.text_type(bundle_uuid), 'name': name, 'title': title}
+
+    def add_file_to_draft(self, draft_uuid, path, data):
+        """
+        Write the file into the draft's directory.
+        """
+        _check_path(path)
+        file_path = os.path.join(self.draft_path(draft_uuid), *path.split('/'))
+        _makedirs(os.path.dirname(file_path))
+        with open(file_path, 'wb') as draft_file:
+            draft_file.write(_as_bytes(data))
+
+    def add_files_to_draft(self, draft_uuid, files):
+        """
+        Write several files into the draft's directory.
+        """
+        for path, data in files:
+            self.add_file_to_draft(draft_uuid, path, data)
+
+    def set_draft_link(self, draft_uuid, link_name, bundle_uuid, version):
+        """
+        Record the draft's link to the given version of another bundle, to be
+        committed with the draft.
+        """
+        self._draft_links.setdefault(six.text_type(draft_uuid), {})[link_name] = _link(bundle_uuid, version)
+
+    def commit_draft(self, draft_uuid):
+        """
+        Move the draft's files into its bundle's directory, replacing any
+        files with the same paths, and record the bundle's new version and
+        links.
+        """
+        draft_path = self.draft_path(draft_uuid)
+        bundle_uuid = self._draft_bundles[six.text_type(draft_uuid)]
+        bundle_path = self.bundle_path(bundle_uuid)
+        for dir_path, _dir_names, file_names in os.walk(draft_path):
+            target_dir = os.path.join(bundle_path, os.path.relpath(dir_path, draft_path))
+            _makedirs(target_dir)
+            for file_name in file_names:
+                os.rename(os.path.join(dir_path, file_name), os.path.join(target_dir, file_name))
+        shutil.rmtree(draft_path)
+        _makedirs(draft_path)
+        bundle_info = _committed_bundle_info(
+            self.get_bundle_info(bundle_uuid), self._draft_links.pop(six.text_type(draft_uuid), {}),
+        )
+        _makedirs(os.path.join(self.root, BUNDLE_INFO_DIR))
+        with open(os.path.join(self.root, BUNDLE_INFO_DIR, '{}.json'.format(bundle_uuid)), 'wb') as info_file:
+            info_file.write(json.dumps(bundle_info, sort_keys=True).encode('utf-8'))
+
+    def get_bundle_version(self, bundle_uuid):
+        """
+        Return the number of times the bundle has been committed to.
+        """
+        return self.get_bundle_info(bundle_uuid)['version']
+
+    def get_bundle_files(self, bundle_uuid):
+        """
+        Return the listing of the files in the bundle's directory, like
+        Blockstore's (with the SHA-1 digest of each file).
+        """
+        bundle_path = self.bundle_path(bundle_uuid)
+        files = []
+        for dir_path, _dir_names, file_names in os.walk(bundle_path):
+            for file_name in file_names:
+                with open(os.path.join(dir_path, file_name), 'rb') as bundle_file:
+                    data = bundle_file.read()
+                path = os.path.relpath(os.path.join(dir_path, file_name), bundle_path).replace(os.sep, '/')
+                files.append({'path': path, 'size': len(data), 'hash_digest': hashlib.sha1(data).hexdigest()})
+        return files
+
+    def close(self):
+        """
+        Remove the directories of any drafts that were never committed.
+        """
+        shutil.rmtree(os.path.join(self.root, '.drafts'), ignore_errors=True)
+
+
+class TarSink(object):
+    """
+    Streams bundles into a tar archive, with each file stored as
+    <bundle uuid>/<path>, as it is added to a draft.
+
+    The archive is written sequentially (it can be a pipe), so files can't be
+    taken out of it again: files added to drafts that are never committed end
+    up in it too, and a file added several times (like bundle.json) is stored
+    several times, the last copy being the one that tar extracts. Each commit
+    stores the bundle's number of versions and its links as
+    .bundles/<bundle uuid>.json, like DirectorySink.
+    """
+
+    def __init__(self, target, compression=''):
+        """
+        Args:
+        * target: path of the archive file, or a binary file object to write it to
+        * compression: '', 'gz' or 'bz2'
+        """
+        mode = 'w|{}'.format(compression)
+        if isinstance(target, six.string_types):
+            self._tar = tarfile.open(target, mode)
+            self.destination = 'tar:{}'.format(os.path.abspath(target))
+        else:
+            self._tar = tarfile.open(fileobj=target, mode=mode)
+            self.destination = 'tar:{}'.format(getattr(target, 'name', '<stream>'))
+        self._draft_bundles = {}  # draft uuid: bundle uuid
+        self._draft_links = {}  # draft uuid: {link name: link}
+        self._bundle_info = {}  # bundle uuid: version and links, as stored in the archive
+        self._lock = threading.Lock()  # Upload threads may add files concurrently
+
+    def create_bundle(self, collection_uuid, title, slug, **kwargs):  # pylint: disable=unused-argument
+        """
+        Return a new bundle UUID.
+        """
+        bundle_uuid = six.text_type(uuid.uuid4())
+        return {'uuid': bundle_uuid, 'collection_uuid': _uuid_or_none(collection_uuid), 'title': title, 'slug': slug}
+
+    def create_draft(self, bundle_uuid, name, title):
+        """
+        Return a new draft UUID, for files to go into the given bundle's directory.
+        """
+        draft_uuid = six.text_type(uuid.uuid4())
+        self._draft_bundles[draft_uuid] = six.text_type(bundle_uuid)
+        return {'uuid': draft_uuid, 'bundle_uuid': six.text_type(bundle_uuid), 'name': name, 'title': title}
+
+    def add_file_to_draft(self, draft_uuid, path, data):
+        """
+        Write the file into the archive.
+        """
+        _check_path(path)
+        self._add_member('{}/{}'.format(self._draft_bundles[six.text_type(draft_uuid)], path), data)
+
+    def _add_member(self, name, data):
+        """
+        Write the given data into the archive, under the given name.
+        """
+        data = _as_bytes(data)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        with self._lock:
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def add_files_to_draft(self, draft_uuid, files):
+        """
+        Write several files into the archive.
+        """
+        for path, data in files:
+            self.add_file_to_draft(draft_uuid, path, data)
+
+    def set_draft_link(self, draft_uuid, link_name, bundle_uuid, version):
+        """
+        Record the draft's link to the given version of another bundle, to be
+        stored when the draft is committed.
+        """
+        self._draft_links.setdefault(six.text_type(draft_uuid), {})[link_name] = _link(bundle_uuid, version)
+
+    def commit_draft(self, draft_uuid):
+        """
+        Store the bundle's new version and links: the files are already in the
+        archive.
+        """
+        bundle_uuid = self._draft_bundles[six.text_type(draft_uuid)]
+        bundle_info = self._bundle_info[bundle_uuid] = _committed_bundle_info(
+            self._bundle_info.get(bundle_uuid, {}), self._draft_links.pop(six.text_type(draft_uuid), {}),
+        )
+        self._add_member(
+            '{}/{}.json'.format(BUNDLE_INFO_DIR, bundle_uuid), json.dumps(bundle_info, sort_keys=True),
+        )
+        log.debug('Draft %s committed to the archive', draft_uuid)
+
+    def get_bundle_version(self, bundle_uuid):
+        """
+        Return the number of times the bundle has been committed to in the
+        archive.
+        """
+        return self._bundle_info.get(six.text_type(bundle_uuid), {}).get('version', 0)
+
+    def close(self):
+        """
+        Finish writing the archive.
+        """
+        with self._lock:
+            self._tar.close()
+
+
+def _is_transient(exc):
+    """
+    Return whether the given error may go away when the request is retried:
+    connection errors, timeouts and server (5xx) errors, but not client (4xx)
+    errors, which would fail again.
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code >= 500
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+class FanOutError(IOError):
+    """
+    Raised when writing to some of a FanOutSink's mirrors failed.
+    """
+
+
+class Mirror(object):
+    """
+    One of the extra destinations of a FanOutSink: a sink, and the existing
+    bundle (or the collection to create new bundles in) to write to there in
+    place of the primary sink's.
+
+    Its operations are queued and run in order on a thread of its own, with
+    retries, and it keeps its own state: the number of drafts it has committed,
+    and the error which made it give up, if any.
+    """
+
+    def __init__(self, sink, bundle_uuid=None, collection_uuid=None, name=None):
+        self.sink = sink
+        self.bundle_uuid = bundle_uuid
+        self.collection_uuid = collection_uuid
+        self.name = name or getattr(sink, 'api_url', None) or repr(sink)
+        self.commits = 0
+        self.error = None
+        self.queued_bytes = 0
+        self.queue = deque()
+        self.thread = None
+        # The mirror's bundle and draft UUIDs, keyed by the primary sink's:
+        self.bundles = {}
+        self.drafts = {}
+
+
+class FanOutSink(object):
+    """
+    Writes bundles to a primary sink and to any number of mirrors (see
+    Mirror), so that a transfer serializes and reads assets once, whatever the
+    number of destinations.
+
+    The primary sink is written to directly, and the UUIDs it returns are the
+    ones the transfer sees (and records in the ledger). Each mirror replays the
+    same operations, with the same file data, on its own thread, mapping the
+    primary's bundle and draft UUIDs to its own. A slow mirror lags behind by
+    at most max_buffered_bytes of queued file data: past that, adding files
+    waits for it to catch up, so the data held for the mirrors stays bounded.
+    Only the primary's commits are waited for; close() waits for the mirrors
+    to finish, and raises FanOutError if any of them failed.
+
+    Operations which fail with a connection or server error are retried (on
+    the primary sink and on each mirror independently) `retries` times, with
+    an exponential backoff, if they are idempotent (see
+    IDEMPOTENT_OPERATIONS); other failures are not retried. A mirror which
+    still fails gives up, and the others carry on.
+    """
+
+    def __init__(self, primary, mirrors, max_buffered_bytes=DEFAULT_MIRROR_BUFFER_BYTES, retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY, sleep=time.sleep):
+        self.primary = primary
+        self.destination = primary.destination
+        self.mirrors = list(mirrors)
+        self.max_buffered_bytes = max_buffered_bytes
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._sleep = sleep
+        self._condition = threading.Condition()
+        self._closing = False
+
+    def _call(self, sink, name, method, *args, **kwargs):
+        """
+        Call the given method of the given sink, retrying it on transient
+        errors if it is idempotent.
+        """
+        attempt = 0
+        while True:
+            try:
+                return getattr(sink, method)(*args, **kwargs)
+            except IOError as exc:
+                if attempt >= self.retries or method not in IDEMPOTENT_OPERATIONS or not _is_transient(exc):
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                attempt += 1
+                log.warning('%s on %s failed (%s); retrying in %.1f seconds', method, name, exc, delay)
+                self._sleep(delay)
+
+    def _enqueue(self, operation, num_bytes=0):
+        """
+        Queue the given operation for every mirror which hasn't failed, waiting
+        for room in the mirrors' buffers if it carries num_bytes of file data.
+        """
+        with self._condition:
+            for mirror in self.mirrors:
+                if mirror.thread is None:
+                    mirror.thread = threading.Thread(
+                        target=self._run_mirror, args=(mirror,), name='blockstore-mirror-{}'.format(mirror.name),
+                    )
+                    mirror.thread.daemon = True
+                    mirror.thread.start()
+                while (
+                    mirror.error is None and mirror.queued_bytes and
+                    mirror.queued_bytes + num_bytes > self.max_buffered_bytes
+                ):
+                    self._condition.wait()
+                if mirror.error is None:
+                    mirror.queue.append((operation, num_bytes))
+                    mirror.queued_bytes += num_bytes
+            self._condition.notify_all()
+
+    def _run_mirror(self, mirror):
+        """
+        Run the given mirror's queued operations, in order, until the sink is
+        closed.
+        """
+        while True:
+            with self._condition:
+                while not mirror.queue and not self._closing:
+                    self._condition.wait()
+                if not mirror.queue:
+                    return
+                operation, num_bytes = mirror.queue.popleft()
+            try:
+                self._mirror_operation(mirror, *operation)
+            except Exception as exc:  # pylint: disable=broad-except
+                log.exception('Giving up on mirror %s', mirror.name)
+                mirror.error = exc
+            finally:
+                with self._condition:
+                    mirror.queued_bytes -= num_bytes
+                    if mirror.error is not None:
+                        mirror.queued_bytes -= sum(queued_bytes for _operation, queued_bytes in mirror.queue)
+                        mirror.queue.clear()
+                    self._condition.notify_all()
+
+    def _mirror_operation(self, mirror, method, *args):
+        """
+        Run an operation of the primary sink on the given mirror, in terms of
+        the mirror's own bundles and drafts.
+        """
+        if method == 'create_bundle':
+            bundle_uuid, collection_uuid, title, slug, kwargs = args
+            mirror_bundle = self._call(
+                mirror.sink, mirror.name, 'create_bundle', mirror.collection_uuid or collection_uuid, title, slug,
+                **kwargs
+            )
+            mirror.bundles[bundle_uuid] = mirror_bundle['uuid']
+        elif method == 'create_draft':
+            bundle_uuid, draft_uuid, name, title = args
+            mirror_draft = self._call(
+                mirror.sink, mirror.name, 'create_draft', mirror.bundles.get(bundle_uuid, mirror.bundle_uuid), name,
+                title,
+            )
+            mirror.drafts[draft_uuid] = mirror_draft['uuid']
+        elif method == 'add_files_to_draft':
+            draft_uuid, files = args
+            self._call(mirror.sink, mirror.name, 'add_files_to_draft', mirror.drafts[draft_uuid], files)
+        elif method == 'set_draft_link':
+            draft_uuid, link_name, bundle_uuid = args
+            if bundle_uuid not in mirror.bundles:
+                raise ValueError('Bundle {} was not created on this mirror, so it cannot be linked to'.format(
+                    bundle_uuid,
+                ))
+            linked_bundle_uuid = mirror.bundles[bundle_uuid]
+            version = self._call(mirror.sink, mirror.name, 'get_bundle_version', linked_bundle_uuid)
+            self._call(
+                mirror.sink, mirror.name, 'set_draft_link', mirror.drafts[draft_uuid], link_name, linked_bundle_uuid,
+                version,
+            )
+        elif method == 'commit_draft':
+            draft_uuid, = args
+            self._call(mirror.sink, mirror.name, 'commit_draft', mirror.drafts[draft_uuid])
+            mirror.commits += 1
+
+    def create_bundle(self, collection_uuid, title, slug, **kwargs):
+        """
+        Create a bundle in the primary sink's collection, and one in each
+        mirror's.
+        """
+        bundle_data = self._call(self.primary, 'primary', 'create_bundle', collection_uuid, title, slug, **kwargs)
+        self._enqueue(('create_bundle', six.text_type(bundle_data['uuid']), collection_uuid, title, slug, kwargs))
+        return bundle_data
+
+    def create_draft(self, bundle_uuid, name, title):
+        """
+        Create a draft in the given bundle of the primary sink, and in the
+        corresponding bundle of each mirror.
+        """
+        draft_data = self._call(self.primary, 'primary', 'create_draft', bundle_uuid, name, title)
+        self._enqueue(('create_draft', six.text_type(bundle_uuid), six.text_type(draft_data['uuid']), name, title))
+        return draft_data
+
+    def add_file_to_draft(self, draft_uuid, path, data):
+        """
+        Add the specified file data to the draft, in every sink.
+        """
+        self.add_files_to_draft(draft_uuid, [(path, data)])
+
+    def add_files_to_draft(self, draft_uuid, files):
+        """
+        Add several files to the draft, in every sink.
+        """
+        files = list(files.items() if isinstance(files, dict) else files)
+        self._call(self.primary, 'primary', 'add_files_to_draft', draft_uuid, files)
+        num_bytes = sum(len(data) for _path, data in files)
+        self._enqueue(('add_files_to_draft', six.text_type(draft_uuid), files), num_bytes)
+
+    def set_draft_link(self, draft_uuid, link_name, bundle_uuid, version):
+        """
+        Link the draft to the given version of another bundle in the primary
+        sink, and to the latest version of the corresponding bundle in every
+        mirror.
+        """
+        self._call(self.primary, 'primary', 'set_draft_link', draft_uuid, link_name, bundle_uuid, version)
+        self._enqueue(('set_draft_link', six.text_type(draft_uuid), link_name, six.text_type(bundle_uuid)))
+
+    def commit_draft(self, draft_uuid):
+        """
+        Commit the draft in the primary sink, and queue its commit in every
+        mirror.
+        """
+        self._call(self.primary, 'primary', 'commit_draft', draft_uuid)
+        self._enqueue(('commit_draft', six.text_type(draft_uuid)))
+
+    def get_bundle_version(self, bundle_uuid):
+        """
+        Return the number of the primary sink's bundle's latest version.
+        """
+        return self.primary.get_bundle_version(bundle_uuid)
+
+    def get_bundle_files(self, bundle_uuid):
+        """
+        Return the listing of the primary sink's bundle.
+        """
+        return self.primary.get_bundle_files(bundle_uuid)
+
+    def close(self):
+        """
+        Wait for every mirror to run its queued operations, close all the
+        sinks, and raise FanOutError if any mirror failed.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        for mirror in self.mirrors:
+            if mirror.thread is not None:
+                mirror.thread.join()
+        self.primary.close()
+        for mirror in self.mirrors:
+            mirror.sink.close()
+        failed = [mirror for mirror in self.mirrors if mirror.error is not None]
+        if failed:
+            raise FanOutError('Writing to {} failed: {}'.format(
+                ', '.join(mirror.name for mirror in failed),
+                '; '.join(six.text_type(mirror.error) for mirror in failed),
+            ))
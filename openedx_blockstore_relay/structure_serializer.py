@@ -0,0 +1,70 @@
+"""
+Code for serializing blocks to OLX straight from split modulestore's documents.
+
+Loading each block with compat.get_block() sets up a full XBlock runtime for
+it, which is the dominant cost of transferring a whole course. But the OLX of
+the most common block types only depends on their stored fields: the course's
+structure document holds every block's settings and children, and the
+definition documents hold their content. So for those block types,
+StructureBlockSerializer builds the same OLX and static files that
+XBlockSerializer would, from the documents read in bulk by
+compat.get_stored_blocks(). Other blocks are loaded and serialized as usual.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+from lxml.etree import Element
+from lxml.etree import fromstring as etree_fromstring
+
+from .adapters import stored_fields_olx_node
+from .block_serializer import StaticFile, XBlockSerializer, blockstore_def_key_from_modulestore_usage_key, html_filename
+
+# Block types whose OLX StructureBlockSerializer can build from stored fields:
+STRUCTURE_BLOCK_TYPES = ('chapter', 'sequential', 'vertical', 'html', 'problem')
+# ... and which of those need their 'data' content field to do so:
+DATA_BLOCK_TYPES = ('html', 'problem')
+
+
+def can_serialize_stored_block(usage_key, stored_block):
+    """
+    Return True if StructureBlockSerializer can serialize the given block,
+    given its entry from compat.get_stored_blocks().
+    """
+    if usage_key.block_type not in STRUCTURE_BLOCK_TYPES or stored_block['asides']:
+        return False
+    return usage_key.block_type not in DATA_BLOCK_TYPES or 'data' in stored_block['definition_fields']
+
+
+class StructureBlockSerializer(XBlockSerializer):
+    """
+    Serializes a block from its stored fields, with the same result as
+    XBlockSerializer. Only use it for blocks for which
+    can_serialize_stored_block() is True.
+    """
+
+    def __init__(self, usage_key, stored_block, known_assets=None):  # pylint: disable=super-init-not-called
+        """
+        Serialize the block with the given usage key, given its entry from
+        compat.get_stored_blocks() (see XBlockSerializer about known_assets).
+        """
+        self.orig_block_key = usage_key
+        self.static_files = []
+        self.def_id = blockstore_def_key_from_modulestore_usage_key(usage_key)
+        self.init_assets(known_assets)
+
+        block_type = usage_key.block_type
+        settings = {name: value for name, value in stored_block['fields'].items() if name != 'children'}
+        html_data = None
+        if block_type == 'html':
+            # Like HtmlDescriptor.definition_to_xml():
+            html_data = stored_block['definition_fields']['data']
+            filename = html_filename(usage_key.block_id)
+            self.static_files.append(StaticFile(name=filename + '.html', data=html_data.encode('utf-8')))
+            xml_object = Element('html', {'filename': filename})
+        elif block_type == 'problem':
+            # Like CapaDescriptor.definition_to_xml():
+            xml_object = etree_fromstring(stored_block['definition_fields']['data'])
+        else:
+            # Like SequenceDescriptor.definition_to_xml() and VerticalBlock.definition_to_xml(), without children:
+            xml_object = Element(block_type)
+        olx_node = stored_fields_olx_node(xml_object, block_type, usage_key.block_id, settings)
+        self.finish(olx_node, children=stored_block['fields'].get('children', []), html_data=html_data)
@@ -0,0 +1,227 @@
+"""
+Celery tasks for running transfers to Blockstore in the background.
+
+transfer_to_blockstore_task() runs a whole transfer inside a worker. Very
+large roots (courses) are split up: the parent task creates the bundle and the
+draft, then one transfer_chunk_task() per child (i.e. per chapter) serializes
+and uploads that child's subtree into the shared draft, and once every chunk
+has finished, finish_transfer_task() collects their results, uploads the
+bundle.json manifest and commits the draft. If any of them fails,
+fail_transfer_task() records the failure of the transfer in the ledger
+instead, leaving the draft uncommitted.
+
+Task arguments and results are plain JSON-serializable values, so they can be
+stored by whichever result backend the workers use; each task also reports
+its progress events (see progress.py) as its 'PROGRESS' state.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+import six
+from celery import chord, shared_task
+from django.conf import settings
+from opaque_keys.edx.keys import CourseKey, UsageKey
+
+from . import compat, ledger
+from .live_relay import coalesce_subtrees, relay_pending_changes
+from .models import Transfer
+from .progress import TransferProgress
+from .transfer_data import (
+    count_upload_work,
+    create_destination_bundle,
+    finish_import,
+    new_manifest,
+    serialize_subtree,
+    start_import,
+    transfer_changes_to_blockstore,
+    transfer_subtrees_to_blockstore,
+    transfer_to_blockstore,
+    upload_serialized_blocks
+)
+
+log = logging.getLogger(__name__)
+
+# Transfers of blocks of these types are split into one sub-task per child:
+CHUNKED_BLOCK_TYPES = ('course', )
+
+PROGRESS_STATE = 'PROGRESS'
+
+
+def _progress_reporter(task):
+    """
+    Return a progress callback that stores each progress event as the given
+    task's state, so it can be polled via the task's AsyncResult.
+    """
+    def report(event):
+        """ Store the event as the task's current state """
+        if not task.request.called_directly:
+            task.update_state(state=PROGRESS_STATE, meta=event)
+    return report
+
+
+@shared_task(bind=True)
+def transfer_to_blockstore_task(self, block_key, bundle_uuid=None, collection_uuid=None, chunked=None):
+    """
+    Transfer the given block (and its children) to Blockstore in the background.
+
+    Args:
+    * block_key: usage key (as a string) of the Open edX block to transfer
+    * bundle_uuid: UUID (as a string) of the destination bundle
+    * collection_uuid: UUID (as a string) of the destination collection, used
+      to create a new bundle if no bundle_uuid is provided.
+    * chunked: whether to transfer each child of the block in its own
+      sub-task. Defaults to True for blocks in CHUNKED_BLOCK_TYPES.
+
+    Returns a dict describing the transfer. For chunked transfers, the draft is
+    committed later, by the task whose ID is given as 'finish_task_id'.
+    """
+    root_block_key = UsageKey.from_string(block_key)
+    if chunked is None:
+        chunked = root_block_key.block_type in CHUNKED_BLOCK_TYPES
+
+    if not chunked:
+        bundle_uuid = transfer_to_blockstore(
+            root_block_key,
+            bundle_uuid=bundle_uuid,
+            collection_uuid=collection_uuid,
+            progress_callback=_progress_reporter(self),
+        )
+        return {'root': block_key, 'bundle_uuid': six.text_type(bundle_uuid), 'chunks': []}
+
+    root_block = compat.get_block(root_block_key)
+    bundle_uuid, draft_uuid = start_import(root_block, bundle_uuid=bundle_uuid, collection_uuid=collection_uuid)
+    bundle_uuid, draft_uuid = six.text_type(bundle_uuid), six.text_type(draft_uuid)
+    transfer = ledger.start_transfer(root_block_key, bundle_uuid, draft_uuid, collection_uuid)
+    # Upload the root block itself here; its descendants are left to the sub-tasks:
+    manifest = new_manifest(root_block_key)
+    serialized_blocks = serialize_subtree(root_block_key, include_children=False)
+    upload_serialized_blocks(draft_uuid, serialized_blocks, manifest)
+    ledger.record_blocks(transfer, serialized_blocks)
+
+    chunk_keys = [six.text_type(child_key) for child_key in getattr(root_block, 'children', [])]
+    log.info('Transferring %s to bundle %s in %d chunks', block_key, bundle_uuid, len(chunk_keys))
+    finish = finish_transfer_task.s(block_key, bundle_uuid, draft_uuid, manifest, transfer.id)
+    # Called if any chunk (or the finishing task itself) fails:
+    finish.on_error(fail_transfer_task.s(transfer.id))
+    if chunk_keys:
+        finish_result = chord(
+            transfer_chunk_task.s(draft_uuid, chunk_key, transfer.id) for chunk_key in chunk_keys
+        )(finish)
+    else:
+        finish_result = finish.delay([])
+    return {
+        'root': block_key,
+        'bundle_uuid': bundle_uuid,
+        'draft_uuid': draft_uuid,
+        'transfer_id': transfer.id,
+        'chunks': chunk_keys,
+        'finish_task_id': finish_result.id,
+    }
+
+
+@shared_task(bind=True)
+def transfer_chunk_task(self, draft_uuid, block_key, transfer_id):
+    """
+    Serialize the given block and its descendants, and upload them into the
+    given draft, without committing it. The uploaded blocks are recorded in the
+    ledger as part of the Transfer with the given ID.
+
+    Returns the manifest entries for the uploaded files.
+    """
+    chunk_key = UsageKey.from_string(block_key)
+    serialized_blocks = serialize_subtree(chunk_key)
+    progress = TransferProgress(chunk_key, callback=_progress_reporter(self))
+    num_files, num_bytes = count_upload_work(serialized_blocks)
+    progress.set_totals(blocks=len(serialized_blocks), files=num_files, num_bytes=num_bytes)
+    manifest = {'components': [], 'assets': []}
+    upload_serialized_blocks(draft_uuid, serialized_blocks, manifest, progress)
+    ledger.record_blocks(Transfer.objects.get(id=transfer_id), serialized_blocks)
+    return manifest
+
+
+@shared_task
+def finish_transfer_task(chunk_manifests, block_key, bundle_uuid, draft_uuid, manifest, transfer_id):
+    """
+    Collect the results of each chunk of a chunked transfer into the bundle.json
+    manifest, and commit the draft.
+    """
+    for chunk_manifest in chunk_manifests:
+        manifest['components'].extend(chunk_manifest['components'])
+        manifest['assets'].extend(chunk_manifest['assets'])
+    finish_import(draft_uuid, manifest)
+    ledger.mark_committed(Transfer.objects.get(id=transfer_id))
+    log.info('Finished import into bundle {}'.format(bundle_uuid))
+    return {
+        'root': block_key,
+        'bundle_uuid': bundle_uuid,
+        'draft_uuid': draft_uuid,
+        'components': len(manifest['components']),
+        'assets': len(manifest['assets']),
+    }
+
+
+@shared_task
+def fail_transfer_task(request, exc, traceback, transfer_id):  # pylint: disable=unused-argument
+    """
+    Record in the ledger that the chunked transfer with the given ID has
+    failed, given the request and exception of the failed task (as Celery
+    calls errbacks).
+    """
+    log.error('Chunked transfer %s failed in task %s: %r', transfer_id, getattr(request, 'id', None), exc)
+    ledger.mark_failed(Transfer.objects.get(id=transfer_id), repr(exc))
+
+
+@shared_task
+def relay_changes_task(course_key):
+    """
+    Relay the pending batch of changed blocks in one course to Blockstore, if
+    it is due (see live_relay.py).
+    """
+    relay_pending_changes(CourseKey.from_string(course_key), _relay_changes)
+
+
+def _relay_changes(relayed_course, block_keys):
+    """
+    Relay the given changed blocks of a course (a RelayedCourse) to Blockstore.
+
+    The first time a course is relayed, a new bundle is created for it in
+    settings.BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID, and saved as the
+    RelayedCourse's bundle right away, so that a relay which fails later on
+    is retried into the same bundle.
+
+    Where the course's root block has changed (as it has whenever the course
+    is published), only the blocks which have changed since the previous
+    relay are found by their hash tree, and transferred in one incremental
+    transfer (see transfer_changes_to_blockstore()), which transfers every
+    block the first time. Otherwise, only the subtrees of the changed blocks
+    are re-transferred. Either way, the assets that the bundle already has
+    are neither read nor uploaded again. Blocks which no longer exist (i.e.
+    have been deleted) leave no way of knowing which parent has lost them, so
+    they are taken as changes to the root block.
+    """
+    course_key = relayed_course.course_key
+    root_key = compat.get_course_root_key(course_key)
+    bundle_uuid = relayed_course.bundle_uuid
+    if bundle_uuid is None:
+        latest_transfer = ledger.get_latest_transfer(root_key)
+        bundle_uuid = latest_transfer.bundle_uuid if latest_transfer is not None else None
+    if bundle_uuid is None:
+        collection_uuid = settings.BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID
+        if not collection_uuid:
+            log.error('BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID is not set; not relaying changes to %s', course_key)
+            return
+        bundle_uuid = create_destination_bundle(compat.get_block(root_key), collection_uuid)
+        block_keys = {root_key}
+    relayed_course.bundle_uuid = bundle_uuid = six.text_type(bundle_uuid)
+    relayed_course.save(update_fields=['bundle_uuid'])
+
+    block_keys = {
+        block_key if compat.has_block(block_key) else root_key for block_key in block_keys
+    }
+    block_keys = coalesce_subtrees(block_keys, compat.get_parent_key)
+    if root_key in block_keys:
+        # This also rewrites the bundle's bundle.json:
+        transfer_changes_to_blockstore(root_key, bundle_uuid, reuse_assets=True)
+    else:
+        transfer_subtrees_to_blockstore(block_keys, bundle_uuid, reuse_assets=True)
@@ -19,7 +19,7 @@ class StubCompat(object):
     def get_block(self, usage_key):
         return self.blocks[usage_key]
 
-    def collect_assets_from_text(self, text, course_id):
+    def collect_assets_from_text(self, text, course_id, as_stream=False):
         if self.assets:
             return self.assets
         return []
@@ -0,0 +1,193 @@
+"""
+A minimal in-process Blockstore server, implementing the parts of the
+Blockstore API that blockstore_client uses, for tests and benchmarks.
+
+Use it like:
+
+    with FakeBlockstore() as blockstore:
+        with override_settings(BLOCKSTORE_API_URL=blockstore.url):
+            ...
+        blockstore.drafts[draft_uuid]  # {path: data} of the files uploaded into the draft
+        blockstore.bundle_files(bundle_uuid)  # {path: data} of the bundle's committed files
+
+or, for the whole of a test, blockstore = use_fake_blockstore(self) in setUp().
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import base64
+import hashlib
+import json
+import threading
+import uuid
+import zlib
+
+from django.test.utils import override_settings
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qsl
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server handling each request in its own thread, like the upload pipeline needs.
+    """
+    daemon_threads = True
+
+
+class FakeBlockstore(object):
+    """
+    Fake Blockstore server, listening on localhost on a free port.
+
+    Keeps the bundles, drafts and committed files it was sent in memory, and
+    counts the request body bytes it received (as sent on the wire, i.e.
+    before any gzip decompression).
+    """
+
+    def __init__(self):
+        self.bundles = {}  # uuid: POSTed data
+        self.drafts = {}  # uuid: {path: data}
+        self.draft_bundles = {}  # draft uuid: bundle uuid
+        self.commits = []  # (draft uuid, {path: data}) for each commit
+        self.draft_links = {}  # draft uuid: {link name: {'bundle_uuid': ..., 'version': ...}}
+        self.links = {}  # bundle uuid: {link name: {'bundle_uuid': ..., 'version': ...}} as committed
+        self.requests = []  # (method, path, headers) for each request
+        self.wire_bytes = 0
+        self.lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The base API URL, to use as settings.BLOCKSTORE_API_URL.
+        """
+        return 'http://127.0.0.1:{}/api/v1/'.format(self._server.server_address[1])
+
+    def start(self):
+        """
+        Start serving requests, on a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-blockstore')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def bundle_files(self, bundle_uuid):
+        """
+        Return the files committed to the given bundle, as {path: data}.
+        """
+        files = {}
+        with self.lock:
+            for draft_uuid, committed_files in self.commits:
+                if self.draft_bundles.get(draft_uuid) == bundle_uuid:
+                    files.update(committed_files)
+        return files
+
+    def bundle_versions(self, bundle_uuid):
+        """
+        Return the number of commits into the given bundle.
+        """
+        with self.lock:
+            return sum(1 for draft_uuid, _files in self.commits if self.draft_bundles.get(draft_uuid) == bundle_uuid)
+
+    def handle(self, method, path, headers, body):
+        """
+        Handle an API request, returning (status, response data).
+        """
+        with self.lock:
+            self.requests.append((method, path, headers))
+            self.wire_bytes += len(body)
+        if headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        parts = path.strip('/').split('/')[2:]  # Drop "api/v1"
+        if method == 'POST' and parts == ['bundles']:
+            bundle_uuid = str(uuid.uuid4())
+            with self.lock:
+                self.bundles[bundle_uuid] = dict(parse_qsl(body.decode('utf-8')))
+            return 201, {'uuid': bundle_uuid}
+        if method == 'POST' and parts == ['drafts']:
+            data = dict(parse_qsl(body.decode('utf-8')))
+            draft_uuid = str(uuid.uuid4())
+            with self.lock:
+                self.drafts[draft_uuid] = {}
+                self.draft_bundles[draft_uuid] = data.get('bundle_uuid')
+            return 201, {'uuid': draft_uuid}
+        if method == 'PATCH' and len(parts) == 2 and parts[0] == 'drafts' and parts[1] in self.drafts:
+            patch = json.loads(body.decode('utf-8'))
+            with self.lock:
+                files = patch.get('files', {})
+                self.drafts[parts[1]].update({path: base64.b64decode(data) for path, data in files.items()})
+                self.draft_links.setdefault(parts[1], {}).update(patch.get('links', {}))
+            return 200, {}
+        if method == 'POST' and len(parts) == 3 and parts[0] == 'drafts' and parts[2] == 'commit':
+            with self.lock:
+                self.commits.append((parts[1], dict(self.drafts[parts[1]])))
+                self.links.setdefault(self.draft_bundles.get(parts[1]), {}).update(self.draft_links.get(parts[1], {}))
+            return 200, {}
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'bundles' and parts[1] in self.bundles:
+            return 200, {'uuid': parts[1], 'versions': [
+                '{}bundle_versions/{},{}'.format(self.url, parts[1], version)
+                for version in range(1, self.bundle_versions(parts[1]) + 1)
+            ]}
+        if method == 'GET' and len(parts) == 3 and parts[0] == 'bundles' and parts[2] == 'files':
+            return 200, [
+                {'path': path, 'size': len(data), 'hash_digest': hashlib.sha1(data).hexdigest()}
+                for path, data in sorted(self.bundle_files(parts[1]).items())
+            ]
+        return 404, {'detail': 'Not found.'}
+
+    def _handler_class(self):
+        """
+        Return a request handler class which passes requests to self.handle().
+        """
+        blockstore = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            """
+            Request handler for FakeBlockstore.
+            """
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, data = blockstore.handle(self.command, self.path, dict(self.headers.items()), body)
+                response = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            do_GET = do_POST = do_PATCH = _respond
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return Handler
+
+
+def use_fake_blockstore(test_case):
+    """
+    Start a FakeBlockstore, and make it settings.BLOCKSTORE_API_URL, until
+    the given test case's test is over. Returns the FakeBlockstore.
+    """
+    blockstore = FakeBlockstore()
+    blockstore.start()
+    test_case.addCleanup(blockstore.stop)
+    settings_override = override_settings(BLOCKSTORE_API_URL=blockstore.url)
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+    return blockstore
@@ -0,0 +1,14 @@
+"""
+A stand-in for the serialized blocks (XBlockSerializer objects) that
+uploading, the upload pipeline and the ledger are given.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple
+
+# The parts of XBlockSerializer that they use; the contentstore assets found by the serializer (reused_assets and
+# asset_md5s) default to none:
+SerializedBlock = namedtuple(
+    'SerializedBlock', ['orig_block_key', 'def_id', 'olx_str', 'static_files', 'reused_assets', 'asset_md5s'],
+)
+SerializedBlock.__new__.__defaults__ = ((), {})
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` shared asset cache.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+from django.test.utils import override_settings
+from opaque_keys.edx.keys import CourseKey
+
+from .. import asset_cache, compat
+from ..asset_cache import MMAP_MIN_BYTES, AssetCache, CachedAsset
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+
+
+def cache_in_process(args):
+    """
+    Put the same asset into the cache at the given directory several times,
+    reading it back each time, and return whether every read was correct.
+    """
+    root, key, data = args
+    cache = AssetCache(root)
+    correct = True
+    for _ in range(20):
+        cache.put(key, data)
+        correct = correct and cache.get(key, len(data))[:] == data
+    return correct
+
+
+class AssetCacheTestCase(TestCase):
+    """
+    Tests for AssetCache.
+    """
+
+    def setUp(self):
+        super(AssetCacheTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_put_and_get(self):
+        cache = AssetCache(self.root)
+        key = cache.key(COURSE_KEY, 'images/logo.png', 'abc123', 4)
+        self.assertNotEqual(key, cache.key(COURSE_KEY, 'images/logo.png', 'def456', 4))
+        self.assertIsNone(cache.get(key, 4))
+        cache.put(key, b'logo')
+        self.assertEqual(cache.get(key, 4), b'logo')
+        # Another process using the same directory sees it:
+        self.assertEqual(AssetCache(self.root).get(key, 4), b'logo')
+        self.assertEqual(os.listdir(os.path.join(self.root, asset_cache.TMP_DIR)), [])
+
+    def test_wrong_size(self):
+        cache = AssetCache(self.root)
+        cache.put('0123', b'truncated')
+        self.assertIsNone(cache.get('0123', 100))
+        self.assertFalse(os.path.exists(cache.path('0123')))
+
+    def test_large_files_are_mapped(self):
+        cache = AssetCache(self.root)
+        data = os.urandom(MMAP_MIN_BYTES + 1)
+        cache.put('large', data)
+        cached = cache.get('large', len(data))
+        self.assertIsInstance(cached, mmap.mmap)
+        self.assertEqual(cached[:], data)
+        self.assertEqual(len(cached), len(data))
+
+    def test_eviction(self):
+        """
+        Test that the least recently used files are evicted once the cache is
+        over its maximum size.
+        """
+        cache = AssetCache(self.root)
+        for i, key in enumerate(('aa01', 'bb02', 'cc03')):
+            cache.put(key, b'x' * 100)
+            os.utime(cache.path(key), (1000 + i, 1000 + i))
+        cache.max_bytes = 250
+        # Reading the oldest file marks it as recently used:
+        cache.get('aa01', 100)
+        self.assertEqual(cache.evict(), 100)
+        self.assertIsNone(cache.get('bb02', 100))
+        self.assertIsNotNone(cache.get('aa01', 100))
+        self.assertIsNotNone(cache.get('cc03', 100))
+        # Writing enough triggers eviction:
+        cache.put('dd04', b'x' * 100)
+        self.assertEqual(len([key for key in ('aa01', 'cc03', 'dd04') if cache.get(key, 100)]), 2)
+
+    def test_processes_share_cache(self):
+        data = os.urandom(MMAP_MIN_BYTES * 2)
+        pool = multiprocessing.Pool(4)
+        try:
+            results = pool.map(cache_in_process, [(self.root, 'shared', data)] * 4)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(AssetCache(self.root).get('shared', len(data))[:], data)
+        self.assertEqual(os.listdir(os.path.join(self.root, asset_cache.TMP_DIR)), [])
+
+
+class GetAssetContentTestCase(TestCase):
+    """
+    Tests for compat.get_asset_content_from_path() with the asset cache.
+    """
+
+    def setUp(self):
+        super(GetAssetContentTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(BLOCKSTORE_RELAY_ASSET_CACHE_DIR=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.stream = mock.Mock(content_digest='abc123', length=4)
+        self.stream.copy_to_in_mem.return_value.data = b'logo'
+        self.asset_manager = mock.Mock()
+        self.asset_manager.find.return_value = self.stream
+        symbols = {
+            'AssetManager': self.asset_manager,
+            'StaticContent': mock.Mock(),
+            'ItemNotFoundError': type(str('ItemNotFoundError'), (Exception,), {}),
+            'NotFoundError': type(str('NotFoundError'), (Exception,), {}),
+        }
+        patcher = mock.patch.object(compat, 'edx_symbol', side_effect=lambda module, name: symbols[name])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        asset = compat.get_asset_content_from_path(COURSE_KEY, 'images/logo.png')
+        self.assertIsInstance(asset, CachedAsset)
+        # Only the asset's metadata has been read so far:
+        self.assertEqual(self.asset_manager.find.call_args[1], {'as_stream': True})
+        self.assertIs(asset.location, self.stream.location)
+        self.stream.copy_to_in_mem.assert_not_called()
+        self.assertEqual(asset.data, b'logo')
+        self.assertEqual(self.stream.copy_to_in_mem.call_count, 1)
+
+        # The next time (in this process or another), the data comes from the cache:
+        asset_cache._caches.clear()  # pylint: disable=protected-access
+        asset = compat.get_asset_content_from_path(COURSE_KEY, 'images/logo.png')
+        self.assertEqual(asset.copy_to_in_mem().data, b'logo')
+        self.assertEqual(self.stream.copy_to_in_mem.call_count, 1)
+
+        # A new version of the asset is read again:
+        self.stream.content_digest = 'def456'
+        self.assertEqual(compat.get_asset_content_from_path(COURSE_KEY, 'images/logo.png').data, b'logo')
+        self.assertEqual(self.stream.copy_to_in_mem.call_count, 2)
+
+    def test_no_digest(self):
+        self.stream.content_digest = None
+        asset = compat.get_asset_content_from_path(COURSE_KEY, 'images/logo.png')
+        self.assertIs(asset, self.stream.copy_to_in_mem.return_value)
+
+    def test_disabled(self):
+        with override_settings(BLOCKSTORE_RELAY_ASSET_CACHE_DIR=None):
+            self.assertIs(compat.get_asset_content_from_path(COURSE_KEY, 'images/logo.png'), self.stream)
+        self.assertEqual(self.asset_manager.find.call_args[1], {'as_stream': False})
+        self.assertEqual(os.listdir(self.root), [])
@@ -5,10 +5,20 @@ Tests for the `openedx-blockstore-relay` transfer_data module.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import random
+from unittest import TestCase
+
+import mock
+from lxml.etree import Element, SubElement
+from lxml.etree import fromstring as etree_fromstring
+from lxml.etree import tostring as etree_tostring
+
+from edxval import api as edxval_api
+from xmodule.modulestore import ModuleStoreEnum
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
 
 from .. import compat
-from ..block_serializer import XBlockSerializer
+from ..block_serializer import FAST_SERIALIZERS, XBlockSerializer, canonicalize_olx
 from .course_data import TestCourseMixin
 from .xml_test_mixin import XmlTestMixin
 
@@ -137,3 +147,136 @@ class XBlockSerializerTestCase(TestCourseMixin, XmlTestMixin, ModuleStoreTestCas
             </problem>
             <!-- Imported from {block_key} using openedx-blockstore-relay -->
         """.format(block_key=block_key))
+
+    def test_fast_path_parity(self):
+        """
+        Test that the fast-path serializers produce exactly the same OLX and
+        static files as the generic export path.
+        """
+        block_ids = {
+            'html': ['html_a', 'html_b'],
+            'problem': ['problem_a', 'problem_b'],
+            'video': ['video_b'],
+        }
+        self.assertEqual(set(block_ids), set(FAST_SERIALIZERS))
+        for block_type, block_id_list in block_ids.items():
+            for block_id in block_id_list:
+                block_key = self.course.id.make_usage_key(block_type, block_id)
+                generic = XBlockSerializer(compat.get_block(block_key), use_fast_path=False)
+                fast = XBlockSerializer(compat.get_block(block_key))
+                self.assertEqual(fast.olx_str, generic.olx_str)
+                self.assertEqual(fast.static_files, generic.static_files)
+                self.assertEqual(fast.def_id, generic.def_id)
+
+    def test_fast_path_parity_root_attributes(self):
+        """
+        Test that the fast path drops the attributes named after settings
+        fields from the root of a problem's stored XML, as the generic export
+        path does, and keeps the others.
+        """
+        block_key = self.course.id.make_usage_key('problem', 'problem_a')
+        block = compat.get_block(block_key)
+        block.data = '<problem display_name="Stale name" weight="5" custom="kept"><p>Question</p></problem>'
+        compat.modulestore().update_item(block, ModuleStoreEnum.UserID.test)
+
+        generic = XBlockSerializer(compat.get_block(block_key), use_fast_path=False)
+        fast = XBlockSerializer(compat.get_block(block_key))
+        self.assertEqual(fast.olx_str, generic.olx_str)
+        self.assertNotIn('Stale name', fast.olx_str)
+        self.assertNotIn('weight=', fast.olx_str)
+        self.assertIn('custom="kept"', fast.olx_str)
+
+    def test_video_prefetched_edxval(self):
+        """
+        Test that serializing a video from edxval data fetched in bulk gives
+        the same OLX and transcript files, without edxval's own export.
+        """
+        block_key = self.course.id.make_usage_key('video', 'video_b')
+        block = compat.get_block(block_key)
+        expected = XBlockSerializer(block)
+        videos = compat.get_edxval_videos([block.edx_video_id], self.course.id)
+        self.assertEqual(list(videos), [block.edx_video_id])
+
+        with mock.patch('edxval.api.export_to_xml', wraps=edxval_api.export_to_xml) as mock_export_to_xml:
+            result = XBlockSerializer(compat.get_block(block_key), edxval_videos=videos)
+            self.assertFalse(mock_export_to_xml.called)
+            # Serializers without prefetched videos still use edxval:
+            XBlockSerializer(compat.get_block(block_key))
+            self.assertTrue(mock_export_to_xml.called)
+        self.assertEqual(result.olx_str, expected.olx_str)
+        self.assertEqual(result.static_files, expected.static_files)
+
+
+def random_olx(rand, depth=0):
+    """
+    Return a random OLX-like element tree, as a list of (tag, attributes,
+    text, children) tuples, so that it can be built in different ways.
+    """
+    attributes = [('attr{}'.format(i), rand.choice(['1', 'yes', 'ωμέγα', 'a b'])) for i in range(rand.randint(0, 5))]
+    children = [random_olx(rand, depth + 1) for _ in range(rand.randint(0, 3) if depth < 3 else 0)]
+    text = rand.choice([None, 'Text', 'More text']) if not children else None
+    return ('tag{}'.format(rand.randint(0, 3)), attributes, text, children)
+
+
+def build_olx(tree, rand):
+    """
+    Build an element from the given random_olx() tree, adding the attributes
+    in a random order, and serialize it, with a random indentation.
+    """
+    def build(tree, parent=None):
+        """ Build an element and its children """
+        tag, attributes, text, children = tree
+        element = Element(tag) if parent is None else SubElement(parent, tag)
+        for name, value in rand.sample(attributes, len(attributes)):
+            element.set(name, value)
+        element.text = text
+        for child in children:
+            build(child, element)
+        return element
+
+    olx_node = build(tree)
+    if rand.random() < 0.5:
+        return etree_tostring(olx_node)
+    indent = ' ' * rand.randint(1, 4)
+    for element in olx_node.iter():
+        if len(element):
+            element.text = '\n' + indent
+            for child in element:
+                child.tail = '\n' + indent
+    return etree_tostring(olx_node)
+
+
+class CanonicalOlxTestCase(TestCase):
+    """
+    Property tests for canonicalize_olx(), on random OLX trees.
+    """
+
+    def canonical(self, olx_str):
+        """
+        Return the canonical serialization of the given OLX string.
+        """
+        return etree_tostring(canonicalize_olx(etree_fromstring(olx_str)), encoding='utf-8', pretty_print=True)
+
+    def test_same_content_same_bytes(self):
+        rand = random.Random(0)
+        for _ in range(200):
+            tree = random_olx(rand)
+            serializations = set(self.canonical(build_olx(tree, rand)) for _ in range(5))
+            self.assertEqual(len(serializations), 1)
+            # Canonicalizing is idempotent:
+            canonical_olx = serializations.pop()
+            self.assertEqual(self.canonical(canonical_olx), canonical_olx)
+
+    def test_different_content_different_bytes(self):
+        rand = random.Random(1)
+        trees = set()
+        serializations = set()
+        for _ in range(200):
+            tree = random_olx(rand)
+            trees.add(repr(tree))
+            serializations.add(self.canonical(build_olx(tree, rand)))
+        self.assertEqual(len(serializations), len(trees))
+
+    def test_inline_whitespace_kept(self):
+        olx_str = b'<problem>\n  <p><b>Bold</b> <i>italic</i></p>\n</problem>'
+        self.assertEqual(self.canonical(olx_str), b'<problem>\n  <p><b>Bold</b> <i>italic</i></p>\n</problem>\n')
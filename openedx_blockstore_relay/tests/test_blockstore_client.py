@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` Blockstore API client.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import base64
+import io
+import json
+import zlib
+
+import mock
+from django.test import TestCase
+from django.test.utils import override_settings
+from requests.utils import super_len
+
+from ..blockstore_client import (
+    DraftFilesBody,
+    add_file_to_draft,
+    add_files_to_draft,
+    commit_draft,
+    create_bundle,
+    create_draft,
+    get_bundle_version,
+    set_draft_link
+)
+from ..test_utils.fake_blockstore import FakeBlockstore
+
+FILES = [
+    ('html/intro/definition.xml', '<html display_name="Intro">Unicode: ☃</html>'),
+    ('html/intro/static/image.png', bytes(bytearray(range(256))) * 7),
+    ('problem/p1/static/empty.txt', b''),
+]
+
+
+def expected_body(files):
+    """
+    Build the body that DraftFilesBody should generate, the simple way.
+    """
+    encoded = {}
+    for path, data in files:
+        if not isinstance(data, bytes):
+            data = data.encode('utf8')
+        encoded[path] = base64.b64encode(data).decode('ascii')
+    return {'files': encoded}
+
+
+class DraftFilesBodyTestCase(TestCase):
+    """
+    Tests for DraftFilesBody
+    """
+
+    def test_read_all(self):
+        body = DraftFilesBody(FILES, chunk_size=30)
+        data = body.read()
+        self.assertEqual(json.loads(data.decode('ascii')), expected_body(FILES))
+        self.assertEqual(len(body), len(data))
+        self.assertEqual(body.read(), b'')
+
+    def test_read_in_blocks(self):
+        """
+        Test reading the body in blocks which don't line up with the chunks.
+        """
+        for block_size in (1, 7, 100, 8192):
+            body = DraftFilesBody(FILES, chunk_size=3 * 5)
+            blocks = []
+            block = body.read(block_size)
+            while block:
+                self.assertLessEqual(len(block), block_size)
+                blocks.append(block)
+                block = body.read(block_size)
+            data = b''.join(blocks)
+            self.assertEqual(len(body), len(data))
+            self.assertEqual(json.loads(data.decode('ascii')), expected_body(FILES))
+
+    def test_iterate(self):
+        body = DraftFilesBody(dict(FILES))
+        data = b''.join(body)
+        self.assertEqual(json.loads(data.decode('ascii')), expected_body(FILES))
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            DraftFilesBody(FILES, chunk_size=32)
+
+    def test_rewind(self):
+        """
+        Test that the body can be sent again, as requests does after a redirect.
+        """
+        body = DraftFilesBody(FILES, chunk_size=3 * 5)
+        self.assertEqual(super_len(body), len(body))
+        data = body.read()
+        self.assertEqual(body.tell(), len(data))
+        self.assertEqual(super_len(body), 0)
+        self.assertEqual(body.seek(0), 0)
+        self.assertEqual(b''.join(body), data)
+        self.assertEqual(body.seek(-10, io.SEEK_END), len(data) - 10)
+        self.assertEqual(body.read(), data[-10:])
+        body.seek(7)
+        self.assertEqual(body.read(20), data[7:27])
+        self.assertEqual(body.seek(3, io.SEEK_CUR), 30)
+        self.assertEqual(body.read(), data[30:])
+
+    def test_no_files(self):
+        body = DraftFilesBody([])
+        self.assertEqual(json.loads(body.read().decode('ascii')), {'files': {}})
+
+
+@override_settings(BLOCKSTORE_API_URL='http://blockstore.test/api/v1/')
+@mock.patch('openedx_blockstore_relay.blockstore_client.requests')
+class AddFilesToDraftTestCase(TestCase):
+    """
+    Tests for add_files_to_draft() and add_file_to_draft()
+    """
+
+    def test_add_files(self, mock_requests):
+        add_files_to_draft('a3b9b7b8-65d8-4ad8-8e2d-1a2c6d7e40ff', FILES)
+        mock_requests.patch.assert_called_once()
+        args, kwargs = mock_requests.patch.call_args
+        self.assertEqual(args, ('http://blockstore.test/api/v1/drafts/a3b9b7b8-65d8-4ad8-8e2d-1a2c6d7e40ff', ))
+        self.assertEqual(kwargs['headers'], {'Content-Type': 'application/json'})
+        self.assertEqual(json.loads(kwargs['data'].read().decode('ascii')), expected_body(FILES))
+        mock_requests.patch.return_value.raise_for_status.assert_called_once()
+
+    def test_add_file(self, mock_requests):
+        add_file_to_draft('a3b9b7b8-65d8-4ad8-8e2d-1a2c6d7e40ff', FILES[0][0], FILES[0][1])
+        body = mock_requests.patch.call_args[1]['data']
+        self.assertEqual(json.loads(body.read().decode('ascii')), expected_body(FILES[:1]))
+
+    @override_settings(BLOCKSTORE_RELAY_GZIP_MIN_BYTES=100, BLOCKSTORE_RELAY_GZIP_LEVEL=9)
+    def test_gzip(self, mock_requests):
+        """
+        Test that bodies of at least BLOCKSTORE_RELAY_GZIP_MIN_BYTES bytes are gzipped.
+        """
+        add_files_to_draft('a3b9b7b8-65d8-4ad8-8e2d-1a2c6d7e40ff', FILES)
+        kwargs = mock_requests.patch.call_args[1]
+        self.assertEqual(kwargs['headers'], {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        data = zlib.decompress(kwargs['data'], 16 + zlib.MAX_WBITS)
+        self.assertEqual(json.loads(data.decode('ascii')), expected_body(FILES))
+
+        add_file_to_draft('a3b9b7b8-65d8-4ad8-8e2d-1a2c6d7e40ff', 'problem/p1/static/empty.txt', b'')
+        kwargs = mock_requests.patch.call_args[1]
+        self.assertEqual(kwargs['headers'], {'Content-Type': 'application/json'})
+
+
+class FakeBlockstoreTestCase(TestCase):
+    """
+    Test the client against the fake Blockstore server, over HTTP.
+    """
+
+    def test_upload_and_commit(self):
+        for min_bytes in (None, 0):
+            with FakeBlockstore() as blockstore, override_settings(
+                BLOCKSTORE_API_URL=blockstore.url, BLOCKSTORE_RELAY_GZIP_MIN_BYTES=min_bytes,
+            ):
+                bundle_uuid = create_bundle('c0ffee00-65d8-4ad8-8e2d-1a2c6d7e40ff', 'Title', 'slug')['uuid']
+                draft_uuid = create_draft(bundle_uuid, 'relay_import', 'Title')['uuid']
+                add_files_to_draft(draft_uuid, FILES[:2])
+                add_file_to_draft(draft_uuid, FILES[2][0], FILES[2][1])
+                commit_draft(draft_uuid)
+            expected_files = {
+                path: data.encode('utf8') if not isinstance(data, bytes) else data for path, data in FILES
+            }
+            self.assertEqual(blockstore.commits, [(draft_uuid, expected_files)])
+            patch_headers = [headers for method, _path, headers in blockstore.requests if method == 'PATCH']
+            self.assertEqual(
+                [headers.get('Content-Encoding') for headers in patch_headers],
+                [None, None] if min_bytes is None else ['gzip', 'gzip'],
+            )
+
+    def test_links(self):
+        with FakeBlockstore() as blockstore, override_settings(BLOCKSTORE_API_URL=blockstore.url):
+            shard_uuid = create_bundle('c0ffee00-65d8-4ad8-8e2d-1a2c6d7e40ff', 'Shard', 'shard')['uuid']
+            parent_uuid = create_bundle('c0ffee00-65d8-4ad8-8e2d-1a2c6d7e40ff', 'Parent', 'parent')['uuid']
+            self.assertEqual(get_bundle_version(shard_uuid), 0)
+            shard_draft_uuid = create_draft(shard_uuid, 'relay_import', 'Shard')['uuid']
+            commit_draft(shard_draft_uuid)
+            commit_draft(shard_draft_uuid)
+            self.assertEqual(get_bundle_version(shard_uuid), 2)
+            parent_draft_uuid = create_draft(parent_uuid, 'relay_import', 'Parent')['uuid']
+            set_draft_link(parent_draft_uuid, 'unit-u1', shard_uuid, 2)
+            commit_draft(parent_draft_uuid)
+        self.assertEqual(blockstore.links[parent_uuid], {'unit-u1': {'bundle_uuid': shard_uuid, 'version': 2}})
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` compat module.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import subprocess
+import sys
+from unittest import TestCase
+
+import mock
+
+from .. import compat
+
+
+class EdxSymbolTestCase(TestCase):
+    """
+    Tests for compat.edx_symbol().
+    """
+
+    def setUp(self):
+        super(EdxSymbolTestCase, self).setUp()
+        patcher = mock.patch.dict(compat._EDX_SYMBOLS, clear=True)  # pylint: disable=protected-access
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_symbol_is_imported_once(self):
+        """
+        Test that a symbol is resolved on first use, and then served from the cache.
+        """
+        with mock.patch('importlib.import_module', wraps=__import__('importlib').import_module) as mock_import:
+            self.assertIs(compat.edx_symbol('json', 'dumps'), __import__('json').dumps)
+            self.assertIs(compat.edx_symbol('json', 'dumps'), __import__('json').dumps)
+        self.assertEqual(mock_import.call_count, 1)
+
+    def test_missing_symbol(self):
+        """
+        Test that missing modules and names raise EdXPlatformImportError, and aren't cached.
+        """
+        with self.assertRaises(compat.EdXPlatformImportError):
+            compat.edx_symbol('openedx_blockstore_relay.no_such_module', 'anything')
+        with self.assertRaises(compat.EdXPlatformImportError):
+            compat.edx_symbol('json', 'no_such_name')
+        self.assertEqual(compat._EDX_SYMBOLS, {})  # pylint: disable=protected-access
+
+    def test_serializer_import_is_lazy(self):
+        """
+        Test that importing the serializers doesn't import any edx-platform module.
+        """
+        code = (
+            'import sys\n'
+            'import openedx_blockstore_relay.block_serializer\n'
+            'sys.exit(any(name == "xmodule" or name.startswith("xmodule.") for name in sys.modules))\n'
+        )
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+
+class StructureHistoryTestCase(TestCase):
+    """
+    Tests for compat.get_structure_history().
+    """
+
+    def test_follows_draft_branch(self):
+        # v1 <- v2 <- v4 is the draft branch; p3 is a published structure derived from v2:
+        structures = {
+            'v1': {'_id': 'v1', 'original_version': 'v1'},
+            'v2': {'_id': 'v2', 'original_version': 'v1', 'previous_version': 'v1'},
+            'p3': {'_id': 'p3', 'original_version': 'v1', 'previous_version': 'v2'},
+            'v4': {'_id': 'v4', 'original_version': 'v1', 'previous_version': 'v2'},
+        }
+        split = mock.Mock()
+        split.db_connection.structures.find_one.side_effect = lambda query, fields: structures.get(query['_id'])
+        with mock.patch.object(compat, '_get_split_structure', return_value=(split, None, structures['v4'])):
+            self.assertEqual(compat.get_structure_history(None), ['v1', 'v2', 'v4'])
+        self.assertEqual(
+            [call[0][0]['_id'] for call in split.db_connection.structures.find_one.call_args_list], ['v4', 'v2', 'v1'],
+        )
+
+    def test_not_split(self):
+        with mock.patch.object(compat, '_get_split_structure', return_value=None):
+            self.assertIsNone(compat.get_structure_history(None))
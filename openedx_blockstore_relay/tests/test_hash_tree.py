@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` hash trees and changed-only transfers.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+
+import mock
+from django.test import TestCase
+from opaque_keys.edx.keys import CourseKey
+
+from .. import ledger
+from ..block_serializer import StaticFile
+from ..hash_tree import compute_hash_tree, diff_hash_trees
+from ..sinks import BlockstoreSink
+from ..test_utils.fake_blockstore import use_fake_blockstore
+from ..test_utils.serialized_block import SerializedBlock
+from ..transfer_data import transfer_changes_to_blockstore
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+COURSE = COURSE_KEY.make_usage_key('course', 'course')
+COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+BLOCK_TYPES = ('chapter', 'sequential', 'vertical', 'html')
+
+
+def make_block_versions(width, depth=len(BLOCK_TYPES)):
+    """
+    Return the block versions (see compat.get_block_versions()) of a course
+    with the given number of children per block, down to the given depth.
+    """
+    block_versions = {}
+    parents = [COURSE]
+    block_versions[COURSE] = ['v1', []]
+    for block_type in BLOCK_TYPES[:depth]:
+        children = []
+        for parent in parents:
+            for i in range(width):
+                child = COURSE_KEY.make_usage_key(block_type, '{}_{}'.format(parent.block_id, i))
+                block_versions[parent][1].append(child)
+                block_versions[child] = ['v1', []]
+                children.append(child)
+        parents = children
+    return block_versions
+
+
+class HashTreeTestCase(TestCase):
+    """
+    Tests for computing and comparing hash trees.
+    """
+
+    def test_unchanged(self):
+        block_versions = make_block_versions(3)
+        hashes = compute_hash_tree(block_versions, COURSE)
+        self.assertEqual(len(hashes), 1 + 3 + 9 + 27 + 81)
+        self.assertEqual(compute_hash_tree(block_versions, COURSE), hashes)
+        diff = diff_hash_trees(COURSE, block_versions, hashes, hashes)
+        self.assertEqual((diff.changed, diff.outdated, diff.compared), ([], set(), 1))
+
+    def test_nothing_recorded(self):
+        block_versions = make_block_versions(2)
+        hashes = compute_hash_tree(block_versions, COURSE)
+        diff = diff_hash_trees(COURSE, block_versions, hashes, {})
+        self.assertEqual(len(diff.changed), len(hashes))
+        self.assertEqual(diff.outdated, set(hashes))
+        # Parents come before their children:
+        self.assertEqual(diff.changed[:3], [
+            COURSE,
+            COURSE_KEY.make_usage_key('chapter', 'course_0'),
+            COURSE_KEY.make_usage_key('sequential', 'course_0_0'),
+        ])
+
+    def test_one_edit(self):
+        """
+        Test that after a single edit in a course of 11,111 blocks, only the
+        blocks along the path to it (and their siblings) are compared.
+        """
+        block_versions = make_block_versions(10)
+        recorded = compute_hash_tree(block_versions, COURSE)
+        html = COURSE_KEY.make_usage_key('html', 'course_3_1_4_1')
+        block_versions[html][0] = 'v2'
+        hashes = compute_hash_tree(block_versions, COURSE)
+
+        diff = diff_hash_trees(COURSE, block_versions, hashes, recorded)
+        self.assertEqual(diff.changed, [html])
+        self.assertEqual(diff.outdated, {
+            COURSE,
+            COURSE_KEY.make_usage_key('chapter', 'course_3'),
+            COURSE_KEY.make_usage_key('sequential', 'course_3_1'),
+            COURSE_KEY.make_usage_key('vertical', 'course_3_1_4'),
+            html,
+        })
+        self.assertEqual(diff.compared, 1 + 4 * 10)
+
+    def test_new_child(self):
+        block_versions = make_block_versions(2)
+        recorded = compute_hash_tree(block_versions, COURSE)
+        unit = COURSE_KEY.make_usage_key('vertical', 'course_1_0_1')
+        html = COURSE_KEY.make_usage_key('html', 'new')
+        block_versions[unit][1].append(html)
+        block_versions[html] = ['v1', []]
+        hashes = compute_hash_tree(block_versions, COURSE)
+        self.assertEqual(diff_hash_trees(COURSE, block_versions, hashes, recorded).changed, [unit, html])
+
+
+class TransferChangesTestCase(TestCase):
+    """
+    Tests for transfer_changes_to_blockstore(), against the fake Blockstore
+    server.
+    """
+
+    def setUp(self):
+        super(TransferChangesTestCase, self).setUp()
+        self.blockstore = use_fake_blockstore(self)
+        self.block_versions = make_block_versions(2)
+        self.bundle_uuid = BlockstoreSink().create_bundle(COLLECTION_UUID, 'Course', 'course')['uuid']
+        self.mock_serialize = self.start_patch('serialize_subtree', side_effect=self.serialize)
+        self.mock_get_block_versions = self.start_patch('compat.get_block_versions', return_value=self.block_versions)
+        self.start_patch('compat.get_block').return_value.scope_ids.usage_id = COURSE
+
+    def start_patch(self, name, **kwargs):
+        """
+        Patch the given attribute of transfer_data for the rest of the test,
+        and return the mock.
+        """
+        patch = mock.patch('openedx_blockstore_relay.transfer_data.' + name, **kwargs)
+        self.addCleanup(patch.stop)
+        return patch.start()
+
+    def serialize(self, block_key, include_children=True, known_assets=None):  # pylint: disable=unused-argument
+        """
+        Stand-in for serialize_subtree(), serializing a single block.
+        """
+        def_id = '{}/{}'.format(block_key.block_type, block_key.block_id)
+        olx_str = '<{} version="{}"/>'.format(block_key.block_type, self.block_versions[block_key][0])
+        static_files = [StaticFile('page.html', b'<p/>')] if block_key.block_type == 'html' else []
+        return {block_key: SerializedBlock(block_key, def_id, olx_str.encode('utf-8'), static_files)}
+
+    def transfer(self):
+        """
+        Run a changed-only transfer of the course, and return the keys of the
+        blocks which were serialized.
+        """
+        self.mock_serialize.reset_mock()
+        transfer_changes_to_blockstore(COURSE, self.bundle_uuid)
+        for call in self.mock_serialize.call_args_list:
+            self.assertFalse(call[1]['include_children'])
+        return [call[0][0] for call in self.mock_serialize.call_args_list]
+
+    def test_transfer_changes(self):
+        # The first time, every block is transferred:
+        self.assertEqual(len(self.transfer()), len(self.block_versions))
+        self.assertEqual(len(self.blockstore.commits), 1)
+        self.assertEqual(len(ledger.get_subtree_hashes(self.bundle_uuid)), len(self.block_versions))
+        # Then, nothing is serialized or committed until something changes:
+        self.assertEqual(self.transfer(), [])
+        self.assertEqual(len(self.blockstore.commits), 1)
+
+        html = COURSE_KEY.make_usage_key('html', 'course_1_0_1_1')
+        self.block_versions[html][0] = 'v2'
+        self.assertEqual(self.transfer(), [html])
+        self.assertEqual(len(self.blockstore.commits), 2)
+        bundle_files = self.blockstore.bundle_files(self.bundle_uuid)
+        self.assertEqual(bundle_files['html/course_1_0_1_1/definition.xml'], b'<html version="v2"/>')
+        self.assertEqual(self.transfer(), [])
+
+        # The manifest lists every block, not only the changed one:
+        self.assertEqual(set(self.blockstore.commits[-1][1]), {
+            'bundle.json', 'html/course_1_0_1_1/definition.xml', 'html/course_1_0_1_1/static/page.html',
+        })
+        manifest = json.loads(bundle_files['bundle.json'].decode('utf-8'))
+        self.assertEqual(len(manifest['components']), len(self.block_versions))
+        self.assertIn('html/course_1_0_1_1/static/page.html', manifest['assets'])
+        # The transfers only had some of the blocks, so they don't count as transfers of the whole course:
+        self.assertIsNone(ledger.get_latest_transfer(COURSE))
+        self.assertIsNone(ledger.get_transfer_since(COURSE))
+        self.assertEqual(ledger.locate_block(html).olx_digest, ledger.digest(b'<html version="v2"/>'))
+
+    def test_deleted_block(self):
+        """
+        Test that a deleted block is left out of the rewritten manifest.
+        """
+        self.transfer()
+        html = COURSE_KEY.make_usage_key('html', 'course_1_0_1_1')
+        unit = COURSE_KEY.make_usage_key('vertical', 'course_1_0_1')
+        self.block_versions[unit][1].remove(html)
+        self.block_versions[unit][0] = 'v2'
+        del self.block_versions[html]
+        self.assertEqual(self.transfer(), [unit])
+        manifest = json.loads(self.blockstore.bundle_files(self.bundle_uuid)['bundle.json'].decode('utf-8'))
+        self.assertEqual(len(manifest['components']), len(self.block_versions))
+        self.assertNotIn('html/course_1_0_1_1/definition.xml', manifest['components'])
+        self.assertNotIn('html/course_1_0_1_1/static/page.html', manifest['assets'])
+
+    def test_failed_commit(self):
+        """
+        Test that the hashes aren't recorded unless the changes are committed.
+        """
+        with mock.patch('openedx_blockstore_relay.sinks.commit_draft', side_effect=IOError):
+            with self.assertRaises(IOError):
+                self.transfer()
+        self.assertEqual(ledger.get_subtree_hashes(self.bundle_uuid), {})
+        self.assertEqual(len(self.transfer()), len(self.block_versions))
+
+    def test_not_split(self):
+        self.mock_get_block_versions.return_value = None
+        with mock.patch('openedx_blockstore_relay.transfer_data.transfer_to_blockstore') as mock_transfer:
+            transfer_changes_to_blockstore(COURSE, self.bundle_uuid)
+        mock_transfer.assert_called_once_with(
+            COURSE, bundle_uuid=self.bundle_uuid, progress_callback=None, sink=mock.ANY, reuse_assets=False,
+        )
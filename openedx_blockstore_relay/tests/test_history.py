@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for replaying a course's history into successive bundle versions.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import copy
+import json
+
+import mock
+from django.test import TestCase
+from opaque_keys.edx.keys import CourseKey
+
+from .. import ledger
+from ..models import Transfer
+from ..test_utils.fake_blockstore import use_fake_blockstore
+from ..transfer_data import replay_history_to_blockstore
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+CHAPTER = COURSE_KEY.make_usage_key('chapter', 'chapter1')
+SEQUENTIAL = COURSE_KEY.make_usage_key('sequential', 'sequential1')
+VERTICAL = COURSE_KEY.make_usage_key('vertical', 'vertical1')
+HTML1 = COURSE_KEY.make_usage_key('html', 'html1')
+HTML2 = COURSE_KEY.make_usage_key('html', 'html2')
+PROBLEM = COURSE_KEY.make_usage_key('problem', 'problem1')
+COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+
+
+class FakeSerializedBlock(object):
+    """
+    Stand-in for an XBlockSerializer of a block which can't be serialized
+    from its stored fields.
+    """
+
+    def __init__(self, block):
+        self.orig_block_key = block.scope_ids.usage_id
+        self.def_id = '{}/{}'.format(self.orig_block_key.block_type, self.orig_block_key.block_id)
+        self.olx_str = b'<problem/>'
+        self.static_files = []
+        self.reused_assets = []
+
+
+@mock.patch('openedx_blockstore_relay.block_serializer.compat.collect_assets_from_text', return_value=[])
+@mock.patch('openedx_blockstore_relay.transfer_data.compat')
+class ReplayHistoryTestCase(TestCase):
+    """
+    Tests for replay_history_to_blockstore(), against the fake Blockstore
+    server.
+    """
+
+    def setUp(self):
+        super(ReplayHistoryTestCase, self).setUp()
+        self.blockstore = use_fake_blockstore(self)
+
+        # The stored blocks (see compat.get_stored_blocks()) of each version of the course:
+        self.history = []
+        blocks = {
+            CHAPTER: self.stored_block(children=[SEQUENTIAL]),
+            SEQUENTIAL: self.stored_block(children=[VERTICAL]),
+            VERTICAL: self.stored_block(children=[HTML1]),
+            HTML1: self.stored_block(data='<p>First draft</p>'),
+        }
+        self.add_version(blocks)
+        blocks[HTML1] = self.stored_block(data='<p>Second draft</p>')
+        self.add_version(blocks, changed=[HTML1])
+        # A version in which only blocks outside of the chapter changed:
+        self.add_version(blocks, changed=[])
+        blocks[VERTICAL] = self.stored_block(children=[HTML1, HTML2])
+        blocks[HTML2] = self.stored_block(data='<p>New page</p>')
+        self.add_version(blocks, changed=[VERTICAL, HTML2])
+
+    @staticmethod
+    def stored_block(children=None, data=None):
+        """
+        Return a stored block with the given children or content.
+        """
+        fields = {'display_name': 'Block'}
+        if children is not None:
+            fields['children'] = children
+        return {
+            'fields': fields,
+            'definition_fields': {'data': data} if data is not None else {},
+            'asides': [],
+        }
+
+    def add_version(self, blocks, changed=None):
+        """
+        Add a version of the course with the given stored blocks, in which the
+        given blocks (all of them, by default) were edited.
+        """
+        version = 'version{}'.format(len(self.history) + 1)
+        previous = self.history[-1][1] if self.history else {}
+        block_versions = {}
+        for block_key in blocks:
+            if changed is None or block_key in changed:
+                block_versions[block_key] = version
+            else:
+                block_versions[block_key] = previous[block_key]
+        self.history.append((version, block_versions, copy.deepcopy(blocks)))
+
+    def replay(self, mock_compat):
+        """
+        Replay the history of the chapter into a new bundle, and return the
+        bundle's UUID.
+        """
+        versions = {version: (block_versions, blocks) for version, block_versions, blocks in self.history}
+
+        def get_block_versions(course_key, structure_version):
+            """ Stand-in for compat.get_block_versions() """
+            self.assertEqual(course_key, COURSE_KEY)
+            block_versions, blocks = versions[structure_version]
+            return {
+                block_key: (block_versions[block_key], stored_block['fields'].get('children', []))
+                for block_key, stored_block in blocks.items()
+            }
+
+        def get_stored_blocks(course_key, structure_version, usage_keys):  # pylint: disable=unused-argument
+            """ Stand-in for compat.get_stored_blocks() """
+            blocks = versions[structure_version][1]
+            return {block_key: blocks[block_key] for block_key in usage_keys}
+
+        mock_compat.get_structure_history.return_value = [version for version, _, _ in self.history]
+        mock_compat.get_block_versions.side_effect = get_block_versions
+        mock_compat.get_stored_blocks.side_effect = get_stored_blocks
+        mock_compat.get_block.return_value.scope_ids.usage_id = CHAPTER
+        mock_compat.get_block.return_value.display_name = 'Chapter 1'
+        return replay_history_to_blockstore(CHAPTER, collection_uuid=COLLECTION_UUID)
+
+    def test_replay_history(self, mock_compat, _mock_collect_assets):
+        bundle_uuid = self.replay(mock_compat)
+        # Only the blocks which changed in each version are serialized, and nothing is committed for a version in
+        # which nothing changed:
+        self.assertEqual(
+            [call[1]['usage_keys'] for call in mock_compat.get_stored_blocks.call_args_list],
+            [[CHAPTER, SEQUENTIAL, VERTICAL, HTML1], [HTML1], [VERTICAL, HTML2]],
+        )
+        self.assertEqual(len(self.blockstore.commits), 3)
+        transfers = Transfer.objects.filter(bundle_uuid=bundle_uuid).order_by('id')
+        self.assertEqual([transfer.blocks.count() for transfer in transfers], [4, 1, 2])
+        self.assertTrue(all(transfer.committed_at for transfer in transfers))
+        # Only the first commit has every block, so the others don't count as transfers of the whole chapter:
+        self.assertEqual([transfer.incremental for transfer in transfers], [False, True, True])
+        self.assertEqual(ledger.get_latest_transfer(CHAPTER), transfers[0])
+
+        bundle_files = self.blockstore.bundle_files(bundle_uuid)
+        self.assertEqual(bundle_files['html/html1/static/html1.html'], b'<p>Second draft</p>')
+        self.assertEqual(bundle_files['html/html2/static/html2.html'], b'<p>New page</p>')
+        manifest = json.loads(bundle_files['bundle.json'].decode('utf-8'))
+        self.assertEqual(len(manifest['components']), 5)
+        # The changed-only transfers into the bundle carry on from its current version:
+        self.assertEqual(len(ledger.get_subtree_hashes(bundle_uuid)), 5)
+
+    def test_manifest_only_uploaded_when_changed(self, mock_compat, _mock_collect_assets):
+        with mock.patch('openedx_blockstore_relay.sinks.add_file_to_draft') as mock_add_file:
+            with mock.patch('openedx_blockstore_relay.sinks.commit_draft'):
+                self.replay(mock_compat)
+        manifests = [call for call in mock_add_file.call_args_list if call[0][1] == 'bundle.json']
+        # Uploaded with the first version, and once the new block was added to it, but not for the edit in between:
+        self.assertEqual(len(manifests), 2)
+
+    def test_unserializable_block(self, mock_compat, _mock_collect_assets):
+        """
+        Test that blocks which can't be serialized from their stored fields are
+        loaded as they were in the version being replayed.
+        """
+        blocks = copy.deepcopy(self.history[-1][2])
+        blocks[VERTICAL]['fields']['children'].append(PROBLEM)
+        blocks[PROBLEM] = self.stored_block()
+        self.add_version(blocks, changed=[VERTICAL, PROBLEM])
+
+        def get_block_at_version(usage_key, structure_version):
+            """ Stand-in for compat.get_block_at_version() """
+            return mock.Mock(scope_ids=mock.Mock(usage_id=usage_key.for_version(None)), version=structure_version)
+
+        mock_compat.get_block_at_version.side_effect = get_block_at_version
+        with mock.patch('openedx_blockstore_relay.transfer_data.XBlockSerializer', side_effect=FakeSerializedBlock):
+            bundle_uuid = self.replay(mock_compat)
+        mock_compat.get_block_at_version.assert_called_once_with(PROBLEM, 'version5')
+        self.assertEqual(len(self.blockstore.commits), 4)
+        self.assertEqual(self.blockstore.bundle_files(bundle_uuid)['problem/problem1/definition.xml'], b'<problem/>')
+        transfer = Transfer.objects.filter(bundle_uuid=bundle_uuid).order_by('id').last()
+        self.assertEqual(
+            sorted(str(block.usage_key) for block in transfer.blocks.all()), sorted([str(PROBLEM), str(VERTICAL)]),
+        )
+
+    def test_not_split(self, mock_compat, _mock_collect_assets):
+        mock_compat.get_structure_history.return_value = None
+        with self.assertRaises(ValueError):
+            replay_history_to_blockstore(CHAPTER, collection_uuid=COLLECTION_UUID)
+        self.assertEqual(self.blockstore.commits, [])
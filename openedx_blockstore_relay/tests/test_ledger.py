@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` transfer ledger.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+
+from django.test import TestCase
+from opaque_keys.edx.keys import CourseKey
+
+from .. import ledger
+from ..block_serializer import ReusedAsset, StaticFile
+from ..hash_tree import BlockHashes
+from ..test_utils.serialized_block import SerializedBlock
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+UNIT_KEY = COURSE_KEY.make_usage_key('vertical', 'unit1')
+HTML_KEY = COURSE_KEY.make_usage_key('html', 'html1')
+BUNDLE_UUID = '93fc9c6e-4249-4d57-a63c-b08be9f4fe02'
+COLLECTION_UUID = '5e7f1c8a-0d1b-4c4e-9a43-31c1a4b4f9d2'
+OTHER_BUNDLE_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+DRAFT_UUID = '12345678-4249-4d57-a63c-a12354565756'
+
+
+def serialized_unit(html_data):
+    """
+    Return fake serialized blocks for a unit containing an HTML block.
+    """
+    return {
+        UNIT_KEY: SerializedBlock(UNIT_KEY, 'unit/unit1', b'<unit/>', []),
+        HTML_KEY: SerializedBlock(HTML_KEY, 'html/html1', b'<html/>', [StaticFile('html1.html', html_data)]),
+    }
+
+
+class LedgerTestCase(TestCase):
+    """
+    Tests for the transfer ledger API.
+    """
+
+    def transfer(self, bundle_uuid, html_data):
+        """
+        Record a whole (committed) transfer of the unit.
+        """
+        transfer = ledger.start_transfer(UNIT_KEY, bundle_uuid, DRAFT_UUID)
+        ledger.record_blocks(transfer, serialized_unit(html_data))
+        ledger.mark_committed(transfer)
+        return transfer
+
+    def test_record_transfer(self):
+        transfer = ledger.start_transfer(UNIT_KEY, BUNDLE_UUID, DRAFT_UUID)
+        self.assertEqual(transfer.course_key, COURSE_KEY)
+        self.assertIsNone(transfer.committed_at)
+        ledger.record_blocks(transfer, serialized_unit(b'<p>Hello</p>'))
+
+        # Uncommitted transfers don't count:
+        self.assertIsNone(ledger.get_latest_transfer(UNIT_KEY))
+        self.assertIsNone(ledger.locate_block(HTML_KEY))
+
+        ledger.mark_committed(transfer)
+        self.assertEqual(ledger.get_latest_transfer(UNIT_KEY), transfer)
+        self.assertEqual(list(ledger.get_course_transfers(COURSE_KEY)), [transfer])
+        location = ledger.locate_block(HTML_KEY)
+        self.assertEqual(location.transfer, transfer)
+        self.assertEqual(location.def_path, 'html/html1/definition.xml')
+        self.assertEqual(location.olx_digest, hashlib.sha1(b'<html/>').hexdigest())
+        self.assertEqual(location.asset_digests, {
+            'html/html1/static/html1.html': hashlib.sha1(b'<p>Hello</p>').hexdigest(),
+        })
+
+    def test_latest_transfer_wins(self):
+        self.transfer(BUNDLE_UUID, b'<p>Hello</p>')
+        latest = self.transfer(OTHER_BUNDLE_UUID, b'<p>Goodbye</p>')
+        self.assertEqual(ledger.get_latest_transfer(UNIT_KEY), latest)
+        self.assertEqual(ledger.locate_block(HTML_KEY).transfer, latest)
+        self.assertEqual(ledger.get_block_digests(BUNDLE_UUID), {
+            UNIT_KEY: hashlib.sha1(b'<unit/>').hexdigest(),
+            HTML_KEY: hashlib.sha1(b'<html/>').hexdigest(),
+        })
+
+    def test_bundle_contents(self):
+        self.transfer(BUNDLE_UUID, b'<p>Hello</p>')
+        self.transfer(OTHER_BUNDLE_UUID, b'<p>Other</p>')
+        # A later transfer of only the HTML block, with another static file:
+        transfer = ledger.start_transfer(HTML_KEY, BUNDLE_UUID, DRAFT_UUID)
+        ledger.record_blocks(transfer, {
+            HTML_KEY: SerializedBlock(HTML_KEY, 'html/html1', b'<html/>', [StaticFile('html2.html', b'<p>Hi</p>')]),
+        })
+        self.assertEqual(list(ledger.get_bundle_contents(BUNDLE_UUID).values())[1]['assets'],
+                         ['html/html1/static/html1.html'])
+        ledger.mark_committed(transfer)
+        contents = ledger.get_bundle_contents(BUNDLE_UUID)
+        self.assertEqual(list(contents), [UNIT_KEY, HTML_KEY])
+        self.assertEqual(contents[UNIT_KEY], {'components': ['unit/unit1/definition.xml'], 'assets': []})
+        self.assertEqual(contents[HTML_KEY], {
+            'components': ['html/html1/definition.xml'], 'assets': ['html/html1/static/html2.html'],
+        })
+
+    def test_transfer_since(self):
+        self.assertIsNone(ledger.get_transfer_since(UNIT_KEY))
+        committed = self.transfer(BUNDLE_UUID, b'<p>Hello</p>')
+        self.assertEqual(ledger.get_transfer_since(UNIT_KEY), committed)
+        uncommitted = ledger.start_transfer(UNIT_KEY, OTHER_BUNDLE_UUID, DRAFT_UUID)
+        self.assertEqual(ledger.get_transfer_since(UNIT_KEY), uncommitted)
+        self.assertEqual(ledger.get_transfer_since(UNIT_KEY, since=committed.committed_at), uncommitted)
+        self.assertIsNone(ledger.get_transfer_since(UNIT_KEY, since=uncommitted.created))
+
+    def test_transfers_in_collection(self):
+        ledger.mark_committed(ledger.start_transfer(UNIT_KEY, BUNDLE_UUID, collection_uuid=COLLECTION_UUID))
+        # A later transfer into the same bundle, which it didn't create:
+        latest = self.transfer(BUNDLE_UUID, b'<p>Hello</p>')
+        other = self.transfer(OTHER_BUNDLE_UUID, b'<p>Other</p>')
+        self.assertEqual(ledger.get_latest_transfer(UNIT_KEY), other)
+        self.assertEqual(ledger.get_latest_transfer(UNIT_KEY, collection_uuid=COLLECTION_UUID), latest)
+        self.assertEqual(ledger.get_transfer_since(UNIT_KEY, collection_uuid=COLLECTION_UUID), latest)
+        self.assertIsNone(ledger.get_transfer_since(UNIT_KEY, collection_uuid=DRAFT_UUID))
+
+    def test_local_destinations(self):
+        """
+        Test that transfers written to local files are kept apart from those
+        into Blockstore.
+        """
+        blockstore = self.transfer(BUNDLE_UUID, b'<p>Hello</p>')
+        local = ledger.start_transfer(UNIT_KEY, BUNDLE_UUID, DRAFT_UUID, destination='dir:/tmp/bundles')
+        ledger.record_blocks(local, serialized_unit(b'<p>Local</p>'))
+        ledger.mark_committed(local)
+        ledger.record_subtree_hashes(
+            BUNDLE_UUID, {UNIT_KEY: BlockHashes('local', 'local')}, destination=local.destination,
+        )
+
+        self.assertEqual(ledger.get_latest_transfer(UNIT_KEY), blockstore)
+        self.assertEqual(ledger.get_transfer_since(UNIT_KEY), blockstore)
+        self.assertEqual(ledger.locate_block(HTML_KEY).transfer, blockstore)
+        self.assertEqual(list(ledger.get_course_transfers(COURSE_KEY)), [blockstore])
+        self.assertEqual(ledger.get_subtree_hashes(BUNDLE_UUID), {})
+        self.assertEqual(ledger.get_latest_transfer(UNIT_KEY, destination=local.destination), local)
+        self.assertEqual(ledger.get_subtree_hashes(BUNDLE_UUID, local.destination), {
+            UNIT_KEY: BlockHashes('local', 'local'),
+        })
+
+    def test_asset_registry(self):
+        pdf_digest = hashlib.sha1(b'%PDF').hexdigest()
+        html = SerializedBlock(
+            HTML_KEY, 'html/html1', b'<html/>', [StaticFile('html1.html', b'<p>Hi</p>'), StaticFile('a.pdf', b'%PDF')],
+            reused_assets=[], asset_md5s={'a.pdf': 'md5-a'},
+        )
+        first = ledger.start_transfer(HTML_KEY, BUNDLE_UUID, DRAFT_UUID, collection_uuid=COLLECTION_UUID)
+        ledger.record_blocks(first, {HTML_KEY: html})
+        # Uncommitted transfers don't count:
+        self.assertEqual(ledger.get_bundle_assets(BUNDLE_UUID), {})
+        ledger.mark_committed(first)
+        self.assertEqual(ledger.get_bundle_assets(BUNDLE_UUID), {
+            'html/html1/static/a.pdf': ledger.BundleAsset('md5-a', pdf_digest, 4),
+        })
+
+        # A later transfer which reused the asset, and added another one:
+        html = html._replace(
+            static_files=[StaticFile('html1.html', b'<p>Hi</p>'), StaticFile('b.png', b'PNG')],
+            reused_assets=[ReusedAsset('a.pdf', pdf_digest, 4)],
+            asset_md5s={'a.pdf': 'md5-a', 'b.png': 'md5-b'},
+        )
+        self.assertEqual(ledger.block_digests(html)[1]['html/html1/static/a.pdf'], pdf_digest)
+        second = ledger.start_transfer(HTML_KEY, BUNDLE_UUID, DRAFT_UUID)
+        ledger.record_blocks(second, {HTML_KEY: html})
+        ledger.mark_committed(second)
+        self.assertEqual(set(ledger.get_bundle_assets(BUNDLE_UUID)), {
+            'html/html1/static/a.pdf', 'html/html1/static/b.png',
+        })
+
+        self.assertEqual([asset.transfer for asset in ledger.find_asset(asset_digest=pdf_digest)], [second, first])
+        self.assertEqual([asset.transfer for asset in ledger.find_asset(md5='md5-a', collection_uuid=COLLECTION_UUID)],
+                         [first])
+        self.assertEqual(list(ledger.find_asset(md5='md5-c')), [])
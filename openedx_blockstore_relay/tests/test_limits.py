@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` Blockstore rate limits.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import time
+from unittest import TestCase
+
+import mock
+from django.test.utils import override_settings
+
+from .. import blockstore_client, limits
+from ..limits import RateGovernor
+from ..test_utils.fake_blockstore import FakeBlockstore
+
+BUNDLE_UUID = '93fc9c6e-4249-4d57-a63c-b08be9f4fe02'
+
+
+def create_drafts(count):
+    """
+    Create the given number of drafts through blockstore_client, and return
+    the change in this process's throttle stats.
+    """
+    before = limits.get_throttle_stats()  # A forked process starts with its parent's
+    for _ in range(count):
+        blockstore_client.create_draft(BUNDLE_UUID, 'draft', 'Draft')
+    return {name: value - before[name] for name, value in limits.get_throttle_stats().items()}
+
+
+class FakeClock(object):
+    """
+    A clock which only moves when told to, or when sleeping.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        """ Move the clock forward """
+        self.now += seconds
+
+
+class RateGovernorTestCase(TestCase):
+    """
+    Tests for RateGovernor and limits.throttle().
+    """
+
+    def setUp(self):
+        super(RateGovernorTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'rate-limit')
+        self.addCleanup(limits._governors.clear)  # pylint: disable=protected-access
+
+    def test_requests(self):
+        clock = FakeClock()
+        governor = RateGovernor(self.path, requests_per_second=2, clock=clock, sleep=clock.sleep)
+        # The bucket starts full, with a second's worth of requests:
+        self.assertEqual([governor.reserve() for _ in range(4)], [0, 0, 0.5, 1.0])
+        # It refills at the given rate, up to one second's worth:
+        clock.now += 60
+        self.assertEqual([governor.throttle() for _ in range(3)], [0, 0, 0.5])
+        self.assertEqual(clock.now, 1060.5)
+        self.assertEqual(governor.stats(), {'wait_seconds': 2.0, 'throttled_calls': 3})
+
+    def test_bytes(self):
+        """
+        Test that the byte rate is shared by every governor using the same
+        file, and that uploads bigger than the rate just wait longer.
+        """
+        clock = FakeClock()
+        governor = RateGovernor(self.path, bytes_per_second=100, clock=clock, sleep=clock.sleep)
+        other_process = RateGovernor(self.path, bytes_per_second=100, clock=clock, sleep=clock.sleep)
+        self.assertEqual(governor.reserve(60), 0)
+        self.assertEqual(other_process.reserve(60), 0.2)
+        self.assertEqual(governor.reserve(280), 3.0)
+        self.assertEqual(other_process.stats(), {'wait_seconds': 3.2, 'throttled_calls': 2})
+
+    def test_state_file_private(self):
+        RateGovernor(self.path, requests_per_second=2).reserve()
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode) & 0o077, 0)
+        # A link (e.g. planted by another user) is never followed:
+        link_path = os.path.join(self.tmp_dir, 'link')
+        os.symlink(self.path, link_path)
+        with self.assertRaises(OSError):
+            RateGovernor(link_path, requests_per_second=2).reserve()
+
+    def test_default_file(self):
+        rate_limit_dir = os.path.join(self.tmp_dir, 'limits')
+        with mock.patch.object(limits, 'DEFAULT_RATE_LIMIT_DIR', rate_limit_dir), mock.patch.object(
+            limits, 'DEFAULT_RATE_LIMIT_FILE', os.path.join(rate_limit_dir, 'rate-limit'),
+        ):
+            self.assertEqual(
+                limits.rate_limit_path(None, 'blockstore.example.com:8250'),
+                os.path.join(rate_limit_dir, 'rate-limit.blockstore.example.com_8250'),
+            )
+            self.assertEqual(stat.S_IMODE(os.stat(rate_limit_dir).st_mode), 0o700)
+            # Nor is a directory which isn't private to this user used:
+            os.rmdir(rate_limit_dir)
+            os.symlink(self.tmp_dir, rate_limit_dir)
+            with self.assertRaises(ValueError):
+                limits.rate_limit_path(None, 'blockstore.example.com:8250')
+
+    def test_hosts(self):
+        """
+        Test that each Blockstore instance (e.g. a mirror) has rate limits of
+        its own.
+        """
+        with override_settings(
+            BLOCKSTORE_API_URL='http://blockstore.example.com/api/v1/',
+            BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND=1,
+            BLOCKSTORE_RELAY_RATE_LIMIT_FILE=self.path,
+        ):
+            governor = limits.get_rate_governor()
+            self.assertIs(limits.get_rate_governor('http://blockstore.example.com/api/v2/'), governor)
+            mirror = limits.get_rate_governor('https://mirror.example.com:8250/api/v1/')
+            self.assertNotEqual(mirror.path, governor.path)
+            self.assertEqual(mirror.path, self.path + '.mirror.example.com_8250')
+            self.assertEqual(governor.reserve(), 0)
+            self.assertEqual(mirror.reserve(), 0)
+
+    def test_disabled(self):
+        with override_settings(
+            BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND=None, BLOCKSTORE_RELAY_MAX_BYTES_PER_SECOND=None,
+        ):
+            self.assertIsNone(limits.get_rate_governor())
+            calls = limits.get_throttle_stats()['calls']
+            self.assertEqual(limits.throttle(1000), 0)
+            self.assertEqual(limits.get_throttle_stats()['calls'], calls + 1)
+
+    def test_processes(self):
+        """
+        Test that several processes calling Blockstore at the same time share
+        the request rate.
+        """
+        rate, processes, calls_per_process = 40, 3, 20
+        with FakeBlockstore() as blockstore, override_settings(
+            BLOCKSTORE_API_URL=blockstore.url,
+            BLOCKSTORE_RELAY_MAX_REQUESTS_PER_SECOND=rate,
+            BLOCKSTORE_RELAY_RATE_LIMIT_FILE=self.path,
+        ):
+            started = time.time()
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(create_drafts, [calls_per_process] * processes)
+            finally:
+                pool.close()
+                pool.join()
+            elapsed = time.time() - started
+            shared_stats = limits.get_rate_governor().stats()
+        self.assertEqual(len(blockstore.drafts), processes * calls_per_process)
+        # Beyond the first second's worth of requests, they were sent no faster than the rate:
+        self.assertGreaterEqual(elapsed, (processes * calls_per_process - rate) / rate * 0.9)
+        self.assertEqual(sum(result['calls'] for result in results), processes * calls_per_process)
+        self.assertAlmostEqual(sum(result['wait_seconds'] for result in results), shared_stats['wait_seconds'])
+        self.assertEqual(sum(result['throttled_calls'] for result in results), shared_stats['throttled_calls'])
+        self.assertGreater(shared_stats['throttled_calls'], 0)
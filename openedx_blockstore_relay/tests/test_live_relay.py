@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` live relay.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from datetime import timedelta
+
+import mock
+from django.db import transaction
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from opaque_keys.edx.keys import CourseKey
+
+from .. import ledger, live_relay, signals
+from ..live_relay import coalesce_subtrees, relay_pending_changes
+from ..models import PendingChange, RelayedCourse
+from ..tasks import relay_changes_task
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+COURSE = COURSE_KEY.make_usage_key('course', 'course')
+CHAPTER = COURSE_KEY.make_usage_key('chapter', 'chapter1')
+SEQUENTIAL = COURSE_KEY.make_usage_key('sequential', 'sequential1')
+UNIT_1 = COURSE_KEY.make_usage_key('vertical', 'unit1')
+UNIT_2 = COURSE_KEY.make_usage_key('vertical', 'unit2')
+HTML_1 = COURSE_KEY.make_usage_key('html', 'html1')
+HTML_2 = COURSE_KEY.make_usage_key('html', 'html2')
+BUNDLE_UUID = '93fc9c6e-4249-4d57-a63c-b08be9f4fe02'
+PARENTS = {
+    CHAPTER: COURSE, SEQUENTIAL: CHAPTER, UNIT_1: SEQUENTIAL, UNIT_2: SEQUENTIAL, HTML_1: UNIT_1, HTML_2: UNIT_2,
+}
+
+
+class CoalesceSubtreesTestCase(TestCase):
+    """
+    Tests for coalesce_subtrees()
+    """
+
+    def test_coalesce(self):
+        self.assertEqual(coalesce_subtrees([HTML_1, UNIT_1, HTML_2], PARENTS.get), {UNIT_1, HTML_2})
+        self.assertEqual(coalesce_subtrees([HTML_1, HTML_2, CHAPTER], PARENTS.get), {CHAPTER})
+        self.assertEqual(coalesce_subtrees([HTML_1, HTML_2], PARENTS.get), {HTML_1, HTML_2})
+        self.assertEqual(coalesce_subtrees([], PARENTS.get), set())
+
+
+@override_settings(BLOCKSTORE_RELAY_LIVE=True)
+@mock.patch('openedx_blockstore_relay.live_relay._schedule_relay')
+class PendingChangesTestCase(TestCase):
+    """
+    Tests for batching the changes to a course.
+    """
+
+    def setUp(self):
+        super(PendingChangesTestCase, self).setUp()
+        self.relay = mock.Mock()
+        self.start = timezone.now()
+
+    def change(self, usage_key, seconds):
+        """
+        Record a change to the given block, the given number of seconds after the start.
+        """
+        live_relay.block_changed(usage_key)
+        change = PendingChange.objects.latest('id')
+        change.changed_at = self.start + timedelta(seconds=seconds)
+        change.save()
+
+    def relay_at(self, seconds):
+        """
+        Run relay_pending_changes() the given number of seconds after the start.
+        """
+        relay_pending_changes(COURSE_KEY, self.relay, now=self.start + timedelta(seconds=seconds))
+
+    def test_burst_of_changes_is_one_batch(self, mock_schedule):
+        """
+        Test that a burst of changes results in a single relay, once the
+        changes have stopped for the debounce period.
+        """
+        for i in range(200):
+            self.change(HTML_1 if i % 2 else HTML_2, i)
+        # Only the first change scheduled a relay:
+        mock_schedule.assert_called_once_with(COURSE_KEY, 30)
+
+        # The task finds the batch isn't due yet, so it runs again when it is:
+        self.relay_at(30)
+        self.relay.assert_not_called()
+        mock_schedule.assert_called_with(COURSE_KEY, 199)
+
+        self.relay_at(229)
+        relayed_course, usage_keys = self.relay.call_args[0]
+        self.assertEqual(relayed_course.course_key, COURSE_KEY)
+        self.assertEqual(usage_keys, {HTML_1, HTML_2})
+        self.assertFalse(PendingChange.objects.exists())
+        self.assertEqual(mock_schedule.call_count, 2)
+        # A second run has nothing left to do, and the next change starts a new batch:
+        self.relay_at(300)
+        self.relay.assert_called_once()
+        self.change(HTML_1, 400)
+        self.assertEqual(mock_schedule.call_count, 3)
+
+    @override_settings(BLOCKSTORE_RELAY_LIVE_DEBOUNCE_SECONDS=30, BLOCKSTORE_RELAY_LIVE_MAX_DELAY_SECONDS=300)
+    def test_max_delay(self, mock_schedule):
+        """
+        Test that a steady stream of changes can't postpone a relay beyond the
+        maximum delay.
+        """
+        self.change(HTML_1, 0)
+        self.change(HTML_2, 290)
+        self.relay_at(295)
+        mock_schedule.assert_called_with(COURSE_KEY, 5)
+        self.relay_at(300)
+        self.relay.assert_called_once()
+
+    def test_changes_while_relaying(self, mock_schedule):
+        """
+        Test that changes made while a batch is being relayed are relayed in
+        the next batch.
+        """
+        self.change(HTML_1, 0)
+        self.relay.side_effect = lambda relayed_course, usage_keys: self.change(HTML_2, 40)
+        self.relay_at(30)
+        mock_schedule.assert_called_with(COURSE_KEY, 30)
+        self.assertEqual([change.usage_key for change in PendingChange.objects.all()], [HTML_2])
+
+    def test_relay_fails(self, mock_schedule):
+        self.change(HTML_1, 0)
+
+        def relay(relayed_course, usage_keys):  # pylint: disable=unused-argument
+            """ Save the bundle UUID, then fail """
+            relayed_course.bundle_uuid = BUNDLE_UUID
+            relayed_course.save(update_fields=['bundle_uuid'])
+            raise IOError
+        self.relay.side_effect = relay
+        with self.assertRaises(IOError):
+            self.relay_at(30)
+        # The batch is kept, and retried later, but what the relay saved is kept too:
+        self.assertEqual(PendingChange.objects.count(), 1)
+        mock_schedule.assert_called_with(COURSE_KEY, 300)
+        relayed_course = RelayedCourse.objects.get(course_key=COURSE_KEY)
+        self.assertEqual(str(relayed_course.bundle_uuid), BUNDLE_UUID)
+        self.assertIsNone(relayed_course.relay_started)
+
+    def test_relay_outside_transaction(self, mock_schedule):  # pylint: disable=unused-argument
+        """
+        Test that the course's batch is claimed before it is relayed, rather
+        than relayed while the course's row is locked.
+        """
+        self.change(HTML_1, 0)
+        test_atomic_blocks = len(transaction.get_connection().savepoint_ids)  # Those of the TestCase itself
+
+        def relay(relayed_course, usage_keys):  # pylint: disable=unused-argument
+            """ Check that the batch has been claimed, outside of the claim's transaction """
+            self.assertEqual(len(transaction.get_connection().savepoint_ids), test_atomic_blocks)
+            self.assertIsNotNone(RelayedCourse.objects.get(course_key=COURSE_KEY).relay_started)
+        self.relay.side_effect = relay
+        self.relay_at(30)
+        self.relay.assert_called_once()
+
+    def test_concurrent_relays(self, mock_schedule):
+        """
+        Test that a relay of a course whose batch is claimed by another one
+        leaves it alone.
+        """
+        self.change(HTML_1, 0)
+        relayed_course = RelayedCourse.objects.create(course_key=COURSE_KEY, relay_started=self.start)
+        self.relay_at(60)
+        self.relay.assert_not_called()
+        # It tries again once the other relay's claim times out, in case it died:
+        mock_schedule.assert_called_with(COURSE_KEY, live_relay.RELAY_CLAIM_TIMEOUT.total_seconds() - 60)
+        self.relay_at(live_relay.RELAY_CLAIM_TIMEOUT.total_seconds())
+        self.relay.assert_called_once()
+        relayed_course.refresh_from_db()
+        self.assertIsNone(relayed_course.relay_started)
+        self.assertFalse(PendingChange.objects.exists())
+
+
+@mock.patch('openedx_blockstore_relay.signals.compat')
+@mock.patch('openedx_blockstore_relay.live_relay._schedule_relay')
+class SignalsTestCase(TestCase):
+    """
+    Tests for the signal receivers.
+    """
+
+    def test_disabled_by_default(self, mock_schedule, mock_compat):
+        signals.relay_course_published(sender=None, course_key=COURSE_KEY)
+        signals.relay_item_changed(sender=None, usage_key=HTML_1, user_id=1)
+        mock_schedule.assert_not_called()
+        self.assertFalse(PendingChange.objects.exists())
+
+    @override_settings(BLOCKSTORE_RELAY_LIVE=True)
+    def test_course_published(self, mock_schedule, mock_compat):
+        mock_compat.get_course_root_key.return_value = COURSE
+        signals.relay_course_published(sender=None, course_key=COURSE_KEY)
+        self.assertEqual([change.usage_key for change in PendingChange.objects.all()], [COURSE])
+        mock_schedule.assert_called_once_with(COURSE_KEY, 30)
+
+    @override_settings(BLOCKSTORE_RELAY_LIVE=True)
+    def test_item_changed(self, mock_schedule, mock_compat):
+        signals.relay_item_changed(sender=None, usage_key=HTML_1, user_id=1)
+        mock_compat.get_course_root_key.assert_not_called()
+        self.assertEqual([change.usage_key for change in PendingChange.objects.all()], [HTML_1])
+
+
+@override_settings(BLOCKSTORE_RELAY_LIVE_COLLECTION_UUID='d3e311a8-b3a8-439d-a111-cc6cb99790e8')
+@mock.patch('openedx_blockstore_relay.live_relay._schedule_relay')
+@mock.patch('openedx_blockstore_relay.tasks.transfer_subtrees_to_blockstore')
+@mock.patch('openedx_blockstore_relay.tasks.transfer_changes_to_blockstore')
+@mock.patch('openedx_blockstore_relay.tasks.create_destination_bundle')
+@mock.patch('openedx_blockstore_relay.tasks.compat')
+class RelayChangesTaskTestCase(TestCase):
+    """
+    Tests for relay_changes_task
+    """
+
+    def relay(self, *block_keys):
+        """
+        Relay a batch of changes to the given blocks, made long enough ago to be due.
+        """
+        for block_key in block_keys:
+            PendingChange.objects.create(
+                course_key=COURSE_KEY, usage_key=block_key, changed_at=timezone.now() - timedelta(minutes=10),
+            )
+        relay_changes_task(str(COURSE_KEY))
+        self.assertFalse(PendingChange.objects.exists())
+
+    def test_relay(
+        self, mock_compat, mock_create_bundle, mock_transfer_changes, mock_transfer_subtrees, _mock_schedule,
+    ):
+        mock_compat.get_course_root_key.return_value = COURSE
+        mock_compat.get_parent_key.side_effect = PARENTS.get
+        mock_compat.has_block.side_effect = lambda block_key: block_key != HTML_2
+        mock_create_bundle.return_value = BUNDLE_UUID
+
+        # The first batch of changes creates a new bundle, and transfers the whole course into it:
+        self.relay(HTML_1)
+        mock_create_bundle.assert_called_once_with(
+            mock_compat.get_block.return_value, 'd3e311a8-b3a8-439d-a111-cc6cb99790e8',
+        )
+        mock_compat.get_block.assert_called_once_with(COURSE)
+        mock_transfer_changes.assert_called_once_with(COURSE, BUNDLE_UUID, reuse_assets=True)
+        mock_transfer_subtrees.assert_not_called()
+        self.assertEqual(str(RelayedCourse.objects.get(course_key=COURSE_KEY).bundle_uuid), BUNDLE_UUID)
+
+        # Later batches only transfer the changed subtrees, into that bundle:
+        self.relay(HTML_1, UNIT_1, UNIT_2)
+        mock_transfer_subtrees.assert_called_once_with({UNIT_1, UNIT_2}, BUNDLE_UUID, reuse_assets=True)
+
+        # Changes to the root (as when the course is published) only transfer the blocks which have changed:
+        self.relay(HTML_1, COURSE)
+        self.assertEqual(mock_transfer_changes.call_count, 2)
+        mock_transfer_changes.assert_called_with(COURSE, BUNDLE_UUID, reuse_assets=True)
+
+        # So do deleted blocks:
+        self.relay(HTML_1, HTML_2)
+        self.assertEqual(mock_transfer_changes.call_count, 3)
+        mock_transfer_changes.assert_called_with(COURSE, BUNDLE_UUID, reuse_assets=True)
+        mock_create_bundle.assert_called_once()
+
+    def test_failed_first_relay(
+        self, mock_compat, mock_create_bundle, mock_transfer_changes, _mock_transfer_subtrees, _mock_schedule,
+    ):
+        """
+        Test that a first relay which fails after creating the course's bundle
+        is retried into the same bundle, rather than a new one.
+        """
+        mock_compat.get_course_root_key.return_value = COURSE
+        mock_compat.get_parent_key.side_effect = PARENTS.get
+        mock_create_bundle.return_value = BUNDLE_UUID
+        mock_transfer_changes.side_effect = IOError
+        PendingChange.objects.create(
+            course_key=COURSE_KEY, usage_key=HTML_1, changed_at=timezone.now() - timedelta(minutes=10),
+        )
+        with self.assertRaises(IOError):
+            relay_changes_task(str(COURSE_KEY))
+        self.assertEqual(str(RelayedCourse.objects.get(course_key=COURSE_KEY).bundle_uuid), BUNDLE_UUID)
+
+        mock_transfer_changes.side_effect = None
+        self.relay()
+        mock_create_bundle.assert_called_once()
+        mock_transfer_changes.assert_called_with(COURSE, BUNDLE_UUID, reuse_assets=True)
+
+    def test_existing_transfer(
+        self, mock_compat, mock_create_bundle, mock_transfer_changes, mock_transfer_subtrees, _mock_schedule,
+    ):
+        """
+        Test that a course which was transferred before the live relay was
+        turned on is relayed into the same bundle.
+        """
+        mock_compat.get_course_root_key.return_value = COURSE
+        mock_compat.get_parent_key.side_effect = PARENTS.get
+        ledger.mark_committed(ledger.start_transfer(COURSE, BUNDLE_UUID))
+        self.relay(HTML_1)
+        mock_create_bundle.assert_not_called()
+        mock_transfer_changes.assert_not_called()
+        mock_transfer_subtrees.assert_called_once_with({HTML_1}, BUNDLE_UUID, reuse_assets=True)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for transferring courses from OLX course exports.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import tarfile
+import tempfile
+
+import mock
+from django.test import TestCase
+from django.test.utils import override_settings
+from opaque_keys.edx.keys import CourseKey
+
+from ..asset_cache import MMAP_MIN_BYTES
+from ..ledger import get_latest_transfer
+from ..models import Transfer
+from ..olx_export import OlxExport
+from ..sinks import DirectorySink
+from ..test_utils.fake_blockstore import FakeBlockstore
+from ..transfer_data import transfer_export_to_blockstore
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+2020')
+COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+
+EXPORT_FILES = {
+    'course.xml': '<course url_name="2020" org="edX" course="DemoX"/>',
+    'course/2020.xml': '<course display_name="Demo Course"><chapter url_name="chapter1"/><wiki slug="demo"/></course>',
+    'chapter/chapter1.xml': '<chapter display_name="Chapter 1"><sequential url_name="sequential1"/></chapter>',
+    # A unit whose children are inline, and which has an inline child of its own:
+    'sequential/sequential1.xml': (
+        '<sequential display_name="Subsection 1">'
+        '<vertical url_name="vertical1" display_name="Unit 1">'
+        '<html url_name="intro" display_name="Intro">Hello <img src="/static/images/logo.png"/></html>'
+        '<html url_name="page"/>'
+        '<problem url_name="problem1"/>'
+        '</vertical>'
+        '</sequential>'
+    ),
+    'html/page.xml': '<html filename="page" display_name="Page"/>',
+    'html/page.html': '<p>See the <a href="/static/handout.pdf">handout</a>.</p>',
+    'problem/problem1.xml': '<problem display_name="Question"><multiplechoiceresponse/></problem>',
+    'policies/2020/policy.json': json.dumps({'course/2020': {'start': '2020-01-01T00:00:00Z', 'days_early': 2}}),
+    'static/images/logo.png': 'logo',
+}
+
+
+class OlxExportTestCase(TestCase):
+    """
+    Tests for reading and transferring course exports.
+    """
+
+    def setUp(self):
+        super(OlxExportTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.export_dir = os.path.join(self.tmp_dir, 'course')
+        for path, content in EXPORT_FILES.items():
+            self.write_file(path, content.encode('utf-8'))
+        self.handout = os.urandom(MMAP_MIN_BYTES + 1)
+        self.write_file('static/handout.pdf', self.handout)
+
+    def write_file(self, path, data):
+        """
+        Write the given file of the export.
+        """
+        full_path = os.path.join(self.export_dir, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, 'wb') as export_file:
+            export_file.write(data)
+
+    def make_archive(self, extra_member=None):
+        """
+        Archive the export, as Studio does, and return the archive's path.
+        """
+        archive_path = os.path.join(self.tmp_dir, 'course.tar.gz')
+        with tarfile.open(archive_path, 'w:gz') as archive:
+            archive.add(self.export_dir, arcname='course')
+            if extra_member:
+                info = tarfile.TarInfo(extra_member)
+                info.size = 4
+                archive.addfile(info, io.BytesIO(b'evil'))
+        return archive_path
+
+    def test_read_blocks(self):
+        with OlxExport(self.export_dir) as export:
+            self.assertEqual(export.course_key, COURSE_KEY)
+            blocks = {block.usage_key: block for block in export.iter_blocks()}
+        course = blocks[COURSE_KEY.make_usage_key('course', 'course')]
+        self.assertEqual(course.children, [COURSE_KEY.make_usage_key('chapter', 'chapter1')])
+        self.assertEqual(course.display_name, 'Demo Course')
+        # Elements which aren't blocks are kept, and the policy's settings are added:
+        self.assertEqual([child.tag for child in course.olx_node], ['wiki'])
+        self.assertEqual(course.olx_node.get('start'), '2020-01-01T00:00:00Z')
+        self.assertEqual(course.olx_node.get('days_early'), '2')
+
+        vertical = blocks[COURSE_KEY.make_usage_key('vertical', 'vertical1')]
+        self.assertEqual(
+            [str(child) for child in vertical.children],
+            [str(COURSE_KEY.make_usage_key(block_type, block_id))
+             for block_type, block_id in (('html', 'intro'), ('html', 'page'), ('problem', 'problem1'))],
+        )
+        self.assertEqual(blocks[COURSE_KEY.make_usage_key('html', 'intro')].html_data,
+                         'Hello <img src="/static/images/logo.png"/>')
+        page = blocks[COURSE_KEY.make_usage_key('html', 'page')]
+        self.assertEqual(page.html_data, EXPORT_FILES['html/page.html'])
+        self.assertEqual(dict(page.olx_node.attrib), {'filename': 'page', 'display_name': 'Page'})
+        problem = blocks[COURSE_KEY.make_usage_key('problem', 'problem1')]
+        self.assertEqual([child.tag for child in problem.olx_node], ['multiplechoiceresponse'])
+        self.assertEqual(len(blocks), 7)
+
+    def test_pointer_content(self):
+        """
+        Test that an element of a block's content which looks like a pointer is
+        only treated as a child block if the file it points to exists.
+        """
+        self.write_file('problem/problem1.xml', b'<problem><script url_name="solution"/></problem>')
+        self.write_file('script/solution', b'not a block')  # A directory or other file isn't the block's OLX
+        with OlxExport(self.export_dir) as export:
+            blocks = {block.usage_key: block for block in export.iter_blocks()}
+        problem = blocks[COURSE_KEY.make_usage_key('problem', 'problem1')]
+        self.assertEqual(problem.children, [])
+        self.assertEqual([child.tag for child in problem.olx_node], ['script'])
+        self.assertEqual(len(blocks), 7)
+
+    def test_asset_digest_cached(self):
+        with OlxExport(self.export_dir) as export:
+            asset = export.static_asset('images/logo.png')
+            digest = hashlib.md5(b'logo').hexdigest()
+            with mock.patch('openedx_blockstore_relay.olx_export.hashlib.md5', wraps=hashlib.md5) as mock_md5:
+                self.assertEqual(asset.content_digest, digest)
+                self.assertEqual(asset.content_digest, digest)
+            self.assertEqual(mock_md5.call_count, 1)
+
+    def test_large_assets_mapped(self):
+        with OlxExport(self.export_dir) as export:
+            self.assertIsInstance(export.static_asset('handout.pdf').data, mmap.mmap)
+            self.assertEqual(export.static_asset('images/logo.png').data, b'logo')
+            self.assertEqual(export.static_asset('images/logo.png').location.path, 'images_logo.png')
+            self.assertIsNone(export.static_asset('../course.xml'))
+            self.assertIsNone(export.static_asset('missing.png'))
+
+    def test_archive(self):
+        with OlxExport(self.make_archive(extra_member='../evil.txt')) as export:
+            tmp_dir = export.root
+            self.assertEqual(len(list(export.iter_blocks())), 7)
+            self.assertEqual(export.static_asset('handout.pdf').data[:], self.handout)
+        # The extracted files are removed, and the archive can't write outside of them:
+        self.assertFalse(os.path.exists(tmp_dir))
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(os.path.dirname(tmp_dir)), 'evil.txt')))
+
+    def test_no_course(self):
+        os.remove(os.path.join(self.export_dir, 'course.xml'))
+        with self.assertRaises(ValueError):
+            OlxExport(self.export_dir)
+
+    def test_transfer(self):
+        with FakeBlockstore() as blockstore, override_settings(BLOCKSTORE_API_URL=blockstore.url):
+            bundle_uuid = transfer_export_to_blockstore(self.export_dir, collection_uuid=COLLECTION_UUID)
+            bundle_files = blockstore.bundle_files(bundle_uuid)
+            archive_bundle_uuid = transfer_export_to_blockstore(self.make_archive(), collection_uuid=COLLECTION_UUID)
+            # The archive gives the same bundle as the directory:
+            self.assertEqual(blockstore.bundle_files(archive_bundle_uuid), bundle_files)
+        self.assertEqual(blockstore.bundles[bundle_uuid]['title'], 'Demo Course')
+
+        self.assertEqual(
+            bundle_files['unit/vertical1/definition.xml'].split(b'<!--')[0],
+            b'<unit display_name="Unit 1">\n'
+            b'  <xblock-include definition="html/intro"/>\n'
+            b'  <xblock-include definition="html/page"/>\n'
+            b'  <xblock-include definition="problem/problem1"/>\n'
+            b'</unit>\n',
+        )
+        self.assertIn(b'<html filename="intro" display_name="Intro"/>', bundle_files['html/intro/definition.xml'])
+        self.assertEqual(bundle_files['html/intro/static/intro.html'], b'Hello <img src="/static/images/logo.png"/>')
+        self.assertEqual(bundle_files['html/intro/static/images_logo.png'], b'logo')
+        self.assertEqual(bundle_files['html/page/static/handout.pdf'], self.handout)
+        self.assertIn(b'<wiki slug="demo"/>', bundle_files['course/course/definition.xml'])
+        manifest = json.loads(bundle_files['bundle.json'].decode('utf-8'))
+        self.assertEqual(len(manifest['components']), 7)
+
+        transfer = Transfer.objects.get(bundle_uuid=bundle_uuid)
+        self.assertEqual(transfer.root_key, COURSE_KEY.make_usage_key('course', 'course'))
+        self.assertTrue(transfer.committed_at)
+        self.assertEqual(transfer.blocks.count(), 7)
+
+    def test_transfer_to_directory(self):
+        output_dir = os.path.join(self.tmp_dir, 'output')
+        sink = DirectorySink(output_dir)
+        bundle_uuid = transfer_export_to_blockstore(self.export_dir, collection_uuid=COLLECTION_UUID, sink=sink)
+        self.assertTrue(os.path.isfile(os.path.join(sink.bundle_path(bundle_uuid), 'bundle.json')))
+        # The transfer is recorded against the directory, so Blockstore lookups don't find it:
+        transfer = Transfer.objects.get()
+        self.assertEqual(transfer.destination, sink.destination)
+        self.assertIsNone(get_latest_transfer(COURSE_KEY.make_usage_key('course', 'course')))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` upload pipeline.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+import threading
+import time
+from unittest import TestCase
+
+from opaque_keys.edx.keys import CourseKey
+
+from ..block_serializer import StaticFile
+from ..pipeline import ByteBudget, TransferAborted, UploadPipeline, inflight_cost
+from ..progress import TransferProgress
+from ..test_utils.serialized_block import SerializedBlock
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+DRAFT_UUID = '12345678-4249-4d57-a63c-a12354565756'
+
+
+def synthetic_course(num_blocks, max_file_size, seed=0):
+    """
+    Yield fake serialized blocks with static files of random sizes, generating
+    each block only when asked for it (like the real serializer does).
+    """
+    rand = random.Random(seed)
+    for i in range(num_blocks):
+        block_key = COURSE_KEY.make_usage_key('html', 'html{}'.format(i))
+        static_files = [
+            StaticFile('file{}.bin'.format(j), b'x' * rand.randint(0, max_file_size)) for j in range(rand.randint(0, 3))
+        ]
+        yield SerializedBlock(block_key, 'html/html{}'.format(i), b'<html/>', static_files)
+
+
+class FakeUploader(object):
+    """
+    Records uploads, taking a little time over each one.
+    """
+
+    def __init__(self, fail_on=None):
+        self.uploaded = {}
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+        self.requests = []  # The paths uploaded by each request, in order
+
+    def __call__(self, draft_uuid, path, data):
+        self.upload_batch(draft_uuid, [(path, data)])
+
+    def upload_batch(self, draft_uuid, files):
+        time.sleep(0.0005)
+        for path, data in files:
+            if path == self.fail_on:
+                raise IOError('Upload of {} failed'.format(path))
+        with self.lock:
+            self.requests.append([path for path, _data in files])
+            for path, data in files:
+                self.uploaded[path] = len(data)
+
+
+class ByteBudgetTestCase(TestCase):
+    """
+    Tests for ByteBudget
+    """
+
+    def test_blocks_until_released(self):
+        budget = ByteBudget(100)
+        budget.acquire(60)
+        acquired = threading.Event()
+
+        def acquire_more():
+            budget.acquire(60)
+            acquired.set()
+        thread = threading.Thread(target=acquire_more)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        budget.release(60)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(budget.in_use, 60)
+        self.assertEqual(budget.peak, 60)
+
+    def test_oversized_request(self):
+        """
+        Test that a request larger than the whole budget doesn't block forever.
+        """
+        budget = ByteBudget(100)
+        budget.acquire(500)
+        self.assertEqual(budget.peak, 500)
+
+    def test_abort(self):
+        budget = ByteBudget(100)
+        budget.acquire(100)
+        budget.abort()
+        with self.assertRaises(TransferAborted):
+            budget.acquire(1)
+
+
+class UploadPipelineTestCase(TestCase):
+    """
+    Tests for UploadPipeline
+    """
+
+    def test_peak_memory_within_budget(self):
+        """
+        Test that on a large course, the data in flight never exceeds the
+        budget, and that everything still gets uploaded.
+        """
+        max_inflight_bytes = 2 * 1024 * 1024
+        max_file_size = 64 * 1024
+        uploader = FakeUploader()
+        manifest = {'components': [], 'assets': []}
+        progress = TransferProgress(COURSE_KEY, interval=1000)
+        pipeline = UploadPipeline(
+            uploader, DRAFT_UUID, manifest, progress=progress, max_inflight_bytes=max_inflight_bytes, workers=4,
+        )
+        expected = {}
+        for data in synthetic_course(2000, max_file_size):
+            expected['{}/definition.xml'.format(data.def_id)] = len(data.olx_str)
+            for asset_file in data.static_files:
+                expected['{}/static/{}'.format(data.def_id, asset_file.name)] = len(asset_file.data)
+            pipeline.add_block(data)
+        pipeline.close()
+
+        self.assertEqual(uploader.uploaded, expected)
+        self.assertEqual(set(manifest['components'] + manifest['assets']), set(expected))
+        self.assertEqual(progress.blocks_done, 2000)
+        self.assertEqual(progress.bytes_done, sum(expected.values()))
+        self.assertEqual(pipeline.budget.in_use, 0)
+        self.assertLessEqual(pipeline.budget.peak, max_inflight_bytes)
+        # The budget must actually have been the limiting factor:
+        self.assertGreater(pipeline.budget.peak, max_inflight_bytes - 4 * inflight_cost(max_file_size))
+        self.assertGreater(pipeline.budget.wait_seconds, 0)
+
+    def test_upload_error(self):
+        """
+        Test that a failed upload stops the producer and is re-raised.
+        """
+        uploader = FakeUploader(fail_on='html/html10/definition.xml')
+        pipeline = UploadPipeline(
+            uploader, DRAFT_UUID, {'components': [], 'assets': []}, max_inflight_bytes=64 * 1024, workers=2,
+        )
+        with self.assertRaises(TransferAborted):
+            for data in synthetic_course(2000, 16 * 1024):
+                pipeline.add_block(data)
+        with self.assertRaisesRegexp(IOError, 'html10'):
+            pipeline.close()
+        self.assertLess(len(uploader.uploaded), 2000)
+
+    def test_lanes(self):
+        """
+        Test that large files are uploaded largest first, on their own, and
+        small files in batches.
+        """
+        uploader = FakeUploader()
+        progress = TransferProgress(COURSE_KEY, interval=1000)
+        pipeline = UploadPipeline(
+            uploader, DRAFT_UUID, {'components': [], 'assets': []}, progress=progress,
+            max_inflight_bytes=10 * 1024 * 1024, workers=2,
+            upload_batch=uploader.upload_batch, large_file_bytes=1000, batch_max_files=10,
+        )
+        started_first = threading.Event()
+        finish_first = threading.Event()
+        upload = pipeline.upload
+
+        def upload_after_first(draft_uuid, path, data):
+            """ Hold the large-file worker on the first file, until all of the others are queued """
+            if not started_first.is_set():
+                started_first.set()
+                finish_first.wait(5)
+            upload(draft_uuid, path, data)
+        pipeline.upload = upload_after_first
+
+        def add_block(i, big_file_size):
+            """ Add a block with a large file and 4 small ones """
+            static_files = [StaticFile('big.bin', b'x' * big_file_size)] + [
+                StaticFile('small{}.txt'.format(j), b'y' * 10) for j in range(4)
+            ]
+            block_key = COURSE_KEY.make_usage_key('html', 'html{}'.format(i))
+            pipeline.add_block(SerializedBlock(block_key, 'html/html{}'.format(i), b'<html/>', static_files))
+
+        add_block(0, 1000)
+        self.assertTrue(started_first.wait(5))
+        for i, size in enumerate([1500, 3000, 2000], 1):
+            add_block(i, size)
+        finish_first.set()
+        pipeline.close()
+
+        large_requests = [paths for paths in uploader.requests if paths[0].endswith('big.bin')]
+        self.assertEqual(large_requests, [
+            ['html/html0/static/big.bin'],
+            ['html/html2/static/big.bin'],
+            ['html/html3/static/big.bin'],
+            ['html/html1/static/big.bin'],
+        ])
+        small_requests = [paths for paths in uploader.requests if not paths[0].endswith('big.bin')]
+        self.assertEqual([len(paths) for paths in small_requests], [10, 10])
+        self.assertEqual(len(uploader.uploaded), 4 * 6)
+        self.assertEqual(progress.blocks_done, 4)
+        self.assertEqual(progress.files_done, 4 * 6)
+
+    def test_batches_within_budget(self):
+        """
+        Test that a partly filled batch doesn't keep the producer waiting for
+        budget that the batch itself holds.
+        """
+        uploader = FakeUploader()
+        pipeline = UploadPipeline(
+            uploader, DRAFT_UUID, {'components': [], 'assets': []}, max_inflight_bytes=64 * 1024, workers=2,
+            upload_batch=uploader.upload_batch, batch_max_files=1000, batch_max_bytes=10 * 1024 * 1024,
+        )
+        blocks = list(synthetic_course(200, 16 * 1024))
+        for data in blocks:
+            pipeline.add_block(data)
+        pipeline.close()
+        self.assertEqual(len(uploader.uploaded), sum(1 + len(data.static_files) for data in blocks))
+        self.assertEqual(pipeline.budget.in_use, 0)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` progress module.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+from unittest import TestCase
+
+import mock
+
+from ..progress import STAGE_COMMITTED, STAGE_SERIALIZED, STAGE_UPLOADING, TransferProgress
+
+
+class FakeClock(object):
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TransferProgressTestCase(TestCase):
+    """
+    Tests for TransferProgress.
+    """
+
+    def setUp(self):
+        super(TransferProgressTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.events = []
+        self.progress = TransferProgress(
+            'block-v1:A+B+C+type@course+block@course',
+            callback=self.events.append,
+            interval=5,
+            clock=self.clock,
+        )
+
+    def test_rate_and_eta(self):
+        """
+        Test that rates and the ETA are computed from the uploads so far.
+        """
+        self.clock.now += 3  # Walking the tree takes 3s, and doesn't count towards the upload rate
+        self.progress.set_totals(blocks=2, files=4, num_bytes=1000)
+        self.assertEqual(self.events[-1]['stage'], STAGE_SERIALIZED)
+        self.assertIsNone(self.events[-1]['eta'])
+
+        self.clock.now += 5
+        self.progress.file_uploaded(250)
+        event = self.events[-1]
+        self.assertEqual(event['stage'], STAGE_UPLOADING)
+        self.assertEqual(event['files_done'], 1)
+        self.assertEqual(event['bytes_done'], 250)
+        self.assertEqual(event['elapsed'], 8)
+        self.assertEqual(event['bytes_per_sec'], 50)
+        self.assertEqual(event['files_per_sec'], 0.2)
+        self.assertEqual(event['eta'], 15)
+
+    def test_throttle_wait(self):
+        """
+        Test that events report the time spent waiting for the Blockstore rate
+        limits since the transfer started.
+        """
+        stats = {'calls': 3, 'throttled_calls': 1, 'wait_seconds': 2.5}
+        with mock.patch('openedx_blockstore_relay.progress.limits.get_throttle_stats', return_value=stats):
+            progress = TransferProgress('block-v1:A+B+C+type@course+block@course', clock=self.clock)
+            stats['wait_seconds'] += 1.25
+            self.assertEqual(progress.event(STAGE_UPLOADING)['throttle_wait'], 1.25)
+
+    def test_interval(self):
+        """
+        Test that 'uploading' events are rate limited, but others are not.
+        """
+        self.progress.set_totals(blocks=1, files=3, num_bytes=30)
+        self.progress.file_uploaded(10)
+        self.clock.now += 1
+        self.progress.file_uploaded(10)
+        self.assertEqual([event['stage'] for event in self.events], [STAGE_SERIALIZED])
+        self.clock.now += 5
+        self.progress.file_uploaded(10)
+        self.progress.block_uploaded()
+        self.progress.committed()
+        self.assertEqual(
+            [event['stage'] for event in self.events],
+            [STAGE_SERIALIZED, STAGE_UPLOADING, STAGE_COMMITTED],
+        )
+        self.assertEqual(self.events[-1]['blocks_done'], 1)
+        self.assertEqual(self.events[-1]['bytes_done'], 30)
+        self.assertEqual(self.events[-1]['eta'], 0)
+
+    def test_events_are_logged_as_json(self):
+        """
+        Test that each event is also logged, as JSON.
+        """
+        with mock.patch('openedx_blockstore_relay.progress.log') as mock_log:
+            self.progress.set_totals(blocks=1, files=1, num_bytes=10)
+        logged = json.loads(mock_log.info.call_args[0][0])
+        self.assertEqual(logged, self.events[-1])
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` migration scheduler.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import mock
+from django.test import TestCase, TransactionTestCase
+from opaque_keys.edx.keys import CourseKey
+
+from .. import ledger, limits
+from ..models import MigrationJob
+from ..scheduler import MigrationScheduler, take_census
+
+COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+BUNDLE_UUID = '93fc9c6e-4249-4d57-a63c-b08be9f4fe02'
+OTHER_BUNDLE_UUID = '12345678-4249-4d57-a63c-a12354565756'
+
+
+def course_root(name):
+    """
+    Return the usage key of the root block of the course with the given name.
+    """
+    return CourseKey.from_string('course-v1:edX+{}+Run'.format(name)).make_usage_key('course', 'course')
+
+
+class CensusTestCase(TestCase):
+    """
+    Tests for take_census().
+    """
+
+    @mock.patch('openedx_blockstore_relay.scheduler.compat')
+    def test_census(self, mock_compat):
+        course = course_root('DemoX')
+        chapter = course.course_key.make_usage_key('chapter', 'chapter1')
+        html = course.course_key.make_usage_key('html', 'html1')
+        mock_compat.get_block_versions.return_value = {
+            course: ('v1', [chapter, course.course_key.make_usage_key('chapter', 'chapter2')]),
+            chapter: ('v1', [html]),
+            html: ('v1', []),
+            course.course_key.make_usage_key('chapter', 'chapter2'): ('v1', []),
+        }
+        mock_compat.get_course_asset_bytes.return_value = 4000
+        self.assertEqual(take_census(course), (4, 4000))
+        # Assets are apportioned to blocks below the course:
+        self.assertEqual(take_census(chapter), (2, 2000))
+        mock_compat.get_block.assert_not_called()
+
+    @mock.patch('openedx_blockstore_relay.scheduler.compat')
+    def test_census_not_split(self, mock_compat):
+        course = course_root('DemoX')
+        chapter = course.course_key.make_usage_key('chapter', 'chapter1')
+        mock_compat.get_block_versions.return_value = None
+        mock_compat.get_course_asset_bytes.return_value = 4000
+        blocks = {
+            course: mock.Mock(has_children=True, children=[chapter]),
+            chapter: mock.Mock(has_children=False),
+        }
+        mock_compat.get_block.side_effect = blocks.get
+        self.assertEqual(take_census(course), (2, 4000))
+
+
+@mock.patch('openedx_blockstore_relay.scheduler.transfer_to_blockstore')
+@mock.patch('openedx_blockstore_relay.scheduler.take_census')
+class MigrationSchedulerTestCase(TestCase):
+    """
+    Tests for running batches of transfers with MigrationScheduler.
+    """
+
+    def setUp(self):
+        super(MigrationSchedulerTestCase, self).setUp()
+        patch = mock.patch('openedx_blockstore_relay.scheduler.create_destination_bundle', side_effect=self.new_bundle)
+        self.mock_create_bundle = patch.start()
+        self.addCleanup(patch.stop)
+        patch = mock.patch('openedx_blockstore_relay.scheduler.compat.get_block')
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def new_bundle(self, root_block, collection_uuid, sink=None):  # pylint: disable=unused-argument
+        """
+        Stand-in for create_destination_bundle().
+        """
+        self.assertEqual(str(collection_uuid), COLLECTION_UUID)
+        return str(uuid.uuid4())
+
+    def submit(self, scheduler, mock_census, name, blocks, waited=0):
+        """
+        Submit a course with the given number of blocks (and no assets), as if
+        it had been submitted the given number of seconds ago.
+        """
+        mock_census.return_value = (blocks, 0)
+        job = scheduler.submit(course_root(name), collection_uuid=COLLECTION_UUID)
+        job.submitted -= timedelta(seconds=waited)
+        job.save()
+        return job
+
+    def test_shortest_first(self, mock_census, mock_transfer):
+        scheduler = MigrationScheduler('batch', workers=1)
+        for name, blocks in (('Huge', 10000), ('Small', 10), ('Medium', 1000), ('Tiny', 1)):
+            self.submit(scheduler, mock_census, name, blocks)
+        mock_transfer.return_value = BUNDLE_UUID
+        counts = scheduler.run()
+        self.assertEqual(counts, {'pending': 0, 'running': 0, 'done': 4, 'failed': 0})
+        self.assertEqual(
+            [call[0][0] for call in mock_transfer.call_args_list],
+            [course_root('Tiny'), course_root('Small'), course_root('Medium'), course_root('Huge')],
+        )
+        self.assertEqual(str(mock_transfer.call_args[1]['collection_uuid']), COLLECTION_UUID)
+        # Running the batch again does nothing:
+        mock_transfer.reset_mock()
+        scheduler.run()
+        mock_transfer.assert_not_called()
+
+    def test_aging(self, mock_census, mock_transfer):
+        """
+        Test that a job which has waited long enough runs before cheaper ones.
+        """
+        scheduler = MigrationScheduler('batch', workers=1)
+        # 10,000 blocks cost 200 seconds:
+        self.submit(scheduler, mock_census, 'Huge', 10000, waited=300)
+        self.submit(scheduler, mock_census, 'Small', 10)
+        self.submit(scheduler, mock_census, 'Medium', 7500, waited=100)
+        mock_transfer.return_value = BUNDLE_UUID
+        scheduler.run()
+        self.assertEqual(
+            [call[0][0] for call in mock_transfer.call_args_list],
+            [course_root('Huge'), course_root('Small'), course_root('Medium')],
+        )
+
+    def test_failures(self, mock_census, mock_transfer):
+        scheduler = MigrationScheduler('batch', workers=1)
+        self.submit(scheduler, mock_census, 'Broken', 10)
+        self.submit(scheduler, mock_census, 'Fine', 20)
+        mock_transfer.side_effect = [IOError('Blockstore is down'), BUNDLE_UUID]
+        self.assertEqual(scheduler.run(), {'pending': 0, 'running': 0, 'done': 1, 'failed': 1})
+        failed = scheduler.jobs().get(state=MigrationJob.FAILED)
+        self.assertEqual(failed.error, 'Blockstore is down')
+        # The failed job keeps the bundle it created:
+        self.assertEqual(str(mock_transfer.call_args_list[0][1]['bundle_uuid']), str(failed.bundle_uuid))
+
+        mock_transfer.side_effect = None
+        mock_transfer.return_value = BUNDLE_UUID
+        scheduler.run()
+        self.assertEqual(mock_transfer.call_count, 2)
+        self.assertEqual(scheduler.run(retry_failed=True)['done'], 2)
+        self.assertEqual(mock_transfer.call_args[0][0], course_root('Broken'))
+        self.assertEqual(str(mock_transfer.call_args[1]['bundle_uuid']), str(failed.bundle_uuid))
+        self.assertEqual(self.mock_create_bundle.call_count, 2)
+
+    def test_restart(self, mock_census, mock_transfer):
+        """
+        Test that jobs which were running when a run stopped are run again,
+        into the bundle they had created, unless they had been committed.
+        Transfers of the same blocks into other bundles don't count.
+        """
+        scheduler = MigrationScheduler('batch', workers=1)
+        committed = self.submit(scheduler, mock_census, 'Committed', 10)
+        started = self.submit(scheduler, mock_census, 'Started', 20)
+        MigrationJob.objects.filter(id=committed.id).update(state=MigrationJob.RUNNING, bundle_uuid=BUNDLE_UUID)
+        MigrationJob.objects.filter(id=started.id).update(state=MigrationJob.RUNNING, bundle_uuid=OTHER_BUNDLE_UUID)
+        ledger.mark_committed(ledger.start_transfer(committed.root_key, BUNDLE_UUID))
+        ledger.start_transfer(started.root_key, OTHER_BUNDLE_UUID)
+        ledger.mark_committed(ledger.start_transfer(started.root_key, str(uuid.uuid4())))
+
+        mock_transfer.return_value = OTHER_BUNDLE_UUID
+        self.assertEqual(scheduler.run()['done'], 2)
+        mock_transfer.assert_called_once_with(
+            started.root_key, bundle_uuid=mock.ANY, collection_uuid=mock.ANY, progress_callback=None,
+        )
+        self.assertEqual(str(mock_transfer.call_args[1]['bundle_uuid']), OTHER_BUNDLE_UUID)
+        self.mock_create_bundle.assert_not_called()
+        self.assertEqual(str(scheduler.jobs().get(id=committed.id).bundle_uuid), BUNDLE_UUID)
+
+
+class PhaseLimitsTestCase(TransactionTestCase):
+    """
+    Tests for limiting the number of threads in each phase of the transfers.
+    """
+
+    def tearDown(self):
+        limits.set_phase_limits({})
+        super(PhaseLimitsTestCase, self).tearDown()
+
+    def test_phase_limits(self):
+        with self.assertRaises(ValueError):
+            limits.set_phase_limits({'bogus': 1})
+        with self.assertRaises(ValueError):
+            limits.set_phase_limits({limits.PHASE_UPLOAD: 0})
+
+        lock = threading.Lock()
+        active = {limits.PHASE_UPLOAD: 0, limits.PHASE_MODULESTORE: 0}
+        peak = dict(active)
+
+        def use(phase_name):
+            """ Spend a little while in the given phase, counting the threads in it """
+            with limits.phase(phase_name):
+                with lock:
+                    active[phase_name] += 1
+                    peak[phase_name] = max(peak[phase_name], active[phase_name])
+                time.sleep(0.01)
+                with lock:
+                    active[phase_name] -= 1
+
+        def transfer(root_block_key, **kwargs):  # pylint: disable=unused-argument
+            """ Stand-in for transfer_to_blockstore() """
+            for phase_name in (limits.PHASE_MODULESTORE, limits.PHASE_UPLOAD, limits.PHASE_UPLOAD):
+                use(phase_name)
+            return BUNDLE_UUID
+
+        scheduler = MigrationScheduler('batch', workers=6, phase_limits={limits.PHASE_UPLOAD: 2})
+        with mock.patch('openedx_blockstore_relay.scheduler.take_census', return_value=(10, 0)):
+            for i in range(12):
+                scheduler.submit(course_root('Course{}'.format(i)), collection_uuid=COLLECTION_UUID)
+        with mock.patch('openedx_blockstore_relay.scheduler.compat.get_block'), mock.patch(
+            'openedx_blockstore_relay.scheduler.create_destination_bundle', return_value=BUNDLE_UUID,
+        ), mock.patch('openedx_blockstore_relay.scheduler.transfer_to_blockstore', side_effect=transfer):
+            self.assertEqual(scheduler.run()['done'], 12)
+        self.assertEqual(peak[limits.PHASE_UPLOAD], 2)
+        self.assertGreater(peak[limits.PHASE_MODULESTORE], 2)
+        # The limits only apply while the batch runs:
+        self.assertEqual(limits._semaphores, {})  # pylint: disable=protected-access
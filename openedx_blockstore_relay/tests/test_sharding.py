@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` sharded transfers.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+
+import mock
+
+from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
+
+from .. import ledger
+from ..sharding import ShardTransferError, find_shards, transfer_sharded_to_blockstore
+from .course_data import TestCourseMixin
+
+
+class ShardedTransferTestCase(TestCourseMixin, ModuleStoreTestCase):
+    """
+    Tests for transfer_sharded_to_blockstore(), with Blockstore mocked out.
+    """
+    # pylint: disable=no-member
+    maxDiff = None
+    BUNDLE_UUIDS = [
+        '00000000-4249-4d57-a63c-b08be9f4fe02',
+        '11111111-4249-4d57-a63c-b08be9f4fe02',
+        '22222222-4249-4d57-a63c-b08be9f4fe02',
+        '33333333-4249-4d57-a63c-b08be9f4fe02',
+    ]
+    DRAFT_UUID = '12345678-4249-4d57-a63c-a12354565756'
+
+    def setUp(self):
+        super(ShardedTransferTestCase, self).setUp()
+        for mocked_fn in (
+            'create_bundle', 'create_draft', 'add_file_to_draft', 'add_files_to_draft', 'set_draft_link',
+            'commit_draft', 'get_bundle_version', 'get_bundle_files',
+        ):
+            patcher = mock.patch('openedx_blockstore_relay.sinks.{}'.format(mocked_fn))
+            setattr(self, 'mock_' + mocked_fn, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.mock_create_bundle.side_effect = [{'uuid': uuid} for uuid in self.BUNDLE_UUIDS]
+        self.mock_create_draft.return_value = {'uuid': self.DRAFT_UUID}
+        self.mock_get_bundle_version.return_value = 1
+        self.unit_1 = self.course.id.make_usage_key('vertical', 'unit1_1_1')
+        self.unit_2 = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+
+    def uploaded_manifest(self):
+        """
+        Return the most recently uploaded bundle.json manifest.
+        """
+        manifests = [call[0][2] for call in self.mock_add_file_to_draft.call_args_list if call[0][1] == 'bundle.json']
+        return json.loads(manifests[-1])
+
+    def test_find_shards(self):
+        parent_keys, shard_keys = find_shards(self.course.location, 'vertical')
+        self.assertEqual([key.block_type for key in parent_keys], ['course', 'chapter', 'sequential'])
+        self.assertEqual(shard_keys, [self.unit_1, self.unit_2])
+
+    def test_sharded_transfer(self):
+        """
+        Test that each shard gets its own bundle, and that the parent bundle
+        depends on them.
+        """
+        bundle_uuid = transfer_sharded_to_blockstore(
+            self.course.location, self.COLLECTION_UUID, shard_block_type='vertical', workers=1,
+        )
+        self.assertEqual(bundle_uuid, self.BUNDLE_UUIDS[2])
+        self.assertEqual(self.mock_commit_draft.call_count, 3)
+        self.assertEqual(str(ledger.get_latest_transfer(self.unit_1).bundle_uuid), self.BUNDLE_UUIDS[0])
+        self.assertEqual(str(ledger.get_latest_transfer(self.unit_2).bundle_uuid), self.BUNDLE_UUIDS[1])
+        manifest = self.uploaded_manifest()
+        self.assertEqual(manifest['type'], 'olx/course')
+        self.assertEqual(manifest['dependencies'], [
+            {'name': 'unit-unit1_1_1', 'bundle_uuid': self.BUNDLE_UUIDS[0], 'definition': 'unit/unit1_1_1'},
+            {'name': 'unit-unit1_1_2', 'bundle_uuid': self.BUNDLE_UUIDS[1], 'definition': 'unit/unit1_1_2'},
+        ])
+        # The parent's blocks include the shards through those links:
+        sequential_olx = [
+            call[0][2] for call in self.mock_add_file_to_draft.call_args_list
+            if call[0][1].startswith('sequential/')
+        ][0]
+        self.assertIn(b'<xblock-include definition="unit/unit1_1_1" source="unit-unit1_1_1"/>', sequential_olx)
+        # ...which the parent draft has, to the shards' committed versions:
+        self.assertEqual(self.mock_set_draft_link.call_args_list, [
+            mock.call(self.DRAFT_UUID, 'unit-unit1_1_1', self.BUNDLE_UUIDS[0], 1),
+            mock.call(self.DRAFT_UUID, 'unit-unit1_1_2', self.BUNDLE_UUIDS[1], 1),
+        ])
+        self.mock_get_bundle_version.assert_has_calls([
+            mock.call(self.BUNDLE_UUIDS[0]), mock.call(self.BUNDLE_UUIDS[1]),
+        ])
+        self.assertEqual(len(manifest['components']), 3)  # course, chapter and sequential
+        self.assertEqual(ledger.get_latest_transfer(self.course.location).blocks.count(), 3)
+
+    def test_repair_parent(self):
+        """
+        Test that verifying the parent bundle repairs its blocks with the same
+        serializer as the transfer, keeping their shard includes.
+        """
+        uploaded = {}
+
+        def add_file(draft_uuid, path, data):  # pylint: disable=unused-argument
+            """ Lose the sequential's OLX """
+            if not path.startswith('sequential/'):
+                uploaded[path] = data
+
+        def add_files(draft_uuid, files):  # pylint: disable=unused-argument
+            """ Upload the repaired files """
+            uploaded.update(files)
+
+        self.mock_add_file_to_draft.side_effect = add_file
+        self.mock_add_files_to_draft.side_effect = add_files
+        self.mock_get_bundle_files.side_effect = lambda bundle_uuid: [
+            {'path': path, 'size': len(data), 'hash_digest': ledger.digest(data)} for path, data in uploaded.items()
+        ]
+        transfer_sharded_to_blockstore(
+            self.course.location, self.COLLECTION_UUID, shard_block_type='vertical', workers=1, verify=True,
+        )
+        sequential_olx = [data for path, data in uploaded.items() if path.startswith('sequential/')]
+        self.assertEqual(len(sequential_olx), 1)
+        self.assertIn(b'<xblock-include definition="unit/unit1_1_1" source="unit-unit1_1_1"/>', sequential_olx[0])
+
+    def test_resume_after_failure(self):
+        """
+        Test that when a shard fails, the others are still committed, and that
+        resuming only transfers the failed shard again.
+        """
+        def fail_unit_2(draft_uuid, path, data):  # pylint: disable=unused-argument
+            """ Fail to upload the second unit """
+            if path == 'unit/unit1_1_2/definition.xml':
+                raise IOError('Blockstore is down')
+        self.mock_add_file_to_draft.side_effect = fail_unit_2
+        with self.assertRaises(ShardTransferError) as context:
+            transfer_sharded_to_blockstore(
+                self.course.location, self.COLLECTION_UUID, shard_block_type='vertical', workers=1,
+            )
+        self.assertEqual(list(context.exception.failures), [self.unit_2])
+        self.assertIsNotNone(ledger.get_latest_transfer(self.unit_1))
+        self.assertIsNone(ledger.get_latest_transfer(self.unit_2))
+        self.assertIsNone(ledger.get_latest_transfer(self.course.location))
+        self.assertEqual(self.mock_commit_draft.call_count, 1)
+
+        self.mock_add_file_to_draft.side_effect = None
+        self.mock_create_bundle.reset_mock()
+        bundle_uuid = transfer_sharded_to_blockstore(
+            self.course.location, self.COLLECTION_UUID, shard_block_type='vertical', resume=True,
+        )
+        # Only the parent bundle is new; unit 2 goes into the bundle created by the failed run:
+        self.assertEqual(self.mock_create_bundle.call_count, 1)
+        self.assertEqual(bundle_uuid, self.BUNDLE_UUIDS[2])
+        self.assertEqual(self.mock_commit_draft.call_count, 3)
+        self.assertEqual(str(ledger.get_latest_transfer(self.unit_2).bundle_uuid), self.BUNDLE_UUIDS[1])
+        # The resumed transfers record the collection too, like the first ones:
+        self.assertEqual(str(ledger.get_latest_transfer(self.unit_2).collection_uuid), self.COLLECTION_UUID)
+        self.assertEqual(
+            [dependency['bundle_uuid'] for dependency in self.uploaded_manifest()['dependencies']],
+            self.BUNDLE_UUIDS[:2],
+        )
+
+    def test_resume_other_collection(self):
+        """
+        Test that resuming doesn't reuse the bundles of shards transferred
+        into another collection.
+        """
+        other_bundle_uuid = '44444444-4249-4d57-a63c-b08be9f4fe02'
+        ledger.mark_committed(ledger.start_transfer(
+            self.unit_1, other_bundle_uuid, collection_uuid='5e7f1c8a-0d1b-4c4e-9a43-31c1a4b4f9d2',
+        ))
+        transfer_sharded_to_blockstore(
+            self.course.location, self.COLLECTION_UUID, shard_block_type='vertical', workers=1, resume=True,
+        )
+        self.assertEqual(self.mock_create_bundle.call_count, 3)
+        self.assertEqual(str(ledger.get_latest_transfer(self.unit_1).bundle_uuid), self.BUNDLE_UUIDS[0])
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` output sinks.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+from unittest import TestCase
+
+import mock
+import requests
+
+from ..sinks import BlockstoreSink, DirectorySink, FanOutError, FanOutSink, Mirror, TarSink
+from ..test_utils.fake_blockstore import FakeBlockstore
+
+COLLECTION_UUID = 'd3e311a8-b3a8-439d-a111-cc6cb99790e8'
+
+
+def read_file(path):
+    """
+    Return the contents of the file at path.
+    """
+    with open(path, 'rb') as open_file:
+        return open_file.read()
+
+
+class BlockstoreSinkTestCase(TestCase):
+    """
+    Tests for BlockstoreSink.
+    """
+
+    def test_delegates_to_client(self):
+        sink = BlockstoreSink()
+        with mock.patch('openedx_blockstore_relay.sinks.create_bundle') as mock_create_bundle, \
+                mock.patch('openedx_blockstore_relay.sinks.create_draft') as mock_create_draft, \
+                mock.patch('openedx_blockstore_relay.sinks.add_file_to_draft') as mock_add_file_to_draft, \
+                mock.patch('openedx_blockstore_relay.sinks.commit_draft') as mock_commit_draft:
+            mock_create_bundle.return_value = {'uuid': 'b'}
+            mock_create_draft.return_value = {'uuid': 'd'}
+            self.assertEqual(sink.create_bundle(COLLECTION_UUID, 'Title', 'slug', description='x'), {'uuid': 'b'})
+            self.assertEqual(sink.create_draft('b', 'relay_import', 'Title'), {'uuid': 'd'})
+            sink.add_file_to_draft('d', 'bundle.json', '{}')
+            sink.commit_draft('d')
+            sink.close()
+        mock_create_bundle.assert_called_once_with(
+            collection_uuid=COLLECTION_UUID, title='Title', slug='slug', description='x',
+        )
+        mock_create_draft.assert_called_once_with(bundle_uuid='b', name='relay_import', title='Title')
+        mock_add_file_to_draft.assert_called_once_with('d', 'bundle.json', '{}')
+        mock_commit_draft.assert_called_once_with('d')
+
+
+class DirectorySinkTestCase(TestCase):
+    """
+    Tests for DirectorySink.
+    """
+
+    def setUp(self):
+        super(DirectorySinkTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_commit(self):
+        """
+        Test that files only appear in the bundle's directory once committed,
+        and that the draft can be used again after a commit.
+        """
+        sink = DirectorySink(self.root)
+        bundle_uuid = sink.create_bundle(COLLECTION_UUID, 'Title', 'slug')['uuid']
+        draft_uuid = sink.create_draft(bundle_uuid, 'relay_import', 'Title')['uuid']
+        bundle_path = sink.bundle_path(bundle_uuid)
+
+        sink.add_file_to_draft(draft_uuid, 'html/intro/definition.xml', '<html>☃</html>')
+        sink.add_file_to_draft(draft_uuid, 'bundle.json', '{}')
+        self.assertEqual(os.listdir(bundle_path), [])
+        sink.commit_draft(draft_uuid)
+        self.assertEqual(read_file(os.path.join(bundle_path, 'html', 'intro', 'definition.xml')),
+                         '<html>☃</html>'.encode('utf8'))
+        self.assertEqual(read_file(os.path.join(bundle_path, 'bundle.json')), b'{}')
+
+        sink.add_file_to_draft(draft_uuid, 'bundle.json', b'{"schema": 0.1}')
+        sink.commit_draft(draft_uuid)
+        self.assertEqual(read_file(os.path.join(bundle_path, 'bundle.json')), b'{"schema": 0.1}')
+        self.assertEqual(sorted(os.listdir(bundle_path)), ['bundle.json', 'html'])
+
+        sink.add_file_to_draft(draft_uuid, 'never/committed.txt', b'')
+        sink.close()
+        self.assertEqual(sorted(os.listdir(self.root)), ['.bundles', bundle_uuid])
+
+    def test_links(self):
+        """
+        Test that draft links are recorded with the bundle when committed,
+        along with its number of versions.
+        """
+        sink = DirectorySink(self.root)
+        shard_uuid = sink.create_bundle(COLLECTION_UUID, 'Shard', 'shard')['uuid']
+        parent_uuid = sink.create_bundle(COLLECTION_UUID, 'Parent', 'parent')['uuid']
+        self.assertEqual(sink.get_bundle_version(shard_uuid), 0)
+        sink.commit_draft(sink.create_draft(shard_uuid, 'relay_import', 'Shard')['uuid'])
+        self.assertEqual(sink.get_bundle_version(shard_uuid), 1)
+        draft_uuid = sink.create_draft(parent_uuid, 'relay_import', 'Parent')['uuid']
+        sink.set_draft_link(draft_uuid, 'unit-u1', shard_uuid, 1)
+        self.assertEqual(sink.get_bundle_info(parent_uuid), {'version': 0, 'links': {}})
+        sink.commit_draft(draft_uuid)
+        self.assertEqual(sink.get_bundle_info(parent_uuid), {
+            'version': 1, 'links': {'unit-u1': {'bundle_uuid': shard_uuid, 'version': 1}},
+        })
+        # Links are kept by later commits, and a new sink reads them back:
+        sink.commit_draft(draft_uuid)
+        self.assertEqual(DirectorySink(self.root).get_bundle_info(parent_uuid), {
+            'version': 2, 'links': {'unit-u1': {'bundle_uuid': shard_uuid, 'version': 1}},
+        })
+
+    def test_bundle_data(self):
+        sink = DirectorySink(self.root)
+        self.assertEqual(sink.create_bundle(COLLECTION_UUID, 'Title', 'slug')['collection_uuid'], COLLECTION_UUID)
+        self.assertIsNone(sink.create_bundle(None, 'Title', 'slug')['collection_uuid'])
+        self.assertEqual(sink.destination, 'dir:{}'.format(os.path.abspath(self.root)))
+        self.assertEqual(FanOutSink(sink, []).destination, sink.destination)
+        self.assertEqual(BlockstoreSink().destination, '')
+
+    def test_invalid_paths(self):
+        sink = DirectorySink(self.root)
+        draft_uuid = sink.create_draft(sink.create_bundle(COLLECTION_UUID, 'Title', 'slug')['uuid'], 'd', 'D')['uuid']
+        for path in ('/etc/passwd', '../escape.txt', 'html/../../escape.txt'):
+            with self.assertRaises(ValueError):
+                sink.add_file_to_draft(draft_uuid, path, b'')
+
+
+class TarSinkTestCase(TestCase):
+    """
+    Tests for TarSink.
+    """
+
+    def test_archive(self):
+        """
+        Test that files are streamed into the archive under their bundle's
+        UUID, including when they are added from several threads at once.
+        """
+        output = io.BytesIO()
+        sink = TarSink(output, compression='gz')
+        bundle_uuid = sink.create_bundle(COLLECTION_UUID, 'Title', 'slug')['uuid']
+        draft_uuid = sink.create_draft(bundle_uuid, 'relay_import', 'Title')['uuid']
+        threads = [
+            threading.Thread(target=sink.add_file_to_draft, args=(draft_uuid, 'html/h{}/definition.xml'.format(i),
+                                                                  '<html>{}</html>'.format(i) * 1000))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sink.add_file_to_draft(draft_uuid, 'bundle.json', '{}')
+        sink.set_draft_link(draft_uuid, 'unit-u1', 'shard-bundle', 3)
+        sink.commit_draft(draft_uuid)
+        self.assertEqual(sink.get_bundle_version(bundle_uuid), 1)
+        sink.close()
+
+        with tarfile.open(fileobj=io.BytesIO(output.getvalue()), mode='r:gz') as archive:
+            names = archive.getnames()
+            self.assertEqual(sorted(names), sorted(
+                ['{}/bundle.json'.format(bundle_uuid), '.bundles/{}.json'.format(bundle_uuid)] +
+                ['{}/html/h{}/definition.xml'.format(bundle_uuid, i) for i in range(8)]
+            ))
+            html = archive.extractfile('{}/html/h3/definition.xml'.format(bundle_uuid)).read()
+            self.assertEqual(html, b'<html>3</html>' * 1000)
+            bundle_info = archive.extractfile('.bundles/{}.json'.format(bundle_uuid)).read()
+            self.assertEqual(json.loads(bundle_info.decode('utf-8')), {
+                'version': 1, 'links': {'unit-u1': {'bundle_uuid': 'shard-bundle', 'version': 3}},
+            })
+
+
+class GatedSink(DirectorySink):
+    """
+    DirectorySink which only adds files once allowed to, and can be told to
+    fail a number of times first.
+    """
+
+    def __init__(self, root):
+        super(GatedSink, self).__init__(root)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.failures = 0
+
+    def add_files_to_draft(self, draft_uuid, files):
+        self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise requests.ConnectionError('Connection reset')
+        super(GatedSink, self).add_files_to_draft(draft_uuid, files)
+
+
+class FanOutSinkTestCase(TestCase):
+    """
+    Tests for FanOutSink.
+    """
+
+    def setUp(self):
+        super(FanOutSinkTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write_bundle(self, sink, files, collection_uuid=COLLECTION_UUID):
+        """
+        Write the given files into a new bundle of the given sink, like a
+        transfer does, and return the bundle's UUID.
+        """
+        bundle_uuid = sink.create_bundle(collection_uuid, 'Title', 'slug', description='Course')['uuid']
+        draft_uuid = sink.create_draft(bundle_uuid, 'relay_import', 'Title')['uuid']
+        for path, data in files:
+            sink.add_file_to_draft(draft_uuid, path, data)
+        sink.commit_draft(draft_uuid)
+        return bundle_uuid
+
+    def test_blockstore_mirrors(self):
+        files = [('bundle.json', '{}'), ('html/intro/definition.xml', b'<html/>')]
+        with FakeBlockstore() as primary, FakeBlockstore() as staging:
+            mirror = Mirror(BlockstoreSink(api_url=staging.url), collection_uuid='staging-collection')
+            sink = FanOutSink(BlockstoreSink(api_url=primary.url), [mirror])
+            bundle_uuid = self.write_bundle(sink, files)
+            sink.close()
+            self.assertEqual(primary.bundle_files(bundle_uuid), {path: data for path, data in [
+                ('bundle.json', b'{}'), ('html/intro/definition.xml', b'<html/>'),
+            ]})
+            mirror_bundle_uuid = mirror.bundles[bundle_uuid]
+            self.assertNotEqual(mirror_bundle_uuid, bundle_uuid)
+            self.assertEqual(staging.bundle_files(mirror_bundle_uuid), primary.bundle_files(bundle_uuid))
+            self.assertEqual(staging.bundles[mirror_bundle_uuid]['collection_uuid'], 'staging-collection')
+        self.assertEqual((mirror.commits, mirror.error), (1, None))
+
+    def test_mirrored_links(self):
+        """
+        Test that links are mirrored to the latest version of the mirror's copy
+        of the linked bundle.
+        """
+        with FakeBlockstore() as primary, FakeBlockstore() as staging:
+            mirror = Mirror(BlockstoreSink(api_url=staging.url))
+            sink = FanOutSink(BlockstoreSink(api_url=primary.url), [mirror])
+            shard_uuid = self.write_bundle(sink, [('bundle.json', b'{}')])
+            parent_uuid = sink.create_bundle(COLLECTION_UUID, 'Parent', 'parent')['uuid']
+            draft_uuid = sink.create_draft(parent_uuid, 'relay_import', 'Parent')['uuid']
+            sink.set_draft_link(draft_uuid, 'unit-u1', shard_uuid, sink.get_bundle_version(shard_uuid))
+            sink.commit_draft(draft_uuid)
+            sink.close()
+            self.assertEqual(primary.links[parent_uuid], {'unit-u1': {'bundle_uuid': shard_uuid, 'version': 1}})
+            self.assertEqual(staging.links[mirror.bundles[parent_uuid]], {
+                'unit-u1': {'bundle_uuid': mirror.bundles[shard_uuid], 'version': 1},
+            })
+        self.assertEqual((mirror.commits, mirror.error), (2, None))
+
+    def test_existing_bundles(self):
+        primary = DirectorySink(os.path.join(self.root, 'primary'))
+        mirror = Mirror(DirectorySink(os.path.join(self.root, 'mirror')), bundle_uuid='mirror-bundle')
+        sink = FanOutSink(primary, [mirror])
+        draft_uuid = sink.create_draft('primary-bundle', 'relay_import', 'Title')['uuid']
+        sink.add_files_to_draft(draft_uuid, {'bundle.json': b'{}'})
+        sink.commit_draft(draft_uuid)
+        sink.close()
+        self.assertEqual(read_file(os.path.join(self.root, 'primary', 'primary-bundle', 'bundle.json')), b'{}')
+        self.assertEqual(read_file(os.path.join(self.root, 'mirror', 'mirror-bundle', 'bundle.json')), b'{}')
+
+    def test_bounded_buffer(self):
+        """
+        Test that a slow mirror lets the transfer get ahead of it by at most the
+        buffer size, without holding up the primary sink or other mirrors.
+        """
+        slow = Mirror(GatedSink(os.path.join(self.root, 'slow')), bundle_uuid='bundle', name='slow')
+        fast = Mirror(DirectorySink(os.path.join(self.root, 'fast')), bundle_uuid='bundle', name='fast')
+        slow.sink.gate.clear()
+        sink = FanOutSink(DirectorySink(os.path.join(self.root, 'primary')), [slow, fast], max_buffered_bytes=300)
+        draft_uuid = sink.create_draft('bundle', 'relay_import', 'Title')['uuid']
+        added = []
+
+        def write():
+            """ Add ten files of 100 bytes """
+            for i in range(10):
+                sink.add_file_to_draft(draft_uuid, 'file{}'.format(i), b'x' * 100)
+                added.append(i)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(0.5)
+        # The slow mirror holds the first file, and two more are queued for it:
+        self.assertEqual(len(added), 3)
+        self.assertEqual(slow.queued_bytes, 300)
+        slow.sink.gate.set()
+        writer.join()
+        sink.commit_draft(draft_uuid)
+        sink.close()
+        for mirror in (slow, fast):
+            self.assertEqual(mirror.commits, 1)
+            self.assertEqual(mirror.queued_bytes, 0)
+            bundle_path = os.path.join(self.root, mirror.name, 'bundle')
+            self.assertEqual(len(os.listdir(bundle_path)), 10)
+
+    def test_retries(self):
+        sleep = mock.Mock()
+        mirror = Mirror(GatedSink(os.path.join(self.root, 'mirror')))
+        mirror.sink.failures = 2
+        sink = FanOutSink(DirectorySink(os.path.join(self.root, 'primary')), [mirror], retry_delay=1, sleep=sleep)
+        bundle_uuid = self.write_bundle(sink, [('bundle.json', b'{}')])
+        sink.close()
+        self.assertEqual([call[0][0] for call in sleep.call_args_list], [1, 2])
+        self.assertEqual(
+            read_file(os.path.join(self.root, 'mirror', mirror.bundles[bundle_uuid], 'bundle.json')), b'{}',
+        )
+
+    def test_failed_mirror(self):
+        """
+        Test that a mirror which keeps failing is given up on, without stopping
+        the transfer to the other sinks, and that closing the sink reports it.
+        """
+        failing = Mirror(GatedSink(os.path.join(self.root, 'failing')), name='failing')
+        failing.sink.failures = 10
+        working = Mirror(DirectorySink(os.path.join(self.root, 'working')), name='working')
+        sink = FanOutSink(
+            DirectorySink(os.path.join(self.root, 'primary')), [failing, working], retries=1, sleep=mock.Mock(),
+        )
+        bundle_uuid = self.write_bundle(sink, [('a', b'1'), ('b', b'2')])
+        with self.assertRaisesRegexp(FanOutError, 'failing'):
+            sink.close()
+        self.assertEqual((failing.commits, working.commits), (0, 1))
+        self.assertIsInstance(failing.error, IOError)
+        self.assertEqual(failing.queued_bytes, 0)
+        self.assertEqual(read_file(os.path.join(self.root, 'primary', bundle_uuid, 'b')), b'2')
+
+    def test_no_retried_posts(self):
+        """
+        Test that operations which aren't idempotent are not retried, even on
+        connection errors.
+        """
+        sleep = mock.Mock()
+        primary = DirectorySink(os.path.join(self.root, 'primary'))
+        sink = FanOutSink(primary, [], sleep=sleep)
+        for method, args in [
+            ('create_bundle', (COLLECTION_UUID, 'Title', 'slug')),
+            ('create_draft', ('bundle', 'relay_import', 'Title')),
+            ('commit_draft', ('draft',)),
+        ]:
+            with mock.patch.object(primary, method, side_effect=requests.ConnectionError('Connection reset')) as mocked:
+                with self.assertRaises(requests.ConnectionError):
+                    getattr(sink, method)(*args)
+            self.assertEqual(mocked.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_no_retried_client_errors(self):
+        """
+        Test that idempotent operations are retried on server errors, but not
+        on client errors.
+        """
+        def http_error(status_code):
+            """ Return the error raised for a response with the given status """
+            response = requests.Response()
+            response.status_code = status_code
+            return requests.HTTPError('{} Error'.format(status_code), response=response)
+
+        sleep = mock.Mock()
+        primary = DirectorySink(os.path.join(self.root, 'primary'))
+        sink = FanOutSink(primary, [], retry_delay=1, sleep=sleep)
+        with mock.patch.object(primary, 'add_files_to_draft', side_effect=[http_error(503), None]) as mocked:
+            sink.add_files_to_draft('draft', [('bundle.json', b'{}')])
+        self.assertEqual((mocked.call_count, sleep.call_count), (2, 1))
+        with mock.patch.object(primary, 'add_files_to_draft', side_effect=http_error(404)) as mocked:
+            with self.assertRaisesRegexp(requests.HTTPError, '404'):
+                sink.add_files_to_draft('draft', [('bundle.json', b'{}')])
+        self.assertEqual((mocked.call_count, sleep.call_count), (1, 1))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` structure_serializer module.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import mock
+from django.test import TestCase
+from django.test.utils import override_settings
+from opaque_keys.edx.keys import CourseKey
+
+from xblock.core import XBlock
+from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
+
+from .. import compat, ledger
+from ..block_serializer import ReusedAsset, StaticFile, XBlockSerializer
+from ..ledger import BundleAsset
+from ..structure_serializer import StructureBlockSerializer, can_serialize_stored_block
+from ..transfer_data import iter_serialized_subtree
+from .course_data import TestCourseMixin
+from .xml_test_mixin import XmlTestMixin
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+SEQUENTIAL = COURSE_KEY.make_usage_key('sequential', 'subsection1')
+UNIT = COURSE_KEY.make_usage_key('vertical', 'unit1')
+HTML = COURSE_KEY.make_usage_key('html', 'intro')
+PROBLEM = COURSE_KEY.make_usage_key('problem', 'checkbox')
+VIDEO = COURSE_KEY.make_usage_key('video', 'welcome')
+
+# Blocks as returned by compat.get_stored_blocks():
+STORED_BLOCKS = {
+    SEQUENTIAL: {
+        'fields': {'display_name': 'Subsection 1', 'graded': True, 'format': 'Homework', 'children': [UNIT]},
+        'definition_fields': {},
+        'asides': [],
+    },
+    UNIT: {
+        'fields': {'display_name': 'Unit 1', 'children': [HTML, PROBLEM, VIDEO]},
+        'definition_fields': {},
+        'asides': [],
+    },
+    HTML: {
+        'fields': {'display_name': 'Introduction', 'editor': 'raw'},
+        'definition_fields': {'data': '<p>Welcome to the ωμέγα course!</p>'},
+        'asides': [],
+    },
+    PROBLEM: {
+        'fields': {'display_name': 'Checkbox', 'max_attempts': None, 'weight': 2.0},
+        'definition_fields': {
+            'data': '<problem><choiceresponse><checkboxgroup><choice correct="true">A</choice></checkboxgroup>'
+                    '</choiceresponse></problem>',
+        },
+        'asides': [],
+    },
+    VIDEO: {
+        'fields': {'display_name': 'Welcome', 'youtube_id_1_0': '3_yD_cEKoCk'},
+        'definition_fields': {},
+        'asides': [],
+    },
+}
+
+
+@mock.patch(
+    'openedx_blockstore_relay.block_serializer.compat.collect_assets_from_text',
+    lambda text, course_id, as_stream=False: [],
+)
+@mock.patch('openedx_blockstore_relay.adapters.get_block_class', XBlock.load_class)
+class StructureBlockSerializerTestCase(XmlTestMixin, TestCase):
+    """
+    Tests for StructureBlockSerializer, using stored block fixtures.
+    """
+    maxDiff = None
+
+    def test_sequential(self):
+        result = StructureBlockSerializer(SEQUENTIAL, STORED_BLOCKS[SEQUENTIAL])
+        self.assertEqual(result.orig_block_key, SEQUENTIAL)
+        self.assertEqual(result.def_id, 'sequential/subsection1')
+        self.assertEqual(result.static_files, [])
+        self.assertXmlEqual(result.olx_str, """
+            <sequential display_name="Subsection 1" format="Homework" graded="true">
+                <xblock-include definition="unit/unit1"/>
+            </sequential>
+            <!-- Imported from {block_key} using openedx-blockstore-relay -->
+        """.format(block_key=SEQUENTIAL))
+
+    def test_unit(self):
+        result = StructureBlockSerializer(UNIT, STORED_BLOCKS[UNIT])
+        self.assertEqual(result.def_id, 'unit/unit1')
+        self.assertXmlEqual(result.olx_str, """
+            <unit display_name="Unit 1">
+                <xblock-include definition="html/intro"/>
+                <xblock-include definition="problem/checkbox"/>
+                <xblock-include definition="video/welcome"/>
+            </unit>
+            <!-- Imported from {block_key} using openedx-blockstore-relay -->
+        """.format(block_key=UNIT))
+
+    def test_html(self):
+        result = StructureBlockSerializer(HTML, STORED_BLOCKS[HTML])
+        self.assertEqual(result.static_files, [
+            StaticFile(name='intro.html', data='<p>Welcome to the ωμέγα course!</p>'.encode('utf-8')),
+        ])
+        self.assertXmlEqual(result.olx_str, """
+            <html filename="intro" display_name="Introduction" editor="raw"/>
+            <!-- Imported from {block_key} using openedx-blockstore-relay -->
+        """.format(block_key=HTML))
+
+    def test_reuse_assets(self):
+        """
+        Test that assets which the bundle already has, with the same
+        contentstore MD5 digest, aren't read.
+        """
+        known_assets = {'html/intro/static/handout.pdf': BundleAsset('md5-pdf', 'sha1-pdf', 1234)}
+        handout = mock.Mock(location=mock.Mock(path='handout.pdf'), content_digest='md5-pdf', data=None)
+        image = mock.Mock(location=mock.Mock(path='image.png'), content_digest='md5-png', data=None)
+        image.copy_to_in_mem.return_value.data = b'PNG'
+        assets = [{'content': handout, 'path': '/static/handout.pdf'}, {'content': image, 'path': '/static/image.png'}]
+        with mock.patch(
+            'openedx_blockstore_relay.block_serializer.compat.collect_assets_from_text', return_value=assets,
+        ) as mock_collect_assets:
+            result = StructureBlockSerializer(HTML, STORED_BLOCKS[HTML], known_assets=known_assets)
+
+        self.assertTrue(all(call[1]['as_stream'] for call in mock_collect_assets.call_args_list))
+        handout.copy_to_in_mem.assert_not_called()
+        self.assertEqual(result.reused_assets, [ReusedAsset(name='handout.pdf', digest='sha1-pdf', size=1234)])
+        self.assertEqual(result.static_files[1:], [StaticFile(name='image.png', data=b'PNG')])
+        self.assertEqual(result.asset_md5s, {'handout.pdf': 'md5-pdf', 'image.png': 'md5-png'})
+
+    def test_problem(self):
+        result = StructureBlockSerializer(PROBLEM, STORED_BLOCKS[PROBLEM])
+        self.assertEqual(result.static_files, [])
+        self.assertXmlEqual(result.olx_str, """
+            <problem display_name="Checkbox" max_attempts="null" weight="2.0">
+                <choiceresponse>
+                    <checkboxgroup>
+                        <choice correct="true">A</choice>
+                    </checkboxgroup>
+                </choiceresponse>
+            </problem>
+            <!-- Imported from {block_key} using openedx-blockstore-relay -->
+        """.format(block_key=PROBLEM))
+
+    def test_digests(self):
+        """
+        Test that the content digest of a block is the same in a course rerun,
+        unlike the digest of its definition.xml file (which names the source
+        block).
+        """
+        rerun_key = CourseKey.from_string('course-v1:edX+DemoX+Rerun').make_usage_key('problem', 'checkbox')
+        result = StructureBlockSerializer(PROBLEM, STORED_BLOCKS[PROBLEM])
+        rerun_result = StructureBlockSerializer(rerun_key, STORED_BLOCKS[PROBLEM])
+        self.assertEqual(result.content_digest, rerun_result.content_digest)
+        self.assertEqual(list(result.file_digests), ['problem/checkbox/definition.xml'])
+        self.assertNotEqual(result.file_digests, rerun_result.file_digests)
+        self.assertEqual(result.file_digests['problem/checkbox/definition.xml'], ledger.digest(result.olx_str))
+
+    @override_settings(BLOCKSTORE_RELAY_CANONICAL_OLX=True)
+    def test_canonical_olx(self):
+        """
+        Test that in canonical mode, the same problem gives the same OLX
+        however its stored XML is indented and its attributes are ordered.
+        """
+        reformatted = dict(STORED_BLOCKS[PROBLEM], definition_fields={
+            'data': '<problem>\n\t<choiceresponse>\n\t\t<checkboxgroup>\n\t\t\t<choice correct="true">A</choice>'
+                    '\n\t\t</checkboxgroup>\n\t</choiceresponse>\n</problem>',
+        })
+        result = StructureBlockSerializer(PROBLEM, STORED_BLOCKS[PROBLEM])
+        reformatted_result = StructureBlockSerializer(PROBLEM, reformatted)
+        self.assertEqual(result.olx_str, reformatted_result.olx_str)
+        self.assertEqual(result.content_digest, reformatted_result.content_digest)
+        self.assertIn(b'<problem display_name="Checkbox" max_attempts="null" weight="2.0">', result.olx_str)
+
+    def test_can_serialize(self):
+        self.assertTrue(can_serialize_stored_block(HTML, STORED_BLOCKS[HTML]))
+        self.assertFalse(can_serialize_stored_block(VIDEO, STORED_BLOCKS[VIDEO]))
+        with_asides = dict(STORED_BLOCKS[UNIT], asides=[{'aside_type': 'tagging_aside', 'fields': {}}])
+        self.assertFalse(can_serialize_stored_block(UNIT, with_asides))
+        without_data = dict(STORED_BLOCKS[PROBLEM], definition_fields={})
+        self.assertFalse(can_serialize_stored_block(PROBLEM, without_data))
+
+    @mock.patch('openedx_blockstore_relay.transfer_data.XBlockSerializer')
+    @mock.patch('openedx_blockstore_relay.transfer_data.compat')
+    def test_iter_serialized_subtree(self, mock_compat, mock_serializer):
+        """
+        Test that only the blocks which can't be serialized from their stored
+        fields get loaded.
+        """
+        mock_compat.get_stored_blocks.return_value = STORED_BLOCKS
+        mock_compat.get_block.return_value.has_children = False
+        results = list(iter_serialized_subtree(SEQUENTIAL, from_structure=True))
+        self.assertEqual(
+            [result.orig_block_key for result in results[:4]], [SEQUENTIAL, UNIT, HTML, PROBLEM],
+        )
+        self.assertEqual(results[4], mock_serializer.return_value)
+        mock_compat.get_stored_blocks.assert_called_once_with(COURSE_KEY)
+        mock_compat.get_block.assert_called_once_with(VIDEO)
+
+
+class StructureBlockSerializerParityTestCase(TestCourseMixin, ModuleStoreTestCase):
+    """
+    Test that StructureBlockSerializer gives the same results as
+    XBlockSerializer, for the blocks of a real course. Requires a running
+    instance of edX Studio.
+    """
+    maxDiff = None
+
+    def test_parity(self):
+        stored_blocks = compat.get_stored_blocks(self.course.id)
+        serializable_keys = [key for key, block in stored_blocks.items() if can_serialize_stored_block(key, block)]
+        self.assertEqual(
+            sorted(key.block_type for key in serializable_keys),
+            ['chapter', 'html', 'html', 'problem', 'problem', 'sequential', 'vertical', 'vertical'],
+        )
+        for usage_key in serializable_keys:
+            expected = XBlockSerializer(compat.get_block(usage_key))
+            result = StructureBlockSerializer(usage_key, stored_blocks[usage_key])
+            self.assertEqual(result.olx_str, expected.olx_str)
+            self.assertEqual(result.static_files, expected.static_files)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` tasks module.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+
+import mock
+import six
+
+from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
+
+from ..models import Transfer
+from ..tasks import fail_transfer_task, transfer_to_blockstore_task
+from .course_data import TestCourseMixin
+
+
+class TransferToBlockstoreTaskTestCase(TestCourseMixin, ModuleStoreTestCase):
+    """
+    Tests for running transfers as Celery tasks, using an eager broker.
+    """
+    # pylint: disable=no-member
+    DRAFT_UUID = '12345678-4249-4d57-a63c-a12354565756'
+
+    def setUp(self):
+        super(TransferToBlockstoreTaskTestCase, self).setUp()
+
+        # Run the tasks (and their sub-tasks) in this process. The app is already configured by now, so changing the
+        # Django setting would have no effect:
+        conf = transfer_to_blockstore_task.app.conf
+        for option in ('task_always_eager', 'task_eager_propagates'):
+            self.addCleanup(setattr, conf, option, getattr(conf, option))
+            setattr(conf, option, True)
+
+        # Mock out blockstore:
+        for mocked_fn in ('create_bundle', 'create_draft', 'add_file_to_draft', 'add_files_to_draft', 'commit_draft'):
+            patcher = mock.patch('openedx_blockstore_relay.sinks.{}'.format(mocked_fn))
+            setattr(self, 'mock_' + mocked_fn, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.mock_create_bundle.return_value = {"uuid": self.BUNDLE_UUID}
+        self.mock_create_draft.return_value = {"uuid": self.DRAFT_UUID}
+
+    def files_posted(self):
+        """
+        Return a dict of the data uploaded to the draft, keyed by path.
+        """
+        return {call[0][1]: call[0][2] for call in self.mock_add_file_to_draft.call_args_list}
+
+    def test_unchunked(self):
+        """
+        Test that a unit is transferred within a single task.
+        """
+        block_key = six.text_type(self.course.id.make_usage_key('vertical', 'unit1_1_2'))
+        result = transfer_to_blockstore_task.delay(block_key, collection_uuid=self.COLLECTION_UUID).get()
+
+        self.assertEqual(result, {'root': block_key, 'bundle_uuid': self.BUNDLE_UUID, 'chunks': []})
+        self.mock_commit_draft.assert_called_once_with(self.DRAFT_UUID)
+        self.assertIn('unit/unit1_1_2/definition.xml', self.files_posted())
+
+    def test_chunked_course(self):
+        """
+        Test that a course is transferred in one sub-task per chapter, and that
+        the results of all chapters end up in a single commit.
+        """
+        block_key = six.text_type(self.course.location)
+        result = transfer_to_blockstore_task.delay(block_key, collection_uuid=self.COLLECTION_UUID).get()
+
+        self.assertEqual(result['bundle_uuid'], self.BUNDLE_UUID)
+        self.assertEqual(result['draft_uuid'], self.DRAFT_UUID)
+        self.assertEqual(result['chunks'], [six.text_type(self.course.id.make_usage_key('chapter', 'section1'))])
+        self.mock_create_bundle.assert_called_once()
+        self.mock_create_draft.assert_called_once()
+        self.mock_commit_draft.assert_called_once_with(self.DRAFT_UUID)
+
+        files_posted = self.files_posted()
+        manifest = json.loads(files_posted['bundle.json'])
+        self.assertEqual(manifest['type'], 'olx/course')
+        self.assertIn('course/{}/definition.xml'.format(self.course.location.block_id), manifest['components'])
+        self.assertIn('chapter/section1/definition.xml', manifest['components'])
+        self.assertIn('unit/unit1_1_2/definition.xml', manifest['components'])
+        self.assertIn('html/html_b/static/sample_handout.txt', manifest['assets'])
+        self.assertSetEqual(set(files_posted), set(manifest['components'] + manifest['assets'] + ['bundle.json']))
+
+        transfer = Transfer.objects.get(id=result['transfer_id'])
+        self.assertEqual(six.text_type(transfer.collection_uuid), self.COLLECTION_UUID)
+        self.assertIsNotNone(transfer.committed_at)
+
+    def test_chunk_failure(self):
+        """
+        Test that the failure of a chunk is recorded against the transfer,
+        rather than leaving it looking like it is still running.
+        """
+        block_key = six.text_type(self.course.location)
+        with mock.patch('openedx_blockstore_relay.tasks.chord') as mock_chord:
+            result = transfer_to_blockstore_task.delay(block_key, collection_uuid=self.COLLECTION_UUID).get()
+        finish = mock_chord.return_value.call_args[0][0]
+        self.assertEqual(finish.options['link_error'], [fail_transfer_task.s(result['transfer_id'])])
+
+        # Celery calls the errback with the failed task's request, exception and traceback:
+        fail_transfer_task(mock.Mock(id='chunk-task-id'), ValueError('Blockstore is down'), None, result['transfer_id'])
+        transfer = Transfer.objects.get(id=result['transfer_id'])
+        self.assertIsNone(transfer.committed_at)
+        self.assertIsNotNone(transfer.failed_at)
+        self.assertIn('Blockstore is down', transfer.error)
+        self.mock_commit_draft.assert_not_called()
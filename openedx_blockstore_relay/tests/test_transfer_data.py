@@ -11,6 +11,7 @@ import mock
 
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
 
+from .. import ledger
 from ..transfer_data import transfer_to_blockstore
 from .course_data import TestCourseMixin
 from .xml_test_mixin import XmlTestMixin
@@ -31,8 +32,8 @@ class TransferToBlockstoreTestCase(TestCourseMixin, XmlTestMixin, ModuleStoreTes
         super(TransferToBlockstoreTestCase, self).setUp()
 
         # Mock out blockstore:
-        for mocked_fn in ('create_bundle', 'create_draft', 'add_file_to_draft', 'commit_draft'):
-            patcher = mock.patch('openedx_blockstore_relay.transfer_data.{}'.format(mocked_fn))
+        for mocked_fn in ('create_bundle', 'create_draft', 'add_file_to_draft', 'add_files_to_draft', 'commit_draft'):
+            patcher = mock.patch('openedx_blockstore_relay.sinks.{}'.format(mocked_fn))
             setattr(self, 'mock_' + mocked_fn, patcher.start())
             self.addCleanup(patcher.stop)
         self.mock_create_bundle.return_value = {"uuid": self.BUNDLE_UUID}
@@ -93,3 +94,121 @@ class TransferToBlockstoreTestCase(TestCourseMixin, XmlTestMixin, ModuleStoreTes
             file_data_by_path['html/html_b/static/html_b.html'],
             '<p>Activate the ωμέγα 13! <a href="/static/sample_handout.txt">Instructions.</a></p>'
         )
+
+    def test_progress_events(self):
+        """
+        Test that progress events are passed to the callback, ending with a
+        'committed' event once every file has been uploaded.
+        """
+        events = []
+        block_key = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+        transfer_to_blockstore(block_key, progress_callback=events.append, progress_interval=0)
+
+        self.assertEqual(events[0]['stage'], 'serialized')
+        self.assertEqual(events[0]['blocks_total'], 4)
+        self.assertEqual(events[0]['files_total'], 8)
+        self.assertEqual(events[-1]['stage'], 'committed')
+        self.assertEqual(events[-1]['blocks_done'], 4)
+        self.assertEqual(events[-1]['files_done'], self.mock_add_file_to_draft.call_count)
+        self.assertEqual(events[-1]['bytes_done'], events[-1]['bytes_total'])
+
+    def test_ledger(self):
+        """
+        Test that the transfer and each transferred block are recorded in the
+        ledger.
+        """
+        block_key = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+        transfer_to_blockstore(block_key, collection_uuid=self.COLLECTION_UUID)
+
+        transfer = ledger.get_latest_transfer(block_key)
+        self.assertEqual(str(transfer.bundle_uuid), self.BUNDLE_UUID)
+        self.assertEqual(str(transfer.draft_uuid), self.DRAFT_UUID)
+        self.assertEqual(transfer.blocks.count(), 4)
+        location = ledger.locate_block(self.course.id.make_usage_key('html', 'html_b'))
+        self.assertEqual(location.transfer, transfer)
+        self.assertEqual(location.def_path, 'html/html_b/definition.xml')
+        self.assertSetEqual(set(location.asset_digests), {
+            'html/html_b/static/html_b.html',
+            'html/html_b/static/sample_handout.txt',
+        })
+
+    def test_concurrent_upload(self):
+        """
+        Test that serializing and uploading concurrently, within a memory
+        budget, uploads the same files as a sequential transfer.
+        """
+        block_key = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+        transfer_to_blockstore(block_key)
+        sequential_files = {call[0][1]: call[0][2] for call in self.mock_add_file_to_draft.call_args_list}
+        self.mock_add_file_to_draft.reset_mock()
+        self.mock_commit_draft.reset_mock()
+
+        transfer_to_blockstore(block_key, max_inflight_bytes=1024, upload_workers=3)
+        concurrent_files = {call[0][1]: call[0][2] for call in self.mock_add_file_to_draft.call_args_list}
+        for call in self.mock_add_files_to_draft.call_args_list:  # Small files are uploaded in batches
+            concurrent_files.update(call[0][1])
+        self.mock_commit_draft.assert_called_once_with(self.DRAFT_UUID)
+        self.assertEqual(set(concurrent_files), set(sequential_files))
+        for path, data in sequential_files.items():
+            if path != 'bundle.json':  # The manifest lists files in upload order
+                self.assertEqual(concurrent_files[path], data)
+        self.assertEqual(ledger.get_latest_transfer(block_key).blocks.count(), 4)
+
+    def test_chunked_commits(self):
+        """
+        Test that committing every few files uploads the same files, with
+        several commits of the same draft.
+        """
+        block_key = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+        transfer_to_blockstore(block_key, collection_uuid=self.COLLECTION_UUID)
+        single_commit_files = [call[0][1:] for call in self.mock_add_file_to_draft.call_args_list]
+        self.mock_add_file_to_draft.reset_mock()
+        self.mock_commit_draft.reset_mock()
+
+        transfer_to_blockstore(block_key, collection_uuid=self.COLLECTION_UUID, commit_every_files=2)
+        self.assertEqual([call[0][1:] for call in self.mock_add_file_to_draft.call_args_list], single_commit_files)
+        # After the unit and the html block (4 files), after the video (2 files), and at the end:
+        self.assertEqual(self.mock_commit_draft.call_args_list, [mock.call(self.DRAFT_UUID)] * 3)
+        transfer = ledger.get_latest_transfer(block_key)
+        self.assertEqual(transfer.partial_commits, 2)
+        self.assertEqual(transfer.blocks.count(), 4)
+
+    def test_resume_chunked_commits(self):
+        """
+        Test that re-running a transfer which failed after some intermediate
+        commits doesn't upload the blocks it committed again.
+        """
+        block_key = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+
+        def fail_dnd(draft_uuid, path, data):  # pylint: disable=unused-argument
+            """ Fail to upload the drag and drop block """
+            if path.startswith('drag-and-drop-v2/'):
+                raise IOError('Blockstore is down')
+        self.mock_add_file_to_draft.side_effect = fail_dnd
+        with self.assertRaises(IOError):
+            transfer_to_blockstore(block_key, bundle_uuid=self.BUNDLE_UUID, commit_every_files=2)
+        self.assertEqual(self.mock_commit_draft.call_count, 2)
+        self.assertIsNone(ledger.get_latest_transfer(block_key))
+
+        self.mock_add_file_to_draft.reset_mock()
+        self.mock_add_file_to_draft.side_effect = None
+        transfer_to_blockstore(block_key, bundle_uuid=self.BUNDLE_UUID, commit_every_files=2)
+        uploaded_paths = [call[0][1] for call in self.mock_add_file_to_draft.call_args_list]
+        self.assertEqual(uploaded_paths, ['drag-and-drop-v2/dnd/definition.xml', 'bundle.json'])
+        manifest = json.loads(self.mock_add_file_to_draft.call_args[0][2])
+        self.assertEqual(len(manifest['components']), 4)
+        self.assertEqual(ledger.get_latest_transfer(block_key).blocks.count(), 4)
+
+    def test_verify(self):
+        """
+        Test that the bundle is verified once committed, against the manifest
+        that was uploaded.
+        """
+        block_key = self.course.id.make_usage_key('vertical', 'unit1_1_2')
+        with mock.patch('openedx_blockstore_relay.transfer_data.verification.verify_and_repair') as mock_verify:
+            transfer_to_blockstore(block_key)
+            mock_verify.assert_not_called()
+            transfer_to_blockstore(block_key, verify=True)
+        transfer, _sink, manifest_data = mock_verify.call_args[0]
+        self.assertEqual(transfer, ledger.get_latest_transfer(block_key))
+        self.assertEqual(manifest_data, self.mock_add_file_to_draft.call_args[0][2])
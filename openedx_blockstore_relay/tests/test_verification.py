@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the `openedx-blockstore-relay` post-commit verification.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+import shutil
+import tempfile
+
+import mock
+from django.test import TestCase
+from opaque_keys.edx.keys import CourseKey
+
+from .. import ledger
+from ..block_serializer import StaticFile
+from ..sinks import BlockstoreSink, DirectorySink, TarSink
+from ..test_utils.fake_blockstore import use_fake_blockstore
+from ..test_utils.serialized_block import SerializedBlock
+from ..transfer_data import transfer_to_blockstore
+from ..verification import VerificationFailed, can_verify, compare_files, verify_and_repair, verify_transfer
+
+COURSE_KEY = CourseKey.from_string('course-v1:edX+DemoX+Demo_Course')
+UNIT_KEY = COURSE_KEY.make_usage_key('vertical', 'unit1')
+HTML_KEY = COURSE_KEY.make_usage_key('html', 'html1')
+MANIFEST_DATA = '{"components": ["unit/unit1/definition.xml", "html/html1/definition.xml"]}'
+UNIT = SerializedBlock(UNIT_KEY, 'unit/unit1', b'<unit/>', [])
+HTML = SerializedBlock(HTML_KEY, 'html/html1', b'<html/>', [StaticFile('html1.html', b'<p>Hello</p>')])
+
+
+class CompareFilesTestCase(TestCase):
+    """
+    Tests for compare_files().
+    """
+
+    def test_compare(self):
+        expected = {'a.xml': ledger.digest(b'a'), 'b.xml': ledger.digest(b'b'), 'c.xml': ledger.digest(b'c')}
+        result = compare_files(expected, [
+            {'path': 'a.xml', 'size': 1, 'hash_digest': ledger.digest(b'a')},
+            {'path': 'b.xml', 'size': 1, 'hash_digest': ledger.digest(b'x')},
+            {'path': 'other.xml', 'size': 1, 'hash_digest': ledger.digest(b'o')},
+        ])
+        self.assertEqual(result.checked, 3)
+        self.assertEqual(result.missing, ['c.xml'])
+        self.assertEqual(result.mismatched, ['b.xml'])
+        self.assertFalse(result.ok)
+        self.assertEqual(result.bad_paths, {'b.xml', 'c.xml'})
+
+    def test_no_digests(self):
+        # Files listed without a digest are only checked for being there:
+        result = compare_files({'a.xml': ledger.digest(b'a')}, [{'path': 'a.xml', 'size': 1}])
+        self.assertTrue(result.ok)
+
+
+class VerifyTransferTestCase(TestCase):
+    """
+    Tests for verifying and repairing transfers, against the fake Blockstore
+    server.
+    """
+
+    def setUp(self):
+        super(VerifyTransferTestCase, self).setUp()
+        self.blockstore = use_fake_blockstore(self)
+        self.sink = BlockstoreSink()
+
+    def transfer(self, files):
+        """
+        Upload and commit the given files, recording a transfer of the unit
+        and its HTML block in the ledger, and return it.
+        """
+        bundle_uuid = self.sink.create_bundle('d3e311a8-b3a8-439d-a111-cc6cb99790e8', 'Unit', 'unit1')['uuid']
+        draft_uuid = self.sink.create_draft(bundle_uuid, 'relay_import', 'Unit')['uuid']
+        self.sink.add_files_to_draft(draft_uuid, files)
+        self.sink.commit_draft(draft_uuid)
+        transfer = ledger.start_transfer(UNIT_KEY, bundle_uuid, draft_uuid)
+        ledger.record_blocks(transfer, {UNIT_KEY: UNIT, HTML_KEY: HTML})
+        ledger.mark_committed(transfer)
+        return transfer
+
+    def test_verified(self):
+        transfer = self.transfer([
+            ('unit/unit1/definition.xml', b'<unit/>'),
+            ('html/html1/definition.xml', b'<html/>'),
+            ('html/html1/static/html1.html', b'<p>Hello</p>'),
+            ('bundle.json', MANIFEST_DATA),
+        ])
+        num_requests = len(self.blockstore.requests)
+        result = verify_transfer(transfer, self.sink, MANIFEST_DATA)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.checked, 4)
+        # A single request, which downloads no file:
+        self.assertEqual(len(self.blockstore.requests), num_requests + 1)
+
+    @mock.patch('openedx_blockstore_relay.verification.compat.get_block')
+    @mock.patch('openedx_blockstore_relay.verification.XBlockSerializer')
+    def test_repair(self, mock_serializer, mock_get_block):
+        mock_serializer.return_value = HTML
+        transfer = self.transfer([
+            ('unit/unit1/definition.xml', b'<unit/>'),
+            ('html/html1/definition.xml', b'<html/>'),
+            ('html/html1/static/html1.html', b'<p>Hell</p>'),  # Corrupted
+        ])
+        result = verify_transfer(transfer, self.sink, MANIFEST_DATA)
+        self.assertEqual(result.missing, ['bundle.json'])
+        self.assertEqual(result.mismatched, ['html/html1/static/html1.html'])
+
+        result = verify_and_repair(transfer, self.sink, MANIFEST_DATA)
+        self.assertTrue(result.ok)
+        # Only the HTML block was serialized again, and only the bad files were uploaded again:
+        mock_get_block.assert_called_once_with(HTML_KEY)
+        self.assertEqual(set(self.blockstore.commits[-1][1]) - set(self.blockstore.commits[0][1]), {'bundle.json'})
+        self.assertEqual(
+            self.blockstore.bundle_files(str(transfer.bundle_uuid))['html/html1/static/html1.html'], b'<p>Hello</p>',
+        )
+
+    @mock.patch('openedx_blockstore_relay.verification.compat.get_block')
+    @mock.patch('openedx_blockstore_relay.verification.XBlockSerializer')
+    def test_repair_fails(self, mock_serializer, mock_get_block):  # pylint: disable=unused-argument
+        mock_serializer.return_value = HTML
+        transfer = self.transfer([('unit/unit1/definition.xml', b'<unit/>')])
+        with mock.patch.object(self.sink, 'commit_draft'):  # The re-uploaded files never get committed
+            with self.assertRaisesRegexp(VerificationFailed, 'html/html1/definition.xml'):
+                verify_and_repair(transfer, self.sink)
+
+    def test_repair_sharded_parent(self):
+        """
+        Test that the blocks of a bundle which includes blocks from other
+        bundles are repaired with the serializer of its transfer, and only
+        with it.
+        """
+        unit_olx = b'<unit>\n  <xblock-include definition="html/html1" source="html-html1"/>\n</unit>\n'
+        manifest_data = '{"components": ["unit/unit1/definition.xml"], "dependencies": [{"name": "html-html1"}]}'
+        unit = SerializedBlock(UNIT_KEY, 'unit/unit1', unit_olx, [])
+        bundle_uuid = self.sink.create_bundle('d3e311a8-b3a8-439d-a111-cc6cb99790e8', 'Unit', 'unit1')['uuid']
+        draft_uuid = self.sink.create_draft(bundle_uuid, 'relay_import', 'Unit')['uuid']
+        self.sink.add_files_to_draft(draft_uuid, [('bundle.json', manifest_data)])  # The unit's OLX got lost
+        self.sink.commit_draft(draft_uuid)
+        transfer = ledger.start_transfer(UNIT_KEY, bundle_uuid, draft_uuid)
+        ledger.record_blocks(transfer, {UNIT_KEY: unit})
+        ledger.mark_committed(transfer)
+
+        with self.assertRaisesRegexp(VerificationFailed, 'cannot be repaired'):
+            verify_and_repair(transfer, self.sink, manifest_data)
+        serialize = mock.Mock(return_value=unit)
+        self.assertTrue(verify_and_repair(transfer, self.sink, manifest_data, serialize).ok)
+        serialize.assert_called_once_with(UNIT_KEY)
+        self.assertEqual(self.blockstore.bundle_files(bundle_uuid)['unit/unit1/definition.xml'], unit_olx)
+        self.assertEqual(transfer.blocks.get().olx_digest, ledger.digest(unit_olx))
+
+
+class VerifyLocalSinkTestCase(TestCase):
+    """
+    Tests for verifying transfers written to local files.
+    """
+
+    def test_tar_sink(self):
+        """
+        Test that transfers written to a tar archive, which can't be listed,
+        are refused verification before anything is transferred.
+        """
+        sink = TarSink(io.BytesIO())
+        self.addCleanup(sink.close)
+        self.assertFalse(can_verify(sink))
+        self.assertTrue(can_verify(BlockstoreSink()))
+        with mock.patch('openedx_blockstore_relay.transfer_data.serialize_subtree') as mock_serialize:
+            with self.assertRaisesRegexp(ValueError, 'TarSink cannot be verified'):
+                transfer_to_blockstore(UNIT_KEY, collection_uuid='d3e311a8-b3a8-439d-a111-cc6cb99790e8', sink=sink,
+                                       verify=True)
+        mock_serialize.assert_not_called()
+
+    def test_verify(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        sink = DirectorySink(root)
+        bundle_uuid = sink.create_bundle('d3e311a8-b3a8-439d-a111-cc6cb99790e8', 'Unit', 'unit1')['uuid']
+        draft_uuid = sink.create_draft(bundle_uuid, 'relay_import', 'Unit')['uuid']
+        sink.add_files_to_draft(draft_uuid, [
+            ('unit/unit1/definition.xml', b'<unit/>'),
+            ('html/html1/definition.xml', b'<html/>'),
+        ])
+        sink.commit_draft(draft_uuid)
+        transfer = ledger.start_transfer(UNIT_KEY, bundle_uuid, draft_uuid)
+        ledger.record_blocks(transfer, {UNIT_KEY: UNIT, HTML_KEY: HTML})
+
+        result = verify_transfer(transfer, sink)
+        self.assertEqual(result.missing, ['html/html1/static/html1.html'])
+        self.assertEqual(result.mismatched, [])
@@ -5,12 +5,18 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import json
 import logging
+from collections import OrderedDict
 
+import six
 from django.utils.translation import gettext as _
 
-from . import compat
+from . import compat, hash_tree, ledger, verification
 from .block_serializer import XBlockSerializer
-from .blockstore_client import add_file_to_draft, commit_draft, create_bundle, create_draft
+from .olx_export import ExportBlockSerializer, OlxExport
+from .pipeline import DEFAULT_LARGE_FILE_BYTES, DEFAULT_LARGE_FILE_WORKERS, TransferAborted, UploadPipeline
+from .progress import DEFAULT_PROGRESS_INTERVAL, STAGE_SERIALIZED, TransferProgress
+from .sinks import BlockstoreSink
+from .structure_serializer import StructureBlockSerializer, can_serialize_stored_block
 
 log = logging.getLogger(__name__)
 BUNDLE_DRAFT_NAME = 'relay_import'
@@ -30,58 +36,109 @@ def _bundle_type(block_type):
     return 'olx/{}'.format(bundle_type)
 
 
-def transfer_to_blockstore(root_block_key, bundle_uuid=None, collection_uuid=None):
+def count_upload_work(serialized_blocks):
     """
-    Transfer the given block (and its children) to Blockstore.
+    Return the number of files and bytes that uploading serialized_blocks will
+    involve (not counting the bundle.json manifest).
+    """
+    num_files = num_bytes = 0
+    for data in serialized_blocks.values():
+        num_files += 1 + len(data.static_files)
+        num_bytes += len(data.olx_str) + sum(len(asset_file.data) for asset_file in data.static_files)
+    return num_files, num_bytes
 
-    Args:
-    * block_key: usage key of the Open edX block to transfer
-    * bundle_uuid: UUID of the destination block
-    * collection_uuid: UUID of the destination collection
-      If no bundle_uuid provided, then a new bundle will be created here and that becomes the destination bundle.
+
+def _prefetch_edxval_videos(root_block_key, stored_blocks=None):
     """
+    Fetch the edxval data of every video in the subtree of root_block_key in
+    bulk, when that is cheap to find out: for whole courses, and for any
+    subtree whose stored blocks have been read.
 
-    # Step 1: Serialize the XBlocks to OLX files + static asset files
+    Returns the dict from compat.get_edxval_videos(), or None.
+    """
+    course_key = root_block_key.course_key
+    if stored_blocks:
+        edx_video_ids = [
+            stored_block['fields'].get('edx_video_id')
+            for usage_key, stored_block in stored_blocks.items()
+            if usage_key.block_type == 'video'
+        ]
+    elif root_block_key.block_type == 'course':
+        edx_video_ids = compat.get_course_video_ids(course_key)
+    else:
+        return None
+    edx_video_ids = set(video_id for video_id in edx_video_ids if video_id)
+    if not edx_video_ids:
+        return None
+    log.debug('Fetching edxval data for %d videos', len(edx_video_ids))
+    return compat.get_edxval_videos(edx_video_ids, course_key)
 
-    serialized_blocks = {}  # Key is each XBlock's original usage key
 
-    def serialize_block(block_key):
-        """ Inner method to recursively serialize an XBlock to OLX """
-        if block_key in serialized_blocks:
-            return
+def iter_serialized_subtree(root_block_key, include_children=True, from_structure=False, known_assets=None):
+    """
+    Serialize the given XBlock and (unless include_children is False) all of
+    its descendants to OLX files + static asset files, yielding an
+    XBlockSerializer for each block as soon as it has been serialized.
 
-        block = compat.get_block(block_key)
-        serialized_blocks[block_key] = XBlockSerializer(block)
+    If from_structure is True and the course is in split modulestore, the
+    course's stored documents are read in bulk up front, and the common block
+    types are serialized from them without being loaded (see
+    structure_serializer.py). This is worthwhile for large subtrees only.
 
-        if block.has_children:
-            for child_id in block.children:
-                serialize_block(child_id)
+    When serializing a whole course (or from_structure), the edxval data and
+    transcripts of all its videos are fetched in a few bulk queries up front,
+    rather than by each video block's export.
 
-    serialize_block(root_block_key)
+    known_assets is the dict of the contentstore assets which the destination
+    bundle already has (see XBlockSerializer): those aren't read again.
+    """
+    stored_blocks = compat.get_stored_blocks(root_block_key.course_key) if from_structure else None
+    edxval_videos = _prefetch_edxval_videos(root_block_key, stored_blocks) if include_children else None
+    seen = set()
+    to_serialize = [root_block_key]
+    while to_serialize:
+        block_key = to_serialize.pop()
+        if block_key in seen:
+            continue
+        seen.add(block_key)
 
-    root_block = compat.get_block(root_block_key)
+        stored_block = stored_blocks.get(block_key) if stored_blocks else None
+        if stored_block is not None and can_serialize_stored_block(block_key, stored_block):
+            yield StructureBlockSerializer(block_key, stored_block, known_assets=known_assets)
+            children = stored_block['fields'].get('children', [])
+        else:
+            block = compat.get_block(block_key)
+            yield XBlockSerializer(block, known_assets=known_assets, edxval_videos=edxval_videos)
+            children = block.children if block.has_children else []
 
-    # Step 2: Create a bundle and draft to hold the incoming data:
-    if bundle_uuid is None:
-        log.debug('Creating bundle')
-        bundle_data = create_bundle(
-            collection_uuid=collection_uuid,
-            title=getattr(root_block, 'display_name', root_block_key),
-            slug=root_block_key.block_id,
-            description=_("Transferred to Blockstore from Open edX {block_key}").format(block_key=root_block_key),
+        if include_children:
+            # Reversed, so that children get popped off the stack in order:
+            to_serialize.extend(reversed(children))
+
+
+def serialize_subtree(root_block_key, include_children=True, from_structure=False, known_assets=None):
+    """
+    Serialize the given XBlock and (unless include_children is False) all of
+    its descendants to OLX files + static asset files (see
+    iter_serialized_subtree() about from_structure and known_assets).
+
+    Returns a dict of XBlockSerializer objects, keyed by each XBlock's original
+    usage key.
+    """
+    return {
+        data.orig_block_key: data
+        for data in iter_serialized_subtree(
+            root_block_key, include_children=include_children, from_structure=from_structure,
+            known_assets=known_assets,
         )
-        bundle_uuid = bundle_data["uuid"]
-    log.debug('Creating "%s" draft to hold incoming files', BUNDLE_DRAFT_NAME)
-    draft_data = create_draft(
-        bundle_uuid=bundle_uuid,
-        name=BUNDLE_DRAFT_NAME,
-        title="OLX imported via openedx-blockstore-relay",
-    )
-    bundle_draft_uuid = draft_data['uuid']
+    }
 
-    # Step 3: Upload files into the draft
 
-    manifest = {
+def new_manifest(root_block_key):
+    """
+    Return a new, empty bundle.json manifest for a bundle holding the given block.
+    """
+    return {
         'schema': BUNDLE_SCHEMA_VERSION,
         'type': _bundle_type(root_block_key.block_type),
         'assets': [],
@@ -89,23 +146,622 @@ def transfer_to_blockstore(root_block_key, bundle_uuid=None, collection_uuid=Non
         'dependencies': [],
     }
 
+
+def _bundle_manifest(root_block_key, block_manifests):
+    """
+    Return the bundle.json manifest for a bundle holding the given block,
+    listing the files of each of block_manifests (manifest entries of the
+    blocks in the bundle, as returned by ledger.get_bundle_contents()).
+    """
+    manifest = new_manifest(root_block_key)
+    for block_manifest in block_manifests:
+        manifest['components'].extend(block_manifest['components'])
+        manifest['assets'].extend(block_manifest['assets'])
+    return manifest
+
+
+def create_destination_bundle(root_block, collection_uuid, sink=None):
+    """
+    Create a new bundle in collection_uuid, in the given sink (Blockstore by
+    default; see sinks.py), to hold the files imported from root_block.
+
+    Returns the UUID of the bundle.
+    """
+    sink = sink or BlockstoreSink()
+    root_block_key = root_block.scope_ids.usage_id
+    log.debug('Creating bundle')
+    bundle_data = sink.create_bundle(
+        collection_uuid=collection_uuid,
+        title=getattr(root_block, 'display_name', root_block_key),
+        slug=root_block_key.block_id,
+        description=_("Transferred to Blockstore from Open edX {block_key}").format(block_key=root_block_key),
+    )
+    return bundle_data["uuid"]
+
+
+def start_import(root_block, bundle_uuid=None, collection_uuid=None, sink=None):
+    """
+    Create a draft to hold the files imported from root_block (and, if no
+    bundle_uuid is given, a new bundle in collection_uuid to hold the draft),
+    in the given sink (Blockstore by default; see sinks.py).
+
+    Returns (bundle_uuid, draft_uuid).
+    """
+    sink = sink or BlockstoreSink()
+    if bundle_uuid is None:
+        bundle_uuid = create_destination_bundle(root_block, collection_uuid, sink)
+    log.debug('Creating "%s" draft to hold incoming files', BUNDLE_DRAFT_NAME)
+    draft_data = sink.create_draft(
+        bundle_uuid=bundle_uuid,
+        name=BUNDLE_DRAFT_NAME,
+        title="OLX imported via openedx-blockstore-relay",
+    )
+    return bundle_uuid, draft_data['uuid']
+
+
+def upload_serialized_blocks(draft_uuid, serialized_blocks, manifest, progress=None, committer=None, sink=None):
+    """
+    Upload the OLX and static files of each of serialized_blocks into the
+    given draft (in the given sink), recording their paths in manifest.
+
+    If a ChunkedCommitter is given, it is told about each uploaded block (so
+    it can commit the draft every so often), and blocks which it knows are
+    already committed unchanged are not uploaded again.
+    """
+    sink = sink or BlockstoreSink()
     # For each XBlock that we're exporting:
     for data in serialized_blocks.values():
-        # Add the OLX to the draft:
         folder_path = '{}/'.format(data.def_id)
         path = folder_path + 'definition.xml'
-        log.info('Uploading {} to {}'.format(data.orig_block_key, path))
-        add_file_to_draft(bundle_draft_uuid, path, data.olx_str)
+        # The OLX, and any static asset files the block depends on:
+        files = [(path, data.olx_str)]
+        files.extend((folder_path + 'static/' + asset_file.name, asset_file.data) for asset_file in data.static_files)
+        skip = committer is not None and committer.already_committed(data)
+        if skip:
+            log.info('Not uploading {}: it is already committed to {}'.format(data.orig_block_key, path))
+        else:
+            log.info('Uploading {} to {}'.format(data.orig_block_key, path))
+        for file_path, file_data in files:
+            if not skip:
+                sink.add_file_to_draft(draft_uuid, file_path, file_data)
+            if progress:
+                progress.file_uploaded(len(file_data))
         manifest['components'].append(path)
-        # If the block depends on any static asset files, add those too:
-        for asset_file in data.static_files:
-            asset_path = folder_path + 'static/' + asset_file.name
-            add_file_to_draft(bundle_draft_uuid, asset_path, asset_file.data)
-            manifest['assets'].append(asset_path)
+        manifest['assets'].extend(file_path for file_path, _file_data in files[1:])
+        manifest['assets'].extend(folder_path + 'static/' + reused_asset.name for reused_asset in data.reused_assets)
+        if progress:
+            progress.block_uploaded()
+        if committer is not None:
+            if skip:
+                committer.block_uploaded(data, num_files=0, num_bytes=0)
+            else:
+                committer.block_uploaded(data, len(files), sum(len(file_data) for _path, file_data in files))
+
+
+class ChunkedCommitter(object):
+    """
+    Commits a draft whenever the files uploaded into it since its last commit
+    reach a given number of files or bytes, so that Blockstore never has to
+    commit too much at once, and a transfer which fails halfway keeps what it
+    has committed so far. The same draft keeps being used after each commit.
+
+    The transfer's blocks are recorded in the ledger as they get committed, so
+    that re-running a failed transfer into the same bundle can skip the blocks
+    which it already committed, if they haven't changed since (see
+    ledger.get_partially_committed_blocks()).
+    """
+
+    def __init__(self, draft_uuid, transfer, max_files=None, max_bytes=None, previous_blocks=None, sink=None):
+        """
+        Args:
+        * draft_uuid: UUID of the draft the files are uploaded into
+        * transfer: the ledger Transfer being run
+        * max_files, max_bytes: commit the draft once this many files / bytes
+          have been uploaded since the last commit
+        * previous_blocks: blocks committed by a previous, failed run of the
+          same transfer, as returned by ledger.get_partially_committed_blocks()
+        * sink: where the draft is (Blockstore by default; see sinks.py)
+        """
+        self.draft_uuid = draft_uuid
+        self.sink = sink or BlockstoreSink()
+        self.transfer = transfer
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.previous_blocks = previous_blocks or {}
+        self.recorder = ledger.BlockRecorder(transfer)
+        self.pending_files = self.pending_bytes = 0
+
+    def already_committed(self, data):
+        """
+        Return True if the given serialized block was committed unchanged by a
+        previous run of the transfer.
+        """
+        previous = self.previous_blocks.get(data.orig_block_key)
+        return previous is not None and tuple(previous) == ledger.block_digests(data)
+
+    def block_uploaded(self, data, num_files, num_bytes):
+        """
+        Record that the given serialized block's files (num_files files of
+        num_bytes bytes in total) have been uploaded, and commit the draft if
+        that makes enough files or bytes.
+        """
+        self.recorder.add(data)
+        self.pending_files += num_files
+        self.pending_bytes += num_bytes
+        if (
+            (self.max_files and self.pending_files >= self.max_files) or
+            (self.max_bytes and self.pending_bytes >= self.max_bytes)
+        ):
+            self.commit()
+
+    def commit(self):
+        """
+        Commit the files uploaded so far, and record their blocks in the ledger.
+        """
+        if self.pending_files:
+            log.info('Committing {} file(s) ({} bytes) to draft {}'.format(
+                self.pending_files, self.pending_bytes, self.draft_uuid,
+            ))
+            self.sink.commit_draft(self.draft_uuid)
+            ledger.mark_partially_committed(self.transfer)
+        self.recorder.save()
+        self.pending_files = self.pending_bytes = 0
+
+    def finish(self):
+        """
+        Record the remaining blocks in the ledger, once the final commit (see
+        finish_import()) has been made.
+        """
+        self.recorder.save()
+
+
+def manifest_json(manifest):
+    """
+    Return the data of the bundle.json file for the given manifest.
+    """
+    return json.dumps(manifest, ensure_ascii=False)
 
+
+def finish_import(draft_uuid, manifest, progress=None, sink=None):
+    """
+    Upload the bundle.json manifest and commit the draft.
+    """
+    sink = sink or BlockstoreSink()
     # Commit the manifest file. TODO: do we actually need this?
-    add_file_to_draft(bundle_draft_uuid, 'bundle.json', json.dumps(manifest, ensure_ascii=False))
+    sink.add_file_to_draft(draft_uuid, 'bundle.json', manifest_json(manifest))
+    if progress:
+        progress.file_uploaded(0)
+    sink.commit_draft(draft_uuid)
+    if progress:
+        progress.committed()
+
+
+def transfer_to_blockstore(
+    root_block_key, bundle_uuid=None, collection_uuid=None,
+    progress_callback=None, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+    max_inflight_bytes=None, upload_workers=1, from_structure=False,
+    commit_every_files=None, commit_every_bytes=None, sink=None,
+    large_file_bytes=DEFAULT_LARGE_FILE_BYTES, large_file_workers=DEFAULT_LARGE_FILE_WORKERS, verify=False,
+    reuse_assets=False,
+):
+    """
+    Transfer the given block (and its children) to Blockstore.
+
+    Args:
+    * block_key: usage key of the Open edX block to transfer
+    * bundle_uuid: UUID of the destination block
+    * collection_uuid: UUID of the destination collection
+      If no bundle_uuid provided, then a new bundle will be created here and that becomes the destination bundle.
+    * progress_callback: optional callable which is passed a progress event
+      dict (see progress.TransferProgress) periodically during the transfer
+    * progress_interval: minimum number of seconds between progress events
+    * max_inflight_bytes: if set, serialize and upload blocks concurrently
+      (see _stream_to_blockstore()), keeping the memory used by data which has
+      been serialized but not yet uploaded within this many bytes (plus the
+      block waiting for room; see pipeline.py)
+    * upload_workers: if more than 1, serialize and upload blocks
+      concurrently, using this many upload threads
+    * large_file_bytes, large_file_workers: when uploading concurrently,
+      files of at least large_file_bytes are uploaded, largest first, by
+      large_file_workers threads of their own, while the smaller files are
+      uploaded in batches (see pipeline.UploadPipeline)
+    * from_structure: serialize the common block types straight from split
+      modulestore's documents, without loading them (see iter_serialized_subtree())
+    * commit_every_files, commit_every_bytes: if either is set, commit the
+      draft whenever this many files or bytes have been uploaded since the
+      last commit (see ChunkedCommitter). When re-running a transfer into the
+      same bundle, blocks committed unchanged by a previous run that failed
+      are not uploaded again. Can't be combined with concurrent uploads.
+    * sink: where to write the bundle (see sinks.py); Blockstore by default.
+      The sink is not closed.
+    * verify: once committed, check the bundle's file listing against the
+      digests of the files sent, and upload any missing or mismatched files
+      again (see verification.verify_and_repair())
+    * reuse_assets: when transferring into an existing bundle, don't read or
+      upload the contentstore assets which the ledger says the bundle already
+      has at the same path, if their contentstore MD5 digest hasn't changed
+
+    Returns the UUID of the destination bundle.
+    """
+    sink = sink or BlockstoreSink()
+    progress = TransferProgress(root_block_key, callback=progress_callback, interval=progress_interval)
+    chunked_commits = bool(commit_every_files or commit_every_bytes)
+    if chunked_commits and (max_inflight_bytes or upload_workers > 1):
+        raise ValueError('Intermediate commits cannot be combined with concurrent uploads')
+    if verify and not verification.can_verify(sink):
+        raise ValueError('Transfers written to {} cannot be verified'.format(type(sink).__name__))
+    known_assets = ledger.get_bundle_assets(bundle_uuid, sink.destination) if reuse_assets and bundle_uuid else None
+    if max_inflight_bytes or upload_workers > 1:
+        return _stream_to_blockstore(
+            root_block_key, bundle_uuid, collection_uuid, progress, max_inflight_bytes, upload_workers,
+            from_structure, sink, large_file_bytes, large_file_workers, verify, known_assets,
+        )
+
+    # Step 1: Serialize the XBlocks to OLX files + static asset files
+    serialized_blocks = serialize_subtree(root_block_key, from_structure=from_structure, known_assets=known_assets)
+
+    root_block = compat.get_block(root_block_key)
+    num_files, num_bytes = count_upload_work(serialized_blocks)
+    progress.set_totals(blocks=len(serialized_blocks), files=num_files + 1, num_bytes=num_bytes)
+
+    # Step 2: Create a bundle and draft to hold the incoming data:
+    previous_blocks = (
+        ledger.get_partially_committed_blocks(root_block_key, bundle_uuid, sink.destination)
+        if chunked_commits and bundle_uuid else {}
+    )
+    bundle_uuid, bundle_draft_uuid = start_import(
+        root_block, bundle_uuid=bundle_uuid, collection_uuid=collection_uuid, sink=sink,
+    )
+    transfer = ledger.start_transfer(root_block_key, bundle_uuid, bundle_draft_uuid, collection_uuid, sink.destination)
+    committer = None
+    if chunked_commits:
+        committer = ChunkedCommitter(
+            bundle_draft_uuid, transfer,
+            max_files=commit_every_files, max_bytes=commit_every_bytes, previous_blocks=previous_blocks, sink=sink,
+        )
+
+    # Step 3: Upload files into the draft
+    manifest = new_manifest(root_block_key)
+    upload_serialized_blocks(bundle_draft_uuid, serialized_blocks, manifest, progress, committer, sink)
+    if committer is None:
+        ledger.record_blocks(transfer, serialized_blocks)
 
     # Step 4: Commit the draft
-    commit_draft(bundle_draft_uuid)
+    finish_import(bundle_draft_uuid, manifest, progress, sink)
+    if committer is not None:
+        committer.finish()
+    ledger.mark_committed(transfer)
+    log.info('Finished import into bundle {}'.format(bundle_uuid))
+    if verify:
+        verification.verify_and_repair(transfer, sink, manifest_json(manifest))
+    return bundle_uuid
+
+
+def _stream_to_blockstore(
+    root_block_key, bundle_uuid, collection_uuid, progress, max_inflight_bytes, upload_workers, from_structure=False,
+    sink=None, large_file_bytes=DEFAULT_LARGE_FILE_BYTES, large_file_workers=DEFAULT_LARGE_FILE_WORKERS, verify=False,
+    known_assets=None,
+):
+    """
+    Transfer the given block (and its children) to Blockstore, uploading each
+    block while the next ones are being serialized rather than holding the
+    whole serialized subtree in memory.
+
+    The serializer is made to wait whenever the data which has been serialized
+    but not yet uploaded exceeds max_inflight_bytes.
+    """
+    sink = sink or BlockstoreSink()
+    root_block = compat.get_block(root_block_key)
+    bundle_uuid, bundle_draft_uuid = start_import(
+        root_block, bundle_uuid=bundle_uuid, collection_uuid=collection_uuid, sink=sink,
+    )
+    transfer = ledger.start_transfer(root_block_key, bundle_uuid, bundle_draft_uuid, collection_uuid, sink.destination)
+    recorder = ledger.BlockRecorder(transfer)
+    manifest = new_manifest(root_block_key)
+    pipeline = UploadPipeline(
+        sink.add_file_to_draft, bundle_draft_uuid, manifest,
+        progress=progress, max_inflight_bytes=max_inflight_bytes, workers=upload_workers,
+        upload_batch=sink.add_files_to_draft, large_file_bytes=large_file_bytes, large_file_workers=large_file_workers,
+    )
+    try:
+        for data in iter_serialized_subtree(root_block_key, from_structure=from_structure, known_assets=known_assets):
+            recorder.add(data)
+            num_files, num_bytes = count_upload_work({data.orig_block_key: data})
+            with pipeline.lock:
+                progress.add_totals(blocks=1, files=num_files, num_bytes=num_bytes)
+            pipeline.add_block(data)
+        with pipeline.lock:
+            progress.add_totals(files=1)  # The bundle.json manifest
+            progress.emit(STAGE_SERIALIZED)
+    except TransferAborted:
+        pass  # An upload has failed; pipeline.close() will raise its error.
+    finally:
+        pipeline.close()
+    recorder.save()
+
+    finish_import(bundle_draft_uuid, manifest, progress, sink)
+    ledger.mark_committed(transfer)
     log.info('Finished import into bundle {}'.format(bundle_uuid))
+    if verify:
+        verification.verify_and_repair(transfer, sink, manifest_json(manifest))
+    return bundle_uuid
+
+
+def transfer_subtrees_to_blockstore(block_keys, bundle_uuid, progress_callback=None, sink=None, reuse_assets=False):
+    """
+    Re-transfer the given blocks (and their children) into an existing bundle,
+    using a single draft and a single commit.
+
+    This is an incremental update: other files in the bundle are left as they
+    are, and the bundle.json manifest is rewritten to list the files of the
+    blocks which the ledger says are already in the bundle along with those of
+    the given subtrees. See transfer_to_blockstore() about reuse_assets.
+    """
+    sink = sink or BlockstoreSink()
+    block_keys = sorted(block_keys, key=six.text_type)
+    progress = TransferProgress(', '.join(six.text_type(key) for key in block_keys), callback=progress_callback)
+    known_assets = ledger.get_bundle_assets(bundle_uuid, sink.destination) if reuse_assets else None
+    serialized_subtrees = [
+        (block_key, serialize_subtree(block_key, known_assets=known_assets)) for block_key in block_keys
+    ]
+    num_blocks = num_files = num_bytes = 0
+    for _block_key, serialized_blocks in serialized_subtrees:
+        subtree_files, subtree_bytes = count_upload_work(serialized_blocks)
+        num_blocks += len(serialized_blocks)
+        num_files += subtree_files
+        num_bytes += subtree_bytes
+    progress.set_totals(blocks=num_blocks, files=num_files + 1, num_bytes=num_bytes)
+
+    block_manifests = ledger.get_bundle_contents(bundle_uuid, sink.destination)
+    bundle_uuid, bundle_draft_uuid = start_import(compat.get_block(block_keys[0]), bundle_uuid=bundle_uuid, sink=sink)
+    transfers = []
+    for block_key, serialized_blocks in serialized_subtrees:
+        for usage_key, data in serialized_blocks.items():
+            block_manifests[usage_key] = {'components': [], 'assets': []}
+            upload_serialized_blocks(
+                bundle_draft_uuid, {usage_key: data}, block_manifests[usage_key], progress, sink=sink,
+            )
+        transfer = ledger.start_transfer(block_key, bundle_uuid, bundle_draft_uuid, destination=sink.destination)
+        ledger.record_blocks(transfer, serialized_blocks)
+        transfers.append(transfer)
+    manifest = _bundle_manifest(compat.get_course_root_key(block_keys[0].course_key), block_manifests.values())
+    finish_import(bundle_draft_uuid, manifest, progress, sink)
+    for transfer in transfers:
+        ledger.mark_committed(transfer)
+    log.info('Finished updating %d block(s) in bundle %s', num_blocks, bundle_uuid)
+    return bundle_uuid
+
+
+def transfer_changes_to_blockstore(root_block_key, bundle_uuid, progress_callback=None, sink=None, reuse_assets=False):
+    """
+    Re-transfer into an existing bundle only those of the given block and its
+    descendants which have changed since the bundle's last changed-only
+    transfer, using a single draft and a single commit.
+
+    The changed blocks are found by comparing the hash tree of the block
+    versions in the course's split modulestore structure with the one recorded
+    in the ledger (see hash_tree.py), so unchanged blocks aren't serialized at
+    all. The first changed-only transfer into a bundle transfers every block.
+    Courses which aren't in split modulestore are transferred in full.
+
+    Other files in the bundle are left as they are, and the bundle.json
+    manifest is rewritten to list the files of the blocks which the ledger
+    says are already in the bundle (and which are still under the given
+    block) along with those of the changed blocks.
+    The transfer is recorded as incremental, since it only has the changed
+    blocks. See transfer_to_blockstore() about reuse_assets.
+
+    Returns the UUID of the bundle.
+    """
+    sink = sink or BlockstoreSink()
+    block_versions = compat.get_block_versions(root_block_key.course_key)
+    if block_versions is None:
+        log.info('%s is not in split modulestore; transferring all of it', root_block_key.course_key)
+        return transfer_to_blockstore(
+            root_block_key, bundle_uuid=bundle_uuid, progress_callback=progress_callback, sink=sink,
+            reuse_assets=reuse_assets,
+        )
+    hashes = hash_tree.compute_hash_tree(block_versions, root_block_key)
+    diff = hash_tree.diff_hash_trees(
+        root_block_key, block_versions, hashes, ledger.get_subtree_hashes(bundle_uuid, sink.destination),
+    )
+    log.info(
+        '%d of %d block(s) under %s have changed (%d compared)',
+        len(diff.changed), len(hashes), root_block_key, diff.compared,
+    )
+    progress = TransferProgress(root_block_key, callback=progress_callback)
+    if diff.changed:
+        known_assets = ledger.get_bundle_assets(bundle_uuid, sink.destination) if reuse_assets else None
+        serialized_blocks = {}
+        for block_key in diff.changed:
+            serialized_blocks.update(serialize_subtree(block_key, include_children=False, known_assets=known_assets))
+        num_files, num_bytes = count_upload_work(serialized_blocks)
+        progress.set_totals(blocks=len(serialized_blocks), files=num_files + 1, num_bytes=num_bytes)
+
+        # Blocks which are no longer in the course (e.g. deleted ones) are left out of the manifest:
+        block_manifests = OrderedDict(
+            (usage_key, block_manifest)
+            for usage_key, block_manifest in ledger.get_bundle_contents(bundle_uuid, sink.destination).items()
+            if usage_key in hashes
+        )
+        bundle_uuid, bundle_draft_uuid = start_import(
+            compat.get_block(root_block_key), bundle_uuid=bundle_uuid, sink=sink,
+        )
+        transfer = ledger.start_transfer(
+            root_block_key, bundle_uuid, bundle_draft_uuid, destination=sink.destination, incremental=True,
+        )
+        for usage_key, data in serialized_blocks.items():
+            block_manifests[usage_key] = {'components': [], 'assets': []}
+            upload_serialized_blocks(
+                bundle_draft_uuid, {usage_key: data}, block_manifests[usage_key], progress, sink=sink,
+            )
+        ledger.record_blocks(transfer, serialized_blocks)
+        finish_import(bundle_draft_uuid, _bundle_manifest(root_block_key, block_manifests.values()), progress, sink)
+        ledger.mark_committed(transfer)
+    else:
+        progress.committed()
+    # Only now that the changes are committed can the bundle be said to match these hashes:
+    ledger.record_subtree_hashes(
+        bundle_uuid, {usage_key: hashes[usage_key] for usage_key in diff.outdated}, destination=sink.destination,
+    )
+    log.info('Finished updating %d block(s) in bundle %s', len(diff.changed), bundle_uuid)
+    return bundle_uuid
+
+
+def _subtree_versions(block_versions, root_block_key):
+    """
+    Return the entries of block_versions (see compat.get_block_versions()) for
+    the given block and its descendants, parents first.
+    """
+    subtree = OrderedDict()
+    to_visit = [root_block_key]
+    while to_visit:
+        block_key = to_visit.pop()
+        if block_key in subtree or block_key not in block_versions:
+            continue
+        subtree[block_key] = block_versions[block_key]
+        to_visit.extend(reversed(block_versions[block_key][1]))
+    return subtree
+
+
+def _serialize_at_version(course_key, structure_version, block_keys):
+    """
+    Serialize the given blocks (without their children) as they were in the
+    given version of their course's structure, from their stored fields when
+    possible (see structure_serializer.py), and otherwise by loading them.
+
+    Returns a dict of XBlockSerializer objects, keyed by usage key.
+    """
+    stored_blocks = compat.get_stored_blocks(course_key, structure_version, usage_keys=block_keys)
+    serialized_blocks = OrderedDict()
+    for block_key in block_keys:
+        stored_block = stored_blocks.get(block_key)
+        if stored_block is not None and can_serialize_stored_block(block_key, stored_block):
+            data = StructureBlockSerializer(block_key, stored_block)
+        else:
+            data = XBlockSerializer(compat.get_block_at_version(block_key, structure_version))
+            # Record the block under its usual usage key, not the version-specific one:
+            data.orig_block_key = block_key
+        serialized_blocks[block_key] = data
+    return serialized_blocks
+
+
+def replay_history_to_blockstore(root_block_key, bundle_uuid=None, collection_uuid=None, progress_callback=None,
+                                 sink=None):
+    """
+    Transfer the given block and its descendants as they were in each version
+    of their course's split modulestore structure, oldest first, into the
+    given existing bundle (or a new bundle in the given collection), with one
+    commit per version in which they changed, so that the bundle's history
+    mirrors the course's.
+
+    Consecutive versions are compared using the block versions read from each
+    structure document alone (see compat.get_block_versions()), and only the
+    blocks which changed are serialized and uploaded, so the work done is
+    proportional to the changes rather than to (versions x blocks). The
+    bundle.json manifest is only uploaded again when its contents change.
+
+    Each commit is recorded in the ledger as a transfer of its own, those
+    after the first as incremental ones, since they only have the blocks
+    which changed (see ledger.start_transfer()). Blocks removed from the
+    course in some version are left in the bundle, since a draft's files can
+    only be added or replaced. Assets are read from the contentstore, which
+    only keeps their current version. Once done, the bundle's hash tree is
+    recorded, so changed-only transfers can carry on from there.
+
+    Returns the UUID of the bundle.
+    """
+    sink = sink or BlockstoreSink()
+    course_key = root_block_key.course_key
+    history = compat.get_structure_history(course_key)
+    if history is None:
+        raise ValueError('{} is not in split modulestore, so it has no history to replay'.format(course_key))
+    log.info('Replaying %d version(s) of %s', len(history), course_key)
+
+    progress = TransferProgress(root_block_key, callback=progress_callback)
+    bundle_uuid, draft_uuid = start_import(
+        compat.get_block(root_block_key), bundle_uuid=bundle_uuid, collection_uuid=collection_uuid, sink=sink,
+    )
+    subtree = {}
+    block_manifests = {}  # The manifest entries of each block uploaded so far, keyed by usage key
+    uploaded_manifest = None
+    committed = 0
+    for structure_version in history:
+        previous_subtree = subtree
+        subtree = _subtree_versions(compat.get_block_versions(course_key, structure_version), root_block_key)
+        changed = [block_key for block_key, versions in subtree.items() if previous_subtree.get(block_key) != versions]
+        if not changed:
+            continue
+
+        serialized_blocks = _serialize_at_version(course_key, structure_version, changed)
+        num_files, num_bytes = count_upload_work(serialized_blocks)
+        progress.add_totals(blocks=len(serialized_blocks), files=num_files, num_bytes=num_bytes)
+        # Only the first version's commit has every block:
+        transfer = ledger.start_transfer(
+            root_block_key, bundle_uuid, draft_uuid, destination=sink.destination, incremental=bool(previous_subtree),
+        )
+        for block_key, data in serialized_blocks.items():
+            block_manifests[block_key] = {'components': [], 'assets': []}
+            upload_serialized_blocks(draft_uuid, {block_key: data}, block_manifests[block_key], progress, sink=sink)
+        manifest = new_manifest(root_block_key)
+        for block_key in subtree:
+            if block_key in block_manifests:
+                manifest['components'].extend(block_manifests[block_key]['components'])
+                manifest['assets'].extend(block_manifests[block_key]['assets'])
+        if manifest_json(manifest) != uploaded_manifest:
+            uploaded_manifest = manifest_json(manifest)
+            sink.add_file_to_draft(draft_uuid, 'bundle.json', uploaded_manifest)
+        ledger.record_blocks(transfer, serialized_blocks)
+        sink.commit_draft(draft_uuid)
+        ledger.mark_committed(transfer)
+        committed += 1
+        log.info('Committed %d changed block(s) from version %s of %s', len(changed), structure_version, course_key)
+
+    progress.committed()
+    ledger.record_subtree_hashes(
+        bundle_uuid, hash_tree.compute_hash_tree(subtree, root_block_key), destination=sink.destination,
+    )
+    log.info('Replayed %d version(s) of %s into bundle %s', committed, root_block_key, bundle_uuid)
+    return bundle_uuid
+
+
+def transfer_export_to_blockstore(export_path, bundle_uuid=None, collection_uuid=None, progress_callback=None,
+                                  sink=None):
+    """
+    Transfer the course in the given OLX course export (the path of its
+    directory or .tar.gz archive; see olx_export.py) into the given existing
+    bundle, or a new bundle in the given collection, without reading anything
+    from the modulestore or contentstore.
+
+    The blocks' OLX and static files match what transferring the course from
+    the modulestore would give once the export has been imported into it,
+    except for video blocks: their edxval data and transcripts, which
+    importing the course would load into edx-val, are left as they are in the
+    export's OLX. The transfer is recorded in the ledger (against the sink's
+    destination) using the usage key of that course.
+
+    Returns the UUID of the bundle.
+    """
+    sink = sink or BlockstoreSink()
+    with OlxExport(export_path) as export:
+        root_block_key = export.root_block_key
+        progress = TransferProgress(root_block_key, callback=progress_callback)
+        blocks = list(export.iter_blocks())
+        serialized_blocks = OrderedDict(
+            (block.usage_key, ExportBlockSerializer(export, block)) for block in blocks
+        )
+        num_files, num_bytes = count_upload_work(serialized_blocks)
+        progress.set_totals(blocks=len(serialized_blocks), files=num_files + 1, num_bytes=num_bytes)
+
+        # The course's ExportBlock has what start_import() needs of the root block:
+        bundle_uuid, draft_uuid = start_import(
+            blocks[0], bundle_uuid=bundle_uuid, collection_uuid=collection_uuid, sink=sink,
+        )
+        transfer = ledger.start_transfer(root_block_key, bundle_uuid, draft_uuid, collection_uuid, sink.destination)
+        manifest = new_manifest(root_block_key)
+        upload_serialized_blocks(draft_uuid, serialized_blocks, manifest, progress, sink=sink)
+        ledger.record_blocks(transfer, serialized_blocks)
+        finish_import(draft_uuid, manifest, progress, sink)
+    ledger.mark_committed(transfer)
+    log.info('Finished import of %s into bundle %s', export_path, bundle_uuid)
+    return bundle_uuid
@@ -0,0 +1,208 @@
+"""
+Checking that a committed transfer's bundle holds what was sent, without
+downloading it again.
+
+verify_transfer() fetches the listing of the bundle's files (their paths,
+sizes and SHA-1 digests) in a single request, and compares it with the
+digests of every file of the transfer, as recorded in the ledger when the
+blocks were uploaded. Files which are missing from the bundle, or whose
+digest doesn't match, are re-uploaded by repair_transfer(), which serializes
+only the blocks those files belong to again, the way the transfer did (see
+its serialize argument).
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+from collections import namedtuple
+
+from . import compat, ledger
+from .block_serializer import XBlockSerializer
+from .sinks import BlockstoreSink
+
+log = logging.getLogger(__name__)
+MANIFEST_PATH = 'bundle.json'
+
+
+def can_verify(sink):
+    """
+    Return whether transfers written to the given sink can be verified, i.e.
+    whether it can list the files of its bundles.
+    """
+    return hasattr(sink, 'get_bundle_files')
+
+
+class VerificationFailed(Exception):
+    """
+    Raised when a bundle still doesn't hold the transferred files after they
+    have been re-uploaded.
+    """
+
+
+class Verification(namedtuple('Verification', ['checked', 'missing', 'mismatched'])):
+    """
+    The result of verifying a transfer: the number of files checked, and the
+    sorted lists of the paths of the files missing from the bundle and of
+    those whose digest differs from the one expected.
+    """
+
+    @property
+    def ok(self):
+        """
+        True if every file checked is in the bundle, with the expected digest.
+        """
+        return not self.missing and not self.mismatched
+
+    @property
+    def bad_paths(self):
+        """
+        The paths of the files that need uploading again.
+        """
+        return set(self.missing) | set(self.mismatched)
+
+
+def expected_digests(transfer, manifest_data=None):
+    """
+    Return the SHA-1 digests of the files uploaded by the given ledger
+    Transfer, keyed by path, including the bundle.json manifest if its data
+    is given.
+    """
+    digests = {}
+    for block in transfer.blocks.all():
+        digests[block.def_path] = block.olx_digest
+        digests.update(block.asset_digests)
+    if manifest_data is not None:
+        digests[MANIFEST_PATH] = ledger.digest(manifest_data)
+    return digests
+
+
+def compare_files(expected, bundle_files):
+    """
+    Compare the expected digests (keyed by path) with a bundle file listing
+    (see sinks.py), and return a Verification.
+
+    Files listed without a digest are only checked for being there. Files in
+    the bundle but not expected (e.g. from other transfers into the same
+    bundle) are ignored.
+    """
+    listed = {bundle_file['path']: bundle_file for bundle_file in bundle_files}
+    missing = []
+    mismatched = []
+    for path, expected_digest in expected.items():
+        bundle_file = listed.get(path)
+        if bundle_file is None:
+            missing.append(path)
+        elif bundle_file.get('hash_digest') not in (None, expected_digest):
+            mismatched.append(path)
+    return Verification(checked=len(expected), missing=sorted(missing), mismatched=sorted(mismatched))
+
+
+def verify_transfer(transfer, sink=None, manifest_data=None):
+    """
+    Check that the bundle of the given (committed) ledger Transfer holds every
+    file of the transfer, and return a Verification.
+
+    manifest_data is the bundle.json data that the transfer uploaded, if the
+    manifest should be checked too.
+    """
+    sink = sink or BlockstoreSink()
+    result = compare_files(expected_digests(transfer, manifest_data), sink.get_bundle_files(transfer.bundle_uuid))
+    for path in result.missing:
+        log.warning('Bundle %s is missing %s', transfer.bundle_uuid, path)
+    for path in result.mismatched:
+        log.warning('Bundle %s has the wrong data for %s', transfer.bundle_uuid, path)
+    return result
+
+
+def serialize_block(usage_key):
+    """
+    Serialize the block with the given usage key as it is now, the way
+    transfers of whole subtrees into a single bundle do.
+    """
+    return XBlockSerializer(compat.get_block(usage_key))
+
+
+def _has_dependencies(manifest_data):
+    """
+    Return whether the given bundle.json data lists other bundles as
+    dependencies, i.e. whether blocks include children from other bundles.
+    """
+    return manifest_data is not None and bool(json.loads(manifest_data).get('dependencies'))
+
+
+def repair_transfer(transfer, paths, sink=None, manifest_data=None, serialize=None):
+    """
+    Upload the files at the given paths of the given ledger Transfer into its
+    draft again, and commit it.
+
+    The blocks these files belong to are serialized again by serialize, a
+    callable which is passed a usage key and must return the block's
+    serializer set up the way the transfer's was (e.g. with the child_sources
+    of a sharded parent bundle; see sharding.py). The default,
+    serialize_block(), only reproduces transfers without such options, so
+    repairing a bundle whose manifest lists dependencies is refused
+    (VerificationFailed is raised) unless serialize is given.
+
+    Blocks are serialized from the modulestore as it is now rather than as it
+    was when they were transferred: if a block has been edited since, its
+    current version is uploaded (with a warning), and its digests are updated
+    in the ledger to match. The bundle.json manifest is only re-uploaded if
+    manifest_data is given.
+    """
+    sink = sink or BlockstoreSink()
+    if serialize is None:
+        if _has_dependencies(manifest_data):
+            raise VerificationFailed(
+                'Bundle {} includes blocks from other bundles, so it cannot be repaired without the serializer '
+                'of its transfer'.format(transfer.bundle_uuid)
+            )
+        serialize = serialize_block
+    paths = set(paths)
+    files = []
+    for block in transfer.blocks.all():
+        block_paths = paths.intersection([block.def_path] + list(block.asset_digests))
+        if not block_paths:
+            continue
+        data = serialize(block.usage_key)
+        folder_path = '{}/'.format(data.def_id)
+        block_files = [(folder_path + 'definition.xml', data.olx_str)]
+        block_files.extend(
+            (folder_path + 'static/' + asset_file.name, asset_file.data) for asset_file in data.static_files
+        )
+        files.extend((path, file_data) for path, file_data in block_files if path in block_paths)
+        olx_digest, asset_digests = ledger.block_digests(data)
+        if (olx_digest, asset_digests) != (block.olx_digest, block.asset_digests):
+            log.warning('%s has changed since it was transferred; uploading its current version', block.usage_key)
+            block.olx_digest = olx_digest
+            block.asset_digests = asset_digests
+            block.save(update_fields=['olx_digest', 'asset_digests'])
+    if MANIFEST_PATH in paths and manifest_data is not None:
+        files.append((MANIFEST_PATH, manifest_data))
+    log.info('Uploading {} file(s) to bundle {} again'.format(len(files), transfer.bundle_uuid))
+    if files:
+        sink.add_files_to_draft(transfer.draft_uuid, files)
+        sink.commit_draft(transfer.draft_uuid)
+    return [path for path, _file_data in files]
+
+
+def verify_and_repair(transfer, sink=None, manifest_data=None, serialize=None):
+    """
+    Verify the given ledger Transfer, re-upload any missing or mismatched
+    files once (see repair_transfer() about serialize), and verify it again.
+
+    Returns the final Verification; raises VerificationFailed if the bundle
+    still doesn't hold the expected files.
+    """
+    sink = sink or BlockstoreSink()
+    result = verify_transfer(transfer, sink, manifest_data)
+    if result.ok:
+        log.info('Verified {} file(s) in bundle {}'.format(result.checked, transfer.bundle_uuid))
+        return result
+    repair_transfer(transfer, result.bad_paths, sink, manifest_data, serialize)
+    result = verify_transfer(transfer, sink, manifest_data)
+    if not result.ok:
+        raise VerificationFailed('Bundle {} is still missing {} and has the wrong data for {}'.format(
+            transfer.bundle_uuid, result.missing, result.mismatched,
+        ))
+    log.info('Verified {} file(s) in bundle {} after re-uploading some'.format(result.checked, transfer.bundle_uuid))
+    return result